@@ -4,20 +4,52 @@
 
 # vim: ts=4 sw=4 expandtab
 import base64
+import heapq
+import itertools
 import os
+import random
 
 import socket
+import time
 
 import IndexedRedis
 
-from IndexedRedis.fields import IRField, IRBytesField, IRFieldChain, IRCompressedField
-
-from cryptography.fernet import Fernet
-from hashlib import md5
-
-
-__all__ = ('NoSuchNetFetchFile', 'NetFetchFile', 'InvalidPasswordException', 'setRedisConnectionParams'
-            'NetFetchCompressedLzmaFile', 'NetFetchCompressedGzipFile', 'NetFetchCompressedBzip2File'
+from IndexedRedis.fields import IRField, IRBytesField, IRFieldChain, IRCompressedField, irNull
+from IndexedRedis.compat_str import to_unicode
+
+from .chunks import ( DEFAULT_CHUNK_SIZE, ManifestEntry, getChunkKey, newChunkIdPrefix, getDedupChunkId, isDedupChunkId,
+            parseManifest, buildManifest, iterBlocks, iterBatches, getBatchSize, acquireDedupChunks, releaseChunks )
+from .compression import ( COMPRESS_MODE_LZMA, COMPRESS_MODE_GZIP, COMPRESS_MODE_BZIP2, COMPRESS_MODE_ZSTD, COMPRESS_MODE_LZ4,
+            COMPRESS_MODE_ZSTD_DICT, normalizeCompressMode, compressData, decompressData, trainDictionary )
+from .dictionaries import ( DEFAULT_DICTIONARY_SIZE, DEFAULT_MAX_SAMPLES, DEFAULT_MAX_SAMPLE_SIZE, storeDictionary, setCurrentDictionary,
+            listDictionaries, loadDictionary, loadCurrentDictionary )
+from .fields import DataField, CompressedDataField
+from .scripts import LOOKUP_FILE_SCRIPT, FETCH_FILE_SCRIPT, FETCH_FIELDS_SCRIPT, FETCH_DATA_RANGES_SCRIPT, runScript, hgetallResultToDict
+from .bulk import DEFAULT_BULK_BATCH_SIZE, GLOB_CHARS, BulkResult, runBulk, matchStoredFilenames
+from .encryption import ( ENCRYPTION_FERNET, ENCRYPTION_AESGCM, DEFAULT_PAYLOAD_CHUNK_SIZE, PAYLOAD_HEADER_SIZE, DecryptionError,
+            normalizeEncryption, getCipher, encryptPayload, decryptPayload, getPayloadChunkSize, getPayloadRange, decryptPayloadRange )
+from .checksum import CHECKSUM_MD5, normalizeChecksumType, newHasher, readAndHash
+from .localfile import mapFile, AtomicLocalFile
+from .archive import TarOutput
+from .cache import LINK_MODE_HARDLINK, LINK_MODE_COPY
+from .listing import ( DEFAULT_LIST_BATCH_SIZE, LAYOUT_COMPACT, STORAGE_LAYOUTS, getPathIndexKey, queueListIndexAdd,
+            queueListIndexRemove, iterListIndex, iterListIndexHostnames, getPathIndexFilenames, isCompactLayout )
+from .events import EVENT_UPDATE, EVENT_DELETE, queueChangeEvent
+from .revisions import ( REVISION_FORMAT_FULL, isRevisionsEnabled, getRevisionsKey, getRevisionsKeyPattern, parseRevisionsKey,
+            Revision, PendingRevision, parseRevisionIndex, dumpRevisionIndex, decodeRevision, applyRevisionPolicy, getReleasableChunkIds,
+            queueRevisionsDelete, getDeletedChunkIds, INDEX_FIELD as REVISIONS_INDEX_FIELD )
+from .retention import ( DEFAULT_EXPIRE_BATCH_SIZE, getStorageBudget, isBudgetEnabled, isAccessTracked, isExpireSweepDue, getExpireTime,
+            isExpired, getUsageKey, queueFileStored, queueFileRemoved, queueFilesAccessed, getExpiredFiles, removeExpiryMembers,
+            getEvictionCandidates, removeEvictionMembers, getUsage as getNodeUsage )
+from .sharding import setRedisNodes, isSharded, getNodeNames, getNodeForFile, getNodeModel
+from .stats import ( PHASE_LOOKUP, PHASE_FETCH, PHASE_DECOMPRESS, PHASE_DECRYPT, PHASE_CHECKSUM, PHASE_WRITE, PHASE_PERMISSIONS,
+            PHASE_CACHE, PHASE_READ, PHASE_COMPRESS, PHASE_ENCRYPT, PHASE_STORE, PHASE_DELETE, PHASE_REVISION, timePhase, timeIter )
+from . import checksum as _checksum
+
+
+__all__ = ('NoSuchNetFetchFile', 'NetFetchFile', 'InvalidPasswordException', 'setRedisConnectionParams', 'setRedisNodes',
+            'NetFetchCompressedLzmaFile', 'NetFetchCompressedGzipFile', 'NetFetchCompressedBzip2File',
+            'NetFetchCompressedZstdFile', 'NetFetchCompressedLz4File', 'NetFetchCompressedZstdDictFile', 'NetFetchChunkedFile',
 )
 
 __version__ = '3.0.3'
@@ -46,6 +78,49 @@ NETFETCH_TYPE_PLAIN = 0
 NETFETCH_TYPE_COMPRESSED_LZMA  = 1
 NETFETCH_TYPE_COMPRESSED_GZIP  = 2
 NETFETCH_TYPE_COMPRESSED_BZIP2 = 3
+NETFETCH_TYPE_CHUNKED = 4
+NETFETCH_TYPE_COMPRESSED_ZSTD  = 5
+NETFETCH_TYPE_COMPRESSED_LZ4   = 6
+NETFETCH_TYPE_COMPRESSED_ZSTD_DICT = 7
+
+
+def _getNetFetchFields(netfetchType, dataField):
+    '''
+        _getNetFetchFields - Internal. Get the FIELDS shared by every NetFetch model.
+
+        @param netfetchType <int> - NETFETCH_TYPE_* of the model, used as default for the "netfetchType" field
+        @param dataField <IRField> - The field used to store "data" on this model
+
+        @return list<IRField> - FIELDS for the model
+    '''
+    return [
+        IRField('filename'),
+        IRField('hostname'),
+        IRField('checksum'),
+        # Algorithm of "checksum" (and chunk digests), a checksum.CHECKSUM_* value ('' is MD5)
+        IRField('checksumType', defaultValue=''),
+        IRField('encrypted'),
+        # Format of encrypted data, an encryption.ENCRYPTION_* value ('' is Fernet)
+        IRField('encryption', defaultValue=''),
+        IRField('mode'),
+        IRField('owner'),
+        IRField('group'),
+        IRField('netfetchType', valueType=int, defaultValue=netfetchType),
+        IRField('size', valueType=int),
+        # Time the file was last stored (seconds since epoch). 0 for files stored before this existed.
+        IRField('mtime', valueType=float, defaultValue=0.0),
+        # Number of times the file was stored, starting at 1 (see revisions.py). 0 for files stored before this existed.
+        IRField('revision', valueType=int, defaultValue=0),
+        # Time the file expires (seconds since epoch), if stored with a TTL (see retention.py). 0 for never.
+        IRField('expires', valueType=float, defaultValue=0.0),
+        # Id of the dictionary the data is compressed with (NETFETCH_TYPE_COMPRESSED_ZSTD_DICT only, see dictionaries.py). '' for none.
+        IRField('compressDict', defaultValue=''),
+        # Chunked storage (NETFETCH_TYPE_CHUNKED) only, see NetFetchChunkedFile
+        IRField('chunkSize', valueType=int, defaultValue=0),
+        IRField('chunkCompression', defaultValue=''),
+        IRField('chunks', defaultValue=''),
+        dataField,
+    ]
 
 
 class NetFetchFile(IndexedRedis.IndexedRedisModel):
@@ -61,17 +136,7 @@ class NetFetchFile(IndexedRedis.IndexedRedisModel):
 
     NETFETCH_TYPE = NETFETCH_TYPE_PLAIN
 
-    FIELDS = [
-        IRField('filename'),
-        IRField('hostname'),
-        IRField('checksum'),
-        IRField('encrypted'),
-        IRField('mode'),
-        IRField('owner'),
-        IRField('group'),
-        IRField('netfetchType', valueType=int, defaultValue=NETFETCH_TYPE_PLAIN),
-        IRBytesField('data'),
-    ]
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_PLAIN, DataField('data'))
 
     INDEXED_FIELDS = [
         'filename',
@@ -80,6 +145,10 @@ class NetFetchFile(IndexedRedis.IndexedRedisModel):
 
     KEY_NAME = 'NetFetchFile'
 
+    # SHARD_NODE - Name of the node this model is bound to (see sharding.getNodeModel), or None.
+    #   When None and multiple nodes are configured (see sharding.setRedisNodes), each file is routed to the node it belongs to.
+    SHARD_NODE = None
+
 
     ###################################
     ##      Data Access              ##
@@ -96,25 +165,27 @@ class NetFetchFile(IndexedRedis.IndexedRedisModel):
             @raises InvalidPasswordException - The file was encrypted and a password was invalid, or the file was not encrypted and a password was provided, or the file was encrypted and no password was provided.
             @raises ValueError - If password is not 4-32 characters.
         '''
+        self._checkPassword(password)
         if not password:
-            if self.encrypted == '1':
-                raise InvalidPasswordException('File is encrypted. Must provide password.')
             ret = self.data
+            if not isinstance(ret, bytes):
+                # Set from a buffer (see #setData) and not yet fetched back
+                ret = memoryview(ret).tobytes()
         else:
-            if self.encrypted == '0':
-                raise InvalidPasswordException('File is not encrypted and password was provided.')
+            encryption = self.encryption or ENCRYPTION_FERNET
+            cipher = getCipher(encryption, NetFetchFile._getFernetKey(password))
             try:
-                fernetKey = NetFetchFile._getFernetKey(password)
-                fernet = Fernet(fernetKey)
-                ret = fernet.decrypt(self.data)
-            except ValueError:
-                raise
-            except Exception as e:
-                raise e
-                # Invalid password because did not match fernet structure
+                with timePhase(PHASE_DECRYPT, len(self.data)):
+                    if encryption == ENCRYPTION_FERNET:
+                        ret = cipher.decrypt(self.data)
+                    else:
+                        ret = decryptPayload(cipher, self.data)
+            except DecryptionError:
+                # Invalid password because did not match encrypted structure
                 raise InvalidPasswordException('Invalid Password.')
 
-        checksum = NetFetchFile.calculateChecksum(ret)
+        with timePhase(PHASE_CHECKSUM, len(ret)):
+            checksum = NetFetchFile.calculateChecksum(ret, self.checksumType)
 
         if checksum != self.checksum:
             # Invalid password because either "encrypted" field was tampered-with, 
@@ -124,346 +195,2522 @@ class NetFetchFile(IndexedRedis.IndexedRedisModel):
         return ret
 
 
-    def setData(self, data):
+    def setData(self, data, checksumType=None):
         '''
             setData - Store data on this object and calculates checksum. If a password is required, must also call encryptData. Does not save object.
 
-            @param data <bytes> - Data to store
+            @param data <bytes/memoryview/file-like> - Data to store, or a file-like object opened for binary read (which is hashed as it is read).
+                A memoryview (like that of a memory-mapped file, see localfile.mapFile) is stored without being copied.
+            @param checksumType <str/None> - Checksum algorithm, a checksum.CHECKSUM_* value or name (like "blake2b"). Default (None) is MD5.
+
+            @raises ValueError - If checksumType is unknown
         '''
+        checksumType = normalizeChecksumType(checksumType)
+        if hasattr(data, 'read'):
+            with timePhase(PHASE_READ) as phase:
+                (data, checksum) = readAndHash(data, checksumType)
+                phase.numBytes = len(data)
+        else:
+            with timePhase(PHASE_CHECKSUM, len(data)):
+                checksum = NetFetchFile.calculateChecksum(data, checksumType)
+
         self.data = data
-        self.checksum = NetFetchFile.calculateChecksum(data)
+        self.checksum = checksum
+        self.checksumType = checksumType
+        self.size = len(data)
 
+        self.chunkSize = 0
+        self.chunkCompression = ''
+        self.chunks = ''
+        self.compressDict = ''
 
-    def encryptData(self, password):
+    def iterData(self, password=None):
         '''
-            encryptData - Encrypts data on this object and sets 'encrypted' flag.  Does not save object.
+            iterData - Iterate over the data associated with this file, in blocks. Potentially decrypt.
 
-            @param password <str> 4-32 characters of password, used to encrypt.
+              Models which store their data in pieces (like NetFetchChunkedFile) will fetch and yield one piece at a time,
+                otherwise the whole data is yielded as a single block.
 
-            @raises - ValueError if password does not meet requirements
+              @see getData for params and exceptions
+
+            @return generator<bytes> - Blocks of file data, in order
         '''
-        fernetKey = NetFetchFile._getFernetKey(password)
+        yield self.getData(password)
 
-        fernet = Fernet(fernetKey)
-        self.data = fernet.encrypt(self.data)
-        self.encrypted = '1'
+    def iterRange(self, start=0, end=None, password=None):
+        '''
+            iterRange - Iterate over a range of the data associated with this file, in blocks, fetching only what is needed
+              to decode that range where the stored format allows:
 
+                * Uncompressed files only fetch the bytes of the range (see scripts.FETCH_DATA_RANGES_SCRIPT). If encrypted
+                    with AES-GCM, only the encrypted chunks which hold the range are fetched, and each is authenticated.
 
+                * Files compressed as a whole, or encrypted with Fernet, cannot be decoded in part, so the whole file is fetched,
+                    and verified as by #getData.
 
-    ###################################
-    ##        Retrieval Methods      ##
-    ###################################
+                * NetFetchChunkedFile fetches only the chunks which hold the range, and verifies each against its manifest.
 
+              The checksum of the whole file is only verified when the whole file is fetched.
 
-    @classmethod
-    def exists(cls, hostname, filename):
+            @param start <int> - Offset of the first byte. A negative offset counts back from the end of the file.
+            @param end <int/None> - Offset after the last byte, or None for the end of the file. A negative offset counts back from the end.
+                Offsets past the end of the file are treated as the end, like slicing.
+            @param password <str/None> - None if unencrypted, otherwise a password 4-32 chars.
+
+            @return generator<bytes> - Blocks of the data of the range, in order
+
+            @raises InvalidPasswordException - @see getData
+            @raises NoSuchNetFetchFile - If the file was updated or deleted while fetching
         '''
-            exists - Check if a hostname/filename pair exists
+        self._checkPassword(password)
 
-            @param hostname <str> - Hostname field
-            @param filename <str> - Filename field
+        # The data is already loaded, or cannot be read in part (including files stored before "size" existed)
+        isWhole = bool(not getattr(self, '_onlyMetadata', False) or self.NETFETCH_TYPE != NETFETCH_TYPE_PLAIN or self.size is irNull)
+        if isWhole or (password and self.encryption != ENCRYPTION_AESGCM):
+            data = self._loadData().getData(password)
+            (start, end) = NetFetchFile._resolveRange(start, end, len(data))
+            yield data[start : end]
+            return
 
-            @return <bool> - If a file is stored under the hostname/filename key pair
+        (start, end) = NetFetchFile._resolveRange(start, end, self.size)
+        if start == end:
+            return
+
+        if password:
+            yield self._getEncryptedRange(start, end, password)
+        else:
+            yield self._fetchDataRanges( [ (start, end - start) ] )[0]
+
+    def _fetchDataRanges(self, ranges):
         '''
-        return bool(cls.objects.filter(filename=filename, hostname=hostname).count() > 0)
+            _fetchDataRanges - Internal. Fetch byte ranges of the "data" field as stored, without fetching the rest of it.
+              Only meaningful for models which store the data uncompressed.
 
+            @param ranges list< tuple(offset<int>, length<int>) > - Ranges to fetch
 
-    @staticmethod
-    def getNetFetchClassForKey(primaryKey):
-        try:
-            netfetchType = NetFetchFile.objects.getOnlyFields(primaryKey, ['netfetchType']).netfetchType
-        except:
-            raise NoSuchNetFetchFile('Failed to fetch object.')
+            @return list<bytes> - Bytes of each range
 
-        if netfetchType == NETFETCH_TYPE_PLAIN:
-            return NetFetchFile
-        elif netfetchType == NETFETCH_TYPE_COMPRESSED_LZMA:
-            return NetFetchCompressedLzmaFile
-        elif netfetchType == NETFETCH_TYPE_COMPRESSED_GZIP:
-            return NetFetchCompressedGzipFile
-        elif netfetchType == NETFETCH_TYPE_COMPRESSED_BZIP2:
-            return NetFetchCompressedBzip2File
+            @raises NoSuchNetFetchFile - If the file was updated or deleted since this object was fetched
+        '''
+        args = [ 'data', self.checksum ]
+        for (offset, length) in ranges:
+            args += [ offset, length ]
 
-        return NetFetchFile
+        with timePhase(PHASE_FETCH) as phase:
+            results = runScript(self._getConnection(), FETCH_DATA_RANGES_SCRIPT, [ self.__class__.objects._get_key_for_id(self._id) ], args)
+            phase.numBytes = results and NetFetchFile._getStoredSize(results) or 0
 
-    @classmethod
-    def downloadToLocal(cls, hostname, filename, password=None, localFilename=None, retainPermissions=True):
+        if results is None:
+            raise NoSuchNetFetchFile('File was updated or deleted while fetching.')
+
+        return results
+
+    def _getEncryptedRange(self, start, end, password):
         '''
-            downloadToLocal - Download file to a local filename
+            _getEncryptedRange - Internal. Fetch and decrypt a range of the data of a file encrypted with AES-GCM,
+              fetching only the encrypted chunks which hold it (see encryption.getPayloadRange)
 
-            @param hostname <str> - Hostname that file was stored on
-            @param filename <str> - Filename to fetch
-            @param password <str/None> - Try this password on potentially encrpyted file.
-            @param localFilename <str/None> - If defined, saves at this location. Otherwise, saves at #filename
-            @param retainPermissions <bool> Default True - If True, tries to retain owner/group/mode. If owner/group, you must be root. Silently fails if can't apply.
+            @param start <int> - Offset of the first byte
+            @param end <int> - Offset after the last byte, greater than #start
+            @param password <str> - Password
 
-            @raises NoSuchNetFetchFile - If no hostname/filename match exists
-            @raises InvalidPasswordException - If password was invalid, see getData for all conditions.
+            @return <bytes> - Data of the range
+
+            @raises InvalidPasswordException - If the password is wrong, or the chunks do not authenticate
         '''
-        if not localFilename:
-            localFilename = filename
+        cipher = getCipher(ENCRYPTION_AESGCM, NetFetchFile._getFernetKey(password))
+
+        # Payloads are encrypted with the default chunk size, so fetch the header along with the chunks expected to hold the range,
+        #   and fetch again only if the header says otherwise.
+        chunkSize = DEFAULT_PAYLOAD_CHUNK_SIZE
+        while True:
+            (firstChunkNum, offset, length) = getPayloadRange(cipher, chunkSize, start, end)
+            (header, body) = self._fetchDataRanges( [ (0, PAYLOAD_HEADER_SIZE), (offset, length) ] )
+            try:
+                storedChunkSize = getPayloadChunkSize(header)
+            except DecryptionError:
+                raise InvalidPasswordException('Invalid Password.')
+            if storedChunkSize == chunkSize:
+                break
+            chunkSize = storedChunkSize
 
-        primaryKeys = list(cls.objects.filter(hostname=hostname, filename=filename).getPrimaryKeys())
-        if not primaryKeys:
-            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+        numChunks = max(1, (self.size + chunkSize - 1) // chunkSize)
+        try:
+            with timePhase(PHASE_DECRYPT, len(body)):
+                data = decryptPayloadRange(cipher, header, body, firstChunkNum, numChunks)
+        except DecryptionError:
+            raise InvalidPasswordException('Invalid Password.')
 
-        primaryKey = primaryKeys[0]
+        dataStart = firstChunkNum * chunkSize
+        return data[start - dataStart : end - dataStart]
 
-        fetchClass = cls.getNetFetchClassForKey(primaryKey)
+    @staticmethod
+    def _resolveRange(start, end, size):
+        '''
+            _resolveRange - Internal. Resolve a range (as given to #iterRange) against the size of a file
 
-        obj = fetchClass.objects.get(primaryKey)
-        if not obj:
-            raise NoSuchNetFetchFile('Failed to fetch object.')
+            @param start <int> - Offset of the first byte, negative from the end
+            @param end <int/None> - Offset after the last byte, negative from the end, or None for the end
+            @param size <int> - Size of the file
 
-        data = obj.getData(password)
-        with open(localFilename, 'wb') as f:
-            f.write(data)
+            @return tuple( start<int>, end<int> ) - Offsets within the file, where #start <= #end
+        '''
+        (start, end, _step) = slice(start, end).indices(size)
 
-        if retainPermissions is True:
-            if obj.mode:
-                try:
-                    os.chmod(localFilename, obj.mode)
-                except:
-                    pass
-            if obj.owner or obj.group:
-                owner = obj.owner
-                group = obj.group
-                if not owner or not group:
-                    currentInfo = os.stat(localFilename)
-                    if not owner:
-                        owner = currentInfo.st_uid
-                    elif not group:
-                        group = currentInfo.st_gid
-                                    
-                    try:
-                        os.chown(localFilename, int(owner), int(group))
-                    except:
-                        pass
-            
-    @classmethod
-    def downloadToStr(cls, hostname, filename, password=None):
+        return (start, max(start, end))
+
+
+    def encryptData(self, password, encryption=None):
         '''
-            downloadToStr - Download a hostname/filename pair and return as a string
+            encryptData - Encrypts data on this object and sets 'encrypted' flag.  Does not save object.
 
-            @param hostname <str> - Hostname that file was stored on
-            @param filename <str> - Filename to fetch
-            @param password <str/None> - Try this password on potentially encrpyted file.
+            @param password <str> 4-32 characters of password, used to encrypt.
+            @param encryption <str/None> - Format of encrypted data, an encryption.ENCRYPTION_* value or name (like "aesgcm").
+                Default (None) is Fernet. AES-GCM is binary (so about 1/3 smaller than Fernet), and encrypted in independent chunks.
 
-            @return <bytes> - Data that has been downloaded
+            @raises - ValueError if password does not meet requirements, or encryption is unknown
+        '''
+        encryption = normalizeEncryption(encryption)
+        cipher = getCipher(encryption, NetFetchFile._getFernetKey(password))
 
-            @raises NoSuchNetFetchFile - If no hostname/filename match exists
-            @raises InvalidPasswordException - If password was invalid, see getData for all conditions.
+        with timePhase(PHASE_ENCRYPT, len(self.data)):
+            if encryption == ENCRYPTION_FERNET:
+                self.data = cipher.encrypt(self.data)
+            else:
+                self.data = encryptPayload(cipher, self.data)
+        self.encrypted = '1'
+        self.encryption = encryption
+
+    def _loadData(self):
         '''
-        primaryKeys = list(cls.objects.filter(hostname=hostname, filename=filename).getPrimaryKeys())
-        if not primaryKeys:
-            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+            _loadData - Internal. Get this object with its data loaded, fetching it if this object was fetched with only metadata.
 
-        primaryKey = primaryKeys[0]
+            @return <NetFetchFile> - self, or a newly-fetched copy including data
+
+            @raises NoSuchNetFetchFile - If object no longer exists
+        '''
+        if not getattr(self, '_onlyMetadata', False):
+            return self
 
-        fetchClass = cls.getNetFetchClassForKey(primaryKey)
+        if self.compressDict:
+            loadDictionary(self._getConnection(), self.compressDict)
 
-        obj = fetchClass.objects.get(primaryKey)
+        with timePhase(PHASE_FETCH) as phase:
+            obj = self.__class__.objects.get(self._id)
+            if obj:
+                phase.numBytes = len(obj.data or b'')
         if not obj:
             raise NoSuchNetFetchFile('Failed to fetch object.')
 
-        data = obj.getData(password)
-        return data
+        return obj
 
-    @classmethod
-    def deleteFile(cls, hostname, filename):
+    def _getCachedFilename(self, cache, password=None):
         '''
-            deleteFile - Deletes a file from NetFetch storage.
+            _getCachedFilename - Internal. Get the filename of this file's data within a local cache, fetching and storing it if not present.
 
-            @param hostname <str> - Hostname that file was stored on
-            @param filename <str> - Filename to delete
+            @param cache <cache.LocalCache> - The local cache
+            @param password <str/None> - @see getData
 
-            @return <bool> - True if a file was deleted, otherwise False
+            @return <str> - Path to the cache entry
 
+            @raises InvalidPasswordException - @see getData
         '''
+        self._checkPassword(password)
 
-        numDeleted = cls.objects.filter(hostname=hostname, filename=filename).delete()
+        cacheKey = self._getCacheKey()
+        cachedFilename = cache.getCachedFilename(cacheKey)
+        if not cachedFilename:
+            cachedFilename = cache.store(cacheKey, self._loadData().iterData(password))
 
-        return bool(numDeleted)
+        return cachedFilename
 
+    def _getCacheKey(self):
+        '''
+            _getCacheKey - Internal. Get the key of this file's data within a local cache, which is its checksum
+              (prefixed by the checksum type, if not MD5)
 
-    ###################################
-    ##        Creation Methods       ##
-    ###################################
+            @return <str>
+        '''
+        if self.checksumType:
+            return '%s-%s' %(self.checksumType, self.checksum)
+        return self.checksum
 
-    @classmethod
-    def create(cls, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None):
+    def _writeToLocal(self, localFilename, password=None, retainPermissions=False, dataIter=None, size=None):
         '''
-            create - Create and save NetFetchFile object
+            _writeToLocal - Internal. Write the data of this file to a local filename, one block at a time (see #iterData)
 
-            @param filename <str> - filename to use for storage
-            @param data     <bytes> - Data to str
-            @param mode     <str>  - String or int of base-8 encoded chmod value. os.stat(x).st_mode returns this.
-            @param owner    <str>  - Username owner
-            @param group    <str>  - Associated group
-            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
-            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+              The data is written to a temporary file, which is renamed over #localFilename once complete (see localfile.AtomicLocalFile),
+                so #localFilename is never seen partially written.
 
-            @return - Saved NetFetchFile object
+            @param localFilename <str> - Local file to write
+            @param password <str/None> - @see getData
+            @param retainPermissions <bool> - If True, the stored owner/group/mode are applied (see #_applyPermissions) before the rename
+            @param dataIter <generator<bytes>/None> - If provided, write these blocks instead of #iterData (i.e. those of #iterRange)
+            @param size <int/None> - Expected number of bytes of #dataIter. Default is the size of the file.
 
-            @raises KeyError if a hostname/filename pair already exists. use createOrUpdate to conditionally update it.
-            @raises ValueError  if provided password does not meet criteria
+            @return <int> - Number of bytes written
+
+            @raises InvalidPasswordException - @see getData
         '''
-        hostname = hostnameOverride or socket.gethostname()
-        if cls.exists(hostname, filename):
-            raise KeyError('A file already exists with hostname="%s" and filename="%s!\n' %(hostname, filename))
-        obj = cls( \
-                filename=filename,
-                hostname=hostname,
-                mode=mode,
-                owner=owner,
-                group=group,
-        )
+        if dataIter is None:
+            dataIter = self.iterData(password)
+        if size is None:
+            size = self.size
+        # Fetch the first block prior to opening the output, so a bad password does not leave anything behind
+        firstBlock = next(dataIter, b'')
+
+        localFile = AtomicLocalFile(localFilename, size)
+        try:
+            with timePhase(PHASE_WRITE, len(firstBlock)):
+                localFile.write(firstBlock)
+            firstBlock = None
+            for block in dataIter:
+                with timePhase(PHASE_WRITE, len(block)):
+                    localFile.write(block)
 
-        obj.setData(data)
+            if retainPermissions is True and localFile.tempFilename is not None:
+                self._applyPermissions(localFile.tempFilename)
 
-        if password:
-            obj.encryptData(password)
-        else:
-            obj.encrypted = '0'
+            localFile.commit()
+        except:
+            # Don't leave a partial file around
+            localFile.abort()
+            raise
 
-        obj.save()
-        return obj
+        return localFile.numBytes
 
-    @classmethod
-    def createOrUpdate(cls, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None):
+    def _writeToStream(self, fileObj, password=None, dataIter=None):
         '''
-            createOrUpdate - Create and save NetFetchFile object, or update an existing one.
+            _writeToStream - Internal. Write the data of this file to a file-like object (like stdout), one block at a time (see #iterData)
 
-            @param filename <str> - filename to use for storage
-            @param data     <bytes> - Data to str
-            @param mode     <str>  - String or int of base-8 encoded chmod value. os.stat(x).st_mode returns this.
-            @param owner    <str>  - Username owner
-            @param group    <str>  - Associated group
-            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
-            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+              Unlike #_writeToLocal, data already written cannot be taken back, so with chunked files the chunks prior to a failure
+                (like one updated while fetching) will have been written. Each chunk is verified before it is written.
 
-            @return - Saved NetFetchFile object
+            @param fileObj <file> - File-like object opened for binary write. It is flushed, but not closed.
+            @param password <str/None> - @see getData
+            @param dataIter <generator<bytes>/None> - If provided, write these blocks instead of #iterData (i.e. those of #iterRange)
 
-            @raises ValueError  if provided password does not meet criteria
+            @return <int> - Number of bytes written
+
+            @raises InvalidPasswordException - @see getData
         '''
-        hostname = hostnameOverride or socket.gethostname()
-        existing = cls.objects.filter(filename=filename, hostname=hostname).all()
-        if existing:
-            existing = existing[0]
-            if mode not in (None, ''):
-                existing.mode = mode
-            if owner not in (None, ''):
-                existing.owner = owner
-            if group not in (None, ''):
-                existing.group = group
-
-            existing.netfetchType = cls.NETFETCH_TYPE
-
-            if existing.netfetchType != cls.NETFETCH_TYPE:
-                # NOTE: IndexedRedis doesn't have support for toStorage repr changing, only
-                #  converted change for update, so for now we have to force a change to be seen
-                if existing._origData.get('data', None) != b'':
-                    existing._origData['data'] = b''
-                else:
-                    existing._origData['data'] = b'x'
+        if dataIter is None:
+            dataIter = self.iterData(password)
 
-            existing.setData(data)
-            if password:
-                existing.encryptData(password)
-            else:
-                existing.encrypted = '0'
+        numBytes = 0
+        for block in dataIter:
+            with timePhase(PHASE_WRITE, len(block)):
+                fileObj.write(block)
+            numBytes += len(block)
 
-            existing.save()
-            return existing
-        else:
-            return cls.create(filename, data, mode, owner, group, password)
-                    
-    @classmethod
-    def createOrUpdateFromFile(cls, filename, password=None, hostnameOverride=None, savePermissions=True):
+        fileObj.flush()
+
+        return numBytes
+
+    def _applyPermissions(self, localFilename):
         '''
-            createOrUpdateFromFile - Create and save NetFetchFile object, or update an existing one, provided with a filename.
+            _applyPermissions - Internal. Try to apply the stored owner/group/mode to a local file. Silently fails if can't apply.
 
-            @param filename <str> - filename to use for storage
-            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
-            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
-            @param savePermissions <bool> Default True - If True, will store owner/group/mode of file.
+            @param localFilename <str> - Local file
+        '''
+        with timePhase(PHASE_PERMISSIONS):
+            mode = self._getStoredMode()
+            if mode is not None:
+                try:
+                    os.chmod(localFilename, mode)
+                except:
+                    pass
+            if self.owner or self.group:
+                owner = self.owner
+                group = self.group
+                if not owner or not group:
+                    currentInfo = os.stat(localFilename)
+                    if not owner:
+                        owner = currentInfo.st_uid
+                    if not group:
+                        group = currentInfo.st_gid
 
-            @return - Saved NetFetchFile object
+                try:
+                    os.chown(localFilename, int(owner), int(group))
+                except:
+                    pass
 
-            @raises ValueError  if provided password does not meet criteria
+    def _getStoredMode(self):
         '''
-        if not filename:
-            raise ValueError('No filename provided')
-        if filename[0] != '/':
-            raise ValueError('Given filename, "%s" must be absolute."' %(filename,))
-        if not os.path.exists(filename):
-            raise ValueError('Given filename, "%s" does not exist.' %(filename,))
-        if not os.path.isfile(filename):
-            raise ValueError('Given filename, "%s" is not a regular file.' %(filename,))
+            _getStoredMode - Internal. Get the stored mode as permission bits
 
-        with open(filename, 'rb') as f:
-            data = f.read()
+            @return <int/None> - Mode, or None if none is stored (or it is invalid)
+        '''
+        if not self.mode:
+            return None
 
-        if savePermissions is True:
-            statData = os.stat(filename)
-            (mode, owner, group) = (statData.st_mode, statData.st_uid, statData.st_gid)
-        else:
-            (mode, owner, group) = (None, None, None)
+        try:
+            mode = to_unicode(self.mode)
+            if mode.startswith('0'):
+                # Octal string, like "0644"
+                return int(mode, 8) & 0o7777
+            return int(mode) & 0o7777
+        except:
+            return None
 
-        return cls.createOrUpdate(filename, data, mode, owner, group, password, hostnameOverride)
+    def _getStoredIds(self):
+        '''
+            _getStoredIds - Internal. Get the stored owner and group as ids
 
+            @return tuple( uid<int/None>, gid<int/None> ) - Each is None if none is stored (or it is invalid)
+        '''
+        ret = []
+        for storedId in (self.owner, self.group):
+            try:
+                ret.append( storedId and int(storedId) or None )
+            except (ValueError, TypeError):
+                ret.append(None)
 
-    ###################################
-    ##        Internal Methods       ##
-    ###################################
+        return tuple(ret)
 
-    @staticmethod
-    def _getFernetKey(password):
+    def _hasPermissionsOf(self, localFilename):
         '''
-            _getFernetKey - Internal. Get a Fernet Key for encryption based off provided password.
+            _hasPermissionsOf - Internal. Check if a local file already has the stored owner/group/mode
 
-            @param password <str> - 4 to 32 characters that represent a password.
+            @param localFilename <str> - Local file
 
-            @return - A base64-encoded key that was padded to be 32-characters before encoding.
+            @return <bool> - True if applying the stored permissions would not change #localFilename
+        '''
+        currentInfo = os.stat(localFilename)
 
-            @raises Value
+        mode = self._getStoredMode()
+        if mode is not None and mode != (currentInfo.st_mode & 0o7777):
+            return False
+
+        (uid, gid) = self._getStoredIds()
+        if uid is not None and uid != currentInfo.st_uid:
+            return False
+        if gid is not None and gid != currentInfo.st_gid:
+            return False
+
+        return True
+
+    def _checkPassword(self, password):
         '''
-        if len(password) < 4:
-            raise ValueError('Password must be at least four characters.')
-        if len(password) > 32:
-            raise ValueError('Password cannot be longer than 32 characters')
-        fernetKey = base64.b64encode(str(password + ('a' * (32 - len(password)))).encode('utf-8') )
+            _checkPassword - Internal. Ensure a password is provided if and only if this file is encrypted.
 
-        return fernetKey
+            @param password <str/None> - Provided password
 
-    @staticmethod
-    def calculateChecksum(data):
+            @raises InvalidPasswordException - If file is encrypted and no password was given, or vice versa.
         '''
-            calculateChecksum - Calculates a checksum from given data
+        if not password:
+            if self.encrypted == '1':
+                raise InvalidPasswordException('File is encrypted. Must provide password.')
+        elif self.encrypted == '0':
+            raise InvalidPasswordException('File is not encrypted and password was provided.')
 
-            @param data <bytes> - Data to check
+    def _setPayload(self, data, password=None, encryption=None, checksumType=None):
         '''
-        return md5(data).hexdigest()
+            _setPayload - Internal. Set the data on this object and encrypt it if a password is provided. Does not save object.
 
+            @param data <bytes> - Data to store
+            @param password <str/None> - If provided, 4-32 characters to encrypt.
+            @param encryption <str/None> - Format of encrypted data, @see #encryptData
+            @param checksumType <str/None> - Checksum algorithm, @see #setData
+        '''
+        self.setData(data, checksumType)
 
-class NetFetchCompressedLzmaFile(NetFetchFile):
-    '''
-        NetFetchCompressedLzmaFile - Used for lzma compression on a NetFetchFile
-    '''
+        # The revision of the object this replaces is stored as a delta against this data, see revisions.PendingRevision
+        self._revisionSource = isRevisionsEnabled() and (self.data, password) or None
 
-    NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_LZMA
+        if password:
+            self.encryptData(password, encryption)
+        else:
+            self.encrypted = '0'
+            self.encryption = ENCRYPTION_FERNET
 
-    FIELDS = [
-        IRField('filename'),
-        IRField('hostname'),
-        IRField('checksum'),
-        IRField('encrypted'),
-        IRField('mode'),
-        IRField('owner'),
-        IRField('group'),
-        IRField('netfetchType', valueType=int, defaultValue=NETFETCH_TYPE_COMPRESSED_LZMA),
-        IRFieldChain('data', [IRBytesField(), IRCompressedField(compressMode='lzma')] ),
-    ]
+    def _storePayload(self, data, password=None, **setPayloadKwargs):
+        '''
+            _storePayload - Internal. Set the data on this object, save it, publish the change (see events.py), and release any chunks
+              which were referenced by the previously-saved version but are no longer used.
+
+              If revisions are enabled (see revisions.setRevisionPolicy), the previously-saved version is added to the history of the file.
+              If there is a storage budget (see retention.setStorageBudget), files of the hostname are then evicted while it is over budget.
+
+            @param data <bytes> - Data to store
+            @param password <str/None> - If provided, 4-32 characters to encrypt.
+            @param setPayloadKwargs - Any additional arguments are passed to #_setPayload
+
+            @return - self
+        '''
+        previousChunkIds = self._getChunkIds()
+        previousSize = self._id and (self.size or 0) or 0
+
+        self._setPayload(data, password, **setPayloadKwargs)
+
+        pendingRevision = None
+        if self._id and isRevisionsEnabled():
+            pendingRevision = self.__class__._getPendingRevisions( [ (self._id, self) ] ).get(self._id, None)
+
+        # Models which compress the whole file do so while saving, so that is included here
+        with timePhase(PHASE_STORE, len(self.data or b'')):
+            self._getSaver().save(self)
+
+            pipeline = self._getConnection().pipeline(transaction=False)
+            queueListIndexAdd(pipeline, self.hostname, self.filename, self._id)
+            queueFileStored(pipeline, self.hostname, self.filename, self.size, self.mtime, self.expires, previousSize)
+            if pendingRevision is not None:
+                pendingRevision.queueWrites(pipeline)
+            queueChangeEvent(pipeline, EVENT_UPDATE, self.hostname, self.filename, self.checksum, self.checksumType, self.size, self.mtime)
+            pipeline.execute()
+
+        currentChunkIds = self._getChunkIds()
+        releaseChunkIds = []
+        if previousChunkIds and not (pendingRevision is not None and pendingRevision.keepsChunks()):
+            # Deduplicated chunks had a reference added for the new manifest, so always release the old references.
+            #  Other chunks are only released if the new manifest no longer uses them.
+            releaseChunkIds += [chunkId for chunkId in previousChunkIds if isDedupChunkId(chunkId) or chunkId not in currentChunkIds]
+        if pendingRevision is not None:
+            releaseChunkIds += pendingRevision.getReleasableChunkIds(currentChunkIds)
+        releaseChunks(self._getConnection(), releaseChunkIds)
+
+        NetFetchFile._applyRetention(self.hostname, [self.filename])
+
+        return self
+
+    def _getChunkIds(self):
+        '''
+            _getChunkIds - Internal. Get the ids of all chunks referenced by this object's manifest
+
+            @return list<str> - Chunk ids. Empty list if this is not a chunked file.
+        '''
+        return [entry.chunkId for entry in parseManifest(self.chunks)]
+
+
+
+    ###################################
+    ##        Retrieval Methods      ##
+    ###################################
+
+
+    @classmethod
+    def exists(cls, hostname, filename):
+        '''
+            exists - Check if a hostname/filename pair exists
+
+            @param hostname <str> - Hostname field
+            @param filename <str> - Filename field
+
+            @return <bool> - If a file is stored under the hostname/filename key pair
+        '''
+        if cls._isRouted():
+            return any( nodeModel.exists(hostname, filename) for nodeModel in cls._getNodeModelsForFile(hostname, filename) )
+
+        return bool(cls._lookupPrimaryKey(hostname, filename) is not None)
+
+
+    @staticmethod
+    def getNetFetchClassForKey(primaryKey):
+        '''
+            getNetFetchClassForKey - Fetch the netfetchType of a stored object, and return the model which should be used to fetch it.
+
+            @param primaryKey <int> - Primary key of object
+
+            @return <class> - NetFetchFile or subclass
+
+            @raises NoSuchNetFetchFile - If object could not be fetched
+        '''
+        try:
+            netfetchType = NetFetchFile.objects.getOnlyFields(primaryKey, ['netfetchType']).netfetchType
+        except:
+            raise NoSuchNetFetchFile('Failed to fetch object.')
+
+        return NetFetchFile.getNetFetchClassForType(netfetchType)
+
+    @staticmethod
+    def getNetFetchClassForType(netfetchType):
+        '''
+            getNetFetchClassForType - Get the model which is used for a given netfetchType
+
+            @param netfetchType <int> - A NETFETCH_TYPE_* value
+
+            @return <class> - NetFetchFile or subclass
+        '''
+        if netfetchType == NETFETCH_TYPE_PLAIN:
+            return NetFetchFile
+        elif netfetchType == NETFETCH_TYPE_COMPRESSED_LZMA:
+            return NetFetchCompressedLzmaFile
+        elif netfetchType == NETFETCH_TYPE_COMPRESSED_GZIP:
+            return NetFetchCompressedGzipFile
+        elif netfetchType == NETFETCH_TYPE_COMPRESSED_BZIP2:
+            return NetFetchCompressedBzip2File
+        elif netfetchType == NETFETCH_TYPE_CHUNKED:
+            return NetFetchChunkedFile
+        elif netfetchType == NETFETCH_TYPE_COMPRESSED_ZSTD:
+            return NetFetchCompressedZstdFile
+        elif netfetchType == NETFETCH_TYPE_COMPRESSED_LZ4:
+            return NetFetchCompressedLz4File
+        elif netfetchType == NETFETCH_TYPE_COMPRESSED_ZSTD_DICT:
+            return NetFetchCompressedZstdDictFile
+
+        return NetFetchFile
+
+    @staticmethod
+    def getNetFetchClassForCompressMode(compressMode):
+        '''
+            getNetFetchClassForCompressMode - Get the model which stores data compressed with a given mode
+
+            @param compressMode <str/None> - Compression mode or alias (like "zstd" or "xz"), see compression.normalizeCompressMode.
+                None or empty string is no compression.
+
+            @return <class> - NetFetchFile or subclass
+
+            @raises ValueError - If compressMode is unknown
+        '''
+        compressMode = normalizeCompressMode(compressMode)
+
+        if compressMode == COMPRESS_MODE_LZMA:
+            return NetFetchCompressedLzmaFile
+        elif compressMode == COMPRESS_MODE_GZIP:
+            return NetFetchCompressedGzipFile
+        elif compressMode == COMPRESS_MODE_BZIP2:
+            return NetFetchCompressedBzip2File
+        elif compressMode == COMPRESS_MODE_ZSTD:
+            return NetFetchCompressedZstdFile
+        elif compressMode == COMPRESS_MODE_LZ4:
+            return NetFetchCompressedLz4File
+        elif compressMode == COMPRESS_MODE_ZSTD_DICT:
+            return NetFetchCompressedZstdDictFile
+
+        return NetFetchFile
+
+    @classmethod
+    def downloadToLocal(cls, hostname, filename, password=None, localFilename=None, retainPermissions=True, cache=None, revision=None, asOf=None):
+        '''
+            downloadToLocal - Download file to a local filename
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to fetch
+            @param password <str/None> - Try this password on potentially encrpyted file.
+            @param localFilename <str/None> - If defined, saves at this location. Otherwise, saves at #filename
+            @param retainPermissions <bool> Default True - If True, tries to retain owner/group/mode. If owner/group, you must be root. Silently fails if can't apply.
+            @param cache <cache.LocalCache/None> - If provided, only the metadata is fetched, and if the checksum is already
+                in the cache the file is placed from there. Otherwise it is fetched and added to the cache. Encrypted files are never cached.
+            @param revision <int/None> - If provided, download this revision of the file instead of the current one (see #listRevisions).
+                A negative number counts back from the current revision, so -1 is the one before it.
+            @param asOf <float/None> - If provided, download the revision of the file which was current at this time (seconds since epoch)
+
+              NOTE: #cache is not used when downloading a past revision.
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists, or the revision is not kept
+            @raises InvalidPasswordException - If password was invalid, see getData for all conditions.
+        '''
+        if not localFilename:
+            localFilename = filename
+
+        if revision is not None or asOf is not None:
+            (obj, password) = cls._fetchRevisionObj(hostname, filename, revision, asOf, password)
+            obj._writeToLocal(localFilename, password, retainPermissions)
+            return
+
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=bool(cache is not None))
+
+        if cache is not None and obj.encrypted != '1':
+            cachedFilename = obj._getCachedFilename(cache, password)
+            linkMode = None
+            if retainPermissions is True and cache.linkMode == LINK_MODE_HARDLINK and not obj._hasPermissionsOf(cachedFilename):
+                # A hardlink shares the cache entry's inode with every other file of the same data,
+                #   so applying the stored permissions to it would change them all. Copy instead.
+                linkMode = LINK_MODE_COPY
+            with timePhase(PHASE_CACHE, obj.size or 0):
+                cache.placeFile(cachedFilename, localFilename, linkMode)
+
+            if retainPermissions is True:
+                obj._applyPermissions(localFilename)
+        else:
+            obj._loadData()._writeToLocal(localFilename, password, retainPermissions)
+
+    @classmethod
+    def downloadToStr(cls, hostname, filename, password=None, cache=None, revision=None, asOf=None):
+        '''
+            downloadToStr - Download a hostname/filename pair and return as a string
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to fetch
+            @param password <str/None> - Try this password on potentially encrpyted file.
+            @param cache <cache.LocalCache/None> - If provided, read through this local cache. @see downloadToLocal
+            @param revision <int/None> - If provided, download this revision instead of the current one. @see downloadToLocal
+            @param asOf <float/None> - If provided, download the revision which was current at this time. @see downloadToLocal
+
+            @return <bytes> - Data that has been downloaded
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists, or the revision is not kept
+            @raises InvalidPasswordException - If password was invalid, see getData for all conditions.
+        '''
+        if revision is not None or asOf is not None:
+            (obj, password) = cls._fetchRevisionObj(hostname, filename, revision, asOf, password)
+            return obj.getData(password)
+
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=bool(cache is not None))
+
+        if cache is not None and obj.encrypted != '1':
+            cachedFilename = obj._getCachedFilename(cache, password)
+            with timePhase(PHASE_CACHE, obj.size or 0):
+                with open(cachedFilename, 'rb') as f:
+                    return f.read()
+
+        data = obj._loadData().getData(password)
+        return data
+
+    @classmethod
+    def downloadToStream(cls, hostname, filename, fileObj, password=None, cache=None, revision=None, asOf=None):
+        '''
+            downloadToStream - Download a hostname/filename pair, writing the data to a file-like object (like stdout) one block at a time.
+
+              Chunked files (see NetFetchChunkedFile) are fetched and written one pipelined batch of chunks at a time, so memory
+                stays bounded regardless of file size. Other files are held in memory once, and written as-is (never decoded as text).
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to fetch
+            @param fileObj <file> - File-like object opened for binary write (like sys.stdout.buffer). It is flushed, but not closed.
+            @param password <str/None> - Try this password on potentially encrpyted file.
+            @param cache <cache.LocalCache/None> - If provided, read through this local cache. @see downloadToLocal
+            @param revision <int/None> - If provided, download this revision instead of the current one. @see downloadToLocal
+            @param asOf <float/None> - If provided, download the revision which was current at this time. @see downloadToLocal
+
+            @return <int> - Number of bytes written
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists, or the revision is not kept, or a chunk
+                is missing (i.e. the file was updated or deleted while fetching)
+            @raises InvalidPasswordException - If password was invalid, see getData for all conditions.
+        '''
+        if revision is not None or asOf is not None:
+            (obj, password) = cls._fetchRevisionObj(hostname, filename, revision, asOf, password)
+            return obj._writeToStream(fileObj, password)
+
+        # Chunked files fetch their own data (in batches), so only the metadata is needed
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=True)
+
+        if cache is not None and obj.encrypted != '1':
+            cachedFilename = obj._getCachedFilename(cache, password)
+            with timePhase(PHASE_CACHE, obj.size or 0):
+                with open(cachedFilename, 'rb') as f:
+                    return obj._writeToStream(fileObj, dataIter=iterBlocks(f, DEFAULT_CHUNK_SIZE))
+
+        return obj._loadData()._writeToStream(fileObj, password)
+
+    @classmethod
+    def downloadRange(cls, hostname, filename, start=0, end=None, password=None):
+        '''
+            downloadRange - Download a range of the data of a hostname/filename pair, fetching only what is needed where
+              the stored format allows (see NetFetchFile.iterRange)
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to fetch
+            @param start <int> - Offset of the first byte. A negative offset counts back from the end of the file.
+            @param end <int/None> - Offset after the last byte, or None for the end of the file. A negative offset counts back from the end.
+            @param password <str/None> - Try this password on potentially encrpyted file.
+
+            @return <bytes> - Data of the range
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists, or it was updated or deleted while fetching
+            @raises InvalidPasswordException - If password was invalid, see getData for all conditions.
+        '''
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=True)
+
+        return b''.join(obj.iterRange(start, end, password))
+
+    @classmethod
+    def downloadRangeToLocal(cls, hostname, filename, localFilename, start=0, end=None, password=None):
+        '''
+            downloadRangeToLocal - Download a range of the data of a hostname/filename pair to a local filename.
+              The stored owner/group/mode are not applied. @see downloadRange for the other params
+
+            @param localFilename <str> - Local filename to save the range at
+
+            @return <int> - Number of bytes written
+        '''
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=True)
+
+        size = None
+        if obj.size is not irNull:
+            (rangeStart, rangeEnd) = NetFetchFile._resolveRange(start, end, obj.size)
+            size = rangeEnd - rangeStart
+
+        return obj._writeToLocal(localFilename, password, dataIter=obj.iterRange(start, end, password), size=size or 0)
+
+    @classmethod
+    def downloadRangeToStream(cls, hostname, filename, fileObj, start=0, end=None, password=None):
+        '''
+            downloadRangeToStream - Download a range of the data of a hostname/filename pair, writing it to a file-like object
+              (like stdout) one block at a time. @see downloadRange for the other params
+
+            @param fileObj <file> - File-like object opened for binary write. It is flushed, but not closed.
+
+            @return <int> - Number of bytes written
+        '''
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=True)
+
+        return obj._writeToStream(fileObj, password, dataIter=obj.iterRange(start, end, password))
+
+    @classmethod
+    def listRevisions(cls, hostname, filename):
+        '''
+            listRevisions - List the revisions of a file which can be downloaded: the current one, followed by those kept (see revisions.py)
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename
+
+            @return list<revisions.Revision> - Revisions, newest first. The first is the current revision (format "current").
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists
+        '''
+        obj = cls._fetchObj(hostname, filename, onlyMetadata=True)
+        with timePhase(PHASE_LOOKUP):
+            indexData = obj._getConnection().hget(getRevisionsKey(hostname, filename), REVISIONS_INDEX_FIELD)
+
+        return [ Revision.fromObj(obj) ] + parseRevisionIndex(indexData)
+
+    @classmethod
+    def _fetchRevisionObj(cls, hostname, filename, revision=None, asOf=None, password=None):
+        '''
+            _fetchRevisionObj - Internal. Fetch a revision of a file, rebuilding it from the nearest newer revision which is stored whole
+              (or the current one) by applying the delta of each revision between.
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename
+            @param revision <int/None> - Revision number, or if negative, how many revisions back from the current one
+            @param asOf <float/None> - If #revision is None, the revision which was current at this time
+            @param password <str/None> - Password of any encrypted revisions
+
+            @return tuple( obj<NetFetchFile>, password<str/None> ) - The object with its data loaded, and the password to read that data with
+                (None for a past revision, which is rebuilt unencrypted)
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists, or the revision is not kept
+            @raises InvalidPasswordException - If password was invalid for a revision which is encrypted
+        '''
+        current = cls._fetchObj(hostname, filename)
+        model = current.__class__
+        conn = current._getConnection()
+        revisionsKey = getRevisionsKey(hostname, filename)
+
+        with timePhase(PHASE_LOOKUP):
+            revisions = [ Revision.fromObj(current) ] + parseRevisionIndex(conn.hget(revisionsKey, REVISIONS_INDEX_FIELD))
+
+        if revision is not None:
+            revision = int(revision)
+            if revision < 0:
+                matching = revisions[-revision : -revision + 1]
+            else:
+                matching = [ thisRevision for thisRevision in revisions if thisRevision.revision == revision ]
+        else:
+            matching = [ thisRevision for thisRevision in revisions if thisRevision.mtime <= asOf ][ : 1]
+
+        if not matching:
+            raise NoSuchNetFetchFile('No revision %s of hostname="%s" filename="%s" is kept.' %(revision is not None and str(revision) or 'as of %s' %(str(asOf),), hostname, filename))
+
+        targetIdx = revisions.index(matching[0])
+        if targetIdx == 0:
+            return (current, password)
+
+        # Start from the nearest revision which does not need a newer one
+        startIdx = targetIdx
+        while startIdx > 0 and revisions[startIdx].format != REVISION_FORMAT_FULL:
+            startIdx -= 1
+
+        with timePhase(PHASE_REVISION) as phase:
+            data = None
+            if startIdx == 0:
+                data = current.getData(current.encrypted == '1' and password or None)
+                startIdx = 1
+
+            payloads = conn.hmget(revisionsKey, [ str(thisRevision.revision) for thisRevision in revisions[startIdx : targetIdx + 1] ])
+            phase.numBytes = sum( [ len(payload) for payload in payloads if payload is not None ] )
+
+            for idx in range(startIdx, targetIdx + 1):
+                thisRevision = revisions[idx]
+                payload = payloads[idx - startIdx]
+                if payload is None or (thisRevision.format != REVISION_FORMAT_FULL and thisRevision.baseRevision != revisions[idx - 1].revision):
+                    raise NoSuchNetFetchFile('Revision %d of hostname="%s" filename="%s" cannot be rebuilt, as its history is incomplete.' %(
+                        thisRevision.revision, hostname, filename))
+
+                obj = decodeRevision(model, current._id, thisRevision, payload, data, thisRevision.isEncrypted() and password or None)
+                data = obj.data
+
+        obj.hostname = hostname
+        obj.filename = filename
+        return (obj, None)
+
+    @classmethod
+    def downloadManyToLocal(cls, hostname, filenames, password=None, destDir=None, retainPermissions=True, numWorkers=None, batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+            downloadManyToLocal - Download many files stored from a hostname.
+
+              The files are fetched from Redis in pipelined batches, and decompressed, decrypted, verified, and written
+                by a pool of worker threads. A failure of one file does not stop the others.
+
+            @param hostname <str> - Hostname that files were stored on
+            @param filenames <iterable<str>> - Filenames to fetch
+            @param password <str/None> - Try this password on potentially encrypted files.
+            @param destDir <str/None> - If defined, each file is saved under this directory at its full path (i.e. /etc/hosts is saved at DESTDIR/etc/hosts),
+                creating directories as needed. Otherwise, each file is saved at its filename.
+            @param retainPermissions <bool> Default True - @see downloadToLocal
+            @param numWorkers <int/None> - Number of worker threads. Default is number of cpus.
+            @param batchSize <int> - Number of files fetched per pipeline
+
+            @return <bulk.BulkResult> - Number of files and bytes downloaded, time taken, and any errors
+        '''
+        def _fetchFromNode(nodeModel, nodeFilenames, found):
+            pipeline = nodeModel._getConnection().pipeline(transaction=False)
+            for filename in nodeFilenames:
+                runScript(pipeline, FETCH_FILE_SCRIPT, *cls._getFetchScriptParams(hostname, filename))
+
+            with timePhase(PHASE_FETCH) as phase:
+                results = pipeline.execute()
+                phase.numBytes = sum( [ NetFetchFile._getStoredSize(result[1]) for result in results if result ] )
+
+            now = time.time()
+            accessed = []
+            for (filename, result) in zip(nodeFilenames, results):
+                # Expired files are left for the sweep (see retention.py)
+                if result and not isExpired(hgetallResultToDict(result[1]).get(b'expires', None), now):
+                    found[filename] = (nodeModel, result)
+                    accessed.append(filename)
+
+            if accessed and isAccessTracked():
+                queueFilesAccessed(nodeModel._getConnection(), hostname, accessed, now)
+
+        def _fetchBatch(batch):
+            found = {}
+            for (nodeModel, nodeFilenames) in cls._groupByNode(hostname, batch):
+                _fetchFromNode(nodeModel, nodeFilenames, found)
+
+            if cls._isRouted():
+                # Files not found on the node they belong to may not have been rebalanced yet, so look on the others
+                for nodeModel in cls._getNodeModels():
+                    missing = [ filename for filename in batch if filename not in found and getNodeForFile(hostname, filename) != nodeModel.SHARD_NODE ]
+                    if missing:
+                        _fetchFromNode(nodeModel, missing, found)
+
+            ret = []
+            for filename in batch:
+                if filename not in found:
+                    ret.append( NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename)) )
+                else:
+                    ret.append( (filename, found[filename]) )
+            return ret
+
+        def _writeFile(fetched):
+            (filename, (nodeModel, (primaryKey, flatResult))) = fetched
+            obj = nodeModel._objFromStorage(primaryKey, hgetallResultToDict(flatResult))
+
+            if destDir:
+                localFilename = os.path.join(destDir, filename.lstrip('/'))
+                NetFetchFile._makeLocalDirs(localFilename)
+            else:
+                localFilename = filename
+
+            return obj._writeToLocal(localFilename, password, retainPermissions)
+
+        return runBulk(filenames, _writeFile, beforeBatch=_fetchBatch, numWorkers=numWorkers, batchSize=batchSize)
+
+    @classmethod
+    def downloadFromManyHosts(cls, hostnames, filename, password=None, destDir=None, tarFileObj=None, retainPermissions=True, numWorkers=None, batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+            downloadFromManyHosts - Download one filename as stored from many hostnames (like /etc/hosts from every web server).
+
+              The files are fetched from Redis in pipelined batches (one round-trip per batch, per node), and decompressed, decrypted,
+                verified, and written by a pool of worker threads. A failure of one hostname does not stop the others.
+
+            @param hostnames <iterable<str>> - Hostnames to fetch from. Glob patterns (like "web*") are matched against the hostnames
+                the filename is stored from (see #getFileHostnames).
+            @param filename <str> - Filename to fetch
+            @param password <str/None> - Try this password on potentially encrypted files.
+            @param destDir <str/None> - If defined, the file of each hostname is saved at its full path under DESTDIR/HOSTNAME
+                (i.e. /etc/hosts from web01 is saved at DESTDIR/web01/etc/hosts), creating directories as needed.
+            @param tarFileObj <file/None> - If defined, the files are instead written as a tar stream to this file-like object (opened for
+                binary write, like stdout), each at HOSTNAME/path (i.e. web01/etc/hosts). The tar is finished, but the object is not closed.
+                Each file is held in memory while it is added.
+            @param retainPermissions <bool> Default True - Apply the stored owner/group/mode to each file (or tar entry). @see downloadToLocal
+            @param numWorkers <int/None> - Number of worker threads. Default is number of cpus.
+            @param batchSize <int> - Number of hostnames fetched per pipeline
+
+            @return <bulk.BulkResult> - Number of files and bytes downloaded, time taken, and any errors (by hostname)
+
+            @raises ValueError - If not exactly one of #destDir and #tarFileObj is provided
+        '''
+        if bool(destDir) == bool(tarFileObj is not None):
+            raise ValueError('Exactly one of destDir or tarFileObj must be provided.')
+
+        hostnames = list(hostnames)
+        if [ hostname for hostname in hostnames if any( [ globChar in hostname for globChar in GLOB_CHARS ] ) ]:
+            hostnames = matchStoredFilenames(cls.getFileHostnames(filename), hostnames)
+
+        def _fetchFromNode(nodeModel, nodeHostnames, found):
+            pipeline = nodeModel._getConnection().pipeline(transaction=False)
+            for hostname in nodeHostnames:
+                runScript(pipeline, FETCH_FILE_SCRIPT, *cls._getFetchScriptParams(hostname, filename))
+
+            with timePhase(PHASE_FETCH) as phase:
+                results = pipeline.execute()
+                phase.numBytes = sum( [ NetFetchFile._getStoredSize(result[1]) for result in results if result ] )
+
+            now = time.time()
+            pipeline = nodeModel._getConnection().pipeline(transaction=False)
+            for (hostname, result) in zip(nodeHostnames, results):
+                # Expired files are left for the sweep (see retention.py)
+                if result and not isExpired(hgetallResultToDict(result[1]).get(b'expires', None), now):
+                    found[hostname] = (nodeModel, result)
+                    if isAccessTracked():
+                        queueFilesAccessed(pipeline, hostname, [filename], now)
+
+            if isAccessTracked():
+                pipeline.execute()
+
+        def _fetchBatch(batch):
+            found = {}
+            if cls._isRouted():
+                nodeHostnames = {}
+                for hostname in batch:
+                    nodeHostnames.setdefault(getNodeForFile(hostname, filename), []).append(hostname)
+                for nodeName in getNodeNames():
+                    if nodeName in nodeHostnames:
+                        _fetchFromNode(getNodeModel(cls, nodeName), nodeHostnames[nodeName], found)
+
+                # Files not found on the node they belong to may not have been rebalanced yet, so look on the others
+                for nodeModel in cls._getNodeModels():
+                    missing = [ hostname for hostname in batch if hostname not in found and getNodeForFile(hostname, filename) != nodeModel.SHARD_NODE ]
+                    if missing:
+                        _fetchFromNode(nodeModel, missing, found)
+            else:
+                _fetchFromNode(cls, batch, found)
+
+            ret = []
+            for hostname in batch:
+                if hostname not in found:
+                    ret.append( NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename)) )
+                else:
+                    ret.append( (hostname, found[hostname]) )
+            return ret
+
+        def _writeFile(fetched):
+            (hostname, (nodeModel, (primaryKey, flatResult))) = fetched
+            if not hostname or '/' in hostname or hostname in ('.', '..'):
+                raise ValueError('Hostname "%s" cannot be used as a directory name.' %(hostname,))
+
+            obj = nodeModel._objFromStorage(primaryKey, hgetallResultToDict(flatResult))
+
+            if tarOutput is not None:
+                data = obj.getData(password)
+                (mode, uid, gid) = retainPermissions is True and ( (obj._getStoredMode(), ) + obj._getStoredIds() ) or (None, None, None)
+                with timePhase(PHASE_WRITE, len(data)):
+                    tarOutput.addFile(hostname + '/' + filename.lstrip('/'), data, mode, uid, gid, obj.mtime)
+                return len(data)
+
+            localFilename = os.path.join(destDir, hostname, filename.lstrip('/'))
+            NetFetchFile._makeLocalDirs(localFilename)
+            return obj._writeToLocal(localFilename, password, retainPermissions)
+
+        tarOutput = tarFileObj is not None and TarOutput(tarFileObj) or None
+        try:
+            return runBulk(hostnames, _writeFile, beforeBatch=_fetchBatch, numWorkers=numWorkers, batchSize=batchSize)
+        finally:
+            if tarOutput is not None:
+                tarOutput.close()
+
+    @classmethod
+    def getFileHostnames(cls, filename):
+        '''
+            getFileHostnames - Get the hostnames a filename is stored from, using the listing index (see listing.py)
+
+              Files stored by versions before 3.1.0 are not in the listing index until #rebuildListIndex is run.
+
+            @param filename <str> - Filename
+
+            @return list<str> - Hostnames, sorted
+        '''
+        if cls._isRouted():
+            nodeModels = cls._getNodeModels()
+        else:
+            nodeModels = [cls]
+
+        hostnames = set()
+        for nodeModel in nodeModels:
+            for batch in iterListIndexHostnames(nodeModel._getConnection(), filename):
+                hostnames.update( [ hostname for (hostname, primaryKey) in batch ] )
+
+        return sorted(hostnames)
+
+    @classmethod
+    def getStoredFilenames(cls, hostname):
+        '''
+            getStoredFilenames - Get the filenames of all files stored from a hostname
+
+            @param hostname <str> - Hostname
+
+            @return list<str> - Filenames, sorted
+        '''
+        if cls._isRouted():
+            filenames = set()
+            for nodeModel in cls._getNodeModels():
+                filenames.update(nodeModel.getStoredFilenames(hostname))
+            return sorted(filenames)
+
+        filenames = set(getPathIndexFilenames(cls._getConnection(), hostname))
+        if not isCompactLayout():
+            # Files stored by versions before 3.1.0 are only in the hostname index set (see listing.py)
+            filenames.update( [ obj.filename for obj in cls.objects.filter(hostname=hostname).allOnlyFields(['filename']) ] )
+
+        return sorted(filenames)
+
+    @classmethod
+    def getStorageUsage(cls, hostname=None):
+        '''
+            getStorageUsage - Get the total size of the files stored from each hostname (see retention.py)
+
+              Files stored by versions before 3.1.0 are not counted until #rebuildListIndex is run.
+
+            @param hostname <str/None> - If provided, only this hostname
+
+            @return dict<str, int> - Hostname -> bytes. Hostnames with nothing stored are omitted.
+        '''
+        if cls._isRouted():
+            nodeModels = cls._getNodeModels()
+        else:
+            nodeModels = [cls]
+
+        ret = {}
+        for nodeModel in nodeModels:
+            for (usageHostname, numBytes) in getNodeUsage(nodeModel._getConnection(), hostname).items():
+                ret[usageHostname] = ret.get(usageHostname, 0) + numBytes
+        return ret
+
+    @classmethod
+    def listFiles(cls, hostname=None, prefix='', batchSize=DEFAULT_LIST_BATCH_SIZE):
+        '''
+            listFiles - List stored files by hostname and/or filename prefix, reading only their metadata (never their data).
+
+              Files are read from the listing index (a sorted set, see listing.py) and their metadata fetched a batch at a time,
+                one round-trip per batch, so this scales to any number of stored files.
+
+              Files stored by versions before 3.1.0 are not in the listing index until #rebuildListIndex is run.
+
+            @param hostname <str/None> - If provided, only files stored from this hostname. Default is every hostname.
+            @param prefix <str> - Only files whose filename starts with this (like a directory, "/etc/"). Default is all files.
+            @param batchSize <int> - Number of files fetched per round-trip
+
+            @return generator<NetFetchFile> - Objects with every field except "data" (filename, hostname, size, checksum, netfetchType, mtime, etc).
+                Sorted by hostname then filename if #hostname is provided, otherwise by filename then hostname.
+        '''
+        if cls._isRouted():
+            return cls._mergeNodeFiles(hostname, prefix, batchSize)
+
+        return cls._iterNodeFiles(hostname, prefix, batchSize)
+
+    @classmethod
+    def _iterNodeFiles(cls, hostname, prefix, batchSize):
+        '''
+            _iterNodeFiles - Internal. List the files of one node. @see listFiles
+        '''
+        conn = cls._getConnection()
+        helper = cls.objects
+        fieldNames = cls._getMetadataFieldNames()
+
+        for batch in iterListIndex(conn, hostname, prefix, batchSize):
+            pipeline = conn.pipeline(transaction=False)
+            for (fileHostname, filename, primaryKey) in batch:
+                pipeline.hmget(helper._get_key_for_id(primaryKey), fieldNames)
+            results = pipeline.execute()
+
+            now = time.time()
+            for ((fileHostname, filename, primaryKey), values) in zip(batch, results):
+                storedDict = cls._metadataToStoredDict(fieldNames, values)
+                if not storedDict or isExpired(storedDict.get(b'expires', None), now):
+                    # Deleted since it was read from the index, or expired (see retention.py)
+                    continue
+                obj = cls._objFromStorage(primaryKey, storedDict)
+                obj._onlyMetadata = True
+                yield obj
+
+    @classmethod
+    def _mergeNodeFiles(cls, hostname, prefix, batchSize):
+        '''
+            _mergeNodeFiles - Internal. List the files of every node, merged into one sorted listing. @see listFiles
+
+              A file which is on more than one node (i.e. stored again after a node was added, but not yet rebalanced)
+                is listed once, from the node it belongs to.
+        '''
+        def _keyed(nodeIdx, objs):
+            for (objIdx, obj) in enumerate(objs):
+                if hostname is not None:
+                    yield ( (obj.hostname, obj.filename), nodeIdx, objIdx, obj )
+                else:
+                    yield ( (obj.filename, obj.hostname), nodeIdx, objIdx, obj )
+
+        streams = [ _keyed(nodeIdx, nodeModel._iterNodeFiles(hostname, prefix, batchSize)) for (nodeIdx, nodeModel) in enumerate(cls._getNodeModels()) ]
+
+        for (sortKey, entries) in itertools.groupby(heapq.merge(*streams), key=lambda entry : entry[0]):
+            objs = [ entry[3] for entry in entries ]
+            if len(objs) > 1:
+                nodeName = getNodeForFile(objs[0].hostname, objs[0].filename)
+                objs = [ obj for obj in objs if obj.SHARD_NODE == nodeName ] or objs
+            yield objs[0]
+
+    @classmethod
+    def rebuildListIndex(cls, batchSize=DEFAULT_LIST_BATCH_SIZE):
+        '''
+            rebuildListIndex - Rebuild the listing index (see #listFiles) and path index (see listing.py), and the storage usage,
+              expiry, and eviction order of each hostname (see retention.py), from all stored files, reading only the metadata of each.
+
+              Only needed for files stored (or deleted) by versions before 3.1.0, which did not maintain these.
+
+            @param batchSize <int> - Number of files read per round-trip
+
+            @return <int> - Number of files in the listing index
+        '''
+        if cls._isRouted():
+            return sum( [ nodeModel.rebuildListIndex(batchSize) for nodeModel in cls._getNodeModels() ] )
+
+        conn = cls._getConnection()
+        helper = cls.objects
+
+        primaryKeys = sorted( [ int(primaryKey) for primaryKey in conn.smembers(helper._get_ids_key()) ] )
+
+        # Remove files which no longer exist. This is done first, as the path index holds one primary key per file,
+        #   which may have since been stored again under another.
+        existingKeys = set(primaryKeys)
+        for batch in iterListIndex(conn, batchSize=batchSize):
+            # Files stored since the primary keys were read are also not among them
+            candidates = [ (hostname, filename, primaryKey) for (hostname, filename, primaryKey) in batch if primaryKey not in existingKeys ]
+            if not candidates:
+                continue
+
+            pipeline = conn.pipeline(transaction=False)
+            for (hostname, filename, primaryKey) in candidates:
+                pipeline.exists(helper._get_key_for_id(primaryKey))
+            isStored = pipeline.execute()
+
+            pipeline = conn.pipeline(transaction=False)
+            for ((hostname, filename, primaryKey), exists) in zip(candidates, isStored):
+                if not exists:
+                    queueListIndexRemove(pipeline, hostname, filename, primaryKey)
+            pipeline.execute()
+
+        # Usage is recounted from the sizes of the files
+        conn.delete(getUsageKey())
+
+        numFiles = 0
+        for batch in iterBatches(primaryKeys, batchSize):
+            pipeline = conn.pipeline(transaction=False)
+            for primaryKey in batch:
+                pipeline.hmget(helper._get_key_for_id(primaryKey), ['hostname', 'filename', 'size', 'mtime', 'expires'])
+            results = pipeline.execute()
+
+            pipeline = conn.pipeline(transaction=False)
+            for (primaryKey, (hostname, filename, size, mtime, expires)) in zip(batch, results):
+                if hostname is not None and filename is not None:
+                    queueListIndexAdd(pipeline, hostname, filename, primaryKey)
+                    # Files already in the eviction order keep their place (which may be by when last fetched)
+                    queueFileStored(pipeline, to_unicode(hostname), to_unicode(filename), int(size or 0), float(mtime or 0.0),
+                        float(expires or 0.0), keepAccessTime=True)
+                    numFiles += 1
+            pipeline.execute()
+
+        return numFiles
+
+    @classmethod
+    def migrateLayout(cls, layout, batchSize=DEFAULT_LIST_BATCH_SIZE):
+        '''
+            migrateLayout - Convert all stored files to a storage layout (see listing.setStorageLayout).
+
+              To the compact layout, the listing and path indexes are rebuilt (see #rebuildListIndex), then the hostname and filename
+                index sets are removed. To the indexed layout, the index sets are added back.
+
+              Set the same layout (see config "layout" in [storage]) on every client which stores files. Files stored by clients
+                which still use the indexed layout are found either way, but keep their index sets.
+
+            @param layout <str> - LAYOUT_COMPACT or LAYOUT_INDEXED
+            @param batchSize <int> - Number of files read per round-trip
+
+            @return <int> - Number of files converted
+
+            @raises ValueError - If layout is unknown
+        '''
+        if layout not in STORAGE_LAYOUTS:
+            raise ValueError('Unknown storage layout "%s". Supported layouts are: %s' %(layout, ', '.join(STORAGE_LAYOUTS)))
+
+        if cls._isRouted():
+            return sum( [ nodeModel.migrateLayout(layout, batchSize) for nodeModel in cls._getNodeModels() ] )
+
+        if layout == LAYOUT_COMPACT:
+            # Every file must be in the path index before it can be found without the index sets
+            cls.rebuildListIndex(batchSize)
+
+        conn = cls._getConnection()
+        saver = cls.saver
+
+        primaryKeys = sorted( [ int(primaryKey) for primaryKey in conn.smembers(saver._get_ids_key()) ] )
+
+        numFiles = 0
+        hostnames = set()
+        for batch in iterBatches(primaryKeys, batchSize):
+            pipeline = conn.pipeline(transaction=False)
+            for primaryKey in batch:
+                pipeline.hmget(saver._get_key_for_id(primaryKey), ['hostname', 'filename'])
+            results = pipeline.execute()
+
+            pipeline = conn.pipeline(transaction=False)
+            for (primaryKey, (hostname, filename)) in zip(batch, results):
+                if hostname is None or filename is None:
+                    continue
+                (hostname, filename) = (to_unicode(hostname), to_unicode(filename))
+                if layout == LAYOUT_COMPACT:
+                    # A filename index set holds the file of each hostname, so is removed whole
+                    pipeline.delete(saver._get_key_for_index('filename', filename))
+                    hostnames.add(hostname)
+                else:
+                    saver._add_id_to_index('hostname', primaryKey, hostname, pipeline)
+                    saver._add_id_to_index('filename', primaryKey, filename, pipeline)
+                numFiles += 1
+            pipeline.execute()
+
+        for batch in iterBatches(sorted(hostnames), batchSize):
+            conn.delete(*[ saver._get_key_for_index('hostname', hostname) for hostname in batch ])
+
+        return numFiles
+
+    @classmethod
+    def pruneRevisions(cls, hostname=None, keep=None, maxAge=None, batchSize=DEFAULT_LIST_BATCH_SIZE):
+        '''
+            pruneRevisions - Remove the past revisions of files which are no longer kept by the revision policy (see revisions.setRevisionPolicy),
+              such as those older than its maximum age, and the history of files which are no longer stored.
+
+              Revisions are otherwise only removed when a file is stored again.
+
+            @param hostname <str/None> - Hostname whose files are pruned, or None for every hostname
+            @param keep <int/None> - Number of past revisions kept per file. Default is that of the revision policy.
+            @param maxAge <float/None> - Maximum age in seconds of past revisions. Default is that of the revision policy.
+            @param batchSize <int> - Number of files read per round-trip
+
+            @return <bulk.BulkResult> - Number of revisions removed, and the size of their payloads
+        '''
+        if cls._isRouted():
+            result = BulkResult()
+            for nodeModel in cls._getNodeModels():
+                result.merge( nodeModel.pruneRevisions(hostname, keep, maxAge, batchSize) )
+            result.finish()
+            return result
+
+        conn = cls._getConnection()
+        result = BulkResult()
+
+        for keys in iterBatches(conn.scan_iter(match=getRevisionsKeyPattern(hostname), count=batchSize), batchSize):
+            files = [ parseRevisionsKey(key) for key in keys ]
+
+            # The index of each, and the chunks of the current object (if still stored)
+            pipeline = conn.pipeline(transaction=False)
+            for (key, (fileHostname, filename)) in zip(keys, files):
+                pipeline.hget(key, REVISIONS_INDEX_FIELD)
+                (indexKeys, args) = cls._getFetchScriptParams(fileHostname, filename)
+                runScript(pipeline, FETCH_FIELDS_SCRIPT, indexKeys, args + ['chunks'])
+            results = pipeline.execute()
+
+            pipeline = conn.pipeline(transaction=False)
+            releaseChunkIds = []
+            for (key, indexData, existingResult) in zip(keys, results[0::2], results[1::2]):
+                revisions = parseRevisionIndex(indexData)
+                if not existingResult:
+                    # The file is no longer stored
+                    (kept, removed) = ([], revisions)
+                else:
+                    (kept, removed) = applyRevisionPolicy(revisions, keep, maxAge)
+                if not removed:
+                    continue
+
+                if kept:
+                    pipeline.hdel(key, *[ str(revision.revision) for revision in removed ])
+                    pipeline.hset(key, REVISIONS_INDEX_FIELD, dumpRevisionIndex(kept))
+                else:
+                    pipeline.delete(key)
+
+                currentChunkIds = [ entry.chunkId for entry in parseManifest(to_unicode(existingResult and existingResult[1][0] or b'')) ]
+                releaseChunkIds += getReleasableChunkIds(removed, kept, currentChunkIds)
+                for revision in removed:
+                    result.addFile(revision.storedSize)
+
+            pipeline.execute()
+            releaseChunks(conn, releaseChunkIds)
+
+        result.finish()
+        return result
+
+    @classmethod
+    def trainCompressDictionary(cls, hostname=None, maxSamples=DEFAULT_MAX_SAMPLES, maxSampleSize=DEFAULT_MAX_SAMPLE_SIZE, dictSize=DEFAULT_DICTIONARY_SIZE, makeCurrent=True, batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+            trainCompressDictionary - Train a zstd dictionary on a random sample of the stored files, and store it (on every node)
+              for the "zstd-dict" compression mode (see NetFetchCompressedZstdDictFile).
+
+              Only files which are unencrypted, not chunked, and no larger than #maxSampleSize are sampled. The sample is picked while
+                listing the files (see #listFiles, which reads only metadata), then the data of the sampled files is fetched in pipelined batches.
+
+              Files already stored are not recompressed, store them again with "zstd-dict" to use the new dictionary.
+
+            @param hostname <str/None> - If provided, only sample the files stored from this hostname. Default is every hostname.
+            @param maxSamples <int> - Maximum number of files to train on
+            @param maxSampleSize <int> - Size of the largest file to train on
+            @param dictSize <int> - Maximum size of the dictionary, in bytes
+            @param makeCurrent <bool> - If True (default), files stored with "zstd-dict" from now on are compressed with the new dictionary.
+                A process which already stored a file with "zstd-dict" keeps using the dictionary which was current then (see dictionaries.py).
+            @param batchSize <int> - Number of files fetched per round-trip
+
+            @return tuple( dictId<int>, numSamples<int>, numSampleBytes<int> ) - Id of the new dictionary, and the files it was trained on
+
+            @raises ValueError - If there are too few files to train on
+        '''
+        # Reservoir sampling, so every eligible file is equally likely to be picked, without holding the listing
+        sampled = []
+        numEligible = 0
+        for obj in cls.listFiles(hostname, batchSize=batchSize):
+            if obj.encrypted == '1' or obj.chunks or not obj.size or obj.size > maxSampleSize:
+                continue
+
+            numEligible += 1
+            if len(sampled) < maxSamples:
+                sampled.append(obj)
+            else:
+                idx = random.randint(0, numEligible - 1)
+                if idx < maxSamples:
+                    sampled[idx] = obj
+
+        # Fetch the data with the model (bound to the node) each was listed with
+        sampledByModel = {}
+        for obj in sampled:
+            sampledByModel.setdefault(obj.__class__, []).append(obj)
+
+        samples = []
+        for (model, objs) in sampledByModel.items():
+            for batch in iterBatches(objs, batchSize):
+                for dictId in set( [ obj.compressDict for obj in batch if obj.compressDict ] ):
+                    loadDictionary(model._getConnection(), dictId)
+
+                with timePhase(PHASE_FETCH):
+                    fetchedObjs = model.objects.getMultiple( [ obj._id for obj in batch ] )
+
+                for fetchedObj in fetchedObjs:
+                    if not fetchedObj:
+                        # Deleted since it was listed
+                        continue
+                    try:
+                        samples.append(fetchedObj.getData())
+                    except InvalidPasswordException:
+                        # Failed checksum, don't train on it
+                        continue
+
+        if not samples:
+            raise ValueError('No stored files to train a compression dictionary on.')
+
+        dictData = trainDictionary(samples, dictSize)
+        dictId = storeDictionary( [ nodeModel._getConnection() for nodeModel in cls._getNodeModels() ], dictData, makeCurrent)
+
+        return (dictId, len(samples), sum( [ len(sample) for sample in samples ] ))
+
+    @classmethod
+    def listCompressDictionaries(cls):
+        '''
+            listCompressDictionaries - List the stored zstd dictionaries (see #trainCompressDictionary)
+
+            @return tuple( dictionaries<list< tuple(dictId<int>, size<int>) >>, currentId<int/None> ) - Dictionaries sorted by id,
+                and the id of the one files are compressed with (None if there is none)
+        '''
+        # Every node holds every dictionary, see dictionaries.py
+        return listDictionaries(cls._getNodeModels()[0]._getConnection())
+
+    @classmethod
+    def setCompressDictionary(cls, dictId):
+        '''
+            setCompressDictionary - Make a stored zstd dictionary the one files stored with "zstd-dict" are compressed with (like a previous one)
+
+            @param dictId <int> - Dictionary id
+
+            @raises ValueError - If the dictionary is not stored
+        '''
+        setCurrentDictionary( [ nodeModel._getConnection() for nodeModel in cls._getNodeModels() ], dictId)
+
+    @classmethod
+    def _fetchObj(cls, hostname, filename, onlyMetadata=False):
+        '''
+            _fetchObj - Internal. Fetch the object stored for a hostname/filename pair, using the model that matches its netfetchType
+
+              The lookup of the hostname/filename indexes, the type, and the data are all performed in a single round-trip,
+                by a server-side script (see scripts.FETCH_FILE_SCRIPT)
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to fetch
+            @param onlyMetadata <bool> - If True, fetch every field except "data". Use #_loadData to fetch the data afterwards.
+
+            @return <NetFetchFile> - The fetched object
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists
+        '''
+        if cls._isRouted():
+            # Look on the node the file belongs to first. It may be on another if not yet rebalanced.
+            for nodeModel in cls._getNodeModelsForFile(hostname, filename):
+                try:
+                    return nodeModel._fetchObj(hostname, filename, onlyMetadata)
+                except NoSuchNetFetchFile:
+                    pass
+            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+
+        (keys, args) = cls._getFetchScriptParams(hostname, filename)
+        if onlyMetadata:
+            fieldNames = cls._getMetadataFieldNames()
+            with timePhase(PHASE_LOOKUP) as phase:
+                result = runScript(cls._getConnection(), FETCH_FIELDS_SCRIPT, keys, args + fieldNames)
+                phase.numBytes = result and NetFetchFile._getStoredSize(result[1]) or 0
+        else:
+            with timePhase(PHASE_FETCH) as phase:
+                result = runScript(cls._getConnection(), FETCH_FILE_SCRIPT, keys, args)
+                phase.numBytes = result and NetFetchFile._getStoredSize(result[1]) or 0
+
+        if not result:
+            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+
+        (primaryKey, flatResult) = result
+        if onlyMetadata:
+            storedDict = cls._metadataToStoredDict(fieldNames, flatResult)
+        else:
+            storedDict = hgetallResultToDict(flatResult)
+
+        now = time.time()
+        if isExpired(storedDict.get(b'expires', None), now):
+            # An expired file is as if it does not exist, so is deleted when seen (see retention.py)
+            cls._deleteBatch(hostname, [filename], expiredBefore=now)
+            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+
+        if isAccessTracked():
+            queueFilesAccessed(cls._getConnection(), hostname, [filename], now)
+
+        obj = cls._objFromStorage(primaryKey, storedDict)
+        if onlyMetadata:
+            obj._onlyMetadata = True
+        return obj
+
+    @staticmethod
+    def _getMetadataFieldNames():
+        '''
+            _getMetadataFieldNames - Internal. Get the names of all fields except "data"
+
+            @return list<str> - Field names
+        '''
+        return [ str(field) for field in NetFetchFile.FIELDS if str(field) != 'data' ]
+
+    @staticmethod
+    def _metadataToStoredDict(fieldNames, values):
+        '''
+            _metadataToStoredDict - Internal. Convert the values of some fields (as returned by HMGET) into a stored hash, see #_objFromStorage
+
+            @param fieldNames list<str> - Field names
+            @param values list<bytes/None> - Value of each field, None if not present
+
+            @return <dict> - field -> stored value, of the fields which are present. Empty if the object does not exist.
+        '''
+        return dict( [ (fieldName.encode('utf-8'), value) for (fieldName, value) in zip(fieldNames, values) if value is not None ] )
+
+    @staticmethod
+    def _getStoredSize(values):
+        '''
+            _getStoredSize - Internal. Get the number of bytes transferred for a fetched object, for stats
+
+            @param values list<bytes/None> - Flat result of HGETALL, or values of HMGET
+
+            @return <int>
+        '''
+        return sum( [ len(value) for value in values if value is not None ] )
+
+    @classmethod
+    def _getFetchScriptParams(cls, hostname, filename):
+        '''
+            _getFetchScriptParams - Internal. Get the KEYS and ARGV for running FETCH_FILE_SCRIPT (or LOOKUP_FILE_SCRIPT, FETCH_FIELDS_SCRIPT)
+              on a hostname/filename pair
+
+            @return tuple( keys<list>, args<list> )
+        '''
+        helper = cls.objects
+        keys = [ helper._get_key_for_index('hostname', hostname), helper._get_key_for_index('filename', filename), getPathIndexKey(hostname) ]
+        args = [ helper._get_key_for_id(''), filename ]
+
+        return (keys, args)
+
+    @classmethod
+    def _lookupPrimaryKey(cls, hostname, filename):
+        '''
+            _lookupPrimaryKey - Internal. Resolve a hostname/filename pair to the primary key of its object on this model's node,
+              in a single round-trip (see scripts.LOOKUP_FILE_SCRIPT)
+
+            @param hostname <str> - Hostname
+            @param filename <str> - Filename
+
+            @return <int/None> - Primary key, or None if not stored
+        '''
+        with timePhase(PHASE_LOOKUP):
+            primaryKey = runScript(cls._getConnection(), LOOKUP_FILE_SCRIPT, *cls._getFetchScriptParams(hostname, filename))
+
+        return primaryKey is not None and int(primaryKey) or None
+
+    @classmethod
+    def _objFromStorage(cls, primaryKey, storedDict):
+        '''
+            _objFromStorage - Internal. Convert a stored hash (as returned by HGETALL) into an object,
+              using the model that matches its netfetchType (bound to the same node as this model, if any)
+
+            @param primaryKey <int/bytes> - Primary key of object
+            @param storedDict <dict> - Hash of the object, field -> stored value
+
+            @return <NetFetchFile> - The object
+
+            @raises NoSuchNetFetchFile - If storedDict is empty (object is gone)
+        '''
+        if not storedDict:
+            raise NoSuchNetFetchFile('Failed to fetch object.')
+
+        netfetchType = storedDict.get(b'netfetchType', None)
+        try:
+            netfetchType = int(netfetchType)
+        except:
+            netfetchType = NETFETCH_TYPE_PLAIN
+
+        fetchClass = NetFetchFile.getNetFetchClassForType(netfetchType)
+        if cls.SHARD_NODE is not None:
+            fetchClass = getNodeModel(fetchClass, cls.SHARD_NODE)
+
+        if storedDict.get(b'compressDict', None) and storedDict.get(b'data', None):
+            # The dictionary must be loaded before the data can be decompressed, see dictionaries.py
+            loadDictionary(fetchClass._getConnection(), to_unicode(storedDict[b'compressDict']))
+
+        storedDict['_id'] = int(primaryKey)
+        with timePhase(PHASE_DECOMPRESS, len(storedDict.get(b'data', None) or b'')):
+            return fetchClass.objects._redisResultToObj(storedDict)
+
+    @classmethod
+    def deleteFile(cls, hostname, filename, notify=True):
+        '''
+            deleteFile - Deletes a file from NetFetch storage.
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to delete
+            @param notify <bool> Default True - If True, publish the deletion (see events.py). False is for moving a file between nodes.
+
+            @return <bool> - True if a file was deleted, otherwise False
+
+        '''
+        if cls._isRouted():
+            # The file may be on more than one node, if not yet rebalanced
+            return any( [ nodeModel.deleteFile(hostname, filename, notify) for nodeModel in cls._getNodeModels() ] )
+
+        return bool(cls._deleteBatch(hostname, [filename], notify=notify))
+
+    @classmethod
+    def deleteMany(cls, hostname, filenames, batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+            deleteMany - Delete many files stored from a hostname. Files are looked-up and deleted a batch at a time,
+              so a batch costs a few round-trips, instead of a few per file.
+
+            @param hostname <str> - Hostname that files were stored on
+            @param filenames <iterable<str>> - Filenames to delete
+            @param batchSize <int> - Number of files deleted per pipeline
+
+            @return <bulk.BulkResult> - Number of files deleted, and their total size. Filenames which are not stored are not counted.
+        '''
+        result = BulkResult()
+
+        for batch in iterBatches(filenames, batchSize):
+            if cls._isRouted():
+                # A file may be on more than one node, if not yet rebalanced
+                nodeModels = cls._getNodeModels()
+            else:
+                nodeModels = [cls]
+
+            for nodeModel in nodeModels:
+                for obj in nodeModel._deleteBatch(hostname, batch):
+                    result.addFile(obj.size or 0)
+
+        result.finish()
+        return result
+
+    @classmethod
+    def deleteByPrefix(cls, hostname=None, prefix='', batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+            deleteByPrefix - Delete every file of a hostname and/or under a filename prefix. Files are read from the listing index
+              (see #listFiles) and deleted a batch at a time, so a batch costs a few round-trips, and the data of the files is never read.
+
+              Files stored by versions before 3.1.0 are not in the listing index until #rebuildListIndex is run.
+
+            @param hostname <str/None> - If provided, only files stored from this hostname. Otherwise, files of every hostname.
+            @param prefix <str> - Only files whose filename starts with this prefix (like "/var/log/"). Empty string matches all.
+            @param batchSize <int> - Number of files deleted per pipeline
+
+            @return <bulk.BulkResult> - Number of files deleted, and their total size
+
+            @raises ValueError - If neither hostname nor prefix is provided
+        '''
+        if hostname is None and not prefix:
+            raise ValueError('A hostname or a prefix is required.')
+
+        result = BulkResult()
+
+        for nodeModel in cls._getNodeModels():
+            for batch in iterListIndex(nodeModel._getConnection(), hostname, prefix, batchSize):
+                for obj in nodeModel._deletePrimaryKeys( [ primaryKey for (fileHostname, filename, primaryKey) in batch ] ):
+                    result.addFile(obj.size or 0)
+
+        result.finish()
+        return result
+
+    @classmethod
+    def _deleteBatch(cls, hostname, filenames, expiredBefore=None, notify=True):
+        '''
+            _deleteBatch - Internal. Delete a batch of files from one node, in a fixed number of round-trips. @see deleteMany
+
+            @param hostname <str> - Hostname
+            @param filenames list<str> - Filenames
+            @param expiredBefore <float/None> - If provided, only files which expired by this time (see retention.py) are deleted
+            @param notify <bool> - If True, publish the deletion of each (see events.py)
+
+            @return list<NetFetchFile> - The objects (with only their indexed fields, size, chunks, and expires) which were deleted
+        '''
+        conn = cls._getConnection()
+
+        with timePhase(PHASE_LOOKUP):
+            pipeline = conn.pipeline(transaction=False)
+            for filename in filenames:
+                runScript(pipeline, LOOKUP_FILE_SCRIPT, *cls._getFetchScriptParams(hostname, filename))
+            primaryKeys = [ int(primaryKey) for primaryKey in pipeline.execute() if primaryKey is not None ]
+
+        return cls._deletePrimaryKeys(primaryKeys, expiredBefore, notify)
+
+    @classmethod
+    def _deletePrimaryKeys(cls, primaryKeys, expiredBefore=None, notify=True):
+        '''
+            _deletePrimaryKeys - Internal. Delete a batch of objects from one node, by primary key, in a fixed number of round-trips.
+              @see _deleteBatch for params
+
+            @param primaryKeys list<int> - Primary keys. Those no longer stored are skipped.
+
+            @return list<NetFetchFile> - The objects which were deleted
+        '''
+        if not primaryKeys:
+            return []
+
+        conn = cls._getConnection()
+        helper = cls.objects
+        fieldNames = ['filename', 'hostname', 'size', 'chunks', 'expires']
+
+        with timePhase(PHASE_LOOKUP):
+            pipeline = conn.pipeline(transaction=False)
+            for primaryKey in primaryKeys:
+                pipeline.hmget(helper._get_key_for_id(primaryKey), fieldNames)
+
+            objs = []
+            for (primaryKey, values) in zip(primaryKeys, pipeline.execute()):
+                # Fields which are not present (i.e. stored by a version before 3.1.0) take their defaults,
+                #   where getMultipleOnlyFields would give the string 'None'
+                storedDict = cls._metadataToStoredDict(fieldNames, values)
+                if not storedDict:
+                    continue
+                storedDict['_id'] = int(primaryKey)
+                objs.append( helper._redisResultToObj(storedDict) )
+
+            if expiredBefore is not None:
+                objs = [ obj for obj in objs if isExpired(obj.expires, expiredBefore) ]
+                if not objs:
+                    return []
+
+        chunkIds = []
+        for obj in objs:
+            chunkIds += obj._getChunkIds()
+
+        with timePhase(PHASE_DELETE):
+            pipeline = conn.pipeline(transaction=False)
+            for obj in objs:
+                queueRevisionsDelete(pipeline, obj.hostname, obj.filename)
+            for obj in objs:
+                # Deleting clears the primary key of the object, so queue the removal from the listing index first
+                queueListIndexRemove(pipeline, obj.hostname, obj.filename, obj._id)
+                queueFileRemoved(pipeline, obj.hostname, obj.filename, obj.size)
+                if notify:
+                    queueChangeEvent(pipeline, EVENT_DELETE, obj.hostname, obj.filename)
+                cls.deleter.deleteOne(obj, pipeline)
+            results = pipeline.execute()
+
+            # The first two results of each object are its history (see revisions.queueRevisionsDelete)
+            for indexData in results[ : len(objs) * 2 : 2]:
+                chunkIds += getDeletedChunkIds(indexData)
+
+            releaseChunks(conn, chunkIds)
+
+        return objs
+
+    @classmethod
+    def expireFiles(cls, batchSize=DEFAULT_EXPIRE_BATCH_SIZE, maxFiles=None):
+        '''
+            expireFiles - Delete the files which have expired (were stored with a TTL, see #createOrUpdate), with their
+              indexes, listing index entries, past revisions, and chunks.
+
+              Expired files are never returned, and are deleted when next fetched. A batch is also deleted every
+                retention.EXPIRE_SWEEP_INTERVAL as files are stored, so this is only needed to reclaim the rest (i.e. from cron).
+
+            @param batchSize <int> - Number of files deleted per round-trip
+            @param maxFiles <int/None> - If provided, the most files (per node) to check
+
+            @return <bulk.BulkResult> - Number of files deleted, and their total size
+        '''
+        if cls._isRouted():
+            result = BulkResult()
+            for nodeModel in cls._getNodeModels():
+                result.merge( nodeModel.expireFiles(batchSize, maxFiles) )
+            result.finish()
+            return result
+
+        conn = cls._getConnection()
+        result = BulkResult()
+
+        numChecked = 0
+        while maxFiles is None or numChecked < maxFiles:
+            now = time.time()
+            expired = getExpiredFiles(conn, now, maxFiles is None and batchSize or min(batchSize, maxFiles - numChecked))
+            if not expired:
+                break
+            numChecked += len(expired)
+
+            filesByHostname = {}
+            for (hostname, filename) in expired:
+                filesByHostname.setdefault(hostname, []).append(filename)
+
+            deleted = set()
+            for (hostname, filenames) in filesByHostname.items():
+                for obj in cls._deleteBatch(hostname, filenames, expiredBefore=now):
+                    deleted.add( (obj.hostname, obj.filename) )
+                    result.addFile(obj.size or 0)
+
+            # Any others which are no longer stored (i.e. deleted by a version before 3.1.0) are only removed from the expiry set.
+            #  Those stored again meanwhile were already given their new expiry.
+            notDeleted = [ (hostname, filename) for (hostname, filename) in expired if (hostname, filename) not in deleted ]
+            stale = []
+            if notDeleted:
+                pipeline = conn.pipeline(transaction=False)
+                for (hostname, filename) in notDeleted:
+                    runScript(pipeline, LOOKUP_FILE_SCRIPT, *cls._getFetchScriptParams(hostname, filename))
+                stale = [ fileInfo for (fileInfo, primaryKey) in zip(notDeleted, pipeline.execute()) if primaryKey is None ]
+
+                pipeline = conn.pipeline(transaction=False)
+                removeExpiryMembers(pipeline, stale)
+                pipeline.execute()
+
+            if not deleted and not stale:
+                break
+
+        result.finish()
+        return result
+
+    @classmethod
+    def enforceStorageBudget(cls, hostname, maxBytes=None, exclude=None, batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+            enforceStorageBudget - Evict (delete) files of a hostname while the total size of its files (on every node) is over budget.
+              The files evicted first are those stored longest ago, or with retention.EVICT_LRU, those fetched longest ago.
+
+              This is run after each store if there is a storage budget (see retention.setStorageBudget).
+
+            @param hostname <str> - Hostname
+            @param maxBytes <int/None> - Budget, in bytes. Default is that of retention.setStorageBudget.
+            @param exclude list<str>/None - Filenames which are never evicted, like those just stored
+            @param batchSize <int> - Number of files considered per round-trip
+
+            @return <bulk.BulkResult> - Number of files evicted, and their total size
+        '''
+        if maxBytes is None:
+            maxBytes = getStorageBudget()[0]
+
+        result = BulkResult()
+        if not maxBytes:
+            result.finish()
+            return result
+
+        if cls._isRouted():
+            nodeModels = cls._getNodeModels()
+        else:
+            nodeModels = [cls]
+        exclude = set(exclude or [])
+
+        excess = sum( [ getNodeUsage(nodeModel._getConnection(), hostname).get(hostname, 0) for nodeModel in nodeModels ] ) - maxBytes
+        while excess > 0:
+            candidates = []
+            for nodeIdx in range(len(nodeModels)):
+                for (score, filename) in getEvictionCandidates(nodeModels[nodeIdx]._getConnection(), hostname, batchSize + len(exclude)):
+                    if filename not in exclude:
+                        candidates.append( (score, nodeIdx, filename) )
+            if not candidates:
+                break
+            candidates = sorted(candidates)[ : batchSize]
+
+            # The size of each, in one round-trip per node
+            sizes = {}
+            for nodeIdx in range(len(nodeModels)):
+                nodeFilenames = [ filename for (score, candidateNodeIdx, filename) in candidates if candidateNodeIdx == nodeIdx ]
+                if not nodeFilenames:
+                    continue
+                pipeline = nodeModels[nodeIdx]._getConnection().pipeline(transaction=False)
+                for filename in nodeFilenames:
+                    (keys, args) = cls._getFetchScriptParams(hostname, filename)
+                    runScript(pipeline, FETCH_FIELDS_SCRIPT, keys, args + ['filename', 'size'])
+                for (filename, sizeResult) in zip(nodeFilenames, pipeline.execute()):
+                    # Empty files, and those stored by a version before 3.1.0, have no size (or 0), but are still stored
+                    if sizeResult and sizeResult[1][0] is not None:
+                        sizes[ (nodeIdx, filename) ] = int(sizeResult[1][1] or 0)
+                    else:
+                        sizes[ (nodeIdx, filename) ] = None
+
+            toEvict = {}
+            stale = {}
+            for (score, nodeIdx, filename) in candidates:
+                size = sizes[ (nodeIdx, filename) ]
+                if size is None:
+                    # No longer stored
+                    stale.setdefault(nodeIdx, []).append(filename)
+                    continue
+                toEvict.setdefault(nodeIdx, []).append(filename)
+                excess -= size
+                if excess <= 0:
+                    break
+
+            for (nodeIdx, filenames) in stale.items():
+                pipeline = nodeModels[nodeIdx]._getConnection().pipeline(transaction=False)
+                removeEvictionMembers(pipeline, hostname, filenames)
+                pipeline.execute()
+
+            for (nodeIdx, filenames) in toEvict.items():
+                for obj in nodeModels[nodeIdx]._deleteBatch(hostname, filenames):
+                    result.addFile(obj.size or 0)
+
+        result.finish()
+        return result
+
+    @staticmethod
+    def _applyRetention(hostname, storedFilenames):
+        '''
+            _applyRetention - Internal. Run after files are stored: delete a batch of expired files (every retention.EXPIRE_SWEEP_INTERVAL),
+              and evict files of the hostname if it is over the storage budget. @see retention.py
+
+            @param hostname <str> - Hostname of the stored files
+            @param storedFilenames list<str> - Filenames stored, which are not evicted
+        '''
+        if isExpireSweepDue():
+            NetFetchFile.expireFiles(maxFiles=DEFAULT_EXPIRE_BATCH_SIZE)
+
+        if isBudgetEnabled():
+            NetFetchFile.enforceStorageBudget(hostname, exclude=storedFilenames)
+
+
+    ###################################
+    ##        Creation Methods       ##
+    ###################################
+
+    @classmethod
+    def create(cls, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None, encryption=None, checksumType=None, ttl=None):
+        '''
+            create - Create and save NetFetchFile object
+
+            @param filename <str> - filename to use for storage
+            @param data     <bytes/file-like> - Data to store, or a file-like object opened for binary read
+            @param mode     <str>  - String or int of base-8 encoded chmod value. os.stat(x).st_mode returns this.
+            @param owner    <str>  - Username owner
+            @param group    <str>  - Associated group
+            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
+            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+            @param encryption <str/None> - If password provided, the format of encrypted data, like "aesgcm". Default is Fernet. @see #encryptData
+            @param checksumType <str/None> - Checksum algorithm, like "blake2b" or "xxh3". Default is MD5. @see #setData
+            @param ttl <float/None> - If provided, the file expires this many seconds after it is stored (see retention.py).
+                Storing a file again replaces its TTL, so it is kept forever if none is provided.
+
+            @return - Saved NetFetchFile object
+
+            @raises KeyError if a hostname/filename pair already exists. use createOrUpdate to conditionally update it.
+            @raises ValueError  if provided password does not meet criteria, or ttl is not positive
+        '''
+        expires = getExpireTime(ttl)
+        hostname = hostnameOverride or socket.gethostname()
+        if cls.exists(hostname, filename):
+            raise KeyError('A file already exists with hostname="%s" and filename="%s!\n' %(hostname, filename))
+        obj = cls._newObj(filename, hostname, mode, owner, group)
+        obj.expires = expires
+
+        return obj._storePayload(data, password, encryption=encryption, checksumType=checksumType)
+
+    @classmethod
+    def createOrUpdate(cls, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None, encryption=None, checksumType=None, ttl=None):
+        '''
+            createOrUpdate - Create and save NetFetchFile object, or update an existing one.
+
+            @param filename <str> - filename to use for storage
+            @param data     <bytes/file-like> - Data to store, or a file-like object opened for binary read
+            @param mode     <str>  - String or int of base-8 encoded chmod value. os.stat(x).st_mode returns this.
+            @param owner    <str>  - Username owner
+            @param group    <str>  - Associated group
+            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
+            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+            @param encryption <str/None> - If password provided, the format of encrypted data, like "aesgcm". Default is Fernet. @see #encryptData
+            @param checksumType <str/None> - Checksum algorithm, like "blake2b" or "xxh3". Default is MD5. @see #setData
+            @param ttl <float/None> - If provided, the file expires this many seconds after it is stored (see retention.py).
+                Storing a file again replaces its TTL, so it is kept forever if none is provided.
+
+            @return - Saved NetFetchFile object
+
+            @raises ValueError  if provided password does not meet criteria, or ttl is not positive
+        '''
+        expires = getExpireTime(ttl)
+        hostname = hostnameOverride or socket.gethostname()
+        obj = cls._getOrNewObj(filename, hostname, mode, owner, group)
+        obj.expires = expires
+
+        return obj._storePayload(data, password, encryption=encryption, checksumType=checksumType)
+
+    @classmethod
+    def restoreRevision(cls, filename, revision=None, asOf=None, password=None, hostnameOverride=None, encryption=None):
+        '''
+            restoreRevision - Store a past revision of a file as its newest revision (so the current one is kept in its history, see revisions.py)
+
+            @param filename <str> - Filename
+            @param revision <int/None> - Revision number, or if negative, how many revisions back from the current one. @see #listRevisions
+            @param asOf <float/None> - If #revision is None, restore the revision which was current at this time (seconds since epoch)
+            @param password <str/None> - Password of any encrypted revisions. If provided, the restored data is encrypted with it.
+            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+            @param encryption <str/None> - If password provided, the format of encrypted data. @see #encryptData
+
+            @return - Saved object of this model
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists, or the revision is not kept
+            @raises InvalidPasswordException - If password was invalid for a revision which is encrypted
+            @raises ValueError - If neither #revision nor #asOf is provided
+        '''
+        if revision is None and asOf is None:
+            raise ValueError('A revision or time must be provided to restore.')
+
+        hostname = hostnameOverride or socket.gethostname()
+        (obj, objPassword) = cls._fetchRevisionObj(hostname, filename, revision, asOf, password)
+
+        return cls.createOrUpdate(filename, obj.getData(objPassword), obj.mode, obj.owner, obj.group, password, hostname,
+                    encryption=encryption, checksumType=obj.checksumType or None)
+
+    @classmethod
+    def _newObj(cls, filename, hostname, mode='', owner='', group=''):
+        '''
+            _newObj - Internal. Construct a new, unsaved, object of this model.
+
+            @see create for params
+        '''
+        if cls._isRouted():
+            return cls._getNodeModelsForFile(hostname, filename)[0]._newObj(filename, hostname, mode, owner, group)
+
+        return cls( \
+                filename=filename,
+                hostname=hostname,
+                mode=mode,
+                owner=owner,
+                group=group,
+                mtime=time.time(),
+                revision=1,
+        )
+
+    @classmethod
+    def _getOrNewObj(cls, filename, hostname, mode='', owner='', group=''):
+        '''
+            _getOrNewObj - Internal. Fetch the existing object for a hostname/filename pair and apply any provided attributes,
+              or construct a new one if none exists. Does not save object.
+
+            @see createOrUpdate for params
+
+            @return <NetFetchFile> - Object of this model (bound to the node the file belongs to, if multiple nodes are configured)
+        '''
+        if cls._isRouted():
+            return cls._getNodeModelsForFile(hostname, filename)[0]._getOrNewObj(filename, hostname, mode, owner, group)
+
+        # The existing data is about to be replaced, so only fetch the metadata. The data is then always seen as changed,
+        #   and stored by this model (even if the existing object is of another model)
+        fieldNames = cls._getMetadataFieldNames()
+        with timePhase(PHASE_LOOKUP):
+            (keys, args) = cls._getFetchScriptParams(hostname, filename)
+            result = runScript(cls._getConnection(), FETCH_FIELDS_SCRIPT, keys, args + fieldNames)
+        if not result or not any( [ value is not None for value in result[1] ] ):
+            return cls._newObj(filename, hostname, mode, owner, group)
+
+        # Fields which are not present (i.e. stored by a version before 3.1.0) take their defaults
+        storedDict = cls._metadataToStoredDict(fieldNames, result[1])
+        storedDict['_id'] = int(result[0])
+        existing = cls.objects._redisResultToObj(storedDict)
+        if mode not in (None, ''):
+            existing.mode = mode
+        if owner not in (None, ''):
+            existing.owner = owner
+        if group not in (None, ''):
+            existing.group = group
+
+        existing.netfetchType = cls.NETFETCH_TYPE
+        existing.mtime = time.time()
+        existing.revision = (existing.revision or 0) + 1
+
+        return existing
+                    
+    @classmethod
+    def createOrUpdateFromFile(cls, filename, password=None, hostnameOverride=None, savePermissions=True, encryption=None, checksumType=None, ttl=None):
+        '''
+            createOrUpdateFromFile - Create and save NetFetchFile object, or update an existing one, provided with a filename.
+
+              The file is memory-mapped (see localfile.mapFile), so its data is not copied into memory before being stored.
+
+            @param filename <str> - filename to use for storage
+            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
+            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+            @param savePermissions <bool> Default True - If True, will store owner/group/mode of file.
+            @param encryption <str/None> - If password provided, the format of encrypted data, like "aesgcm". Default is Fernet. @see #encryptData
+            @param checksumType <str/None> - Checksum algorithm, like "blake2b" or "xxh3". Default is MD5. @see #setData
+            @param ttl <float/None> - If provided, the file expires this many seconds after it is stored. @see #createOrUpdate
+
+            @return - Saved NetFetchFile object
+
+            @raises ValueError  if provided password does not meet criteria, or ttl is not positive
+        '''
+        (mode, owner, group) = cls._getSourceFileInfo(filename, savePermissions)
+
+        with timePhase(PHASE_READ):
+            data = mapFile(filename)
+
+        return cls.createOrUpdate(filename, data, mode, owner, group, password, hostnameOverride, encryption=encryption, checksumType=checksumType, ttl=ttl)
+
+
+    @classmethod
+    def createOrUpdateMany(cls, filenames, password=None, hostnameOverride=None, savePermissions=True, numWorkers=None, batchSize=DEFAULT_BULK_BATCH_SIZE, **kwargs):
+        '''
+            createOrUpdateMany - Create or update many files at once, provided with their filenames.
+
+              Files are read, hashed, compressed, and encrypted by a pool of worker threads, and
+                written to Redis in pipelined batches. A failure of one file does not stop the others.
+
+            @param filenames <iterable<str>> - Absolute filenames to store
+            @param password <str/None>  - If provided, 4-32 characters to encrypt. If not provided, files will not be encrypted.
+            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+            @param savePermissions <bool> Default True - If True, will store owner/group/mode of files.
+            @param numWorkers <int/None> - Number of worker threads. Default is number of cpus.
+            @param batchSize <int> - Number of files written per pipeline
+            @param kwargs - Any additional arguments are passed to #createOrUpdateFromFile (i.e. encryption, ttl, or chunkSize on NetFetchChunkedFile)
+
+            @return <bulk.BulkResult> - Number of files and bytes stored, time taken, and any errors
+        '''
+        hostname = hostnameOverride or socket.gethostname()
+
+        def _prepareFile(filename):
+            return cls._prepareBulkUpload(filename, hostname, password, savePermissions, **kwargs)
+
+        def _saveBatch(batch, prepared):
+            return cls._saveBulkUploads(prepared, savePermissions)
+
+        return runBulk(filenames, _prepareFile, afterBatch=_saveBatch, numWorkers=numWorkers, batchSize=batchSize)
+
+    @classmethod
+    def _prepareBulkUpload(cls, filename, hostname, password=None, savePermissions=True, encryption=None, checksumType=None, ttl=None):
+        '''
+            _prepareBulkUpload - Internal. Read a file and prepare it for storage (see #_prepareUpload). Run by the workers of #createOrUpdateMany
+
+            @return tuple( obj<NetFetchFile>, storageDict<dict>, numBytes<int> )
+        '''
+        (mode, owner, group) = cls._getSourceFileInfo(filename, savePermissions)
+
+        with timePhase(PHASE_READ):
+            data = mapFile(filename)
+
+        return cls._prepareUpload(filename, data, hostname, mode, owner, group, password, encryption, checksumType, ttl)
+
+    @classmethod
+    def _prepareUpload(cls, filename, data, hostname, mode='', owner='', group='', password=None, encryption=None, checksumType=None, ttl=None):
+        '''
+            _prepareUpload - Internal. Build a new object with some data (encrypted, if password provided),
+              and the representation of that object for storage (i.e. compressed). This is all of the cpu-bound work of storing a file,
+              the result is saved by #_queueUploadLookups and #_queueUploadWrites
+
+            @see createOrUpdate for params
+
+            @return tuple( obj<NetFetchFile>, storageDict<dict>, numBytes<int> )
+        '''
+        obj = cls._newObj(filename, hostname, mode, owner, group)
+        obj.expires = getExpireTime(ttl)
+        obj._setPayload(data, password, encryption, checksumType)
+
+        with timePhase(PHASE_COMPRESS, len(obj.data or b'')):
+            storageDict = obj.asDict(forStorage=True)
+
+        return (obj, storageDict, obj.size)
+
+    @classmethod
+    def _saveBulkUploads(cls, prepared, savePermissions=True):
+        '''
+            _saveBulkUploads - Internal. Save a batch of objects prepared by #_prepareBulkUpload, replacing any existing
+              objects with the same hostname/filename, in a fixed number of round-trips.
+
+            @param prepared list< tuple/Exception > - Results of #_prepareBulkUpload, or Exception if preparing failed.
+                A result with no object is already stored, and is passed through.
+            @param savePermissions <bool> - If False, the owner/group/mode of existing objects are kept
+
+            @return list< int/Exception > - For each item, the number of bytes stored or the Exception if it failed
+        '''
+        toSave = [ item for item in prepared if not isinstance(item, Exception) and item[0] is not None ]
+        if toSave and cls._isRouted():
+            # Each object was built bound to the node it belongs to (see #_newObj), save each node's objects together
+            nodeToSave = {}
+            for item in toSave:
+                nodeToSave.setdefault(item[0].SHARD_NODE, []).append(item)
+            for (nodeName, nodeItems) in nodeToSave.items():
+                getNodeModel(cls, nodeName)._saveBulkUploads(nodeItems, savePermissions)
+        elif toSave:
+            conn = cls._getConnection()
+
+            with timePhase(PHASE_LOOKUP):
+                pipeline = conn.pipeline(transaction=False)
+                cls._queueUploadLookups(pipeline, toSave, runScript)
+                existingResults = pipeline.execute()
+
+                numNew = len( [ result for result in existingResults if not result ] )
+                newIds = []
+                if numNew:
+                    pipeline = conn.pipeline(transaction=False)
+                    cls._queueNewIds(pipeline, numNew)
+                    newIds = pipeline.execute()
+
+            pendingRevisions = None
+            if isRevisionsEnabled():
+                pendingRevisions = cls._getPendingRevisions( [ (int(result[0]), item[0]) for (item, result) in zip(toSave, existingResults) if result ] )
+
+            with timePhase(PHASE_STORE, sum( [ len(item[1].get('data', None) or b'') for item in toSave ] )):
+                pipeline = conn.pipeline()
+                releaseChunkIds = cls._queueUploadWrites(pipeline, toSave, existingResults, newIds, pendingRevisions)
+                pipeline.execute()
+
+                releaseChunks(conn, releaseChunkIds)
+
+        if toSave and cls.SHARD_NODE is None:
+            # Once every node's objects are saved (see retention.py)
+            filenamesByHostname = {}
+            for item in toSave:
+                filenamesByHostname.setdefault(item[0].hostname, []).append(item[0].filename)
+            for (hostname, filenames) in filenamesByHostname.items():
+                NetFetchFile._applyRetention(hostname, filenames)
+
+        return [ item if isinstance(item, Exception) else item[2] for item in prepared ]
+
+    # _UPLOAD_EXISTING_FIELDS - Fields of an existing object which are fetched when replacing it,
+    #   to carry over owner/group/mode (if not provided), to release chunks, to number the new revision, and to account its size
+    _UPLOAD_EXISTING_FIELDS = ['chunks', 'mode', 'owner', 'group', 'revision', 'size']
+
+    @classmethod
+    def _queueUploadLookups(cls, pipeline, toSave, queueScript):
+        '''
+            _queueUploadLookups - Internal. Queue onto a pipeline the lookup of any existing object for each prepared upload.
+
+            @param pipeline - Pipeline (sync or asyncio)
+            @param toSave list<tuple> - Results of #_prepareUpload
+            @param queueScript <function> - Called as queueScript(pipeline, scriptSource, keys, args) to queue a script (like scripts.runScript)
+        '''
+        for (obj, storageDict, numBytes) in toSave:
+            (keys, args) = cls._getFetchScriptParams(obj.hostname, obj.filename)
+            queueScript(pipeline, FETCH_FIELDS_SCRIPT, keys, args + cls._UPLOAD_EXISTING_FIELDS)
+
+    @classmethod
+    def _queueNewIds(cls, pipeline, numNew):
+        '''
+            _queueNewIds - Internal. Queue onto a pipeline the allocation of primary keys for new objects.
+
+            @param pipeline - Pipeline (sync or asyncio)
+            @param numNew <int> - Number of primary keys to allocate
+        '''
+        nextIdKey = cls.saver._get_next_id_key()
+        for i in range(numNew):
+            pipeline.incr(nextIdKey)
+
+    @classmethod
+    def _queueUploadWrites(cls, pipeline, toSave, existingResults, newIds, pendingRevisions=None):
+        '''
+            _queueUploadWrites - Internal. Queue onto a pipeline (which should be a transaction) the writes of prepared uploads,
+              replacing the existing object (if any) of each, their accounting (see retention.py), and the publishing of each change (see events.py).
+              Owner/group/mode are kept from the existing object, if not provided.
+
+            @param pipeline - Pipeline (sync or asyncio)
+            @param toSave list<tuple> - Results of #_prepareUpload
+            @param existingResults list - Results of the lookups queued by #_queueUploadLookups
+            @param newIds list<int> - Primary keys allocated by #_queueNewIds, one per lookup which found no existing object
+            @param pendingRevisions dict<int, revisions.PendingRevision>/None - From #_getPendingRevisions, if revisions are enabled.
+                The revision of each existing object replaced is added to the history of its file.
+
+            @return list<str> - Chunk ids of replaced objects, which must be released (see chunks.releaseChunks) after the writes
+        '''
+        saver = cls._getSaver()
+        newIds = list(newIds)
+
+        releaseChunkIds = []
+
+        for ((obj, storageDict, numBytes), existingResult) in zip(toSave, existingResults):
+            previousSize = 0
+            if existingResult:
+                (primaryKey, existingValues) = existingResult
+                obj._id = int(primaryKey)
+                existingValues = dict(zip(cls._UPLOAD_EXISTING_FIELDS, existingValues))
+
+                pipeline.delete(saver._get_key_for_id(obj._id))
+
+                obj.revision = storageDict['revision'] = int(existingValues['revision'] or 0) + 1
+                previousSize = int(existingValues['size'] or 0)
+
+                pendingRevision = (pendingRevisions or {}).get(obj._id, None)
+                if pendingRevision is not None:
+                    pendingRevision.queueWrites(pipeline)
+                    releaseChunkIds += pendingRevision.getReleasableChunkIds([])
+
+                if existingValues['chunks'] and not (pendingRevision is not None and pendingRevision.keepsChunks()):
+                    releaseChunkIds += [ entry.chunkId for entry in parseManifest(to_unicode(existingValues['chunks'])) ]
+                for fieldName in ('mode', 'owner', 'group'):
+                    value = getattr(obj, fieldName)
+                    if (value in (None, '') or value is irNull) and existingValues[fieldName] is not None:
+                        storageDict[fieldName] = existingValues[fieldName]
+            else:
+                obj._id = int(newIds.pop(0))
+                saver._add_id_to_keys(obj._id, pipeline)
+                for indexedField in saver.indexedFields:
+                    saver._add_id_to_index(indexedField, obj._id, getattr(obj, str(indexedField)), pipeline)
+
+            key = saver._get_key_for_id(obj._id)
+            for thisField in cls.FIELDS:
+                pipeline.hset(key, thisField, storageDict.get(thisField, thisField.getDefaultValue()))
+
+            queueListIndexAdd(pipeline, obj.hostname, obj.filename, obj._id)
+            queueFileStored(pipeline, obj.hostname, obj.filename, obj.size, obj.mtime, obj.expires, previousSize)
+            queueChangeEvent(pipeline, EVENT_UPDATE, obj.hostname, obj.filename, obj.checksum, obj.checksumType, obj.size, obj.mtime)
+
+        return releaseChunkIds
+
+    @classmethod
+    def _queueRevisionLookups(cls, pipeline, replaced):
+        '''
+            _queueRevisionLookups - Internal. Queue onto a pipeline the fetch of objects which are being replaced, and of the
+              index of the history of each file, to build their revisions. @see #_buildPendingRevisions
+
+            @param pipeline - Pipeline (sync or asyncio)
+            @param replaced list< tuple(primaryKey<int>, newObj<NetFetchFile>) > - Primary key of each stored object, and the object replacing it
+        '''
+        for (primaryKey, newObj) in replaced:
+            pipeline.hgetall(cls.objects._get_key_for_id(primaryKey))
+            pipeline.hget(getRevisionsKey(newObj.hostname, newObj.filename), REVISIONS_INDEX_FIELD)
+
+    @classmethod
+    def _buildPendingRevisions(cls, replaced, results):
+        '''
+            _buildPendingRevisions - Internal. Build the revisions of objects which are being replaced.
+
+            @param replaced list<tuple> - @see #_queueRevisionLookups
+            @param results list - Results of the lookups queued by #_queueRevisionLookups
+
+            @return dict<int, revisions.PendingRevision> - Primary key -> revision to add. Objects deleted meanwhile are omitted.
+        '''
+        ret = {}
+        for i in range(len(replaced)):
+            (primaryKey, newObj) = replaced[i]
+            (storedDict, indexData) = results[i * 2 : i * 2 + 2]
+            if storedDict:
+                ret[primaryKey] = PendingRevision.fromStorage(cls, primaryKey, storedDict, indexData, newObj)
+
+        return ret
+
+    @classmethod
+    def _getPendingRevisions(cls, replaced):
+        '''
+            _getPendingRevisions - Internal. Fetch objects which are being replaced, and build their revisions, in one round-trip.
+
+            @see #_buildPendingRevisions
+        '''
+        if not replaced:
+            return {}
+
+        with timePhase(PHASE_REVISION) as phase:
+            pipeline = cls._getConnection().pipeline(transaction=False)
+            cls._queueRevisionLookups(pipeline, replaced)
+            results = pipeline.execute()
+            phase.numBytes = sum( [ len(storedDict.get(b'data', None) or b'') for storedDict in results[::2] ] )
+
+            return cls._buildPendingRevisions(replaced, results)
+
+
+    ###################################
+    ##        Internal Methods       ##
+    ###################################
+
+    @classmethod
+    def _getConnection(cls):
+        '''
+            _getConnection - Internal. Get a redis connection using the connection params of this model,
+              for keys which are not managed by IndexedRedis (like chunks)
+
+            @return <redis.Redis> - Connection
+        '''
+        return cls.objects._get_connection()
+
+    @classmethod
+    def _getSaver(cls):
+        '''
+            _getSaver - Internal. Get the IndexedRedis saver of this model. With the compact layout (see listing.setStorageLayout),
+              it does not add objects to the hostname/filename index sets.
+
+            @return <IndexedRedis.IndexedRedisSave>
+        '''
+        saver = cls.saver
+        if isCompactLayout():
+            saver.indexedFields = []
+        return saver
+
+    @classmethod
+    def _isRouted(cls):
+        '''
+            _isRouted - Internal. Check if files of this model are routed to the node each belongs to, i.e.
+              multiple nodes are configured (see sharding.setRedisNodes) and this model is not bound to one of them.
+
+            @return <bool>
+        '''
+        return cls.SHARD_NODE is None and isSharded()
+
+    @classmethod
+    def _getNodeModels(cls):
+        '''
+            _getNodeModels - Internal. Get this model bound to each configured node (see sharding.getNodeModel)
+
+            @return list<class> - Model for each node, or just this model if not routed (see #_isRouted)
+        '''
+        if not cls._isRouted():
+            return [cls]
+
+        return [ getNodeModel(cls, nodeName) for nodeName in getNodeNames() ]
+
+    @classmethod
+    def _getNodeModelsForFile(cls, hostname, filename):
+        '''
+            _getNodeModelsForFile - Internal. Get this model bound to the node a file belongs to, followed by every other node
+              (which may still hold the file if it was stored before a node was added, and not yet rebalanced)
+
+            @param hostname <str> - Hostname
+            @param filename <str> - Filename
+
+            @return list<class> - Models, or just this model if not routed (see #_isRouted)
+        '''
+        if not cls._isRouted():
+            return [cls]
+
+        nodeName = getNodeForFile(hostname, filename)
+        return [ getNodeModel(cls, nodeName) ] + [ nodeModel for nodeModel in cls._getNodeModels() if nodeModel.SHARD_NODE != nodeName ]
+
+    @classmethod
+    def _groupByNode(cls, hostname, filenames):
+        '''
+            _groupByNode - Internal. Group the filenames of a hostname by the node each belongs to
+
+            @param hostname <str> - Hostname
+            @param filenames list<str> - Filenames
+
+            @return list< tuple(model<class>, filenames<list<str>>) > - This model bound to each node, and the filenames which belong to it.
+                Just this model and all filenames if not routed (see #_isRouted)
+        '''
+        if not cls._isRouted():
+            return [ (cls, list(filenames)) ]
+
+        nodeFilenames = {}
+        for filename in filenames:
+            nodeFilenames.setdefault(getNodeForFile(hostname, filename), []).append(filename)
+
+        return [ (getNodeModel(cls, nodeName), nodeFilenames[nodeName]) for nodeName in getNodeNames() if nodeName in nodeFilenames ]
+
+    @staticmethod
+    def _getSourceFileInfo(filename, savePermissions=True):
+        '''
+            _getSourceFileInfo - Internal. Validate a local filename to be stored, and get its permissions.
+
+            @param filename <str> - Absolute filename
+            @param savePermissions <bool> - If True, return the owner/group/mode of file, otherwise all are None
+
+            @return tuple( mode, owner, group )
+
+            @raises ValueError - If filename is not absolute, does not exist, or is not a regular file
+        '''
+        if not filename:
+            raise ValueError('No filename provided')
+        if filename[0] != '/':
+            raise ValueError('Given filename, "%s" must be absolute."' %(filename,))
+        if not os.path.exists(filename):
+            raise ValueError('Given filename, "%s" does not exist.' %(filename,))
+        if not os.path.isfile(filename):
+            raise ValueError('Given filename, "%s" is not a regular file.' %(filename,))
+
+        if savePermissions is True:
+            statData = os.stat(filename)
+            return (statData.st_mode, statData.st_uid, statData.st_gid)
+
+        return (None, None, None)
+
+    @staticmethod
+    def _makeLocalDirs(localFilename):
+        '''
+            _makeLocalDirs - Internal. Create the directory of a local filename (and its parents) if it does not exist.
+              Safe if another worker creates it at the same time.
+
+            @param localFilename <str> - Local filename
+        '''
+        localDirname = os.path.dirname(localFilename)
+        if not os.path.isdir(localDirname):
+            try:
+                os.makedirs(localDirname)
+            except OSError:
+                # Another worker may have created it
+                if not os.path.isdir(localDirname):
+                    raise
+
+    @staticmethod
+    def _getFernetKey(password):
+        '''
+            _getFernetKey - Internal. Get a Fernet Key for encryption based off provided password.
+
+            @param password <str> - 4 to 32 characters that represent a password.
+
+            @return - A base64-encoded key that was padded to be 32-characters before encoding.
+
+            @raises Value
+        '''
+        if len(password) < 4:
+            raise ValueError('Password must be at least four characters.')
+        if len(password) > 32:
+            raise ValueError('Password cannot be longer than 32 characters')
+        fernetKey = base64.b64encode(str(password + ('a' * (32 - len(password)))).encode('utf-8') )
+
+        return fernetKey
+
+    @staticmethod
+    def calculateChecksum(data, checksumType=CHECKSUM_MD5):
+        '''
+            calculateChecksum - Calculates a checksum from given data
+
+            @param data <bytes> - Data to check
+            @param checksumType <str> - checksum.CHECKSUM_* value. Default is MD5.
+
+            @return <str> - Hex digest
+        '''
+        return _checksum.calculateChecksum(checksumType, data)
+
+
+class NetFetchCompressedLzmaFile(NetFetchFile):
+    '''
+        NetFetchCompressedLzmaFile - Used for lzma compression on a NetFetchFile
+    '''
+
+    NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_LZMA
+
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_COMPRESSED_LZMA,
+        IRFieldChain('data', [DataField(copyBuffers=True), IRCompressedField(compressMode='lzma')] ),
+    )
 
 class NetFetchCompressedGzipFile(NetFetchFile):
     '''
@@ -472,17 +2719,9 @@ class NetFetchCompressedGzipFile(NetFetchFile):
 
     NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_GZIP
 
-    FIELDS = [
-        IRField('filename'),
-        IRField('hostname'),
-        IRField('checksum'),
-        IRField('encrypted'),
-        IRField('mode'),
-        IRField('owner'),
-        IRField('group'),
-        IRField('netfetchType', valueType=int, defaultValue=NETFETCH_TYPE_COMPRESSED_GZIP),
-        IRFieldChain('data', [IRBytesField(), IRCompressedField(compressMode='gzip')] ),
-    ]
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_COMPRESSED_GZIP,
+        IRFieldChain('data', [DataField(copyBuffers=True), IRCompressedField(compressMode='gzip')] ),
+    )
 
 class NetFetchCompressedBzip2File(NetFetchFile):
     '''
@@ -491,15 +2730,490 @@ class NetFetchCompressedBzip2File(NetFetchFile):
 
     NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_BZIP2
 
-    FIELDS = [
-        IRField('filename'),
-        IRField('hostname'),
-        IRField('checksum'),
-        IRField('encrypted'),
-        IRField('mode'),
-        IRField('owner'),
-        IRField('group'),
-        IRField('netfetchType', valueType=int, defaultValue=NETFETCH_TYPE_COMPRESSED_BZIP2),
-        IRFieldChain('data', [IRBytesField(), IRCompressedField(compressMode='bzip2')] ),
-    ]
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_COMPRESSED_BZIP2,
+        IRFieldChain('data', [DataField(copyBuffers=True), IRCompressedField(compressMode='bzip2')] ),
+    )
+
+class NetFetchCompressedZstdFile(NetFetchFile):
+    '''
+        NetFetchCompressedZstdFile - Used for zstd compression on a NetFetchFile. Requires the "zstandard" module.
+
+          Much faster than lzma for a similar ratio. The level is set by compression.setDefaultCompressLevel('zstd', level), default 3.
+    '''
+
+    NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_ZSTD
+
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_COMPRESSED_ZSTD,
+        CompressedDataField('data', compressMode=COMPRESS_MODE_ZSTD),
+    )
+
+class NetFetchCompressedLz4File(NetFetchFile):
+    '''
+        NetFetchCompressedLz4File - Used for lz4 compression on a NetFetchFile. Requires the "lz4" module.
+
+          Fastest to compress and decompress, with a lower ratio. The level is set by compression.setDefaultCompressLevel('lz4', level), default 0.
+    '''
+
+    NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_LZ4
+
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_COMPRESSED_LZ4,
+        CompressedDataField('data', compressMode=COMPRESS_MODE_LZ4),
+    )
+
+class NetFetchCompressedZstdDictFile(NetFetchFile):
+    '''
+        NetFetchCompressedZstdDictFile - Used for zstd compression with a shared dictionary on a NetFetchFile. Requires the "zstandard" module.
+
+          For small, similar files (like config files), which compress poorly on their own. The dictionary is trained on stored files
+            (see NetFetchFile.trainCompressDictionary), and each file records the id of the one it was compressed with (see dictionaries.py).
+            Until a dictionary is trained, files are compressed with plain zstd.
+
+          The level is set by compression.setDefaultCompressLevel('zstd-dict', level), default 3.
+    '''
+
+    NETFETCH_TYPE = NETFETCH_TYPE_COMPRESSED_ZSTD_DICT
+
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_COMPRESSED_ZSTD_DICT,
+        CompressedDataField('data', compressMode=COMPRESS_MODE_ZSTD_DICT),
+    )
+
+    def _setPayload(self, data, password=None, encryption=None, checksumType=None):
+        '''
+            _setPayload - Internal. Set the data on this object, and the id of the dictionary it will be compressed with when saved.
+
+            @see NetFetchFile._setPayload
+        '''
+        NetFetchFile._setPayload(self, data, password, encryption, checksumType)
+
+        dictId = loadCurrentDictionary(self._getConnection())
+        self.compressDict = dictId and str(dictId) or ''
+
+
+class NetFetchChunkedFile(NetFetchFile):
+    '''
+        NetFetchChunkedFile - A NetFetchFile which is stored as a manifest plus fixed-size chunk keys.
+
+          The file data is never held whole in memory, it is read, (optionally) compressed and encrypted,
+            and sent/fetched in pipelined batches of chunks, bounded by chunks.DEFAULT_BUFFER_SIZE.
+
+          Use this for large files. Each chunk is compressed (see "chunkCompression") and encrypted independently.
+
+          If stored with dedup=True, chunks are content-addressed and reference-counted, so identical content
+            (across any number of hostnames/filenames) is stored and uploaded only once.
+    '''
+
+    NETFETCH_TYPE = NETFETCH_TYPE_CHUNKED
+
+    FIELDS = _getNetFetchFields(NETFETCH_TYPE_CHUNKED, IRBytesField('data'))
+
+
+    ###################################
+    ##      Data Access              ##
+    ###################################
+
+    def getData(self, password=None):
+        '''
+            getData - Fetch all the data associated with this file, and potentially decrypt.
+
+              NOTE: This holds the whole file in memory. Use #iterData to process one chunk at a time.
+
+            @see NetFetchFile.getData
+        '''
+        return b''.join(self.iterData(password))
+
+    def iterData(self, password=None):
+        '''
+            iterData - Fetch the chunks of this file, in pipelined batches, and yield the data of each.
+
+              The checksum of each chunk is verified as it is read, and the checksum of the whole file
+                is verified before the final chunk is yielded.
+
+            @param password <str/None> - None if unencrypted, otherwise a password 4-32 chars.
+
+            @return generator<bytes> - The data of each chunk, in order
+
+            @raises InvalidPasswordException - @see NetFetchFile.getData
+            @raises NoSuchNetFetchFile - If a chunk is missing (i.e. the file was deleted or updated while fetching)
+        '''
+        self._checkPassword(password)
+        (cipher, compressMode, checksumType) = self._getChunkCodec(password)
+
+        entries = parseManifest(self.chunks)
+        numEntries = len(entries)
+        checksum = newHasher(checksumType)
+
+        for (chunkNum, block) in enumerate(self._iterChunks(entries, cipher, compressMode, checksumType)):
+            with timePhase(PHASE_CHECKSUM, len(block)):
+                checksum.update(block)
+            if chunkNum == numEntries - 1 and checksum.hexdigest() != self.checksum:
+                raise InvalidPasswordException('Invalid Password.')
+
+            yield block
+
+        if numEntries == 0 and checksum.hexdigest() != self.checksum:
+            raise InvalidPasswordException('Invalid Password.')
+
+    def iterRange(self, start=0, end=None, password=None):
+        '''
+            iterRange - Fetch only the chunks of this file which hold a range of its data, in pipelined batches,
+              and yield the part of the range within each.
+
+              Each chunk is verified against its manifest entry as it is read. The checksum of the whole file is not verified.
+
+            @see NetFetchFile.iterRange
+        '''
+        self._checkPassword(password)
+        (cipher, compressMode, checksumType) = self._getChunkCodec(password)
+
+        (start, end) = NetFetchFile._resolveRange(start, end, self.size)
+
+        # Find the chunks which hold the range, and the offset of the first within the file
+        entries = []
+        firstChunkNum = None
+        offset = rangeOffset = 0
+        for (chunkNum, entry) in enumerate(parseManifest(self.chunks)):
+            if offset >= end:
+                break
+            if offset + entry.size > start:
+                if firstChunkNum is None:
+                    (firstChunkNum, rangeOffset) = (chunkNum, offset)
+                entries.append(entry)
+            offset += entry.size
+
+        for block in self._iterChunks(entries, cipher, compressMode, checksumType, firstChunkNum or 0):
+            blockStart = max(0, start - rangeOffset)
+            blockEnd = min(len(block), end - rangeOffset)
+            rangeOffset += len(block)
+
+            if blockStart == 0 and blockEnd == len(block):
+                yield block
+            else:
+                yield block[blockStart : blockEnd]
+
+    def _iterChunks(self, entries, cipher, compressMode, checksumType, firstChunkNum=0):
+        '''
+            _iterChunks - Internal. Fetch chunks in pipelined batches (bounded by chunks.DEFAULT_BUFFER_SIZE), and yield the data of each,
+              verified against its manifest entry (see #_decodeChunk)
+
+            @param entries list<ManifestEntry> - Manifest entries of the chunks, in order
+            @param cipher <object/None> - @see #_getChunkCodec
+            @param compressMode <str> - @see #_getChunkCodec
+            @param checksumType <str> - @see #_getChunkCodec
+            @param firstChunkNum <int> - Index of the first entry within the manifest, for error messages
+
+            @return generator<bytes> - The data of each chunk, in order
+
+            @raises InvalidPasswordException - @see #_decodeChunk
+            @raises NoSuchNetFetchFile - If a chunk is missing (i.e. the file was deleted or updated while fetching)
+        '''
+        numEntries = len(entries)
+        batchSize = getBatchSize(self.chunkSize)
+
+        conn = self._getConnection()
+
+        for batchStart in range(0, numEntries, batchSize):
+            batch = entries[batchStart : batchStart + batchSize]
+
+            with timePhase(PHASE_FETCH) as phase:
+                pipeline = conn.pipeline(transaction=False)
+                for entry in batch:
+                    pipeline.get(getChunkKey(entry.chunkId))
+                results = pipeline.execute()
+                phase.numBytes = NetFetchFile._getStoredSize(results)
+
+            for i in range(len(batch)):
+                block = NetFetchChunkedFile._decodeChunk(batch[i], results[i], cipher, compressMode, checksumType, firstChunkNum + batchStart + i)
+                results[i] = None
+
+                yield block
+
+    def _getChunkCodec(self, password=None):
+        '''
+            _getChunkCodec - Internal. Get what is needed to decode the chunks of this file
+
+            @param password <str/None> - Password, if encrypted
+
+            @return tuple( cipher<encryption.FernetCipher/encryption.AesGcmCipher/None>, compressMode<str>, checksumType<str> )
+
+            @raises ValueError - If the file is stored with an unknown encryption
+        '''
+        if password:
+            cipher = getCipher(self.encryption or ENCRYPTION_FERNET, NetFetchFile._getFernetKey(password))
+        else:
+            cipher = None
+
+        return (cipher, normalizeCompressMode(self.chunkCompression), self.checksumType or CHECKSUM_MD5)
+
+    @staticmethod
+    def _decodeChunk(entry, block, cipher, compressMode, checksumType, chunkNum):
+        '''
+            _decodeChunk - Internal. Decrypt and decompress a stored chunk, and verify it against its manifest entry
+
+            @param entry <ManifestEntry> - Manifest entry of chunk
+            @param block <bytes/None> - Stored chunk, or None if it was missing
+            @param cipher <object/None> - @see #_getChunkCodec
+            @param compressMode <str> - @see #_getChunkCodec
+            @param checksumType <str> - @see #_getChunkCodec
+            @param chunkNum <int> - Index of chunk within file, for error message
+
+            @return <bytes> - Data of chunk
+
+            @raises InvalidPasswordException - If chunk could not be decrypted, or does not match its manifest entry
+            @raises NoSuchNetFetchFile - If chunk is missing
+        '''
+        if block is None:
+            raise NoSuchNetFetchFile('Missing chunk %d of file. Was it updated or deleted while fetching?' %(chunkNum,))
+
+        if cipher is not None:
+            try:
+                with timePhase(PHASE_DECRYPT, len(block)):
+                    block = cipher.decrypt(block, NetFetchChunkedFile._getChunkAAD(entry.chunkId))
+            except DecryptionError:
+                raise InvalidPasswordException('Invalid Password.')
+
+        with timePhase(PHASE_DECOMPRESS, len(block)):
+            block = decompressData(compressMode, block)
+
+        if len(block) != entry.size:
+            raise InvalidPasswordException('Invalid Password.')
+        with timePhase(PHASE_CHECKSUM, len(block)):
+            digest = NetFetchFile.calculateChecksum(block, checksumType)
+        if digest != entry.digest:
+            raise InvalidPasswordException('Invalid Password.')
+
+        return block
+
+    @staticmethod
+    def _getChunkAAD(chunkId):
+        '''
+            _getChunkAAD - Internal. Get the associated data of an encrypted chunk (its id), which binds it to its key,
+              so a stored chunk cannot be swapped for another. Only used by AEAD encryptions (not Fernet).
+
+            @param chunkId <str> - Chunk id
+
+            @return <bytes>
+        '''
+        return chunkId.encode('utf-8')
+
+    def setData(self, data, checksumType=None):
+        '''
+            setData - Store data as chunks of this object (unencrypted). Unlike other models, the chunks are written immediately,
+              but the manifest is not saved until the object is saved.
+
+            @param data <bytes/file-like> - Data to store, or a file-like object opened for binary read
+            @param checksumType <str/None> - Checksum algorithm, @see NetFetchFile.setData
+        '''
+        self._setPayload(data, None, checksumType=checksumType)
+
+    def encryptData(self, password, encryption=None):
+        '''
+            encryptData - Not supported on chunked files, as each chunk is encrypted while being stored.
+              Use #createOrUpdate with a password.
+
+            @raises - TypeError always
+        '''
+        raise TypeError('Chunks are encrypted while they are stored. Provide a password when storing the data.')
+
+    def _setPayload(self, data, password=None, chunkSize=None, compressMode=None, dedup=False, encryption=None, checksumType=None):
+        '''
+            _setPayload - Internal. Split data into chunks, compress and (if password provided) encrypt each one,
+              and send them to Redis in pipelined batches. Updates manifest, checksum, and size. Does not save object.
+
+              If this object already has a manifest (i.e. is being updated), only chunks which changed are sent:
+
+                * Deduplicated chunks are content-addressed, so any chunk already stored is never sent again.
+
+                * Otherwise, a chunk whose checksum and size match a chunk of the current manifest reuses that chunk,
+                    provided it was stored unencrypted with the same compression. (Encrypted files get incremental
+                    updates via dedup, where chunk ids are keyed by the password.)
+
+            @param data <bytes/file-like> - Data to store, or a file-like object opened for binary read
+            @param password <str/None> - If provided, 4-32 characters to encrypt.
+            @param chunkSize <int/None> - Number of bytes of file data per chunk. If None, the chunk size of the current
+                manifest is kept (so unchanged chunks line up), otherwise DEFAULT_CHUNK_SIZE.
+            @param compressMode <str/None> - If provided, compress each chunk with this mode (e.g. "zstd", "lz4", "lzma", "gzip", "bzip2")
+            @param dedup <bool> - If True, chunks are content-addressed and reference-counted. A chunk whose content is
+                already stored (by any file) is not sent again, and is shared.
+            @param encryption <str/None> - If password provided, the format of encrypted chunks (see NetFetchFile.encryptData).
+                With AES-GCM, each chunk is bound to its chunk id.
+            @param checksumType <str/None> - Checksum algorithm of the file and of each chunk, @see NetFetchFile.setData
+        '''
+        encryption = normalizeEncryption(encryption)
+        checksumType = normalizeChecksumType(checksumType)
+        if password:
+            fernetKey = NetFetchFile._getFernetKey(password)
+            cipher = getCipher(encryption, fernetKey)
+        else:
+            fernetKey = cipher = None
+            encryption = ENCRYPTION_FERNET
+
+        chunkSize = chunkSize or self.chunkSize or DEFAULT_CHUNK_SIZE
+        compressMode = normalizeCompressMode(compressMode)
+        if compressMode == COMPRESS_MODE_ZSTD_DICT:
+            raise ValueError('Compression mode "%s" is for small files, and cannot be used on chunks. Use "%s".' %(COMPRESS_MODE_ZSTD_DICT, COMPRESS_MODE_ZSTD))
+        batchSize = getBatchSize(chunkSize)
+
+        # Chunks of the current manifest which may be reused as-is, (checksum, size) -> chunkId
+        reusableChunks = {}
+        if not dedup and cipher is None and self.encrypted != '1' and self.chunkCompression == compressMode and (self.checksumType or CHECKSUM_MD5) == checksumType:
+            for entry in parseManifest(self.chunks):
+                if not isDedupChunkId(entry.chunkId):
+                    reusableChunks[ (entry.digest, entry.size) ] = entry.chunkId
+
+        conn = self._getConnection()
+        chunkIdPrefix = newChunkIdPrefix()
+        entries = []
+        reusedChunkIds = set()
+        checksum = newHasher(checksumType)
+        totalSize = 0
+
+        try:
+            for blocks in iterBatches(timeIter(PHASE_READ, iterBlocks(data, chunkSize)), batchSize):
+                firstIdx = len(entries)
+                alreadyStored = []
+                for block in blocks:
+                    with timePhase(PHASE_CHECKSUM, len(block)):
+                        checksum.update(block)
+                        digest = NetFetchFile.calculateChecksum(block, checksumType)
+                    totalSize += len(block)
+
+                    reuseChunkId = reusableChunks.get( (digest, len(block)), None)
+                    if reuseChunkId is not None:
+                        chunkId = reuseChunkId
+                        reusedChunkIds.add(chunkId)
+                    elif dedup:
+                        chunkId = getDedupChunkId(block, compressMode, fernetKey, encryption)
+                    else:
+                        chunkId = '%s.%d' %(chunkIdPrefix, len(entries))
+
+                    entries.append( ManifestEntry(chunkId, len(block), digest) )
+                    alreadyStored.append( reuseChunkId is not None )
+
+                batchEntries = entries[firstIdx:]
+                if dedup:
+                    with timePhase(PHASE_LOOKUP):
+                        alreadyStored = acquireDedupChunks(conn, [entry.chunkId for entry in batchEntries])
+
+                pipeline = conn.pipeline(transaction=False)
+                numPending = 0
+                numPendingBytes = 0
+                for i in range(len(blocks)):
+                    if alreadyStored[i]:
+                        continue
+
+                    with timePhase(PHASE_COMPRESS, len(blocks[i])):
+                        storeData = compressData(compressMode, blocks[i])
+                    if cipher is not None:
+                        with timePhase(PHASE_ENCRYPT, len(storeData)):
+                            storeData = cipher.encrypt(storeData, NetFetchChunkedFile._getChunkAAD(batchEntries[i].chunkId))
+
+                    pipeline.set(getChunkKey(batchEntries[i].chunkId), storeData)
+                    numPending += 1
+                    numPendingBytes += len(storeData)
+
+                if numPending:
+                    with timePhase(PHASE_STORE, numPendingBytes):
+                        pipeline.execute()
+        except:
+            # Don't leave orphaned chunks (or references) around. Reused chunks still belong to the current manifest.
+            releaseChunks(conn, [entry.chunkId for entry in entries if entry.chunkId not in reusedChunkIds])
+            raise
+
+        self.data = b''
+        self.compressDict = ''
+        self.chunkSize = chunkSize
+        self.chunkCompression = compressMode
+        self.chunks = buildManifest(entries)
+        self.checksum = checksum.hexdigest()
+        self.checksumType = checksumType
+        self.size = totalSize
+        self.encryption = encryption
+        if cipher is not None:
+            self.encrypted = '1'
+        else:
+            self.encrypted = '0'
+
+
+    ###################################
+    ##        Creation Methods       ##
+    ###################################
+
+    @classmethod
+    def create(cls, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None, chunkSize=None, compressMode=None, dedup=False, encryption=None, checksumType=None, ttl=None):
+        '''
+            create - Create and save a chunked NetFetchFile object
+
+            @param data <bytes/file-like> - Data to store, or a file-like object opened for binary read
+            @param chunkSize <int/None> - Number of bytes of file data per chunk. Default (None) keeps the chunk size of an existing
+                chunked file (so unchanged chunks are not sent again), or uses DEFAULT_CHUNK_SIZE.
+            @param compressMode <str/None> - If provided, compress each chunk with this mode (e.g. "zstd", "lz4", "lzma", "gzip", "bzip2")
+            @param dedup <bool> - If True, chunks are stored once by content and shared (reference-counted) with any other
+                file that has the same chunk. Chunks already stored are not sent again.
+            @param encryption <str/None> - If password provided, the format of encrypted chunks, like "aesgcm". Default is Fernet.
+            @param checksumType <str/None> - Checksum algorithm of the file and each chunk, like "blake2b" or "xxh3". Default is MD5.
+
+            @see NetFetchFile.create for other params and exceptions
+        '''
+        expires = getExpireTime(ttl)
+        hostname = hostnameOverride or socket.gethostname()
+        if cls.exists(hostname, filename):
+            raise KeyError('A file already exists with hostname="%s" and filename="%s!\n' %(hostname, filename))
+        obj = cls._newObj(filename, hostname, mode, owner, group)
+        obj.expires = expires
+        return obj._storePayload(data, password, chunkSize=chunkSize, compressMode=compressMode, dedup=dedup, encryption=encryption, checksumType=checksumType)
+
+    @classmethod
+    def createOrUpdate(cls, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None, chunkSize=None, compressMode=None, dedup=False, encryption=None, checksumType=None, ttl=None):
+        '''
+            createOrUpdate - Create and save a chunked NetFetchFile object, or update an existing one.
+
+            @param data <bytes/file-like> - Data to store, or a file-like object opened for binary read
+            @param chunkSize <int/None> - Number of bytes of file data per chunk. Default (None) keeps the chunk size of an existing
+                chunked file (so unchanged chunks are not sent again), or uses DEFAULT_CHUNK_SIZE.
+            @param compressMode <str/None> - If provided, compress each chunk with this mode (e.g. "zstd", "lz4", "lzma", "gzip", "bzip2")
+            @param dedup <bool> - If True, chunks are stored once by content and shared (reference-counted) with any other
+                file that has the same chunk. Chunks already stored are not sent again.
+            @param encryption <str/None> - If password provided, the format of encrypted chunks, like "aesgcm". Default is Fernet.
+            @param checksumType <str/None> - Checksum algorithm of the file and each chunk, like "blake2b" or "xxh3". Default is MD5.
+
+            @see NetFetchFile.createOrUpdate for other params and exceptions
+        '''
+        expires = getExpireTime(ttl)
+        hostname = hostnameOverride or socket.gethostname()
+        obj = cls._getOrNewObj(filename, hostname, mode, owner, group)
+        obj.expires = expires
+        return obj._storePayload(data, password, chunkSize=chunkSize, compressMode=compressMode, dedup=dedup, encryption=encryption, checksumType=checksumType)
+
+    @classmethod
+    def createOrUpdateFromFile(cls, filename, password=None, hostnameOverride=None, savePermissions=True, chunkSize=None, compressMode=None, dedup=False, encryption=None, checksumType=None, ttl=None):
+        '''
+            createOrUpdateFromFile - Create and save a chunked NetFetchFile object, or update an existing one, provided with a filename.
+
+              The file is read one chunk at a time, so it is never held whole in memory.
+
+            @param chunkSize <int/None> - Number of bytes of file data per chunk. Default (None) keeps the chunk size of an existing
+                chunked file (so unchanged chunks are not sent again), or uses DEFAULT_CHUNK_SIZE.
+            @param compressMode <str/None> - If provided, compress each chunk with this mode (e.g. "zstd", "lz4", "lzma", "gzip", "bzip2")
+            @param dedup <bool> - If True, chunks are stored once by content and shared (reference-counted) with any other
+                file that has the same chunk. Chunks already stored are not sent again.
+            @param encryption <str/None> - If password provided, the format of encrypted chunks, like "aesgcm". Default is Fernet.
+            @param checksumType <str/None> - Checksum algorithm of the file and each chunk, like "blake2b" or "xxh3". Default is MD5.
+
+            @see NetFetchFile.createOrUpdateFromFile for other params and exceptions
+        '''
+        (mode, owner, group) = cls._getSourceFileInfo(filename, savePermissions)
+
+        with open(filename, 'rb') as f:
+            return cls.createOrUpdate(filename, f, mode, owner, group, password, hostnameOverride, chunkSize, compressMode, dedup, encryption, checksumType, ttl)
+
+    @classmethod
+    def _prepareBulkUpload(cls, filename, hostname, password=None, savePermissions=True, chunkSize=None, compressMode=None, dedup=False, encryption=None, checksumType=None, ttl=None):
+        '''
+            _prepareBulkUpload - Internal. Chunked files send their chunks in their own pipelined batches,
+              so each is stored entirely by the worker (see NetFetchFile.createOrUpdateMany)
+
+            @return tuple( None, None, numBytes<int> )
+        '''
+        obj = cls.createOrUpdateFromFile(filename, password, hostname, savePermissions, chunkSize, compressMode, dedup, encryption, checksumType, ttl)
 
+        return (None, None, obj.size)
@@ -0,0 +1,55 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the tar output of files fetched from many hosts (see NetFetchFile.downloadFromManyHosts)
+
+# vim: ts=4 sw=4 expandtab
+
+import io
+import tarfile
+import threading
+import time
+
+__all__ = ('TarOutput', )
+
+
+class TarOutput(object):
+    '''
+        TarOutput - Write files into a tar stream, from any number of threads.
+
+          The stream is written sequentially (it is never seeked), so it may be a pipe or stdout.
+    '''
+
+    def __init__(self, fileObj):
+        '''
+            @param fileObj <file> - File-like object opened for binary write. It is not closed by #close.
+        '''
+        self._tarFile = tarfile.open(fileobj=fileObj, mode='w|')
+        self._lock = threading.Lock()
+
+    def addFile(self, name, data, mode=None, uid=None, gid=None, mtime=None):
+        '''
+            addFile - Add a file to the tar
+
+            @param name <str> - Path of the file within the tar (like "web01/etc/hosts")
+            @param data <bytes> - Data of the file
+            @param mode <int/None> - Permission bits. Default is 0644.
+            @param uid <int/None> - Owner id. Default is 0.
+            @param gid <int/None> - Group id. Default is 0.
+            @param mtime <float/None> - Modification time (seconds since epoch). Default is now.
+        '''
+        tarInfo = tarfile.TarInfo(name)
+        tarInfo.size = len(data)
+        tarInfo.mode = mode is None and 0o644 or mode
+        tarInfo.uid = uid or 0
+        tarInfo.gid = gid or 0
+        tarInfo.mtime = int(mtime or time.time())
+
+        with self._lock:
+            self._tarFile.addfile(tarInfo, io.BytesIO(data))
+
+    def close(self):
+        '''
+            close - Finish the tar (writing its end-of-archive marker)
+        '''
+        with self._lock:
+            self._tarFile.close()
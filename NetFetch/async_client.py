@@ -0,0 +1,417 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the asyncio client API. Requires python 3.5+ and redis-py with redis.asyncio (4.2+)
+#
+#   This module is not imported by "import NetFetch", import it directly:  from NetFetch.async_client import AsyncNetFetchClient
+
+# vim: ts=4 sw=4 expandtab
+
+import asyncio
+import functools
+import socket
+import time
+
+import IndexedRedis
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+from . import NetFetchFile, NetFetchChunkedFile, NoSuchNetFetchFile, InvalidPasswordException
+from .checksum import newHasher
+from .compression import hasCompressDictionary, addCompressDictionary
+from .dictionaries import getDictionariesKey
+from .chunks import getChunkKey, getChunkRefsKey, parseManifest, getBatchSize, RELEASE_BATCH_SIZE
+from .listing import queueListIndexRemove
+from .events import EVENT_DELETE, queueChangeEvent
+from .revisions import isRevisionsEnabled, queueRevisionsDelete, getDeletedChunkIds
+from .retention import ( DEFAULT_EXPIRE_BATCH_SIZE, isBudgetEnabled, isAccessTracked, isExpireSweepDue, isExpired, queueFileRemoved,
+            queueFilesAccessed )
+from .sharding import isSharded, getNodeNames, getNodeForFile, getNodeModel
+from .scripts import LOOKUP_FILE_SCRIPT, FETCH_FILE_SCRIPT, RELEASE_CHUNKS_SCRIPT, hgetallResultToDict
+
+__all__ = ('DEFAULT_MAX_CONNECTIONS', 'AsyncNetFetchClient')
+
+# DEFAULT_MAX_CONNECTIONS - Default size of the connection pool. Operations beyond this wait for a free connection.
+DEFAULT_MAX_CONNECTIONS = 64
+
+
+class AsyncNetFetchClient(object):
+    '''
+        AsyncNetFetchClient - asyncio API to store, fetch, and delete NetFetch files.
+
+          All Redis I/O is performed on an asyncio connection pool, and cpu-bound work (hashing, compression, encryption)
+            is run in an executor, so the event loop is never blocked. Many operations may be run at once (i.e. with asyncio.gather)
+
+          Data is stored in the same format as NetFetchFile (and its subclasses), so files may be put with one API and fetched with the other.
+
+          If multiple Redis nodes are configured (see NetFetch.setRedisNodes), a connection pool is kept to each,
+            and each file is stored on (and fetched first from) the node it belongs to, same as NetFetchFile.
+
+          Use as an async context manager, or call #close when done.
+    '''
+
+    def __init__(self, connectionParams=None, executor=None, maxConnections=DEFAULT_MAX_CONNECTIONS):
+        '''
+            @param connectionParams <dict/None> - Redis connection params (host/port/db, etc). Default is those set by NetFetch.setRedisConnectionParams,
+                or every node set by NetFetch.setRedisNodes. If provided, only that server is used.
+            @param executor <concurrent.futures.Executor/None> - Executor (of threads) to run cpu-bound work. Default is the event loop's default executor.
+            @param maxConnections <int> - Maximum number of connections to Redis (to each node)
+
+            @raises ImportError - If redis.asyncio is not available
+        '''
+        if aioredis is None:
+            raise ImportError('AsyncNetFetchClient requires redis-py 4.2 or greater (redis.asyncio)')
+
+        self.executor = executor
+
+        # _conns - Node name -> connection (pool). Only one, with node name None, if not sharded.
+        self._conns = {}
+        self._pools = []
+        self._scripts = {}
+
+        if connectionParams is None and isSharded():
+            for nodeName in getNodeNames():
+                nodeParams = dict(IndexedRedis.getDefaultRedisConnectionParams())
+                nodeParams.pop('connection_pool', None)
+                nodeParams.update(getNodeModel(NetFetchFile, nodeName).REDIS_CONNECTION_PARAMS)
+                self._connect(nodeName, nodeParams, maxConnections)
+        else:
+            if connectionParams is None:
+                connectionParams = IndexedRedis.getDefaultRedisConnectionParams()
+            self._connect(None, connectionParams, maxConnections)
+
+    def _connect(self, nodeName, connectionParams, maxConnections):
+        '''
+            _connect - Internal. Create the connection pool to a node
+        '''
+        connectionParams = dict(connectionParams)
+
+        # A (synchronous) connection pool cannot be shared, so connect using the same params
+        connectionPool = connectionParams.pop('connection_pool', None)
+        if connectionPool is not None:
+            connectionParams.update(connectionPool.connection_kwargs)
+
+        pool = aioredis.BlockingConnectionPool(max_connections=maxConnections, **connectionParams)
+        self._pools.append(pool)
+        self._conns[nodeName] = aioredis.Redis(connection_pool=pool)
+
+    def _getConnsForFile(self, hostname, filename):
+        '''
+            _getConnsForFile - Internal. Get the connection to the node a file belongs to, followed by every other node
+              (which may still hold the file, if not yet rebalanced). @see NetFetchFile._getNodeModelsForFile
+
+            @return list<aioredis.Redis>
+        '''
+        if None in self._conns:
+            return [ self._conns[None] ]
+
+        nodeName = getNodeForFile(hostname, filename)
+        return [ self._conns[nodeName] ] + [ conn for (otherNodeName, conn) in self._conns.items() if otherNodeName != nodeName ]
+
+    async def close(self):
+        '''
+            close - Close all connections to Redis
+        '''
+        for pool in self._pools:
+            await pool.disconnect()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def exists(self, hostname, filename):
+        '''
+            exists - Check if a hostname/filename pair exists
+
+            @param hostname <str> - Hostname field
+            @param filename <str> - Filename field
+
+            @return <bool> - If a file is stored under the hostname/filename key pair
+        '''
+        (keys, args) = NetFetchFile._getFetchScriptParams(hostname, filename)
+
+        for conn in self._getConnsForFile(hostname, filename):
+            if await self._runScript(conn, LOOKUP_FILE_SCRIPT, keys, args) is not None:
+                return True
+
+        return False
+
+    async def fetch(self, hostname, filename, password=None):
+        '''
+            fetch - Fetch the data of a file
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to fetch
+            @param password <str/None> - Try this password on potentially encrpyted file.
+
+            @return <bytes> - Data of file
+
+            @raises NoSuchNetFetchFile - If no hostname/filename match exists
+            @raises InvalidPasswordException - If password was invalid, see NetFetchFile.getData for all conditions.
+        '''
+        (keys, args) = NetFetchFile._getFetchScriptParams(hostname, filename)
+
+        result = None
+        for conn in self._getConnsForFile(hostname, filename):
+            result = await self._runScript(conn, FETCH_FILE_SCRIPT, keys, args)
+            if result:
+                break
+        if not result:
+            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+
+        (primaryKey, flatResult) = result
+        storedDict = hgetallResultToDict(flatResult)
+
+        now = time.time()
+        if isExpired(storedDict.get(b'expires', None), now):
+            # Deleted by the next sweep (see retention.py)
+            raise NoSuchNetFetchFile('No file matching hostname="%s" filename="%s"' %(hostname, filename))
+        if isAccessTracked():
+            await queueFilesAccessed(conn, hostname, [filename], now)
+
+        if not storedDict.get(b'chunks', None):
+            await self._loadCompressDictionary(conn, storedDict)
+            return await self._runInExecutor(_decodeStored, primaryKey, storedDict, password)
+
+        # Chunked files carry no data in the hash, so converting to an object is cheap
+        obj = NetFetchFile._objFromStorage(primaryKey, storedDict)
+        return await self._fetchChunks(conn, obj, password)
+
+    async def _loadCompressDictionary(self, conn, storedDict):
+        '''
+            _loadCompressDictionary - Load the dictionary a "zstd-dict" file was compressed with (if not already loaded),
+              so it is not fetched on a synchronous connection when the file is decoded. @see dictionaries.loadDictionary
+
+            @param conn <redis.asyncio.Redis> - Connection to the node the file was fetched from
+            @param storedDict <dict> - Stored fields of the file
+
+            @raises ValueError - If the dictionary is not stored
+        '''
+        dictId = storedDict.get(b'compressDict', None)
+        if not dictId or not storedDict.get(b'data', None):
+            return
+
+        dictId = int(dictId)
+        if hasCompressDictionary(dictId):
+            return
+
+        dictData = await conn.hget(getDictionariesKey(), str(dictId))
+        if not dictData:
+            raise ValueError('Compression dictionary %d is not stored. If a node was added, run netFetchRebalance.' %(dictId,))
+
+        await self._runInExecutor(addCompressDictionary, dictData)
+
+    async def put(self, filename, data, mode='', owner='', group='', password=None, hostnameOverride=None, model=NetFetchFile, encryption=None, checksumType=None, ttl=None, **kwargs):
+        '''
+            put - Create or update a file
+
+            @param filename <str> - filename to use for storage
+            @param data <bytes> - Data to store
+            @param mode <str> - String or int of base-8 encoded chmod value
+            @param owner <str> - Owner uid
+            @param group <str> - Group gid
+            @param password <str/None> - If provided, 4-32 characters to encrypt. If not provided, file will not be encrypted.
+            @param hostnameOverride <None/Str> - Override hostname with this value. Default is to use current hostname.
+            @param model <class> - NetFetchFile or a subclass, which determines how the data is stored (i.e. NetFetchCompressedLzmaFile)
+            @param encryption <str/None> - If password provided, the format of encrypted data, like "aesgcm". Default is Fernet. @see NetFetchFile.encryptData
+            @param checksumType <str/None> - Checksum algorithm, like "blake2b" or "xxh3". Default is MD5. @see NetFetchFile.setData
+            @param ttl <float/None> - If provided, the file expires this many seconds after it is stored. @see NetFetchFile.createOrUpdate
+            @param kwargs - Additional arguments for NetFetchChunkedFile.createOrUpdate (chunkSize, compressMode, dedup)
+
+              NOTE: Chunked files send their chunks in their own pipelined batches (reusing any stored chunks which are unchanged),
+                so a put using NetFetchChunkedFile runs entirely in the executor, on a synchronous connection.
+
+            @return <int> - Number of bytes stored
+
+            @raises ValueError - If provided password does not meet criteria, or ttl is not positive
+        '''
+        hostname = hostnameOverride or socket.gethostname()
+
+        if issubclass(model, NetFetchChunkedFile):
+            obj = await self._runInExecutor(model.createOrUpdate, filename, data, mode, owner, group, password, hostname, encryption=encryption, checksumType=checksumType, ttl=ttl, **kwargs)
+            return obj.size
+
+        prepared = await self._runInExecutor(model._prepareUpload, filename, data, hostname, mode, owner, group, password, encryption, checksumType, ttl)
+        toSave = [prepared]
+        conn = self._getConnsForFile(hostname, filename)[0]
+
+        pipeline = conn.pipeline(transaction=False)
+        model._queueUploadLookups(pipeline, toSave, _queueScript)
+        existingResults = await pipeline.execute()
+
+        newIds = []
+        if not existingResults[0]:
+            pipeline = conn.pipeline(transaction=False)
+            model._queueNewIds(pipeline, 1)
+            newIds = await pipeline.execute()
+
+        pendingRevisions = None
+        if existingResults[0] and isRevisionsEnabled():
+            replaced = [ (int(existingResults[0][0]), prepared[0]) ]
+            pipeline = conn.pipeline(transaction=False)
+            model._queueRevisionLookups(pipeline, replaced)
+            results = await pipeline.execute()
+            pendingRevisions = await self._runInExecutor(model._buildPendingRevisions, replaced, results)
+
+        pipeline = conn.pipeline(transaction=True)
+        releaseChunkIds = model._queueUploadWrites(pipeline, toSave, existingResults, newIds, pendingRevisions)
+        await pipeline.execute()
+
+        await self._releaseChunks(conn, releaseChunkIds)
+
+        # Sweeping expired files and evicting are rare, so are run on a synchronous connection (see retention.py)
+        if isExpireSweepDue():
+            await self._runInExecutor(NetFetchFile.expireFiles, maxFiles=DEFAULT_EXPIRE_BATCH_SIZE)
+        if isBudgetEnabled():
+            await self._runInExecutor(NetFetchFile.enforceStorageBudget, hostname, None, [filename])
+
+        return prepared[2]
+
+    async def delete(self, hostname, filename):
+        '''
+            delete - Delete a file, and release any chunks it references
+
+            @param hostname <str> - Hostname that file was stored on
+            @param filename <str> - Filename to delete
+
+            @return <bool> - True if a file was deleted, otherwise False
+        '''
+        isDeleted = False
+        # The file may be on more than one node, if not yet rebalanced
+        for conn in self._getConnsForFile(hostname, filename):
+            if await self._deleteFromNode(conn, hostname, filename):
+                isDeleted = True
+
+        return isDeleted
+
+    async def _deleteFromNode(self, conn, hostname, filename):
+        '''
+            _deleteFromNode - Internal. Delete a file from one node. @see delete
+        '''
+        helper = NetFetchFile.objects
+        (indexKeys, args) = NetFetchFile._getFetchScriptParams(hostname, filename)
+
+        primaryKey = await self._runScript(conn, LOOKUP_FILE_SCRIPT, indexKeys, args)
+        if primaryKey is None:
+            return False
+        primaryKeys = [primaryKey]
+
+        pipeline = conn.pipeline(transaction=False)
+        for primaryKey in primaryKeys:
+            pipeline.hmget(helper._get_key_for_id(int(primaryKey)), ['chunks', 'size'])
+        existingValues = await pipeline.execute()
+
+        pipeline = conn.pipeline(transaction=True)
+        queueRevisionsDelete(pipeline, hostname, filename)
+        for primaryKey in primaryKeys:
+            primaryKey = int(primaryKey)
+            pipeline.delete(helper._get_key_for_id(primaryKey))
+            pipeline.srem(helper._get_ids_key(), primaryKey)
+            # The hostname and filename index sets. The path index is updated with the listing index.
+            for indexKey in indexKeys[:2]:
+                pipeline.srem(indexKey, primaryKey)
+            queueListIndexRemove(pipeline, hostname, filename, primaryKey)
+        for (manifest, size) in existingValues:
+            queueFileRemoved(pipeline, hostname, filename, int(size or 0))
+        queueChangeEvent(pipeline, EVENT_DELETE, hostname, filename)
+        results = await pipeline.execute()
+
+        chunkIds = getDeletedChunkIds(results[0])
+        for (manifest, size) in existingValues:
+            if manifest:
+                chunkIds += [ entry.chunkId for entry in parseManifest(manifest.decode('utf-8')) ]
+        await self._releaseChunks(conn, chunkIds)
+
+        return True
+
+    async def _fetchChunks(self, conn, obj, password):
+        '''
+            _fetchChunks - Internal. Fetch the chunks of a chunked file in pipelined batches, decoding each batch in the executor.
+
+            @see NetFetchChunkedFile.iterData
+        '''
+        obj._checkPassword(password)
+        (cipher, compressMode, checksumType) = obj._getChunkCodec(password)
+        checksum = newHasher(checksumType)
+
+        entries = parseManifest(obj.chunks)
+        batchSize = getBatchSize(obj.chunkSize)
+
+        blocks = []
+        for batchStart in range(0, len(entries), batchSize):
+            batch = entries[batchStart : batchStart + batchSize]
+
+            pipeline = conn.pipeline(transaction=False)
+            for entry in batch:
+                pipeline.get(getChunkKey(entry.chunkId))
+            results = await pipeline.execute()
+
+            blocks += await self._runInExecutor(_decodeChunks, batch, results, cipher, compressMode, checksumType, batchStart, checksum)
+
+        if checksum.hexdigest() != obj.checksum:
+            raise InvalidPasswordException('Invalid Password.')
+
+        return b''.join(blocks)
+
+    async def _releaseChunks(self, conn, chunkIds):
+        '''
+            _releaseChunks - Internal. @see chunks.releaseChunks
+        '''
+        if not chunkIds:
+            return
+
+        keys = [getChunkRefsKey()]
+        chunkKeyPrefix = getChunkKey('')
+        for i in range(0, len(chunkIds), RELEASE_BATCH_SIZE):
+            await self._runScript(conn, RELEASE_CHUNKS_SCRIPT, keys, [chunkKeyPrefix] + list(chunkIds[i : i + RELEASE_BATCH_SIZE]))
+
+    async def _runScript(self, conn, scriptSource, keys, args):
+        '''
+            _runScript - Internal. Run a lua script on a node, using EVALSHA. @see scripts.runScript
+        '''
+        script = self._scripts.get( (conn, scriptSource), None )
+        if script is None:
+            script = self._scripts[ (conn, scriptSource) ] = conn.register_script(scriptSource)
+
+        return await script(keys=keys, args=args)
+
+    async def _runInExecutor(self, func, *args, **kwargs):
+        '''
+            _runInExecutor - Internal. Run a function in #executor, and return its result
+        '''
+        loop = asyncio.get_event_loop()
+
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+
+def _queueScript(pipeline, scriptSource, keys, args):
+    '''
+        _queueScript - Internal. Queue a lua script onto an asyncio pipeline
+    '''
+    pipeline.eval(scriptSource, len(keys), *(list(keys) + list(args)))
+
+
+def _decodeStored(primaryKey, storedDict, password):
+    '''
+        _decodeStored - Internal. Convert a stored (non-chunked) hash into its data. Runs in the executor, as this decompresses and decrypts.
+    '''
+    return NetFetchFile._objFromStorage(primaryKey, storedDict).getData(password)
+
+
+def _decodeChunks(entries, blocks, cipher, compressMode, checksumType, firstChunkNum, checksum):
+    '''
+        _decodeChunks - Internal. Decode a batch of chunks, and add each to the checksum of the whole file. Runs in the executor.
+
+        @see NetFetchChunkedFile._decodeChunk
+    '''
+    ret = []
+    for i in range(len(entries)):
+        block = NetFetchChunkedFile._decodeChunk(entries[i], blocks[i], cipher, compressMode, checksumType, firstChunkNum + i)
+        checksum.update(block)
+        ret.append(block)
+
+    return ret
@@ -0,0 +1,295 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the helpers for storing and fetching many files at once, with parallel workers
+
+# vim: ts=4 sw=4 expandtab
+
+import fnmatch
+import glob
+import multiprocessing
+import os
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from .chunks import iterBatches
+
+__all__ = ('DEFAULT_BULK_BATCH_SIZE', 'BulkResult', 'runBulk', 'getDefaultNumWorkers',
+            'expandLocalFilenames', 'readFilenameList', 'matchStoredFilenames',
+)
+
+# DEFAULT_BULK_BATCH_SIZE - Default number of files sent to or fetched from Redis in one pipeline
+DEFAULT_BULK_BATCH_SIZE = 64
+
+# GLOB_CHARS - Characters which mark a path as a glob pattern
+GLOB_CHARS = ('*', '?', '[')
+
+
+class BulkResult(object):
+    '''
+        BulkResult - The outcome of a bulk operation (see NetFetchFile.createOrUpdateMany / NetFetchFile.downloadManyToLocal)
+    '''
+
+    def __init__(self):
+        # numFiles - Number of files successfully processed
+        self.numFiles = 0
+        # numBytes - Number of bytes of file data (uncompressed, unencrypted) successfully processed
+        self.numBytes = 0
+        # errors - list of tuple( filename, exception ) for each file which failed
+        self.errors = []
+
+        self.startTime = time.time()
+        self.endTime = None
+
+    def addFile(self, numBytes):
+        '''
+            addFile - Record a file which was successfully processed
+
+            @param numBytes <int> - Size of file
+        '''
+        self.numFiles += 1
+        self.numBytes += numBytes
+
+    def addError(self, filename, exc):
+        '''
+            addError - Record a file which failed
+
+            @param filename <str> - Filename
+            @param exc <Exception> - The error
+        '''
+        self.errors.append( (filename, exc) )
+
+    def merge(self, other):
+        '''
+            merge - Add the files, bytes, and errors of another result into this one.
+              The timer covers both (from the earliest start to the latest end).
+
+            @param other <BulkResult> - Another result
+        '''
+        self.numFiles += other.numFiles
+        self.numBytes += other.numBytes
+        self.errors += other.errors
+
+        self.startTime = min(self.startTime, other.startTime)
+        if self.endTime is not None and other.endTime is not None:
+            self.endTime = max(self.endTime, other.endTime)
+        else:
+            self.endTime = None
+
+    def finish(self):
+        '''
+            finish - Mark the operation as complete, stopping the timer
+        '''
+        self.endTime = time.time()
+
+    @property
+    def elapsed(self):
+        '''
+            elapsed - Number of seconds the operation took (or has taken so far)
+        '''
+        return (self.endTime or time.time()) - self.startTime
+
+    @property
+    def filesPerSecond(self):
+        '''
+            filesPerSecond - Throughput in files per second
+        '''
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.numFiles / elapsed
+
+    @property
+    def bytesPerSecond(self):
+        '''
+            bytesPerSecond - Throughput in bytes per second
+        '''
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.numBytes / elapsed
+
+    def __str__(self):
+        ret = '%d files, %.2f MB in %.2f seconds (%.1f files/s, %.2f MB/s)' %(self.numFiles, self.numBytes / 1048576.0, self.elapsed,
+                    self.filesPerSecond, self.bytesPerSecond / 1048576.0)
+        if self.errors:
+            ret += ', %d failed' %(len(self.errors),)
+
+        return ret
+
+
+def getDefaultNumWorkers():
+    '''
+        getDefaultNumWorkers - Get the default number of parallel workers (number of cpus)
+
+        @return <int>
+    '''
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 4
+
+
+def _callSafe(func):
+    '''
+        _callSafe - Internal. Wrap a worker function so that a failure (or an input which already failed) is returned as the result, instead of raised.
+    '''
+    def _worker(arg):
+        if isinstance(arg, Exception):
+            return arg
+        try:
+            return func(arg)
+        except Exception as e:
+            return e
+
+    return _worker
+
+
+def runBulk(filenames, workerFunc, beforeBatch=None, afterBatch=None, numWorkers=None, batchSize=DEFAULT_BULK_BATCH_SIZE):
+    '''
+        runBulk - Process many files in batches, running the per-file work in a pool of worker threads,
+          and the work which talks to Redis (which should pipeline a whole batch) in the calling thread.
+
+          While the workers process one batch, the calling thread handles Redis for the next (or previous) one,
+            so at most two batches are held at once.
+
+          A failure of one file is recorded in the result, and does not stop the others.
+
+        @param filenames <iterable<str>> - Files to process
+        @param workerFunc <function> - Called in a worker thread for each file, with the result of #beforeBatch for that file
+            (or the filename itself, if no #beforeBatch)
+        @param beforeBatch <function/None> - Called in the calling thread with a list of filenames, returns a list (same length)
+            of input to #workerFunc. An Exception in the returned list marks that file as failed.
+        @param afterBatch <function/None> - Called in the calling thread with a list of filenames and a list (same length) of
+            results of #workerFunc (or the Exception raised). Returns a list (same length) of the number of bytes processed
+            for each file, or an Exception if it failed. If None, #workerFunc must return the number of bytes.
+        @param numWorkers <int/None> - Number of worker threads. Default is number of cpus.
+        @param batchSize <int> - Maximum number of files per batch
+
+        @return <BulkResult> - The number of files and bytes processed, time taken, and any errors
+    '''
+    result = BulkResult()
+
+    pool = ThreadPool(numWorkers or getDefaultNumWorkers())
+    worker = _callSafe(workerFunc)
+
+    def _finishBatch(batch, asyncResult):
+        workerResults = asyncResult.get()
+        if afterBatch is not None:
+            workerResults = afterBatch(batch, workerResults)
+
+        for (filename, numBytes) in zip(batch, workerResults):
+            if isinstance(numBytes, Exception):
+                result.addError(filename, numBytes)
+            else:
+                result.addFile(numBytes)
+
+    try:
+        pending = None
+        for batch in iterBatches(filenames, batchSize):
+            if beforeBatch is not None:
+                batchInput = beforeBatch(batch)
+            else:
+                batchInput = batch
+
+            asyncResult = pool.map_async(worker, batchInput)
+            if pending is not None:
+                _finishBatch(*pending)
+            pending = (batch, asyncResult)
+
+        if pending is not None:
+            _finishBatch(*pending)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    result.finish()
+    return result
+
+
+def expandLocalFilenames(paths, recursive=False):
+    '''
+        expandLocalFilenames - Expand a list of local paths, which may be filenames, directories, or glob patterns,
+          into absolute filenames of regular files.
+
+        @param paths <iterable<str>> - Paths
+        @param recursive <bool> - If True, directories are expanded into all regular files within them (recursively).
+            Otherwise, a directory is an error.
+
+        @return generator<str> - Absolute filenames, each at most once
+
+        @raises ValueError - If a path does not exist, or is a directory and not #recursive
+    '''
+    seen = set()
+
+    for path in paths:
+        if any( [ globChar in path for globChar in GLOB_CHARS ] ):
+            matched = sorted(glob.glob(path))
+        else:
+            matched = [path]
+
+        for matchedPath in matched:
+            matchedPath = os.path.realpath(matchedPath)
+            if os.path.isdir(matchedPath):
+                if not recursive:
+                    raise ValueError('"%s" is a directory, and recursive was not requested.' %(matchedPath,))
+                filenames = []
+                for (dirName, subdirNames, fileNames) in os.walk(matchedPath):
+                    subdirNames.sort()
+                    for fileName in sorted(fileNames):
+                        filename = os.path.join(dirName, fileName)
+                        if os.path.isfile(filename):
+                            filenames.append(filename)
+            elif not os.path.exists(matchedPath):
+                raise ValueError('"%s" does not exist.' %(matchedPath,))
+            else:
+                filenames = [matchedPath]
+
+            for filename in filenames:
+                if filename not in seen:
+                    seen.add(filename)
+                    yield filename
+
+
+def readFilenameList(fileObj):
+    '''
+        readFilenameList - Read a list of filenames, one per line (like from stdin)
+
+        @param fileObj <file> - File opened for read (in text mode)
+
+        @return list<str> - Filenames, excluding blank lines
+    '''
+    return [ line.rstrip('\r\n') for line in fileObj if line.strip() ]
+
+
+def matchStoredFilenames(storedFilenames, patterns, recursive=False):
+    '''
+        matchStoredFilenames - Match a list of filenames, directories, or glob patterns against the filenames which are stored
+
+        @param storedFilenames list<str> - Stored filenames (absolute)
+        @param patterns list<str> - Filenames, directories (if #recursive), or glob patterns.
+            A filename which matches nothing is returned as-is (so the fetch reports it as missing)
+        @param recursive <bool> - If True, a directory matches every stored filename within it
+
+        @return list<str> - Matched filenames, each at most once
+    '''
+    ret = []
+    seen = set()
+
+    storedFilenames = sorted(storedFilenames)
+
+    for pattern in patterns:
+        if any( [ globChar in pattern for globChar in GLOB_CHARS ] ):
+            matched = fnmatch.filter(storedFilenames, pattern)
+        elif recursive and pattern not in storedFilenames:
+            dirPrefix = pattern.rstrip('/') + '/'
+            matched = [ storedFilename for storedFilename in storedFilenames if storedFilename.startswith(dirPrefix) ] or [pattern]
+        else:
+            matched = [pattern]
+
+        for filename in matched:
+            if filename not in seen:
+                seen.add(filename)
+                ret.append(filename)
+
+    return ret
@@ -0,0 +1,251 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the local on-disk read-through cache of fetched file data
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import os
+import re
+import shutil
+import tempfile
+
+__all__ = ('DEFAULT_CACHE_SIZE', 'LINK_MODE_REFLINK', 'LINK_MODE_HARDLINK', 'LINK_MODE_COPY', 'LINK_MODES', 'LocalCache')
+
+# DEFAULT_CACHE_SIZE - Default maximum number of bytes held in a cache directory
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# LINK_MODE_* - How a cached file is placed at its destination.
+#
+#   reflink  - Copy-on-write clone (btrfs, xfs, etc.), falling back to a copy where not supported
+#   hardlink - Hardlink to the cache entry, falling back to a copy across filesystems.
+#                NOTE: The destination shares the cache entry's inode, so it must not be modified in-place,
+#                 and permissions applied to it apply to the cache entry, and every other file placed from it, as well.
+#                 When retaining permissions which differ from the cache entry's, a copy is placed instead.
+#                 Entries have the mode of a new file (0666 less the umask), so without retained permissions a hardlink
+#                 gets the same mode as a copy would. If an entry's mode differs from that, a copy is placed instead.
+#   copy     - Always copy
+LINK_MODE_REFLINK = 'reflink'
+LINK_MODE_HARDLINK = 'hardlink'
+LINK_MODE_COPY = 'copy'
+
+LINK_MODES = (LINK_MODE_REFLINK, LINK_MODE_HARDLINK, LINK_MODE_COPY)
+
+# FICLONE - Linux ioctl to clone (reflink) one file into another
+FICLONE = 0x40049409
+
+# _CACHE_KEY_RE - Cache keys are used as filenames, so only allow safe characters (checksums)
+_CACHE_KEY_RE = re.compile('^[0-9a-zA-Z_-]+$')
+
+# TEMP_PREFIX - Prefix for partially-written files within the cache directory
+TEMP_PREFIX = '.tmp-'
+
+
+class LocalCache(object):
+    '''
+        LocalCache - A directory of fetched file data, keyed by checksum, with a size cap and LRU eviction.
+
+          Each entry is a file named by the checksum of its data. The modification time of an entry is
+            updated whenever it is used, and the least-recently used entries are removed once the
+            total size exceeds #maxSize.
+
+          Only unencrypted files are cached (so decrypted data is never written to the cache).
+    '''
+
+    def __init__(self, cacheDir, maxSize=DEFAULT_CACHE_SIZE, linkMode=LINK_MODE_REFLINK):
+        '''
+            @param cacheDir <str> - Directory to hold cache. Created if it does not exist.
+            @param maxSize <int> - Maximum number of bytes to hold in cache
+            @param linkMode <str> - One of LINK_MODE_*, how a cached file is placed at its destination.
+
+            @raises ValueError - If linkMode is invalid
+        '''
+        if linkMode not in LINK_MODES:
+            raise ValueError('Invalid cache link mode "%s". Must be one of: %s' %(linkMode, ', '.join(LINK_MODES)))
+
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.linkMode = linkMode
+
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir, 0o700)
+
+    def getCachedFilename(self, cacheKey):
+        '''
+            getCachedFilename - Get the filename of a cache entry, if present, and mark it as recently used.
+
+            @param cacheKey <str> - Cache key (the checksum of the data)
+
+            @return <str/None> - Path to cache entry, or None if not cached
+        '''
+        cachedFilename = self._getEntryFilename(cacheKey)
+        try:
+            os.utime(cachedFilename, None)
+        except OSError:
+            return None
+
+        return cachedFilename
+
+    def store(self, cacheKey, blocks):
+        '''
+            store - Store data in the cache, and evict least-recently used entries to stay within #maxSize
+
+            @param cacheKey <str> - Cache key (the checksum of the data)
+            @param blocks <iterable<bytes>> - The data, in blocks (like the result of NetFetchFile.iterData)
+
+            @return <str> - Path to the cache entry
+        '''
+        cachedFilename = self._getEntryFilename(cacheKey)
+
+        (fd, tempFilename) = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.cacheDir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in blocks:
+                    f.write(block)
+            # mkstemp creates as 0600. A hardlink to the entry has its mode, so give it the mode a regular open would have.
+            os.chmod(tempFilename, _getNewFileMode())
+            os.rename(tempFilename, cachedFilename)
+        except:
+            try:
+                os.unlink(tempFilename)
+            except:
+                pass
+            raise
+
+        self.evict(keepFilename=cachedFilename)
+
+        return cachedFilename
+
+    def placeFile(self, cachedFilename, localFilename, linkMode=None):
+        '''
+            placeFile - Place a cache entry at a destination, replacing it if it exists, using #linkMode
+
+            @param cachedFilename <str> - Path to cache entry, see #getCachedFilename
+            @param localFilename <str> - Destination path
+            @param linkMode <str/None> - If provided, one of LINK_MODE_* to use instead of #linkMode
+
+              A hardlink is only made if the cache entry has the mode a new file would have (see #store), otherwise it is copied.
+        '''
+        if linkMode is None:
+            linkMode = self.linkMode
+        newFileMode = _getNewFileMode()
+
+        if linkMode == LINK_MODE_HARDLINK and (os.stat(cachedFilename).st_mode & 0o7777) != newFileMode:
+            # i.e. the umask has changed since the entry was stored
+            linkMode = LINK_MODE_COPY
+
+        destDir = os.path.dirname(os.path.abspath(localFilename))
+        (fd, tempFilename) = tempfile.mkstemp(prefix='.' + os.path.basename(localFilename) + TEMP_PREFIX, dir=destDir)
+        try:
+            if linkMode == LINK_MODE_HARDLINK:
+                os.close(fd)
+                fd = None
+                try:
+                    os.unlink(tempFilename)
+                    os.link(cachedFilename, tempFilename)
+                except OSError:
+                    fd = os.open(tempFilename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+            if fd is not None:
+                with os.fdopen(fd, 'wb') as destFile:
+                    fd = None
+                    with open(cachedFilename, 'rb') as srcFile:
+                        if linkMode != LINK_MODE_REFLINK or not _reflink(srcFile, destFile):
+                            shutil.copyfileobj(srcFile, destFile, 1024 * 1024)
+                # mkstemp creates as 0600, apply the mode a regular open would have
+                os.chmod(tempFilename, newFileMode)
+
+            os.rename(tempFilename, localFilename)
+        except:
+            if fd is not None:
+                os.close(fd)
+            try:
+                os.unlink(tempFilename)
+            except:
+                pass
+            raise
+
+    def evict(self, keepFilename=None):
+        '''
+            evict - Remove least-recently used entries until the cache is within #maxSize
+
+            @param keepFilename <str/None> - Never remove this entry (i.e. the one just stored)
+
+            @return <int> - Number of entries removed
+        '''
+        entries = []
+        totalSize = 0
+        for name in os.listdir(self.cacheDir):
+            if name.startswith(TEMP_PREFIX):
+                continue
+            entryFilename = os.path.join(self.cacheDir, name)
+            try:
+                statInfo = os.stat(entryFilename)
+            except OSError:
+                continue
+            entries.append( (statInfo.st_mtime, statInfo.st_size, entryFilename) )
+            totalSize += statInfo.st_size
+
+        if totalSize <= self.maxSize:
+            return 0
+
+        numRemoved = 0
+        entries.sort()
+        for (mtime, size, entryFilename) in entries:
+            if totalSize <= self.maxSize:
+                break
+            if entryFilename == keepFilename:
+                continue
+            try:
+                os.unlink(entryFilename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            totalSize -= size
+            numRemoved += 1
+
+        return numRemoved
+
+    def _getEntryFilename(self, cacheKey):
+        '''
+            _getEntryFilename - Internal. Get the path of a cache entry
+
+            @raises ValueError - If cache key contains unsafe characters
+        '''
+        if not cacheKey or not _CACHE_KEY_RE.match(cacheKey):
+            raise ValueError('Invalid cache key: %s' %(repr(cacheKey),))
+
+        return os.path.join(self.cacheDir, cacheKey)
+
+
+def _getUmask():
+    '''
+        _getUmask - Internal. Get the current umask
+    '''
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _getNewFileMode():
+    '''
+        _getNewFileMode - Internal. Get the mode a file created by a regular open would have (0666 less the umask)
+    '''
+    return 0o666 & ~_getUmask()
+
+
+def _reflink(srcFile, destFile):
+    '''
+        _reflink - Internal. Try to clone (copy-on-write) one file into another.
+
+        @param srcFile <file> - Source, opened for read
+        @param destFile <file> - Destination, opened for write
+
+        @return <bool> - True if cloned, False if not supported (caller should copy)
+    '''
+    try:
+        import fcntl
+        fcntl.ioctl(destFile.fileno(), FICLONE, srcFile.fileno())
+        return True
+    except (ImportError, IOError, OSError):
+        return False
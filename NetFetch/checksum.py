@@ -0,0 +1,183 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the checksum algorithms used to verify file data
+
+# vim: ts=4 sw=4 expandtab
+
+import hashlib
+
+__all__ = ('CHECKSUM_MD5', 'CHECKSUM_BLAKE2B', 'CHECKSUM_XXH3', 'CHECKSUM_NAMES', 'DEFAULT_CHECKSUM_TYPE',
+            'normalizeChecksumType', 'newHasher', 'calculateChecksum', 'readAndHash', 'hashFile',
+)
+
+# CHECKSUM_* - Values of the "checksumType" field, which records the algorithm used for the checksum of a file
+#    (and the digests of its chunks)
+#
+#   CHECKSUM_MD5     - (Original) MD5. Files stored before checksumType existed have an empty value, so are MD5.
+#   CHECKSUM_BLAKE2B - BLAKE2b (256-bit digest). Cryptographic, and faster than MD5 on 64-bit cpus.
+#   CHECKSUM_XXH3    - XXH3 (128-bit digest). Non-cryptographic, and many times faster. Requires the "xxhash" module.
+CHECKSUM_MD5 = ''
+CHECKSUM_BLAKE2B = 'blake2b'
+CHECKSUM_XXH3 = 'xxh3'
+
+# CHECKSUM_NAMES - Map of name (as given on the command line) -> CHECKSUM_* value
+CHECKSUM_NAMES = {
+    'md5'     : CHECKSUM_MD5,
+    'blake2b' : CHECKSUM_BLAKE2B,
+    'blake2'  : CHECKSUM_BLAKE2B,
+    'xxh3'    : CHECKSUM_XXH3,
+    'xxhash'  : CHECKSUM_XXH3,
+}
+
+# DEFAULT_CHECKSUM_TYPE - Checksum type used when none is specified. MD5, so files can be verified by all versions of NetFetch.
+DEFAULT_CHECKSUM_TYPE = CHECKSUM_MD5
+
+# READ_BLOCK_SIZE - Number of bytes read (and hashed) at a time by #readAndHash and #hashFile
+READ_BLOCK_SIZE = 1024 * 1024
+
+# BLAKE2B_DIGEST_SIZE - Number of bytes in a BLAKE2b digest
+BLAKE2B_DIGEST_SIZE = 32
+
+
+global _blake2bFunc
+_blake2bFunc = None
+
+def _getBlake2bFunc():
+    '''
+        _getBlake2bFunc - Internal. Get the blake2b constructor (core hashlib on python 3.6+, pyblake2 otherwise)
+    '''
+    global _blake2bFunc
+    if _blake2bFunc is None:
+        try:
+            _blake2bFunc = hashlib.blake2b
+        except AttributeError:
+            from pyblake2 import blake2b
+            _blake2bFunc = blake2b
+    return _blake2bFunc
+
+
+global _xxhashMod
+_xxhashMod = None
+
+def _getXxhashMod():
+    '''
+        _getXxhashMod - Internal. Get the xxhash module
+
+        @raises ImportError - If xxhash is not installed
+    '''
+    global _xxhashMod
+    if _xxhashMod is None:
+        try:
+            import xxhash
+        except ImportError:
+            raise ImportError('Checksum type "xxh3" requires the "xxhash" module. Try: pip install xxhash')
+        _xxhashMod = xxhash
+    return _xxhashMod
+
+
+def normalizeChecksumType(checksumType):
+    '''
+        normalizeChecksumType - Convert a checksum name (like "md5" or "blake2b") into a CHECKSUM_* value
+
+        @param checksumType <str/None> - Name or CHECKSUM_* value. None is DEFAULT_CHECKSUM_TYPE
+
+        @return <str> - CHECKSUM_* value
+
+        @raises ValueError - If checksumType is unknown
+    '''
+    if checksumType is None:
+        return DEFAULT_CHECKSUM_TYPE
+    if not checksumType:
+        return CHECKSUM_MD5
+
+    checksumType = checksumType.lower()
+    if checksumType not in CHECKSUM_NAMES:
+        raise ValueError('Unknown checksum type: "%s". Supported are: %s' %(checksumType, ', '.join(sorted(CHECKSUM_NAMES.keys()))))
+
+    return CHECKSUM_NAMES[checksumType]
+
+
+def newHasher(checksumType=CHECKSUM_MD5):
+    '''
+        newHasher - Create a hash object for incremental hashing (call "update" with each block, then "hexdigest")
+
+        @param checksumType <str> - CHECKSUM_* value
+
+        @return - hash object
+
+        @raises ValueError - If checksumType is unknown
+        @raises ImportError - If the module providing checksumType is not installed
+    '''
+    if checksumType == CHECKSUM_MD5:
+        return hashlib.md5()
+    if checksumType == CHECKSUM_BLAKE2B:
+        return _getBlake2bFunc()(digest_size=BLAKE2B_DIGEST_SIZE)
+    if checksumType == CHECKSUM_XXH3:
+        xxhash = _getXxhashMod()
+        try:
+            return xxhash.xxh3_128()
+        except AttributeError:
+            # Older xxhash
+            return xxhash.xxh128()
+
+    raise ValueError('Unknown checksum type: "%s"' %(checksumType,))
+
+
+def calculateChecksum(checksumType, data):
+    '''
+        calculateChecksum - Calculate the checksum of some data
+
+        @param checksumType <str> - CHECKSUM_* value
+        @param data <bytes> - Data
+
+        @return <str> - Hex digest
+    '''
+    hasher = newHasher(checksumType)
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def readAndHash(fileObj, checksumType=CHECKSUM_MD5, blockSize=READ_BLOCK_SIZE):
+    '''
+        readAndHash - Read all data from a file, hashing each block as it is read (while it is still in cache),
+          instead of hashing the whole data in a separate pass afterwards.
+
+        @param fileObj <file-like> - File opened for binary read
+        @param checksumType <str> - CHECKSUM_* value
+        @param blockSize <int> - Number of bytes read at a time
+
+        @return tuple( data<bytes>, checksum<str> )
+    '''
+    hasher = newHasher(checksumType)
+
+    blocks = []
+    while True:
+        block = fileObj.read(blockSize)
+        if not block:
+            break
+        hasher.update(block)
+        blocks.append(block)
+
+    return (b''.join(blocks), hasher.hexdigest())
+
+
+def hashFile(filename, checksumType=CHECKSUM_MD5, blockSize=READ_BLOCK_SIZE):
+    '''
+        hashFile - Calculate the checksum of a file, reading it one block at a time (so it is never held whole in memory)
+
+        @param filename <str> - Filename
+        @param checksumType <str> - CHECKSUM_* value
+        @param blockSize <int> - Number of bytes read at a time
+
+        @return <str> - Hex digest, the same as #calculateChecksum of the file's data
+    '''
+    hasher = newHasher(checksumType)
+
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blockSize)
+            if not block:
+                break
+            hasher.update(block)
+
+    return hasher.hexdigest()
@@ -0,0 +1,295 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the helpers for storing a file as a manifest plus fixed-size chunk keys
+
+# vim: ts=4 sw=4 expandtab
+
+import hmac
+import uuid
+
+from hashlib import sha256
+
+from IndexedRedis import INDEXED_REDIS_PREFIX
+
+from .scripts import RELEASE_CHUNKS_SCRIPT, runScript
+
+__all__ = ('DEFAULT_CHUNK_SIZE', 'DEFAULT_BUFFER_SIZE', 'ManifestEntry',
+            'getChunkKey', 'getChunkRefsKey', 'newChunkIdPrefix', 'getDedupChunkId', 'isDedupChunkId',
+            'parseManifest', 'buildManifest', 'parseSize',
+            'iterBlocks', 'iterBatches', 'getBatchSize', 'acquireDedupChunks', 'releaseChunks',
+)
+
+# DEFAULT_CHUNK_SIZE - Default number of bytes of file data held in each chunk
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# DEFAULT_BUFFER_SIZE - Maximum number of (uncompressed) bytes of chunks held in memory at once
+#   while uploading or downloading. Chunks are sent/fetched in pipelined batches that fit this size.
+DEFAULT_BUFFER_SIZE = 16 * 1024 * 1024
+
+# CHUNK_KEY_NAME - Name under which chunk keys are stored, within the NetFetchFile key namespace
+CHUNK_KEY_NAME = 'NetFetchFile:chunk:'
+
+# CHUNK_REFS_KEY_NAME - Name of the hash holding the reference count of each deduplicated chunk
+CHUNK_REFS_KEY_NAME = 'NetFetchFile:chunkRefs'
+
+# DEDUP_CHUNK_ID_PREFIX - Prefix of content-addressed (deduplicated) chunk ids
+DEDUP_CHUNK_ID_PREFIX = 'cas-'
+
+# RELEASE_BATCH_SIZE - Maximum number of chunk ids released per script call
+RELEASE_BATCH_SIZE = 1000
+
+
+class ManifestEntry(object):
+    '''
+        ManifestEntry - One chunk as listed in the manifest of a chunked file
+    '''
+
+    __slots__ = ('chunkId', 'size', 'digest')
+
+    def __init__(self, chunkId, size, digest):
+        '''
+            @param chunkId <str> - Id of chunk, see #getChunkKey
+            @param size <int> - Number of bytes of file data (before compression/encryption) within this chunk
+            @param digest <str> - Checksum of the file data within this chunk
+        '''
+        self.chunkId = chunkId
+        self.size = size
+        self.digest = digest
+
+    def __repr__(self):
+        return 'ManifestEntry(%s, %d, %s)' %(repr(self.chunkId), self.size, repr(self.digest))
+
+
+def getChunkKey(chunkId):
+    '''
+        getChunkKey - Get the redis key which holds the data for a given chunk id
+
+        @param chunkId <str> - Chunk id
+
+        @return <str> - Redis key
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, CHUNK_KEY_NAME, chunkId])
+
+
+def getChunkRefsKey():
+    '''
+        getChunkRefsKey - Get the redis key of the hash which holds the reference count of each deduplicated chunk
+
+        @return <str> - Redis key
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, CHUNK_REFS_KEY_NAME])
+
+
+def newChunkIdPrefix():
+    '''
+        newChunkIdPrefix - Generate a unique prefix for the chunk ids of one upload.
+          Chunk ids are formed as PREFIX.NUMBER
+
+        @return <str> - Unique prefix
+    '''
+    return uuid.uuid4().hex
+
+
+def getDedupChunkId(block, compressMode, secret=None, encryption=None):
+    '''
+        getDedupChunkId - Get the content-addressed id of a chunk. Chunks with the same content
+          (and stored the same way) share an id, and thus are only stored once.
+
+        @param block <bytes> - Data of chunk (before compression/encryption)
+        @param compressMode <str> - Compression mode used on the stored chunk
+        @param secret <bytes/None> - If the chunk is encrypted, the encryption key. The id is then an HMAC
+            of the data, so it reveals nothing about the content, and only matches chunks encrypted with the same key.
+        @param encryption <str/None> - If the chunk is encrypted, the format (an encryption.ENCRYPTION_* value), so chunks
+            encrypted with the same key in different formats do not share an id. Fernet ('') ids are unchanged from before.
+
+        @return <str> - Chunk id
+    '''
+    if secret:
+        digest = 'hmac' + hmac.new(secret, block, sha256).hexdigest()
+        if encryption:
+            digest = encryption + '-' + digest
+    else:
+        digest = sha256(block).hexdigest()
+
+    return '%s%s-%s' %(DEDUP_CHUNK_ID_PREFIX, compressMode or 'none', digest)
+
+
+def isDedupChunkId(chunkId):
+    '''
+        isDedupChunkId - Check if a chunk id is content-addressed (deduplicated and reference-counted)
+
+        @param chunkId <str> - Chunk id
+
+        @return <bool>
+    '''
+    return chunkId.startswith(DEDUP_CHUNK_ID_PREFIX)
+
+
+def parseManifest(manifest):
+    '''
+        parseManifest - Parse the manifest of a chunked file
+
+          Format is one line per chunk, in order, of:  chunkId size digest
+
+        @param manifest <str> - Manifest string, as stored in the "chunks" field
+
+        @return list<ManifestEntry> - Chunks in order
+    '''
+    ret = []
+    if not manifest:
+        return ret
+
+    for line in manifest.split('\n'):
+        if not line:
+            continue
+        (chunkId, size, digest) = line.split(' ')
+        ret.append( ManifestEntry(chunkId, int(size), digest) )
+
+    return ret
+
+
+def buildManifest(entries):
+    '''
+        buildManifest - Build a manifest string from a list of chunks. Inverse of #parseManifest
+
+        @param entries list<ManifestEntry> - Chunks in order
+
+        @return <str> - Manifest string
+    '''
+    return '\n'.join([ '%s %d %s' %(entry.chunkId, entry.size, entry.digest) for entry in entries ])
+
+
+def parseSize(sizeStr):
+    '''
+        parseSize - Parse a size in bytes, optionally with a K/M/G suffix (powers of 1024)
+
+        @param sizeStr <str> - Size, like "4096", "512K" or "4M"
+
+        @return <int> - Number of bytes
+
+        @raises ValueError - If size cannot be parsed or is not positive
+    '''
+    sizeStr = sizeStr.strip().upper()
+    if sizeStr.endswith('B'):
+        sizeStr = sizeStr[:-1]
+
+    multiplier = 1
+    if sizeStr and sizeStr[-1] in ('K', 'M', 'G'):
+        multiplier = 1024 ** (('K', 'M', 'G').index(sizeStr[-1]) + 1)
+        sizeStr = sizeStr[:-1]
+
+    try:
+        size = int(sizeStr) * multiplier
+    except ValueError:
+        raise ValueError('Invalid size: "%s"' %(sizeStr,))
+
+    if size <= 0:
+        raise ValueError('Size must be greater than zero.')
+
+    return size
+
+
+def iterBlocks(data, blockSize):
+    '''
+        iterBlocks - Iterate over some data in blocks of at most #blockSize bytes.
+
+        @param data <bytes/file-like> - Either a bytes-like object (sliced without copying via memoryview),
+            or a file-like object with a "read" method, which is read #blockSize bytes at a time.
+
+        @param blockSize <int> - Maximum number of bytes per block
+
+        @return generator<bytes/memoryview> - Blocks of data. The final block may be shorter.
+    '''
+    if hasattr(data, 'read'):
+        while True:
+            block = data.read(blockSize)
+            if not block:
+                break
+            yield block
+    else:
+        view = memoryview(data)
+        dataLen = len(view)
+        offset = 0
+        while offset < dataLen:
+            yield view[offset : offset + blockSize]
+            offset += blockSize
+
+
+def iterBatches(iterable, batchSize):
+    '''
+        iterBatches - Group the items of an iterable into lists of up to #batchSize items
+
+        @param iterable <iterable> - Items
+        @param batchSize <int> - Maximum items per batch
+
+        @return generator<list> - Batches of items
+    '''
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def getBatchSize(chunkSize, bufferSize=DEFAULT_BUFFER_SIZE):
+    '''
+        getBatchSize - Get the number of chunks which may be sent or fetched in one pipeline,
+          keeping the amount of data held in memory within #bufferSize
+
+        @param chunkSize <int> - Size of each chunk
+        @param bufferSize <int> - Maximum bytes to hold at once
+
+        @return <int> - Number of chunks per batch (at least 1)
+    '''
+    if not chunkSize:
+        return 1
+    return max(1, bufferSize // chunkSize)
+
+
+def acquireDedupChunks(conn, chunkIds):
+    '''
+        acquireDedupChunks - Add a reference to each of the given deduplicated chunks, and check which are already stored.
+
+          Chunks which are not yet stored must be stored by the caller, chunks which are already stored should not be sent again.
+
+          A reference is always added, so every chunk id passed must later be released (see #releaseChunks)
+
+        @param conn <redis.Redis> - Connection to redis
+        @param chunkIds list<str> - Content-addressed chunk ids
+
+        @return list<bool> - For each chunk id, True if it is already stored, otherwise False.
+    '''
+    refsKey = getChunkRefsKey()
+
+    pipeline = conn.pipeline(transaction=False)
+    for chunkId in chunkIds:
+        # NOTE: The reference must be added prior to checking existence,
+        #   so the chunk cannot be released by another client in-between.
+        pipeline.hincrby(refsKey, chunkId, 1)
+        pipeline.exists(getChunkKey(chunkId))
+    results = pipeline.execute()
+
+    return [ bool(exists) for exists in results[1::2] ]
+
+
+def releaseChunks(conn, chunkIds):
+    '''
+        releaseChunks - Drop a reference to chunks which are no longer referenced by a manifest.
+
+          Chunks that are deduplicated (see #getDedupChunkId) are only removed once no other manifest references them,
+            all other chunks are removed.
+
+        @param conn <redis.Redis> - Connection to redis
+        @param chunkIds list<str> - Chunk ids to release, once per reference
+    '''
+    if not chunkIds:
+        return
+
+    refsKey = getChunkRefsKey()
+    chunkKeyPrefix = getChunkKey('')
+
+    for i in range(0, len(chunkIds), RELEASE_BATCH_SIZE):
+        runScript(conn, RELEASE_CHUNKS_SCRIPT, [refsKey], [chunkKeyPrefix] + list(chunkIds[i : i + RELEASE_BATCH_SIZE]))
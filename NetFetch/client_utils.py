@@ -1,7 +1,13 @@
 # Copyright (c) 2015 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
 
+import atexit
+import json
 import os
 import sys
+import time
+
+from .stats import Stats, addStatsHook
+from .revisions import AGE_UNITS, parseAge
 
 def readPasswordFromFilename(passwordFilename):
     '''
@@ -48,3 +54,114 @@ def findDefaultConfigFilename():
         return '/etc/netfetch.cfg'
 
     return None
+
+
+# STATS_FORMATS - Supported formats of the --stats option
+STATS_FORMATS = ('text', 'json')
+
+def parseStatsArg(arg):
+    '''
+        parseStatsArg - Parse the --stats(=format) argument. Exits on failure.
+
+        @param arg <str> - The argument, "--stats" or "--stats=FORMAT"
+
+        @return <str> - One of STATS_FORMATS
+    '''
+    if arg == '--stats':
+        return 'text'
+
+    statsFormat = arg[len('--stats='):]
+    if statsFormat not in STATS_FORMATS:
+        sys.stderr.write('Unknown --stats format "%s". Supported formats are: %s\n' %(statsFormat, ', '.join(STATS_FORMATS)))
+        sys.exit(1)
+
+    return statsFormat
+
+
+def enableStats(statsFormat):
+    '''
+        enableStats - Collect the time and bytes of each phase of every NetFetch operation from here on,
+          and print them to stderr when the application exits.
+
+        @param statsFormat <str> - One of STATS_FORMATS
+
+        @return <stats.Stats> - The stats being collected
+    '''
+    stats = Stats()
+    startTime = time.time()
+
+    def _printStats():
+        elapsed = time.time() - startTime
+        if statsFormat == 'json':
+            sys.stderr.write(json.dumps({'elapsed' : elapsed, 'phases' : stats.asDict()}, sort_keys=True) + '\n')
+        else:
+            sys.stderr.write('\nNetFetch stats (%.6f seconds elapsed):\n%s\n' %(elapsed, str(stats)))
+
+    addStatsHook(stats.record)
+    atexit.register(_printStats)
+
+    return stats
+
+
+# TIME_FORMATS - Formats of a (local) date and time accepted by parseTimeArg
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+def parseTimeArg(argName, value):
+    '''
+        parseTimeArg - Parse a time argument (like --at=). Exits on failure.
+
+        @param argName <str> - Name of the argument, for the error message
+        @param value <str> - Seconds since epoch, a local date and time (like "2017-06-01 13:30"),
+            or an age with a unit suffix (like "90m", "12h", "3d"), meaning that long ago
+
+        @return <float> - Seconds since epoch
+    '''
+    value = value.strip()
+    try:
+        if value and value[-1].lower() in AGE_UNITS:
+            return time.time() - parseAge(value)
+        return float(value)
+    except ValueError:
+        pass
+
+    for timeFormat in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, timeFormat))
+        except ValueError:
+            pass
+
+    sys.stderr.write('Invalid %s "%s". Use seconds since epoch, a date and time like "2017-06-01 13:30", or an age like 12h or 3d.\n' %(argName, value))
+    sys.exit(1)
+
+
+def parseRangeArg(argName, value):
+    '''
+        parseRangeArg - Parse a byte range argument (like --range=). Exits on failure.
+
+        @param argName <str> - Name of the argument, for the error message
+        @param value <str> - "START-END" (both offsets included, like an HTTP Range), "START-" (to the end of the file),
+            or "-N" (the last N bytes)
+
+        @return tuple( start<int>, end<int/None> ) - Range as given to NetFetchFile.downloadRange (end is excluded, None for the end of the file)
+    '''
+    (startStr, sep, endStr) = value.strip().partition('-')
+    try:
+        if not sep or (not startStr and not endStr):
+            raise ValueError()
+
+        if not startStr:
+            numBytes = int(endStr)
+            if numBytes <= 0:
+                raise ValueError()
+            return (-numBytes, None)
+
+        start = int(startStr)
+        end = endStr and int(endStr) + 1 or None
+        if start < 0 or (end is not None and end <= start):
+            raise ValueError()
+        return (start, end)
+    except ValueError:
+        pass
+
+    sys.stderr.write('Invalid %s "%s". Use START-END (like 0-1023), START- (to the end of the file), or -N (the last N bytes).\n' %(argName, value))
+    sys.exit(1)
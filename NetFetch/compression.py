@@ -0,0 +1,527 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the compression codecs used on stored data (like chunks, and the zstd / lz4 models)
+
+# vim: ts=4 sw=4 expandtab
+
+import bz2
+import os
+import zlib
+
+__all__ = ('COMPRESS_MODE_NONE', 'COMPRESS_MODE_LZMA', 'COMPRESS_MODE_GZIP', 'COMPRESS_MODE_BZIP2',
+            'COMPRESS_MODE_ZSTD', 'COMPRESS_MODE_LZ4', 'COMPRESS_MODE_ZSTD_DICT', 'COMPRESS_MODE_AUTO',
+            'normalizeCompressMode', 'compressData', 'decompressData', 'isCompressModeAvailable',
+            'getDefaultCompressLevel', 'setDefaultCompressLevel', 'chooseCompressMode', 'readSample',
+            'addCompressDictionary', 'hasCompressDictionary', 'setCurrentCompressDictionary', 'getCurrentCompressDictionary',
+            'getCompressDictionaryId', 'getFrameDictionaryId', 'trainDictionary',
+)
+
+# COMPRESS_MODE_* - Names of compression modes, as stored in the metadata of a file
+COMPRESS_MODE_NONE  = ''
+COMPRESS_MODE_LZMA  = 'lzma'
+COMPRESS_MODE_GZIP  = 'gzip'
+COMPRESS_MODE_BZIP2 = 'bzip2'
+COMPRESS_MODE_ZSTD  = 'zstd'
+COMPRESS_MODE_LZ4   = 'lz4'
+# COMPRESS_MODE_ZSTD_DICT - zstd with a dictionary trained on stored files (see dictionaries.py), for small similar files.
+#   Each frame records the id of the dictionary it was compressed with (0 if none was current, which is plain zstd)
+COMPRESS_MODE_ZSTD_DICT = 'zstd-dict'
+
+# COMPRESS_MODE_AUTO - Not a stored mode. Pick a mode by sampling the data, see #chooseCompressMode
+COMPRESS_MODE_AUTO  = 'auto'
+
+# _COMPRESS_MODE_ALIASES - Map of every accepted name to the canonical COMPRESS_MODE_*
+_COMPRESS_MODE_ALIASES = {
+    ''      : COMPRESS_MODE_NONE,
+    'none'  : COMPRESS_MODE_NONE,
+    'lzma'  : COMPRESS_MODE_LZMA,
+    'xz'    : COMPRESS_MODE_LZMA,
+    'gzip'  : COMPRESS_MODE_GZIP,
+    'gz'    : COMPRESS_MODE_GZIP,
+    'zlib'  : COMPRESS_MODE_GZIP,
+    'bzip2' : COMPRESS_MODE_BZIP2,
+    'bz2'   : COMPRESS_MODE_BZIP2,
+    'zstd'  : COMPRESS_MODE_ZSTD,
+    'zst'   : COMPRESS_MODE_ZSTD,
+    'zstandard' : COMPRESS_MODE_ZSTD,
+    'lz4'   : COMPRESS_MODE_LZ4,
+    'zstd-dict' : COMPRESS_MODE_ZSTD_DICT,
+    'zstddict'  : COMPRESS_MODE_ZSTD_DICT,
+    'dict'  : COMPRESS_MODE_ZSTD_DICT,
+}
+
+# COMPRESS_LEVEL_RANGES - Map of COMPRESS_MODE_* -> tuple( minimum level, maximum level )
+COMPRESS_LEVEL_RANGES = {
+    COMPRESS_MODE_LZMA  : (0, 9),
+    COMPRESS_MODE_GZIP  : (1, 9),
+    COMPRESS_MODE_BZIP2 : (1, 9),
+    COMPRESS_MODE_ZSTD  : (1, 22),
+    COMPRESS_MODE_LZ4   : (0, 16),
+    COMPRESS_MODE_ZSTD_DICT : (1, 22),
+}
+
+# _compressLevels - Map of COMPRESS_MODE_* -> level used by #compressData when none is given. See #setDefaultCompressLevel
+_compressLevels = {
+    COMPRESS_MODE_LZMA  : 6,
+    COMPRESS_MODE_GZIP  : 9,
+    COMPRESS_MODE_BZIP2 : 9,
+    COMPRESS_MODE_ZSTD  : 3,
+    COMPRESS_MODE_LZ4   : 0,
+    COMPRESS_MODE_ZSTD_DICT : 3,
+}
+
+# AUTO_* - Parameters of #chooseCompressMode
+#
+#   AUTO_SAMPLE_SIZE - Number of bytes in each sample of the data
+#   AUTO_NUM_SAMPLES - Number of samples, spread evenly across the data
+#   AUTO_MAX_RATIO   - If the samples do not compress below this ratio (compressed size / size), the data is stored uncompressed
+AUTO_SAMPLE_SIZE = 64 * 1024
+AUTO_NUM_SAMPLES = 4
+AUTO_MAX_RATIO = 0.9
+
+# AUTO_PREFERENCE - Modes which #chooseCompressMode may pick, most preferred first (the first which is available is used)
+AUTO_PREFERENCE = (COMPRESS_MODE_ZSTD, COMPRESS_MODE_LZ4, COMPRESS_MODE_GZIP)
+
+# _AUTO_SAMPLE_LEVELS - The (fastest) level used to test-compress the samples, per mode
+_AUTO_SAMPLE_LEVELS = {
+    COMPRESS_MODE_ZSTD : 1,
+    COMPRESS_MODE_LZ4  : 0,
+    COMPRESS_MODE_GZIP : 1,
+}
+
+# _compressDicts - Map of dictionary id <int> -> zstd dictionary, of every dictionary added to this process (see #addCompressDictionary)
+_compressDicts = {}
+
+# _currentCompressDictId - Id of the dictionary which COMPRESS_MODE_ZSTD_DICT compresses with, or None for no dictionary
+_currentCompressDictId = None
+
+global _lzmaMod
+_lzmaMod = None
+
+def _getLzmaMod():
+    '''
+        _getLzmaMod - Internal. Get the module providing lzma (core module on python3, backports.lzma on python2)
+    '''
+    global _lzmaMod
+    if _lzmaMod is None:
+        try:
+            import lzma
+        except ImportError:
+            from backports import lzma
+        _lzmaMod = lzma
+    return _lzmaMod
+
+
+global _zstdMod
+_zstdMod = None
+
+def _getZstdMod():
+    '''
+        _getZstdMod - Internal. Get the module providing zstd ("zstandard", or "compression.zstd" on python 3.14+)
+
+        @raises ImportError - If neither is available
+    '''
+    global _zstdMod
+    if _zstdMod is None:
+        try:
+            import zstandard
+            _zstdMod = zstandard
+        except ImportError:
+            try:
+                from compression import zstd
+                _zstdMod = zstd
+            except ImportError:
+                raise ImportError('Compression mode "zstd" requires the "zstandard" module. Try: pip install zstandard')
+    return _zstdMod
+
+
+global _lz4FrameMod
+_lz4FrameMod = None
+
+def _getLz4FrameMod():
+    '''
+        _getLz4FrameMod - Internal. Get the lz4.frame module
+
+        @raises ImportError - If lz4 is not installed
+    '''
+    global _lz4FrameMod
+    if _lz4FrameMod is None:
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError('Compression mode "lz4" requires the "lz4" module. Try: pip install lz4')
+        _lz4FrameMod = lz4.frame
+    return _lz4FrameMod
+
+
+def _zstdCompress(data, level):
+    '''
+        _zstdCompress - Internal. Compress data with zstd, with the content size recorded in the frame
+    '''
+    zstdMod = _getZstdMod()
+    if hasattr(zstdMod, 'ZstdCompressor'):
+        return zstdMod.ZstdCompressor(level=level).compress(data)
+    return zstdMod.compress(data, level=level)
+
+
+def _zstdDecompress(data):
+    '''
+        _zstdDecompress - Internal. Decompress data compressed by #_zstdCompress
+    '''
+    zstdMod = _getZstdMod()
+    if hasattr(zstdMod, 'ZstdDecompressor'):
+        return zstdMod.ZstdDecompressor().decompress(data)
+    return zstdMod.decompress(data)
+
+
+def _zstdDictCompress(data, level):
+    '''
+        _zstdDictCompress - Internal. Compress data with zstd and the current dictionary (see #setCurrentCompressDictionary), if any.
+          The id of the dictionary is recorded in the frame.
+    '''
+    zstdDict = _compressDicts.get(_currentCompressDictId, None)
+    if zstdDict is None:
+        return _zstdCompress(data, level)
+
+    zstdMod = _getZstdMod()
+    if hasattr(zstdMod, 'ZstdCompressor'):
+        return zstdMod.ZstdCompressor(level=level, dict_data=zstdDict).compress(data)
+    return zstdMod.compress(data, level=level, zstd_dict=zstdDict)
+
+
+def _zstdDictDecompress(data):
+    '''
+        _zstdDictDecompress - Internal. Decompress data compressed by #_zstdDictCompress, with the dictionary recorded in the frame
+
+        @raises ValueError - If the dictionary has not been added to this process (see dictionaries.loadDictionary)
+    '''
+    dictId = getFrameDictionaryId(data)
+    if not dictId:
+        return _zstdDecompress(data)
+
+    zstdDict = _compressDicts.get(dictId, None)
+    if zstdDict is None:
+        raise ValueError('Compression dictionary %d is not loaded.' %(dictId,))
+
+    zstdMod = _getZstdMod()
+    if hasattr(zstdMod, 'ZstdDecompressor'):
+        return zstdMod.ZstdDecompressor(dict_data=zstdDict).decompress(data)
+    return zstdMod.decompress(data, zstd_dict=zstdDict)
+
+
+def _newZstdDict(dictData):
+    '''
+        _newZstdDict - Internal. Get the zstd dictionary object for the data of a dictionary
+    '''
+    zstdMod = _getZstdMod()
+    if hasattr(zstdMod, 'ZstdCompressionDict'):
+        return zstdMod.ZstdCompressionDict(dictData)
+    return zstdMod.ZstdDict(dictData)
+
+
+def _getZstdDictId(zstdDict):
+    '''
+        _getZstdDictId - Internal. Get the id of a zstd dictionary object
+    '''
+    if hasattr(zstdDict, 'dict_id') and callable(zstdDict.dict_id):
+        return zstdDict.dict_id()
+    return zstdDict.dict_id
+
+
+def getCompressDictionaryId(dictData):
+    '''
+        getCompressDictionaryId - Get the id of a zstd dictionary, as recorded in the frames compressed with it
+
+        @param dictData <bytes> - Data of dictionary (see #trainDictionary)
+
+        @return <int> - Dictionary id. 0 if the data is not a trained dictionary.
+    '''
+    return _getZstdDictId(_newZstdDict(dictData))
+
+
+def getFrameDictionaryId(data):
+    '''
+        getFrameDictionaryId - Get the id of the dictionary a zstd frame was compressed with
+
+        @param data <bytes> - Compressed data
+
+        @return <int> - Dictionary id, or 0 if compressed without a dictionary
+    '''
+    zstdMod = _getZstdMod()
+    if hasattr(zstdMod, 'get_frame_parameters'):
+        return zstdMod.get_frame_parameters(data).dict_id
+    return zstdMod.get_frame_info(data).dictionary_id
+
+
+def addCompressDictionary(dictData):
+    '''
+        addCompressDictionary - Add a zstd dictionary to this process, so data compressed with it can be decompressed.
+          Dictionaries are never changed once trained (a new one gets a new id), so they are kept for the life of the process.
+
+        @param dictData <bytes> - Data of dictionary (see #trainDictionary)
+
+        @return <int> - Dictionary id
+
+        @raises ValueError - If the data is not a trained dictionary
+    '''
+    zstdDict = _newZstdDict(dictData)
+    dictId = _getZstdDictId(zstdDict)
+    if not dictId:
+        raise ValueError('Data is not a trained compression dictionary.')
+
+    _compressDicts[dictId] = zstdDict
+    return dictId
+
+
+def hasCompressDictionary(dictId):
+    '''
+        hasCompressDictionary - Check if a dictionary has been added to this process (see #addCompressDictionary)
+
+        @param dictId <int> - Dictionary id
+
+        @return <bool>
+    '''
+    return bool(int(dictId) in _compressDicts)
+
+
+def setCurrentCompressDictionary(dictId):
+    '''
+        setCurrentCompressDictionary - Set the dictionary which COMPRESS_MODE_ZSTD_DICT compresses with, in this process
+
+        @param dictId <int/None> - Dictionary id (which must have been added, see #addCompressDictionary), or None for no dictionary
+
+        @raises ValueError - If the dictionary has not been added
+    '''
+    global _currentCompressDictId
+
+    if dictId is not None:
+        dictId = int(dictId)
+        if dictId not in _compressDicts:
+            raise ValueError('Compression dictionary %d is not loaded.' %(dictId,))
+
+    _currentCompressDictId = dictId
+
+
+def getCurrentCompressDictionary():
+    '''
+        getCurrentCompressDictionary - Get the id of the dictionary which COMPRESS_MODE_ZSTD_DICT compresses with, in this process
+
+        @return <int/None> - Dictionary id, or None for no dictionary
+    '''
+    return _currentCompressDictId
+
+
+def trainDictionary(samples, dictSize):
+    '''
+        trainDictionary - Train a zstd dictionary on samples of data (like the contents of many small files)
+
+        @param samples list<bytes> - Samples. A few hundred or more, totalling about 100 times #dictSize, gives the best dictionary.
+        @param dictSize <int> - Maximum size of the dictionary, in bytes
+
+        @return <bytes> - Data of dictionary
+
+        @raises ValueError - If there are too few samples to train on
+        @raises ImportError - If zstd is not available
+    '''
+    zstdMod = _getZstdMod()
+    try:
+        if hasattr(zstdMod, 'train_dictionary'):
+            return zstdMod.train_dictionary(dictSize, samples).as_bytes()
+        return zstdMod.train_dict(samples, dictSize).dict_content
+    except ImportError:
+        raise
+    except Exception as e:
+        raise ValueError('Cannot train a dictionary on %d samples: %s' %(len(samples), str(e)))
+
+
+def normalizeCompressMode(compressMode):
+    '''
+        normalizeCompressMode - Convert a compression mode or alias (like "xz" or "bz2") into a COMPRESS_MODE_* value
+
+        @param compressMode <str/None> - Compression mode name. None or empty string means no compression.
+
+        @return <str> - One of the COMPRESS_MODE_* values
+
+        @raises ValueError - If compressMode is not a known mode
+    '''
+    if not compressMode:
+        return COMPRESS_MODE_NONE
+    try:
+        return _COMPRESS_MODE_ALIASES[compressMode.lower()]
+    except KeyError:
+        raise ValueError('Unknown compression mode: "%s"' %(compressMode,))
+
+
+def isCompressModeAvailable(compressMode):
+    '''
+        isCompressModeAvailable - Check if the module providing a compression mode is installed
+
+        @param compressMode <str> - One of the COMPRESS_MODE_* values
+
+        @return <bool>
+    '''
+    try:
+        if compressMode in (COMPRESS_MODE_ZSTD, COMPRESS_MODE_ZSTD_DICT):
+            _getZstdMod()
+        elif compressMode == COMPRESS_MODE_LZ4:
+            _getLz4FrameMod()
+        elif compressMode == COMPRESS_MODE_LZMA:
+            _getLzmaMod()
+    except ImportError:
+        return False
+
+    return True
+
+
+def getDefaultCompressLevel(compressMode):
+    '''
+        getDefaultCompressLevel - Get the level used by #compressData for a mode, when none is given
+
+        @param compressMode <str> - One of the COMPRESS_MODE_* values
+
+        @return <int/None> - Level, or None if mode has no levels
+    '''
+    return _compressLevels.get(compressMode, None)
+
+
+def setDefaultCompressLevel(compressMode, level):
+    '''
+        setDefaultCompressLevel - Set the level used by #compressData for a mode, when none is given.
+          This applies to all data compressed by this process with the mode, including NetFetchCompressedZstdFile / NetFetchCompressedLz4File
+          and the chunks of NetFetchChunkedFile.
+
+          NOTE: The lzma, gzip, and bzip2 models (like NetFetchCompressedLzmaFile) are compressed by IndexedRedis at a fixed level, so are not affected.
+
+        @param compressMode <str> - Compression mode or alias
+        @param level <int> - Level, see COMPRESS_LEVEL_RANGES
+
+        @raises ValueError - If mode is unknown or has no levels, or level is out of range
+    '''
+    compressMode = normalizeCompressMode(compressMode)
+    if compressMode not in COMPRESS_LEVEL_RANGES:
+        raise ValueError('Compression mode "%s" does not support levels.' %(compressMode or 'none',))
+
+    (minLevel, maxLevel) = COMPRESS_LEVEL_RANGES[compressMode]
+    level = int(level)
+    if level < minLevel or level > maxLevel:
+        raise ValueError('Compression level for "%s" must be between %d and %d.' %(compressMode, minLevel, maxLevel))
+
+    _compressLevels[compressMode] = level
+
+
+def compressData(compressMode, data, level=None):
+    '''
+        compressData - Compress a block of data
+
+        @param compressMode <str> - One of the COMPRESS_MODE_* values
+        @param data <bytes> - Data to compress
+        @param level <int/None> - Compression level. Default (None) is the level set for this mode, see #setDefaultCompressLevel
+
+        @return <bytes> - Compressed data
+    '''
+    if compressMode == COMPRESS_MODE_NONE:
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        return data
+
+    if level is None:
+        level = _compressLevels.get(compressMode, None)
+
+    if compressMode == COMPRESS_MODE_ZSTD:
+        return _zstdCompress(data, level)
+    if compressMode == COMPRESS_MODE_ZSTD_DICT:
+        return _zstdDictCompress(data, level)
+    if compressMode == COMPRESS_MODE_LZ4:
+        return _getLz4FrameMod().compress(data, compression_level=level, store_size=True)
+    if compressMode == COMPRESS_MODE_GZIP:
+        return zlib.compress(data, level)
+    if compressMode == COMPRESS_MODE_BZIP2:
+        return bz2.compress(data, level)
+    if compressMode == COMPRESS_MODE_LZMA:
+        return _getLzmaMod().compress(data, preset=level)
+
+    raise ValueError('Unknown compression mode: "%s"' %(compressMode,))
+
+
+def decompressData(compressMode, data):
+    '''
+        decompressData - Decompress a block of data that was compressed with #compressData
+
+        @param compressMode <str> - One of the COMPRESS_MODE_* values
+        @param data <bytes> - Data to decompress
+
+        @return <bytes> - Decompressed data
+    '''
+    if compressMode == COMPRESS_MODE_NONE:
+        return data
+    if compressMode == COMPRESS_MODE_ZSTD:
+        return _zstdDecompress(data)
+    if compressMode == COMPRESS_MODE_ZSTD_DICT:
+        return _zstdDictDecompress(data)
+    if compressMode == COMPRESS_MODE_LZ4:
+        return _getLz4FrameMod().decompress(data)
+    if compressMode == COMPRESS_MODE_GZIP:
+        return zlib.decompress(data)
+    if compressMode == COMPRESS_MODE_BZIP2:
+        return bz2.decompress(data)
+    if compressMode == COMPRESS_MODE_LZMA:
+        return _getLzmaMod().decompress(data)
+
+    raise ValueError('Unknown compression mode: "%s"' %(compressMode,))
+
+
+def readSample(fileObj, sampleSize=AUTO_SAMPLE_SIZE, numSamples=AUTO_NUM_SAMPLES):
+    '''
+        readSample - Read samples spread evenly across a file (the start, the end, and between), for #chooseCompressMode
+
+        @param fileObj <file> - File opened for binary read, which supports seek. Position is restored after.
+        @param sampleSize <int> - Number of bytes per sample
+        @param numSamples <int> - Number of samples
+
+        @return <bytes> - The samples, joined. The whole file, if it is no larger than all the samples.
+    '''
+    startPos = fileObj.tell()
+    try:
+        fileObj.seek(0, os.SEEK_END)
+        fileSize = fileObj.tell()
+
+        if fileSize <= sampleSize * numSamples or numSamples < 2:
+            fileObj.seek(0)
+            return fileObj.read(sampleSize * numSamples)
+
+        samples = []
+        step = (fileSize - sampleSize) // (numSamples - 1)
+        for i in range(numSamples):
+            fileObj.seek(i * step)
+            samples.append(fileObj.read(sampleSize))
+
+        return b''.join(samples)
+    finally:
+        fileObj.seek(startPos)
+
+
+def chooseCompressMode(sample, maxRatio=AUTO_MAX_RATIO):
+    '''
+        chooseCompressMode - Pick the compression mode for some data, given a sample of it (see #readSample).
+
+          The most preferred mode which is installed (see AUTO_PREFERENCE) is used, unless the sample does not compress
+            below #maxRatio with it (like already-compressed archives, images, or random data), in which case no compression is used.
+
+        @param sample <bytes> - Sample of the data
+        @param maxRatio <float> - Maximum ratio of compressed size / size for the data to be worth compressing
+
+        @return <str> - A COMPRESS_MODE_* value, COMPRESS_MODE_NONE if the data should not be compressed
+    '''
+    if not sample:
+        return COMPRESS_MODE_NONE
+
+    for compressMode in AUTO_PREFERENCE:
+        if not isCompressModeAvailable(compressMode):
+            continue
+
+        compressedSize = len(compressData(compressMode, sample, _AUTO_SAMPLE_LEVELS[compressMode]))
+        if compressedSize > len(sample) * maxRatio:
+            return COMPRESS_MODE_NONE
+        return compressMode
+
+    return COMPRESS_MODE_NONE
@@ -5,6 +5,11 @@ try:
 except ImportError:
     from configparser import ConfigParser, NoSectionError
 
+from .sharding import DEFAULT_NODE_NAME
+from .revisions import parseAge
+from .retention import EVICT_OLDEST, EVICTION_POLICIES
+from .chunks import parseSize
+from .listing import LAYOUT_INDEXED, STORAGE_LAYOUTS
 
 
 def getRedisConnectionParams(configFile):
@@ -30,4 +35,167 @@ def getRedisConnectionParams(configFile):
     for key, value in items:
         theDict[key] = value
 
+    # Only used with multiple nodes, see getRedisNodes
+    theDict.pop('weight', None)
+
     return theDict
+
+
+# NODE_SECTION_PREFIX - Prefix of the config sections which each define an additional redis node
+NODE_SECTION_PREFIX = 'redis:'
+
+
+def getRedisNodes(configFile):
+    '''
+        getRedisNodes - Reads the Redis nodes which files are spread across from a config file (see sharding.setRedisNodes)
+
+        Each additional node is a section named [redis:NAME], with the same params as [redis]. Any param not given
+          is taken from [redis]. If there are any additional nodes, [redis] is also a node, named "default" (sharding.DEFAULT_NODE_NAME).
+
+        Each node may have a "weight" (default 1), its share of files relative to the other nodes. A weight of 0 stores
+          no new files on that node, so it can be drained with netFetchRebalance.
+
+        @param configFile <str>  - Config file  path
+
+        @return list< tuple(name<str>, weight<int>, params<dict>) > - Each node, in config order. Empty list if there are no additional nodes.
+
+        @raises ValueError - If a weight is not a non-negative integer, or every weight is 0
+    '''
+    parser = ConfigParser()
+    with open(configFile, 'r') as f:
+        parser.readfp(f)
+
+    nodeSections = [ section for section in parser.sections() if section.startswith(NODE_SECTION_PREFIX) ]
+    if not nodeSections:
+        return []
+
+    defaultParams = {}
+    if parser.has_section('redis'):
+        defaultParams = dict(parser.items('redis'))
+
+    nodes = [ (DEFAULT_NODE_NAME, defaultParams) ]
+    for section in nodeSections:
+        params = dict(defaultParams)
+        params.update( dict(parser.items(section)) )
+        nodes.append( (section[len(NODE_SECTION_PREFIX):], params) )
+
+    ret = []
+    for (nodeName, params) in nodes:
+        weight = params.pop('weight', '1')
+        try:
+            weight = int(weight)
+            if weight < 0:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('Invalid weight for redis node "%s": %s' %(nodeName, weight))
+
+        ret.append( (nodeName, weight, params) )
+
+    if not [ weight for (nodeName, weight, params) in ret if weight ]:
+        raise ValueError('At least one redis node must have a weight greater than 0.')
+
+    return ret
+
+
+# REVISIONS_SECTION - Name of the config section which sets the revision policy (see revisions.setRevisionPolicy)
+REVISIONS_SECTION = 'revisions'
+
+
+def getRevisionsConfig(configFile):
+    '''
+        getRevisionsConfig - Reads the revision policy from a config file
+
+        Format is one section, [revisions], with "keep" (number of past revisions kept per file) and optionally
+          "max_age" (like 3600, 12h, 30d, or 2w), the age beyond which past revisions are removed.
+
+        @param configFile <str>  - Config file  path
+
+        @return tuple( keep<int>, maxAge<float/None> ) - Params to revisions.setRevisionPolicy. (0, None) if there is no [revisions] section.
+
+        @raises ValueError - If keep is not a non-negative integer, or max_age is not a valid age
+    '''
+    parser = ConfigParser()
+    with open(configFile, 'r') as f:
+        parser.readfp(f)
+
+    if not parser.has_section(REVISIONS_SECTION):
+        return (0, None)
+
+    params = dict(parser.items(REVISIONS_SECTION))
+
+    keep = params.get('keep', '0')
+    try:
+        keep = int(keep)
+        if keep < 0:
+            raise ValueError()
+    except ValueError:
+        raise ValueError('Invalid number of revisions to keep: %s' %(keep,))
+
+    maxAge = None
+    if params.get('max_age', None):
+        maxAge = parseAge(params['max_age'])
+
+    return (keep, maxAge)
+
+
+# STORAGE_SECTION - Name of the config section which sets the storage budget (see retention.setStorageBudget)
+STORAGE_SECTION = 'storage'
+
+
+def getStorageConfig(configFile):
+    '''
+        getStorageConfig - Reads the storage budget from a config file
+
+        Format is one section, [storage], with "max_bytes_per_host" (like 512M or 10G), the most bytes stored from each hostname
+          before files are evicted, and optionally "evict" (oldest or lru), which files are evicted first.
+
+        @param configFile <str>  - Config file  path
+
+        @return tuple( maxBytes<int/None>, policy<str> ) - Params to retention.setStorageBudget. (None, "oldest") if there is no [storage] section.
+
+        @raises ValueError - If max_bytes_per_host is not a valid size, or evict is unknown
+    '''
+    parser = ConfigParser()
+    with open(configFile, 'r') as f:
+        parser.readfp(f)
+
+    if not parser.has_section(STORAGE_SECTION):
+        return (None, EVICT_OLDEST)
+
+    params = dict(parser.items(STORAGE_SECTION))
+
+    maxBytes = None
+    if params.get('max_bytes_per_host', None):
+        maxBytes = parseSize(params['max_bytes_per_host'])
+
+    policy = params.get('evict', None) or EVICT_OLDEST
+    if policy not in EVICTION_POLICIES:
+        raise ValueError('Unknown eviction policy "%s". Supported policies are: %s' %(policy, ', '.join(EVICTION_POLICIES)))
+
+    return (maxBytes, policy)
+
+
+def getLayoutConfig(configFile):
+    '''
+        getLayoutConfig - Reads the storage layout from a config file
+
+        Format is "layout" (indexed or compact) in the [storage] section. @see listing.setStorageLayout
+
+        @param configFile <str>  - Config file  path
+
+        @return <str> - Param to listing.setStorageLayout. "indexed" if not set.
+
+        @raises ValueError - If layout is unknown
+    '''
+    parser = ConfigParser()
+    with open(configFile, 'r') as f:
+        parser.readfp(f)
+
+    if not parser.has_section(STORAGE_SECTION):
+        return LAYOUT_INDEXED
+
+    layout = dict(parser.items(STORAGE_SECTION)).get('layout', None) or LAYOUT_INDEXED
+    if layout not in STORAGE_LAYOUTS:
+        raise ValueError('Unknown storage layout "%s". Supported layouts are: %s' %(layout, ', '.join(STORAGE_LAYOUTS)))
+
+    return layout
@@ -0,0 +1,520 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the NetFetch daemon, a resident process which keeps pooled Redis connections and loaded codecs,
+#    and runs jobs (fetch and store a file, store a file, delete a file) requested by thin clients over a unix socket.
+#    See netFetchDaemon and netFetchClient.
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+from collections import OrderedDict
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import NetFetchFile, NetFetchChunkedFile
+from .chunks import parseSize
+from .compression import ( COMPRESS_MODE_AUTO, COMPRESS_MODE_LZMA, COMPRESS_MODE_GZIP, COMPRESS_MODE_BZIP2, COMPRESS_MODE_ZSTD,
+            COMPRESS_MODE_LZ4, normalizeCompressMode, isCompressModeAvailable, chooseCompressMode, readSample )
+from .encryption import ENCRYPTION_FERNET, ENCRYPTION_AESGCM, getCipher
+from .revisions import parseAge
+
+__all__ = ('DEFAULT_DAEMON_WORKERS', 'MAX_FINISHED_JOBS', 'JOB_STATE_QUEUED', 'JOB_STATE_RUNNING', 'JOB_STATE_DONE', 'JOB_STATE_FAILED',
+            'getDefaultSocketPath', 'sendMessage', 'recvMessage', 'DaemonJob', 'NetFetchDaemon', 'DaemonAlreadyRunning',
+)
+
+# DEFAULT_DAEMON_WORKERS - Default number of jobs run at once
+DEFAULT_DAEMON_WORKERS = 4
+
+# MAX_FINISHED_JOBS - Number of finished jobs whose result is kept (for the "status" request). The oldest are dropped beyond this.
+MAX_FINISHED_JOBS = 1000
+
+# JOB_STATE_* - States of a job
+JOB_STATE_QUEUED = 'queued'
+JOB_STATE_RUNNING = 'running'
+JOB_STATE_DONE = 'done'
+JOB_STATE_FAILED = 'failed'
+
+# JOB_OPS - Requests which are run as jobs, and the params each requires. Others ("ping", "status", "shutdown") are answered immediately.
+JOB_OPS = {
+    'get' : ('hostname', 'filename'),
+    'put' : ('filename', ),
+    'delete' : ('hostname', 'filename'),
+}
+
+
+def getDefaultSocketPath():
+    '''
+        getDefaultSocketPath - Get the default path of the daemon's socket, $HOME/.netfetch.sock
+
+        @return <str>
+    '''
+    return os.path.join(os.path.expanduser('~'), '.netfetch.sock')
+
+
+#  Protocol:
+#
+#   Every request and response is one message: a line of JSON (the header), followed by header['dataLength']
+#     bytes of raw data if the header has a "dataLength". A connection may carry any number of requests,
+#     each answered (in order) before the next is read.
+#
+#   Requests have an "op" and its params. Responses have "ok" (bool), and on failure, "error" (message) and
+#     "errorType" (like "NoSuchNetFetchFile", "InvalidPasswordException", or "ValueError").
+#
+#   NOTE: netFetchClient carries its own copy of sendMessage/recvMessage, so that it does not need to import
+#     NetFetch (and its dependencies). Keep them in sync.
+
+def sendMessage(sock, header, data=None):
+    '''
+        sendMessage - Send a message (see Protocol, above)
+
+        @param sock <socket.socket> - Connected socket
+        @param header <dict> - Header, which must be serializable as JSON
+        @param data <bytes/None> - Raw data to follow the header, if any
+    '''
+    if data is not None:
+        header = dict(header, dataLength=len(data))
+
+    sock.sendall(json.dumps(header).encode('utf-8') + b'\n')
+    if data:
+        sock.sendall(data)
+
+
+def recvMessage(rfile):
+    '''
+        recvMessage - Receive a message (see Protocol, above)
+
+        @param rfile <file> - Binary file of the socket (like from socket.makefile('rb'))
+
+        @return tuple( header<dict/None>, data<bytes/None> ) - (None, None) if the connection was closed
+
+        @raises ValueError - If the message is invalid or truncated
+    '''
+    line = rfile.readline()
+    if not line:
+        return (None, None)
+
+    header = json.loads(line.decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError('Invalid message.')
+
+    data = None
+    dataLength = header.get('dataLength', None)
+    if dataLength is not None:
+        data = rfile.read(dataLength)
+        if len(data) != dataLength:
+            raise ValueError('Connection closed mid-message.')
+
+    return (header, data)
+
+
+class DaemonAlreadyRunning(Exception):
+    '''
+        DaemonAlreadyRunning - Raised when starting a daemon on a socket which another daemon is serving
+    '''
+    pass
+
+
+class DaemonJob(object):
+    '''
+        DaemonJob - A request being run (or queued to run) by the daemon
+    '''
+
+    def __init__(self, jobId, op, params):
+        self.jobId = jobId
+        self.op = op
+        self.params = params
+
+        self.state = JOB_STATE_QUEUED
+        # result - dict of the outcome, once done
+        self.result = None
+        # data - Data returned to the client, if any (i.e. a fetch to stdout)
+        self.data = None
+        self.error = None
+        self.errorType = None
+
+        self.submitTime = time.time()
+        self.finishTime = None
+
+        self._finished = threading.Event()
+
+    def wait(self):
+        '''
+            wait - Block until this job has finished
+        '''
+        # Wait in a loop with a timeout, so a waiting thread is still interruptible on python2
+        while not self._finished.wait(60):
+            pass
+
+    def finish(self, result=None, data=None, exc=None):
+        '''
+            finish - Mark this job as done (or failed, if #exc is provided)
+        '''
+        if exc is not None:
+            self.state = JOB_STATE_FAILED
+            self.error = str(exc)
+            self.errorType = exc.__class__.__name__
+        else:
+            self.state = JOB_STATE_DONE
+            self.result = result or {}
+            self.data = data
+
+        self.finishTime = time.time()
+        self._finished.set()
+
+    def asResponse(self):
+        '''
+            asResponse - Get the header of the response which describes this job
+
+            @return <dict>
+        '''
+        response = { 'ok' : self.state != JOB_STATE_FAILED, 'jobId' : self.jobId, 'op' : self.op, 'state' : self.state }
+        if self.state == JOB_STATE_FAILED:
+            response['error'] = self.error
+            response['errorType'] = self.errorType
+        elif self.state == JOB_STATE_DONE:
+            response['result'] = self.result
+            response['seconds'] = self.finishTime - self.submitTime
+
+        return response
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+        _DaemonServer - Internal. Serves each connection in its own thread
+    '''
+    daemon_threads = True
+
+
+class _DaemonRequestHandler(socketserver.BaseRequestHandler):
+    '''
+        _DaemonRequestHandler - Internal. Reads the requests of a connection, and sends their responses
+    '''
+
+    def handle(self):
+        netFetchDaemon = self.server.netFetchDaemon
+        rfile = self.request.makefile('rb')
+        try:
+            while True:
+                try:
+                    (header, data) = recvMessage(rfile)
+                except ValueError as e:
+                    sendMessage(self.request, { 'ok' : False, 'error' : str(e), 'errorType' : 'ValueError' })
+                    return
+
+                if header is None:
+                    return
+
+                (response, responseData) = netFetchDaemon.handleRequest(header)
+                sendMessage(self.request, response, responseData)
+        except socket.error:
+            # Client went away
+            pass
+        finally:
+            rfile.close()
+
+
+class NetFetchDaemon(object):
+    '''
+        NetFetchDaemon - Serve NetFetch requests from a unix socket.
+
+          Requests are run as jobs by a pool of worker threads. A client may wait for the result of a job,
+            or have it queued and check on it later (see the "status" request).
+
+          Redis connections are pooled (by IndexedRedis) and reused across requests, and the compression and
+            encryption modules are loaded at start, so a request costs only the transfer itself.
+    '''
+
+    def __init__(self, socketPath=None, numWorkers=DEFAULT_DAEMON_WORKERS, cache=None):
+        '''
+            @param socketPath <str/None> - Path of the unix socket. Default is getDefaultSocketPath()
+            @param numWorkers <int> - Number of jobs run at once
+            @param cache <cache.LocalCache/None> - If provided, files are fetched through this local cache. @see NetFetchFile.downloadToLocal
+        '''
+        self.socketPath = socketPath or getDefaultSocketPath()
+        self.numWorkers = numWorkers
+        self.cache = cache
+
+        self._jobQueue = queue.Queue()
+        # _jobs - jobId -> DaemonJob, in order of submission
+        self._jobs = OrderedDict()
+        self._jobsLock = threading.Lock()
+        self._nextJobId = 1
+
+        self._workers = []
+        self._server = None
+
+    ###################################
+    ##        Running                ##
+    ###################################
+
+    def start(self):
+        '''
+            start - Load codecs, connect to Redis, start the workers, and bind the socket (only accessible by this user).
+              Call #serveForever to handle requests.
+
+            @raises DaemonAlreadyRunning - If another daemon is serving this socket
+        '''
+        self._warmUp()
+
+        self._removeStaleSocket()
+
+        oldUmask = os.umask(0o077)
+        try:
+            self._server = _DaemonServer(self.socketPath, _DaemonRequestHandler)
+        finally:
+            os.umask(oldUmask)
+        self._server.netFetchDaemon = self
+
+        for i in range(self.numWorkers):
+            worker = threading.Thread(target=self._runWorker, name='NetFetchDaemon-worker-%d' %(i,))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def serveForever(self):
+        '''
+            serveForever - Handle requests until #shutdown (or a "shutdown" request). Removes the socket when done.
+        '''
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try:
+                os.unlink(self.socketPath)
+            except OSError:
+                pass
+
+            for worker in self._workers:
+                self._jobQueue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+
+    def shutdown(self):
+        '''
+            shutdown - Stop serving requests. Queued jobs are finished first. Must be called from a thread other than #serveForever.
+        '''
+        self._server.shutdown()
+
+    def _warmUp(self):
+        '''
+            _warmUp - Internal. Load the optional compression and encryption modules, and open a Redis connection
+              (to each node, if multiple are configured), so the first request does not pay for them.
+        '''
+        for compressMode in (COMPRESS_MODE_LZMA, COMPRESS_MODE_GZIP, COMPRESS_MODE_BZIP2, COMPRESS_MODE_ZSTD, COMPRESS_MODE_LZ4):
+            isCompressModeAvailable(compressMode)
+
+        fernetKey = NetFetchFile._getFernetKey('warmup')
+        for encryption in (ENCRYPTION_FERNET, ENCRYPTION_AESGCM):
+            try:
+                getCipher(encryption, fernetKey)
+            except ImportError:
+                pass
+
+        for nodeModel in NetFetchFile._getNodeModels():
+            nodeModel._getConnection().ping()
+
+    def _removeStaleSocket(self):
+        '''
+            _removeStaleSocket - Internal. Remove the socket file left by a daemon which is no longer running
+
+            @raises DaemonAlreadyRunning - If a daemon is serving the socket
+        '''
+        if not os.path.exists(self.socketPath):
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socketPath)
+        except socket.error as e:
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                raise
+            os.unlink(self.socketPath)
+            return
+        finally:
+            sock.close()
+
+        raise DaemonAlreadyRunning('A NetFetch daemon is already running on "%s"' %(self.socketPath,))
+
+    ###################################
+    ##        Requests               ##
+    ###################################
+
+    def handleRequest(self, header):
+        '''
+            handleRequest - Handle a request. Job requests are queued, and waited upon unless the request has "wait" false.
+
+            @param header <dict> - The request (see Protocol)
+
+            @return tuple( response<dict>, responseData<bytes/None> )
+        '''
+        op = header.get('op', None)
+
+        if op == 'ping':
+            return ( { 'ok' : True, 'pid' : os.getpid(), 'numQueued' : self._jobQueue.qsize() }, None )
+
+        if op == 'status':
+            with self._jobsLock:
+                job = self._jobs.get(header.get('jobId', None), None)
+            if job is None:
+                return ( { 'ok' : False, 'error' : 'No such job: %s' %(header.get('jobId', None),), 'errorType' : 'KeyError' }, None )
+            return ( job.asResponse(), None )
+
+        if op == 'shutdown':
+            # Cannot shut down from a request thread while it is being waited upon
+            threading.Thread(target=self.shutdown).start()
+            return ( { 'ok' : True }, None )
+
+        if op not in JOB_OPS:
+            return ( { 'ok' : False, 'error' : 'Unknown request: %s' %(op,), 'errorType' : 'ValueError' }, None )
+
+        missingParams = [ paramName for paramName in JOB_OPS[op] if not header.get(paramName, None) ]
+        if missingParams:
+            return ( { 'ok' : False, 'error' : 'Missing params: %s' %(', '.join(missingParams),), 'errorType' : 'ValueError' }, None )
+
+        wait = header.get('wait', True)
+        if not wait and op == 'get' and header.get('localFilename', None) is None:
+            return ( { 'ok' : False, 'error' : 'A fetch to stdout cannot be queued.', 'errorType' : 'ValueError' }, None )
+
+        job = self.submit(op, header)
+        if not wait:
+            return ( job.asResponse(), None )
+
+        job.wait()
+        return ( job.asResponse(), job.data )
+
+    def submit(self, op, params):
+        '''
+            submit - Queue a job
+
+            @param op <str> - A key of JOB_OPS
+            @param params <dict> - Params of the job, @see #_runJob
+
+            @return <DaemonJob>
+        '''
+        with self._jobsLock:
+            jobId = self._nextJobId
+            self._nextJobId += 1
+
+            job = DaemonJob(jobId, op, params)
+            self._jobs[jobId] = job
+
+            # Drop the oldest finished jobs beyond MAX_FINISHED_JOBS
+            numFinished = len( [ True for oldJob in self._jobs.values() if oldJob.finishTime is not None ] )
+            if numFinished > MAX_FINISHED_JOBS:
+                for (oldJobId, oldJob) in list(self._jobs.items()):
+                    if oldJob.finishTime is not None:
+                        del self._jobs[oldJobId]
+                        numFinished -= 1
+                        if numFinished <= MAX_FINISHED_JOBS:
+                            break
+
+        self._jobQueue.put(job)
+        return job
+
+    def _runWorker(self):
+        '''
+            _runWorker - Internal. Run queued jobs, until a None is queued
+        '''
+        while True:
+            job = self._jobQueue.get()
+            if job is None:
+                return
+
+            job.state = JOB_STATE_RUNNING
+            try:
+                (result, data) = self._runJob(job.op, job.params)
+            except Exception as e:
+                job.finish(exc=e)
+            else:
+                job.finish(result, data)
+
+    def _runJob(self, op, params):
+        '''
+            _runJob - Internal. Run a job
+
+              get    - hostname, filename, localFilename (None to return the data), password, retainPermissions,
+                         deleteAfter (delete the stored file once it has been fetched)
+              put    - filename, password, savePermissions, hostnameOverride, compressMode (or "auto"), chunked, chunkSize (like "4M"),
+                         dedup, encryption, checksumType, ttl (like "12h")
+              delete - hostname, filename
+
+            @return tuple( result<dict>, data<bytes/None> )
+        '''
+        if op == 'get':
+            return self._runGet(params)
+        if op == 'put':
+            return self._runPut(params)
+
+        return ( { 'deleted' : NetFetchFile.deleteFile(params['hostname'], params['filename']) }, None )
+
+    def _runGet(self, params):
+        '''
+            _runGet - Internal. Fetch a file, to a local file or to the returned data. @see #_runJob
+        '''
+        (hostname, filename) = (params['hostname'], params['filename'])
+        password = params.get('password', None) or None
+        localFilename = params.get('localFilename', None)
+
+        data = None
+        if localFilename is None:
+            data = NetFetchFile.downloadToStr(hostname, filename, password, cache=self.cache)
+            numBytes = len(data)
+        else:
+            NetFetchFile.downloadToLocal(hostname, filename, password, localFilename, params.get('retainPermissions', True), cache=self.cache)
+            numBytes = os.path.getsize(localFilename)
+
+        deleted = False
+        if params.get('deleteAfter', False):
+            deleted = NetFetchFile.deleteFile(hostname, filename)
+
+        return ( { 'numBytes' : numBytes, 'deleted' : deleted }, data )
+
+    def _runPut(self, params):
+        '''
+            _runPut - Internal. Store a local file. @see #_runJob
+        '''
+        filename = params['filename']
+        password = params.get('password', None) or None
+
+        compressMode = params.get('compressMode', None) or None
+        if compressMode == COMPRESS_MODE_AUTO:
+            with open(filename, 'rb') as f:
+                compressMode = chooseCompressMode(readSample(f))
+        elif compressMode:
+            compressMode = normalizeCompressMode(compressMode)
+            if not isCompressModeAvailable(compressMode):
+                raise ValueError('Compression mode "%s" is not available on the daemon.' %(compressMode,))
+
+        modelKwargs = {}
+        for paramName in ('encryption', 'checksumType'):
+            if params.get(paramName, None):
+                modelKwargs[paramName] = params[paramName]
+        if params.get('ttl', None):
+            modelKwargs['ttl'] = parseAge(str(params['ttl']))
+
+        if params.get('chunked', False) or params.get('dedup', False):
+            model = NetFetchChunkedFile
+            chunkSize = params.get('chunkSize', None)
+            modelKwargs.update( { 'chunkSize' : chunkSize and parseSize(chunkSize) or None, 'compressMode' : compressMode, 'dedup' : bool(params.get('dedup', False)) } )
+        else:
+            model = NetFetchFile.getNetFetchClassForCompressMode(compressMode)
+
+        obj = model.createOrUpdateFromFile(filename, password=password, hostnameOverride=params.get('hostnameOverride', None),
+                savePermissions=params.get('savePermissions', True), **modelKwargs)
+
+        return ( { 'hostname' : obj.hostname, 'numBytes' : obj.size }, None )
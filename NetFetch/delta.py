@@ -0,0 +1,208 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the binary delta encoding, which stores one version of some data as the differences from
+#    another (see revisions.py, where older revisions of a file are stored as deltas against the newer one).
+
+# vim: ts=4 sw=4 expandtab
+
+import struct
+import zlib
+
+__all__ = ('DEFAULT_DELTA_BLOCK_SIZE', 'MAX_DELTA_INDEX_BLOCKS', 'makeDelta', 'applyDelta')
+
+# DEFAULT_DELTA_BLOCK_SIZE - Size of the blocks of the base which are matched. Smaller finds more (shorter) matches, but is slower.
+DEFAULT_DELTA_BLOCK_SIZE = 32
+
+# MAX_DELTA_INDEX_BLOCKS - Most blocks of the base which are indexed. Larger bases use larger blocks.
+MAX_DELTA_INDEX_BLOCKS = 1024 * 1024
+
+# DELTA_MAGIC - Start of an (uncompressed) delta, followed by the size of the base and of the result
+DELTA_MAGIC = b'NFD1'
+
+# OP_* - Delta instructions
+#
+#   OP_COPY   - Followed by offset and length (unsigned 64-bit and 32-bit), copies that range of the base
+#   OP_INSERT - Followed by length (unsigned 32-bit) and that many bytes, which are inserted as-is
+OP_COPY = b'C'
+OP_INSERT = b'I'
+
+# MAX_OP_LENGTH - Longest range of a single instruction
+MAX_OP_LENGTH = 0xffffffff
+
+_HEADER_STRUCT = struct.Struct('>QQ')
+_COPY_STRUCT = struct.Struct('>QI')
+_INSERT_STRUCT = struct.Struct('>I')
+
+
+#  A delta is a list of instructions which build the result from ranges of the base (OP_COPY) and new bytes (OP_INSERT),
+#    compressed with zlib (so inserted bytes are compressed).
+#
+#   It is built by first matching the common prefix and suffix (where most edits of a file leave most of it), then
+#     indexing the base in fixed blocks, and looking up each position of the rest of the result in that index.
+#     A match is extended as far as it goes, then the search continues after it. Comparisons are made on whole ranges
+#     (in C), so the cost is per byte only where nothing matches.
+
+
+def _getMatchLength(data1, start1, data2, start2, maxLength):
+    '''
+        _getMatchLength - Internal. Get how many bytes match between two positions, comparing ranges which double
+          in size while they match, and halve when they do not.
+
+        @return <int> - Number of matching bytes, up to #maxLength
+    '''
+    matched = 0
+    step = 64
+    while matched < maxLength:
+        step = min(step, maxLength - matched)
+        if data1[start1 + matched : start1 + matched + step] == data2[start2 + matched : start2 + matched + step]:
+            matched += step
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step //= 2
+
+    return matched
+
+
+def _getSuffixLength(data1, data2, maxLength):
+    '''
+        _getSuffixLength - Internal. Get how many bytes match at the end of two strings. @see _getMatchLength
+
+        @return <int> - Number of matching bytes, up to #maxLength
+    '''
+    (len1, len2) = (len(data1), len(data2))
+    matched = 0
+    step = 64
+    while matched < maxLength:
+        step = min(step, maxLength - matched)
+        if data1[len1 - matched - step : len1 - matched] == data2[len2 - matched - step : len2 - matched]:
+            matched += step
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step //= 2
+
+    return matched
+
+
+def makeDelta(base, data, blockSize=DEFAULT_DELTA_BLOCK_SIZE, compressLevel=6):
+    '''
+        makeDelta - Encode some data as the differences from a base
+
+        @param base <bytes> - Base, which will be required to apply the delta
+        @param data <bytes> - Data to encode
+        @param blockSize <int> - Size of the blocks of the base which are matched (made larger for large bases, see MAX_DELTA_INDEX_BLOCKS)
+        @param compressLevel <int> - zlib level of the delta
+
+        @return <bytes> - Delta. @see applyDelta
+    '''
+    if not isinstance(base, bytes):
+        base = memoryview(base).tobytes()
+    if not isinstance(data, bytes):
+        data = memoryview(data).tobytes()
+
+    (baseLen, dataLen) = (len(base), len(data))
+    blockSize = max(blockSize, baseLen // MAX_DELTA_INDEX_BLOCKS + 1)
+
+    ops = [ DELTA_MAGIC, _HEADER_STRUCT.pack(baseLen, dataLen) ]
+
+    def _addCopy(offset, length):
+        while length > 0:
+            opLength = min(length, MAX_OP_LENGTH)
+            ops.append(OP_COPY + _COPY_STRUCT.pack(offset, opLength))
+            (offset, length) = (offset + opLength, length - opLength)
+
+    def _addInsert(start, end):
+        while start < end:
+            opEnd = min(end, start + MAX_OP_LENGTH)
+            ops.append(OP_INSERT + _INSERT_STRUCT.pack(opEnd - start))
+            ops.append(data[start : opEnd])
+            start = opEnd
+
+    prefixLength = _getMatchLength(base, 0, data, 0, min(baseLen, dataLen))
+    suffixLength = _getSuffixLength(base, data, min(baseLen, dataLen) - prefixLength)
+
+    _addCopy(0, prefixLength)
+
+    (pos, end) = (prefixLength, dataLen - suffixLength)
+    if end - pos >= blockSize and baseLen >= blockSize:
+        # Earliest offset of each distinct block
+        index = {}
+        for offset in range( (baseLen // blockSize - 1) * blockSize, -1, -blockSize ):
+            index[base[offset : offset + blockSize]] = offset
+
+        insertStart = pos
+        lastPos = end - blockSize
+        while pos <= lastPos:
+            offset = index.get(data[pos : pos + blockSize], None)
+            if offset is None:
+                pos += 1
+                continue
+
+            length = blockSize + _getMatchLength(base, offset + blockSize, data, pos + blockSize, min(baseLen - offset, end - pos) - blockSize)
+            _addInsert(insertStart, pos)
+            _addCopy(offset, length)
+            pos += length
+            insertStart = pos
+        pos = insertStart
+
+    _addInsert(pos, end)
+    _addCopy(baseLen - suffixLength, suffixLength)
+
+    return zlib.compress(b''.join(ops), compressLevel)
+
+
+def applyDelta(base, delta):
+    '''
+        applyDelta - Decode data which was encoded as a delta from a base
+
+        @param base <bytes> - The base given to #makeDelta
+        @param delta <bytes> - Delta, from #makeDelta
+
+        @return <bytes> - The data
+
+        @raises ValueError - If the delta is invalid, or is not from this base
+    '''
+    try:
+        delta = zlib.decompress(delta)
+    except zlib.error as e:
+        raise ValueError('Invalid delta: %s' %(str(e),))
+
+    if delta[ : len(DELTA_MAGIC)] != DELTA_MAGIC:
+        raise ValueError('Invalid delta: bad header')
+
+    pos = len(DELTA_MAGIC)
+    (baseLen, dataLen) = _HEADER_STRUCT.unpack_from(delta, pos)
+    pos += _HEADER_STRUCT.size
+    if baseLen != len(base):
+        raise ValueError('Delta is from a base of %d bytes, not %d' %(baseLen, len(base)))
+
+    parts = []
+    deltaLen = len(delta)
+    try:
+        while pos < deltaLen:
+            op = delta[pos : pos + 1]
+            pos += 1
+            if op == OP_COPY:
+                (offset, length) = _COPY_STRUCT.unpack_from(delta, pos)
+                pos += _COPY_STRUCT.size
+                if offset + length > baseLen:
+                    raise ValueError('Invalid delta: copy past end of base')
+                parts.append(base[offset : offset + length])
+            elif op == OP_INSERT:
+                (length, ) = _INSERT_STRUCT.unpack_from(delta, pos)
+                pos += _INSERT_STRUCT.size
+                parts.append(delta[pos : pos + length])
+                pos += length
+            else:
+                raise ValueError('Invalid delta: unknown instruction')
+    except struct.error:
+        raise ValueError('Invalid delta: truncated')
+
+    data = b''.join(parts)
+    if len(data) != dataLen:
+        raise ValueError('Invalid delta: expected %d bytes, got %d' %(dataLen, len(data)))
+
+    return data
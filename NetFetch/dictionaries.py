@@ -0,0 +1,218 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the storage of the zstd dictionaries used by the "zstd-dict" compression mode (see NetFetchCompressedZstdDictFile)
+
+# vim: ts=4 sw=4 expandtab
+
+import threading
+
+from IndexedRedis import INDEXED_REDIS_PREFIX
+
+from IndexedRedis.compat_str import tobytes, to_unicode
+
+from .compression import addCompressDictionary, hasCompressDictionary, setCurrentCompressDictionary, getCurrentCompressDictionary
+
+__all__ = ('DEFAULT_DICTIONARY_SIZE', 'DEFAULT_MAX_SAMPLES', 'DEFAULT_MAX_SAMPLE_SIZE',
+            'getDictionariesKey', 'getCurrentDictionaryKey', 'storeDictionary', 'setCurrentDictionary', 'listDictionaries',
+            'loadDictionary', 'loadCurrentDictionary', 'copyDictionaries',
+)
+
+# DEFAULT_DICTIONARY_SIZE - Default maximum size of a trained dictionary, in bytes
+DEFAULT_DICTIONARY_SIZE = 112 * 1024
+
+# DEFAULT_MAX_SAMPLES - Default maximum number of stored files a dictionary is trained on
+DEFAULT_MAX_SAMPLES = 2000
+
+# DEFAULT_MAX_SAMPLE_SIZE - Default size of the largest stored file a dictionary is trained on. Dictionaries help small files,
+#   larger files compress well on their own.
+DEFAULT_MAX_SAMPLE_SIZE = 128 * 1024
+
+# DICTIONARIES_KEY_NAME - Name of the hash of dictionary id -> data of dictionary
+DICTIONARIES_KEY_NAME = 'NetFetchFile:dictionaries'
+
+# CURRENT_DICTIONARY_KEY_NAME - Name of the key holding the id of the dictionary new files are compressed with
+CURRENT_DICTIONARY_KEY_NAME = 'NetFetchFile:dictionaries:current'
+
+
+#  Every node holds every dictionary (a copy is stored on each when trained, and netFetchRebalance copies them to any node added since),
+#    so a file can be decompressed on whichever node it is stored.
+#
+#   A dictionary is never changed once stored: training again stores a new dictionary (with a new id), and makes it current.
+#     Files keep the id of the dictionary they were compressed with (in the zstd frame, and the "compressDict" field),
+#     so dictionaries are never removed.
+#
+#   Each process loads a dictionary from redis once, the first time it is needed (see compression.addCompressDictionary),
+#     and the current dictionary the first time it stores a file, so a long-running process (like netFetchDaemon)
+#     keeps compressing with the dictionary which was current when it started.
+
+
+global _currentLoaded
+_currentLoaded = False
+
+_currentLock = threading.Lock()
+
+
+def getDictionariesKey():
+    '''
+        getDictionariesKey - Get the redis key of the hash of dictionary id -> data of dictionary
+
+        @return <str> - Redis key
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, DICTIONARIES_KEY_NAME])
+
+
+def getCurrentDictionaryKey():
+    '''
+        getCurrentDictionaryKey - Get the redis key holding the id of the current dictionary
+
+        @return <str> - Redis key
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, CURRENT_DICTIONARY_KEY_NAME])
+
+
+def storeDictionary(conns, dictData, makeCurrent=True):
+    '''
+        storeDictionary - Store a dictionary on every node, and add it to this process
+
+        @param conns list<redis.Redis> - Connection to each node
+        @param dictData <bytes> - Data of dictionary (see compression.trainDictionary)
+        @param makeCurrent <bool> - If True, new files are compressed with this dictionary (by this process too)
+
+        @return <int> - Dictionary id
+
+        @raises ValueError - If the data is not a trained dictionary
+    '''
+    dictId = addCompressDictionary(dictData)
+
+    for conn in conns:
+        pipeline = conn.pipeline(transaction=False)
+        pipeline.hset(getDictionariesKey(), str(dictId), dictData)
+        if makeCurrent:
+            pipeline.set(getCurrentDictionaryKey(), str(dictId))
+        pipeline.execute()
+
+    if makeCurrent:
+        _setCurrentLoaded(dictId)
+
+    return dictId
+
+
+def setCurrentDictionary(conns, dictId):
+    '''
+        setCurrentDictionary - Make a stored dictionary the one new files are compressed with (by this process too)
+
+        @param conns list<redis.Redis> - Connection to each node
+        @param dictId <int> - Dictionary id
+
+        @raises ValueError - If the dictionary is not stored on every node
+    '''
+    for conn in conns:
+        if not conn.hexists(getDictionariesKey(), str(dictId)):
+            raise ValueError('Compression dictionary %d is not stored.' %(dictId,))
+
+    loadDictionary(conns[0], dictId)
+
+    for conn in conns:
+        conn.set(getCurrentDictionaryKey(), str(dictId))
+
+    _setCurrentLoaded(dictId)
+
+
+def _setCurrentLoaded(dictId):
+    '''
+        _setCurrentLoaded - Internal. Make a dictionary (already added to this process) the one this process compresses with,
+          in place of any loaded by #loadCurrentDictionary
+
+        @param dictId <int> - Dictionary id
+    '''
+    global _currentLoaded
+
+    with _currentLock:
+        setCurrentCompressDictionary(dictId)
+        _currentLoaded = True
+
+
+def listDictionaries(conn):
+    '''
+        listDictionaries - List the dictionaries stored on a node
+
+        @param conn <redis.Redis> - Connection to redis
+
+        @return tuple( dictionaries<list< tuple(dictId<int>, size<int>) >>, currentId<int/None> ) - Dictionaries sorted by id,
+            and the id of the current dictionary (None if there is none)
+    '''
+    dictIds = sorted( [ int(to_unicode(dictId)) for dictId in conn.hkeys(getDictionariesKey()) ] )
+
+    pipeline = conn.pipeline(transaction=False)
+    for dictId in dictIds:
+        pipeline.execute_command('HSTRLEN', getDictionariesKey(), str(dictId))
+    pipeline.get(getCurrentDictionaryKey())
+    results = pipeline.execute()
+
+    currentId = results[-1] and int(to_unicode(results[-1])) or None
+
+    return ( list(zip(dictIds, [ int(size) for size in results[:-1] ])), currentId )
+
+
+def loadDictionary(conn, dictId):
+    '''
+        loadDictionary - Add a dictionary to this process (see compression.addCompressDictionary), fetching it if not already added
+
+        @param conn <redis.Redis> - Connection to the node which holds files compressed with it
+        @param dictId <int/str> - Dictionary id
+
+        @raises ValueError - If the dictionary is not stored
+    '''
+    dictId = int(dictId)
+    if hasCompressDictionary(dictId):
+        return
+
+    dictData = conn.hget(getDictionariesKey(), str(dictId))
+    if not dictData:
+        raise ValueError('Compression dictionary %d is not stored. If a node was added, run netFetchRebalance.' %(dictId,))
+
+    addCompressDictionary(tobytes(dictData))
+
+
+def loadCurrentDictionary(conn):
+    '''
+        loadCurrentDictionary - Load the current dictionary (the first time this is called), and make it the one "zstd-dict" compresses with
+          in this process (see compression.setCurrentCompressDictionary)
+
+        @param conn <redis.Redis> - Connection to redis
+
+        @return <int/None> - Id of the dictionary this process compresses with, or None if no dictionary has been trained
+    '''
+    global _currentLoaded
+
+    with _currentLock:
+        if not _currentLoaded:
+            dictId = conn.get(getCurrentDictionaryKey())
+            if dictId:
+                loadDictionary(conn, to_unicode(dictId))
+                setCurrentCompressDictionary(int(to_unicode(dictId)))
+            _currentLoaded = True
+
+    return getCurrentCompressDictionary()
+
+
+def copyDictionaries(sourceConn, targetConn):
+    '''
+        copyDictionaries - Copy the dictionaries (and which is current) of one node that are missing on another
+
+        @param sourceConn <redis.Redis> - Connection to the node to copy from
+        @param targetConn <redis.Redis> - Connection to the node to copy to
+
+        @return <int> - Number of dictionaries copied
+    '''
+    missing = set(sourceConn.hkeys(getDictionariesKey())) - set(targetConn.hkeys(getDictionariesKey()))
+    currentId = sourceConn.get(getCurrentDictionaryKey())
+
+    pipeline = targetConn.pipeline(transaction=False)
+    for dictId in missing:
+        pipeline.hset(getDictionariesKey(), dictId, sourceConn.hget(getDictionariesKey(), dictId))
+    if currentId and not targetConn.exists(getCurrentDictionaryKey()):
+        pipeline.set(getCurrentDictionaryKey(), currentId)
+    pipeline.execute()
+
+    return len(missing)
@@ -0,0 +1,336 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the encryption formats used to store password-protected data
+
+# vim: ts=4 sw=4 expandtab
+
+import base64
+import multiprocessing
+import os
+import struct
+
+from multiprocessing.pool import ThreadPool
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+__all__ = ('ENCRYPTION_FERNET', 'ENCRYPTION_AESGCM', 'ENCRYPTION_NAMES', 'DEFAULT_PAYLOAD_CHUNK_SIZE',
+            'DecryptionError', 'normalizeEncryption', 'getCipher', 'FernetCipher', 'AesGcmCipher',
+            'encryptPayload', 'decryptPayload', 'getPayloadChunkSize', 'getPayloadRange', 'decryptPayloadRange',
+)
+
+# ENCRYPTION_* - Values of the "encryption" field, which records how encrypted data is stored
+#
+#   ENCRYPTION_FERNET - (Original format) A Fernet token of the whole data. Base64-encoded, so about 1/3 larger than the data.
+#   ENCRYPTION_AESGCM - Raw binary AES-256-GCM, over independent chunks of the data. 28 bytes of overhead per chunk.
+ENCRYPTION_FERNET = ''
+ENCRYPTION_AESGCM = 'aesgcm'
+
+# ENCRYPTION_NAMES - Map of name (as given on the command line) -> ENCRYPTION_* value
+ENCRYPTION_NAMES = {
+    'fernet' : ENCRYPTION_FERNET,
+    'aesgcm' : ENCRYPTION_AESGCM,
+    'aes-gcm' : ENCRYPTION_AESGCM,
+}
+
+# DEFAULT_PAYLOAD_CHUNK_SIZE - Number of bytes of data per independently-encrypted chunk,
+#   within a payload encrypted by #encryptPayload
+DEFAULT_PAYLOAD_CHUNK_SIZE = 1024 * 1024
+
+# PAYLOAD_MAGIC - Header of a payload encrypted by #encryptPayload. Followed by the chunk size (4 bytes, big-endian)
+PAYLOAD_MAGIC = b'NFG1'
+PAYLOAD_HEADER_SIZE = len(PAYLOAD_MAGIC) + 4
+
+# PARALLEL_MIN_CHUNKS - Payloads with at least this many chunks are encrypted / decrypted by a pool of threads
+PARALLEL_MIN_CHUNKS = 4
+
+
+class DecryptionError(Exception):
+    '''
+        DecryptionError - Raised when data could not be decrypted (wrong key, or data was modified)
+    '''
+    pass
+
+
+def normalizeEncryption(encryption):
+    '''
+        normalizeEncryption - Convert an encryption name (like "aesgcm" or "fernet") into an ENCRYPTION_* value
+
+        @param encryption <str/None> - Name or ENCRYPTION_* value. None is ENCRYPTION_FERNET
+
+        @return <str> - ENCRYPTION_* value
+
+        @raises ValueError - If encryption is unknown
+    '''
+    if not encryption:
+        return ENCRYPTION_FERNET
+
+    encryption = encryption.lower()
+    if encryption not in ENCRYPTION_NAMES:
+        raise ValueError('Unknown encryption: "%s". Supported are: %s' %(encryption, ', '.join(sorted(ENCRYPTION_NAMES.keys()))))
+
+    return ENCRYPTION_NAMES[encryption]
+
+
+def getCipher(encryption, fernetKey):
+    '''
+        getCipher - Get the cipher for an encryption format
+
+        @param encryption <str> - ENCRYPTION_* value
+        @param fernetKey <bytes> - Key derived from the password, see NetFetchFile._getFernetKey
+
+        @return <FernetCipher/AesGcmCipher>
+
+        @raises ValueError - If encryption is unknown
+    '''
+    if encryption == ENCRYPTION_AESGCM:
+        return AesGcmCipher(fernetKey)
+    if encryption == ENCRYPTION_FERNET:
+        return FernetCipher(fernetKey)
+
+    raise ValueError('Unknown encryption: "%s"' %(encryption,))
+
+
+class FernetCipher(object):
+    '''
+        FernetCipher - Encrypt/decrypt blocks as Fernet tokens
+    '''
+
+    def __init__(self, fernetKey):
+        '''
+            @param fernetKey <bytes> - Key derived from the password, see NetFetchFile._getFernetKey
+        '''
+        self.key = fernetKey
+        self._fernet = Fernet(fernetKey)
+
+    def encrypt(self, data, associatedData=None):
+        '''
+            encrypt - Encrypt a block
+
+            @param data <bytes> - Data
+            @param associatedData <bytes/None> - Ignored, Fernet does not support associated data
+
+            @return <bytes> - Fernet token
+        '''
+        return self._fernet.encrypt(_toBytes(data))
+
+    def decrypt(self, token, associatedData=None):
+        '''
+            decrypt - Decrypt a block encrypted by #encrypt
+
+            @raises DecryptionError - If the key is wrong or the token was modified
+        '''
+        try:
+            return self._fernet.decrypt(token)
+        except InvalidToken:
+            raise DecryptionError('Invalid token.')
+
+
+class AesGcmCipher(object):
+    '''
+        AesGcmCipher - Encrypt/decrypt blocks with AES-256-GCM. Each block is stored as  nonce (12 bytes) + ciphertext + tag (16 bytes)
+
+          The key is derived (HKDF-SHA256) from the same password-based key as Fernet, so is exactly as strong.
+    '''
+
+    NONCE_SIZE = 12
+    TAG_SIZE = 16
+    OVERHEAD = NONCE_SIZE + TAG_SIZE
+
+    # KDF_INFO - HKDF "info", which separates this key from any other derived from the same password
+    KDF_INFO = b'NetFetch AES-256-GCM'
+
+    def __init__(self, fernetKey):
+        '''
+            @param fernetKey <bytes> - Key derived from the password, see NetFetchFile._getFernetKey
+        '''
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=self.KDF_INFO, backend=default_backend())
+        self.key = hkdf.derive(base64.b64decode(fernetKey))
+        self._aead = AESGCM(self.key)
+
+    def encrypt(self, data, associatedData=None):
+        '''
+            encrypt - Encrypt a block, with a random nonce
+
+            @param data <bytes> - Data
+            @param associatedData <bytes/None> - Data which is authenticated (but not stored), and must be provided again to decrypt.
+                Used to bind a block to its position or id.
+
+            @return <bytes> - nonce + ciphertext + tag
+        '''
+        nonce = os.urandom(self.NONCE_SIZE)
+        return nonce + self._aead.encrypt(nonce, _toBytes(data), associatedData)
+
+    def decrypt(self, block, associatedData=None):
+        '''
+            decrypt - Decrypt a block encrypted by #encrypt
+
+            @raises DecryptionError - If the key or associated data is wrong, or the block was modified
+        '''
+        if len(block) < self.OVERHEAD:
+            raise DecryptionError('Block is too short.')
+        try:
+            return self._aead.decrypt(_toBytes(block[:self.NONCE_SIZE]), _toBytes(block[self.NONCE_SIZE:]), associatedData)
+        except InvalidTag:
+            raise DecryptionError('Invalid tag.')
+
+
+def _toBytes(data):
+    '''
+        _toBytes - Internal. Convert a memoryview (i.e. a block from chunks.iterBlocks) into bytes
+    '''
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+def _getPayloadChunkAAD(header, chunkNum, isLast):
+    '''
+        _getPayloadChunkAAD - Internal. Associated data of a chunk within a payload, which binds it to the header,
+          its position, and whether it is the last chunk (so chunks cannot be reordered, and the payload cannot be truncated)
+    '''
+    return header + struct.pack('>QB', chunkNum, int(isLast))
+
+
+# _pool - Pool of threads shared by #encryptPayload and #decryptPayload, created on first use
+_pool = None
+
+def _mapChunks(func, args):
+    '''
+        _mapChunks - Internal. Call func on each item of args, using a pool of threads if there are many
+          (so large payloads can use multiple cores)
+    '''
+    global _pool
+
+    if len(args) < PARALLEL_MIN_CHUNKS:
+        return [ func(arg) for arg in args ]
+
+    if _pool is None:
+        try:
+            numThreads = multiprocessing.cpu_count()
+        except NotImplementedError:
+            numThreads = 1
+        if numThreads <= 1:
+            return [ func(arg) for arg in args ]
+        _pool = ThreadPool(numThreads)
+
+    return _pool.map(func, args)
+
+
+def encryptPayload(cipher, data, chunkSize=DEFAULT_PAYLOAD_CHUNK_SIZE):
+    '''
+        encryptPayload - Encrypt data as a series of independently-encrypted chunks (so it can be decrypted a chunk
+          at a time, and the chunks processed in parallel)
+
+          Format is:  PAYLOAD_MAGIC + chunkSize (4 bytes, big-endian), then each chunk as encrypted by #cipher.
+            All chunks but the last hold exactly #chunkSize bytes of data.
+
+        @param cipher <AesGcmCipher> - Cipher
+        @param data <bytes> - Data
+        @param chunkSize <int> - Number of bytes of data per chunk
+
+        @return <bytes> - Encrypted payload
+    '''
+    header = PAYLOAD_MAGIC + struct.pack('>I', chunkSize)
+
+    view = memoryview(data)
+    dataLen = len(view)
+    numChunks = max(1, (dataLen + chunkSize - 1) // chunkSize)
+
+    def _encryptChunk(chunkNum):
+        offset = chunkNum * chunkSize
+        return cipher.encrypt(view[offset : offset + chunkSize], _getPayloadChunkAAD(header, chunkNum, chunkNum == numChunks - 1))
+
+    return header + b''.join(_mapChunks(_encryptChunk, list(range(numChunks))))
+
+
+def decryptPayload(cipher, payload):
+    '''
+        decryptPayload - Decrypt a payload encrypted by #encryptPayload
+
+        @param cipher <AesGcmCipher> - Cipher
+        @param payload <bytes> - Encrypted payload
+
+        @return <bytes> - Data
+
+        @raises DecryptionError - If the key is wrong, or the payload was modified or truncated
+    '''
+    view = memoryview(payload)
+    header = view[:PAYLOAD_HEADER_SIZE].tobytes()
+    chunkSize = getPayloadChunkSize(header)
+    storedChunkSize = chunkSize + cipher.OVERHEAD
+
+    bodyLen = len(view) - PAYLOAD_HEADER_SIZE
+    numChunks = max(1, (bodyLen + storedChunkSize - 1) // storedChunkSize)
+
+    return decryptPayloadRange(cipher, header, view[PAYLOAD_HEADER_SIZE:], 0, numChunks)
+
+
+def getPayloadChunkSize(header):
+    '''
+        getPayloadChunkSize - Get the number of bytes of data per chunk of a payload encrypted by #encryptPayload
+
+        @param header <bytes> - The first PAYLOAD_HEADER_SIZE bytes of the payload
+
+        @return <int> - Chunk size
+
+        @raises DecryptionError - If #header is not that of an encrypted payload
+    '''
+    if len(header) != PAYLOAD_HEADER_SIZE or header[:len(PAYLOAD_MAGIC)] != PAYLOAD_MAGIC:
+        raise DecryptionError('Not an encrypted payload.')
+
+    return struct.unpack('>I', header[len(PAYLOAD_MAGIC):])[0]
+
+
+def getPayloadRange(cipher, chunkSize, start, end):
+    '''
+        getPayloadRange - Locate the chunks of a payload encrypted by #encryptPayload which hold a range of its data,
+          so only those need to be read (see #decryptPayloadRange)
+
+        @param cipher <AesGcmCipher> - Cipher
+        @param chunkSize <int> - Number of bytes of data per chunk, see #getPayloadChunkSize
+        @param start <int> - Offset of the first byte of data
+        @param end <int> - Offset after the last byte of data
+
+        @return tuple( firstChunkNum<int>, offset<int>, length<int> ) - Index of the first chunk holding the range,
+            and the offset and length within the payload of the chunks holding it
+    '''
+    storedChunkSize = chunkSize + cipher.OVERHEAD
+    firstChunkNum = start // chunkSize
+    lastChunkNum = max(firstChunkNum, (end - 1) // chunkSize)
+
+    return (firstChunkNum, PAYLOAD_HEADER_SIZE + (firstChunkNum * storedChunkSize), (lastChunkNum - firstChunkNum + 1) * storedChunkSize)
+
+
+def decryptPayloadRange(cipher, header, body, firstChunkNum, numChunks):
+    '''
+        decryptPayloadRange - Decrypt consecutive chunks of a payload encrypted by #encryptPayload.
+          Each chunk is authenticated, along with its position in the payload.
+
+        @param cipher <AesGcmCipher> - Cipher
+        @param header <bytes> - The first PAYLOAD_HEADER_SIZE bytes of the payload
+        @param body <bytes/memoryview> - The chunks, as read from the payload (see #getPayloadRange)
+        @param firstChunkNum <int> - Index of the first chunk of #body
+        @param numChunks <int> - Number of chunks in the whole payload (so the last one is known)
+
+        @return <bytes> - Data of the chunks
+
+        @raises DecryptionError - If the key is wrong, or the chunks were modified or truncated
+    '''
+    storedChunkSize = getPayloadChunkSize(header) + cipher.OVERHEAD
+
+    view = memoryview(body)
+    numBodyChunks = max(1, (len(view) + storedChunkSize - 1) // storedChunkSize)
+    if firstChunkNum + numBodyChunks > numChunks:
+        raise DecryptionError('Payload has more chunks than expected.')
+
+    def _decryptChunk(bodyChunkNum):
+        offset = bodyChunkNum * storedChunkSize
+        chunkNum = firstChunkNum + bodyChunkNum
+        return cipher.decrypt(view[offset : offset + storedChunkSize], _getPayloadChunkAAD(header, chunkNum, chunkNum == numChunks - 1))
+
+    return b''.join(_mapChunks(_decryptChunk, list(range(numBodyChunks))))
@@ -0,0 +1,276 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the change events, which are published (on a redis pub/sub channel per hostname) whenever a file
+#    is stored or deleted, and the watcher which subscribes to them. See follow.py for keeping local copies up to date.
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from IndexedRedis import INDEXED_REDIS_PREFIX
+
+from IndexedRedis.compat_str import to_unicode
+
+__all__ = ('EVENT_UPDATE', 'EVENT_DELETE', 'EVENT_RESYNC', 'EVENTS_CHANNEL_NAME', 'getEventsChannel',
+            'ChangeEvent', 'queueChangeEvent', 'EventWatcher',
+)
+
+# EVENT_UPDATE - A file was stored (created or replaced)
+EVENT_UPDATE = 'update'
+# EVENT_DELETE - A file was deleted
+EVENT_DELETE = 'delete'
+# EVENT_RESYNC - Not published. Given by EventWatcher after it reconnects, as events may have been missed meanwhile.
+EVENT_RESYNC = 'resync'
+
+# EVENTS_CHANNEL_NAME - Name of the pub/sub channels, which are suffixed by the db number and the hostname of the file.
+#   Unlike keys, channels are shared by every db of a server, so the db number keeps each db's events apart.
+EVENTS_CHANNEL_NAME = 'NetFetchFile:events:'
+
+
+#  Pub/sub is fire-and-forget: an event is delivered to every subscriber connected when it is published, and is
+#    otherwise lost. So the events only tell a subscriber what to refetch, the stored files are still the
+#    source of truth. Subscribe first, then compare against the stored files (see follow.Follower), and do so
+#    again if the subscription is lost (EVENT_RESYNC).
+#
+#   Each event is published on the node the file is stored on, in the same pipeline (or transaction) as the write,
+#     so it is never seen before the change it describes. With multiple nodes, a watcher subscribes on every node.
+
+
+def getEventsChannel(hostname, db=0):
+    '''
+        getEventsChannel - Get the pub/sub channel which the events of a hostname are published on
+
+        @param hostname <str> - Hostname, or '*' for the pattern matching every hostname (see PSUBSCRIBE)
+        @param db <int> - Redis db number the files are stored in
+
+        @return <str> - Channel name
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, EVENTS_CHANNEL_NAME, str(int(db or 0)), ':', hostname])
+
+
+def _getConnectionDb(conn):
+    '''
+        _getConnectionDb - Internal. Get the db number a connection or pipeline (sync or asyncio) uses
+
+        @param conn <redis.Redis/Pipeline> - Connection or pipeline
+
+        @return <int>
+    '''
+    return conn.connection_pool.connection_kwargs.get('db', 0)
+
+
+class ChangeEvent(object):
+    '''
+        ChangeEvent - A change to a stored file, as published on the events channel of its hostname
+    '''
+
+    __slots__ = ('event', 'hostname', 'filename', 'checksum', 'checksumType', 'size', 'mtime')
+
+    def __init__(self, event, hostname, filename, checksum='', checksumType='', size=0, mtime=0.0):
+        '''
+            @param event <str> - One of EVENT_UPDATE, EVENT_DELETE, EVENT_RESYNC
+            @param hostname <str/None> - Hostname of file. None for EVENT_RESYNC.
+            @param filename <str/None> - Filename of file. None for EVENT_RESYNC.
+            @param checksum <str> - Checksum of the new contents. Empty for EVENT_DELETE.
+            @param checksumType <str> - Algorithm of #checksum, a checksum.CHECKSUM_* value
+            @param size <int> - Size of the new contents
+            @param mtime <float> - Time the file was stored
+        '''
+        self.event = event
+        self.hostname = hostname
+        self.filename = filename
+        self.checksum = checksum or ''
+        self.checksumType = checksumType or ''
+        self.size = int(size or 0)
+        self.mtime = float(mtime or 0.0)
+
+    def toJSON(self):
+        '''
+            toJSON - Get this event as published
+
+            @return <str> - JSON object
+        '''
+        return json.dumps(dict( [ (name, getattr(self, name)) for name in ChangeEvent.__slots__ ] ), sort_keys=True)
+
+    @classmethod
+    def fromJSON(cls, data):
+        '''
+            fromJSON - Parse a published event
+
+            @param data <bytes/str> - JSON object, as created by #toJSON
+
+            @return <ChangeEvent>
+
+            @raises ValueError - If #data is not an event
+        '''
+        try:
+            values = json.loads(to_unicode(data))
+            return cls(values['event'], values['hostname'], values['filename'], values.get('checksum', ''),
+                values.get('checksumType', ''), values.get('size', 0), values.get('mtime', 0.0))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError('Invalid change event: %s' %(str(e),))
+
+    def __repr__(self):
+        return 'ChangeEvent(%s, %r, %r, checksum=%r)' %(self.event, self.hostname, self.filename, self.checksum)
+
+
+def queueChangeEvent(pipeline, event, hostname, filename, checksum='', checksumType='', size=0, mtime=0.0):
+    '''
+        queueChangeEvent - Queue onto a pipeline the publishing of a change event. @see ChangeEvent for the params
+
+        @param pipeline - Pipeline (sync or asyncio), which should be the one that writes the change
+    '''
+    changeEvent = ChangeEvent(event, hostname, filename, checksum, checksumType, size, mtime)
+    pipeline.publish(getEventsChannel(hostname, _getConnectionDb(pipeline)), changeEvent.toJSON())
+
+
+class EventWatcher(object):
+    '''
+        EventWatcher - Subscribe to the change events of one or every hostname, on every node.
+
+          Each subscription is read by a background thread, and the events of all are returned by #getEvent (or by iterating).
+
+          If a subscription is lost, it is re-established and an EVENT_RESYNC event is given, as any events published meanwhile were missed.
+    '''
+
+    def __init__(self, hostname=None, model=None, reconnectDelay=1.0):
+        '''
+            @param hostname <str/None> - Hostname whose events are watched, or None for every hostname
+            @param model <class/None> - Model whose connection(s) are used. Default is NetFetchFile.
+            @param reconnectDelay <float> - Seconds waited before re-establishing a lost subscription
+        '''
+        if model is None:
+            from . import NetFetchFile as model
+
+        self.hostname = hostname
+        self.model = model
+        self.reconnectDelay = reconnectDelay
+
+        self._events = queue.Queue()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        '''
+            start - Subscribe, and start reading events. Every change published after this returns will be given.
+
+            @raises redis.ConnectionError - If a node cannot be reached
+        '''
+        if self.model._isRouted():
+            conns = [ nodeModel._getConnection() for nodeModel in self.model._getNodeModels() ]
+        else:
+            conns = [ self.model._getConnection() ]
+
+        self._stopped.clear()
+        for conn in conns:
+            pubSub = self._subscribe(conn)
+            thread = threading.Thread(target=self._readEvents, args=(conn, pubSub))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        '''
+            stop - Unsubscribe, and stop the background threads. Events already read may still be taken by #getEvent.
+        '''
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def getEvent(self, timeout=None):
+        '''
+            getEvent - Get the next event
+
+            @param timeout <float/None> - Seconds to wait for one, or None to wait until there is one
+
+            @return <ChangeEvent/None> - The event, or None if #timeout elapsed first
+        '''
+        try:
+            if timeout is None:
+                # A wait without timeout cannot be interrupted (i.e. by ctrl+c) on python2
+                while True:
+                    try:
+                        return self._events.get(timeout=3600)
+                    except queue.Empty:
+                        pass
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while not self._stopped.is_set():
+            changeEvent = self.getEvent(timeout=1.0)
+            if changeEvent is not None:
+                yield changeEvent
+
+    def _subscribe(self, conn):
+        '''
+            _subscribe - Internal. Subscribe on a connection, and wait until the server has confirmed it
+
+            @param conn <redis.Redis> - Connection to a node
+
+            @return <redis.client.PubSub>
+        '''
+        pubSub = conn.pubsub()
+        try:
+            if self.hostname is None:
+                pubSub.psubscribe(getEventsChannel('*', _getConnectionDb(conn)))
+            else:
+                pubSub.subscribe(getEventsChannel(self.hostname, _getConnectionDb(conn)))
+
+            while True:
+                message = pubSub.get_message(timeout=1.0)
+                if message and message['type'] in ('subscribe', 'psubscribe'):
+                    return pubSub
+        except:
+            pubSub.close()
+            raise
+
+    def _readEvents(self, conn, pubSub):
+        '''
+            _readEvents - Internal. Read the events of one subscription until stopped, re-subscribing if it is lost
+
+            @param conn <redis.Redis> - Connection to a node
+            @param pubSub <redis.client.PubSub> - The subscription, from #_subscribe
+        '''
+        while not self._stopped.is_set():
+            if pubSub is None:
+                if self._stopped.wait(self.reconnectDelay):
+                    break
+                try:
+                    pubSub = self._subscribe(conn)
+                except Exception:
+                    continue
+                self._events.put( ChangeEvent(EVENT_RESYNC, None, None) )
+
+            try:
+                message = pubSub.get_message(timeout=1.0)
+            except Exception:
+                try:
+                    pubSub.close()
+                except Exception:
+                    pass
+                pubSub = None
+                continue
+
+            if not message or message['type'] not in ('message', 'pmessage'):
+                continue
+
+            try:
+                self._events.put( ChangeEvent.fromJSON(message['data']) )
+            except ValueError:
+                # Not published by NetFetch
+                pass
+
+        if pubSub is not None:
+            try:
+                pubSub.close()
+            except Exception:
+                pass
@@ -0,0 +1,116 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the IndexedRedis field types used by the NetFetch models
+
+# vim: ts=4 sw=4 expandtab
+
+from IndexedRedis.fields import IRField, IRBytesField, irNull
+from IndexedRedis.compat_str import tobytes
+
+from .compression import normalizeCompressMode, compressData, decompressData
+
+__all__ = ('DataField', 'CompressedDataField', )
+
+
+def _isBuffer(value):
+    '''
+        _isBuffer - Internal. Check if a value is a buffer which may be used as-is in place of bytes (like a memoryview
+          of a memory-mapped file, see localfile.mapFile)
+    '''
+    return isinstance(value, (memoryview, bytearray))
+
+
+class DataField(IRBytesField):
+    '''
+        DataField - A bytes field which also takes a buffer (like a memoryview of a memory-mapped file, see localfile.mapFile).
+
+          A buffer is sent to Redis as-is, instead of being copied into bytes first. Stored the same as IRBytesField.
+
+          When followed by another field in an IRFieldChain, use copyBuffers=True, as that field needs bytes.
+    '''
+
+    def __init__(self, name='', defaultValue=irNull, encoding=None, copyBuffers=False):
+        '''
+            @param copyBuffers <bool> - If True, a buffer is converted into bytes for storage
+
+            @see IRBytesField.__init__ for other params
+        '''
+        IRBytesField.__init__(self, name=name, defaultValue=defaultValue, encoding=encoding)
+        self.copyBuffers = copyBuffers
+
+    def _fromInput(self, value):
+        if _isBuffer(value):
+            return value
+
+        return tobytes(value, self.encoding)
+
+    def _toStorage(self, value):
+        if _isBuffer(value):
+            if self.copyBuffers:
+                return memoryview(value).tobytes()
+            return value
+
+        return tobytes(value, self.encoding)
+
+    def copy(self):
+        return self.__class__(name=self.name, defaultValue=self.defaultValue, encoding=self.encoding, copyBuffers=self.copyBuffers)
+
+    def __new__(self, name='', defaultValue=irNull, encoding=None, copyBuffers=False):
+        return IRBytesField.__new__(self, name, defaultValue, encoding)
+
+
+class CompressedDataField(IRField):
+    '''
+        CompressedDataField - A bytes field which is compressed going to Redis, and decompressed coming back,
+          using any of the modes of NetFetch.compression (like zstd and lz4, which IndexedRedis's IRCompressedField does not support).
+
+          The level used is the default for the mode at the time of storage, see compression.setDefaultCompressLevel.
+            Stored data does not depend on the level, so files stored at any level are read the same.
+
+          Unlike IRCompressedField, stored data is always compressed (it does not check for a header), so data which
+            happens to already be compressed with the same mode is stored correctly. Like DataField, a buffer is compressed as-is.
+    '''
+
+    CAN_INDEX = False
+
+    def __init__(self, name='', compressMode='', defaultValue=irNull):
+        '''
+            @param name <str> - Field name
+            @param compressMode <str> - Compression mode, see compression.normalizeCompressMode
+            @param defaultValue - The default value for this field
+
+            @raises ValueError - If compressMode is unknown
+        '''
+        self.valueType = None
+        self.defaultValue = defaultValue
+        self.compressMode = normalizeCompressMode(compressMode)
+
+    def _toStorage(self, value):
+        if not _isBuffer(value):
+            value = tobytes(value)
+        if not value:
+            return b''
+
+        return compressData(self.compressMode, value)
+
+    def _fromStorage(self, value):
+        value = tobytes(value)
+        if not value:
+            return b''
+
+        return decompressData(self.compressMode, value)
+
+    def _fromInput(self, value):
+        if _isBuffer(value):
+            return value
+
+        return tobytes(value)
+
+    def _getReprProperties(self):
+        return [ 'compressMode="%s"' %(self.compressMode, ) ]
+
+    def copy(self):
+        return self.__class__(name=self.name, compressMode=self.compressMode, defaultValue=self.defaultValue)
+
+    def __new__(self, name='', compressMode='', defaultValue=irNull):
+        return IRField.__new__(self, name)
@@ -0,0 +1,301 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the following of stored files, which keeps local copies up to date by refetching only the files
+#    named by change events (see events.py), instead of polling. Used by netFetchGet --follow.
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import fnmatch
+import os
+import threading
+import time
+
+from . import NetFetchFile, NoSuchNetFetchFile
+from .bulk import DEFAULT_BULK_BATCH_SIZE, GLOB_CHARS, BulkResult
+from .checksum import hashFile
+from .events import EVENT_UPDATE, EVENT_DELETE, EVENT_RESYNC, EventWatcher
+
+__all__ = ('Follower', )
+
+
+#  A follower subscribes to the change events of a hostname before anything else, then compares the stored files
+#    against its local copies (a "resync"), fetching those which differ. From then on, only the files named by
+#    an event are fetched, and only if the checksum in the event is not that of the local copy.
+#
+#   The checksum of each local copy is remembered once fetched (or, for a copy which already existed, once hashed),
+#     so a local copy which is changed by something else is not noticed until the stored file changes again.
+
+
+class Follower(object):
+    '''
+        Follower - Keep local copies of stored files up to date, fetching each file only when it changes.
+
+          Files are followed by filename, directory (if #recursive), or glob pattern, like netFetchGet --dest,
+            so files which are stored later within a directory or matching a pattern are fetched too.
+    '''
+
+    def __init__(self, hostname, patterns, recursive=False, destDir=None, localFilename=None, password=None, retainPermissions=True,
+                    removeDeleted=False, resyncInterval=None, numWorkers=None, batchSize=DEFAULT_BULK_BATCH_SIZE, model=NetFetchFile,
+                    onFetch=None, onRemove=None, onError=None):
+        '''
+            @param hostname <str> - Hostname that files were stored on
+            @param patterns list<str> - Absolute filenames, directories (if #recursive), or glob patterns
+            @param recursive <bool> - If True, a directory matches every stored filename within it
+            @param destDir <str/None> - If defined, each file is saved under this directory at its full path. Otherwise, at its filename.
+            @param localFilename <str/None> - If defined, the one filename in #patterns is saved here instead
+            @param password <str/None> - Try this password on potentially encrypted files
+            @param retainPermissions <bool> - @see NetFetchFile.downloadToLocal
+            @param removeDeleted <bool> - If True, the local copy of a file deleted from storage is removed
+            @param resyncInterval <float/None> - If defined, compare every stored file against its local copy this often (in seconds),
+                in case events were missed without the subscription being lost
+            @param numWorkers <int/None> - Number of worker threads when fetching many files. Default is number of cpus.
+            @param batchSize <int> - Number of files fetched per pipeline
+            @param model <class> - Model to fetch with, NetFetchFile or a node-bound subclass
+            @param onFetch <function/None> - If provided, called as onFetch(filename, localFilename) after each file is fetched
+            @param onRemove <function/None> - If provided, called as onRemove(filename, localFilename) after each local copy is removed
+            @param onError <function/None> - If provided, called as onError(filename, exc) when fetching or removing a file fails
+
+            @raises ValueError - If #localFilename is given with anything but a single filename
+        '''
+        if localFilename and (len(patterns) != 1 or recursive or any( [ globChar in patterns[0] for globChar in GLOB_CHARS ] )):
+            raise ValueError('A local filename can only be given when following a single file.')
+
+        self.hostname = hostname
+        self.patterns = list(patterns)
+        self.recursive = recursive
+        self.destDir = destDir
+        self.localFilename = localFilename
+        self.password = password
+        self.retainPermissions = retainPermissions
+        self.removeDeleted = removeDeleted
+        self.resyncInterval = resyncInterval
+        self.numWorkers = numWorkers
+        self.batchSize = batchSize
+        self.model = model
+
+        self.onFetch = onFetch
+        self.onRemove = onRemove
+        self.onError = onError
+
+        # checksums - Map of filename -> checksum of its local copy, for every file known to be up to date
+        self.checksums = {}
+
+        self._watcher = EventWatcher(hostname, model)
+        self._stopped = threading.Event()
+
+    def isFollowed(self, filename):
+        '''
+            isFollowed - Check if a stored filename is followed (is, is within, or matches one of #patterns)
+
+            @param filename <str> - Stored filename
+
+            @return <bool>
+        '''
+        for pattern in self.patterns:
+            if any( [ globChar in pattern for globChar in GLOB_CHARS ] ):
+                if fnmatch.fnmatch(filename, pattern):
+                    return True
+            elif filename == pattern or (self.recursive and filename.startswith(pattern.rstrip('/') + '/')):
+                return True
+
+        return False
+
+    def getLocalFilename(self, filename):
+        '''
+            getLocalFilename - Get where the local copy of a stored file is saved
+
+            @param filename <str> - Stored filename
+
+            @return <str> - Local filename
+        '''
+        if self.localFilename:
+            return self.localFilename
+        if self.destDir:
+            return os.path.join(self.destDir, filename.lstrip('/'))
+        return filename
+
+    def run(self):
+        '''
+            run - Follow the files until #stop is called (i.e. from a signal handler or another thread).
+
+              Subscribes to change events, fetches every file which differs from its local copy, and then each file as it changes.
+
+            @raises redis.ConnectionError - If redis cannot be reached to subscribe
+        '''
+        self._stopped.clear()
+        self._watcher.start()
+        try:
+            self.resync()
+            lastResync = time.time()
+
+            while not self._stopped.is_set():
+                changeEvents = self._getEvents(timeout=1.0)
+
+                # A resync compares every stored file, so covers any events received with it
+                if [ changeEvent for changeEvent in changeEvents if changeEvent.event == EVENT_RESYNC ] or \
+                        (self.resyncInterval and time.time() - lastResync >= self.resyncInterval):
+                    self.resync()
+                    lastResync = time.time()
+                elif changeEvents:
+                    self._handleEvents(changeEvents)
+        finally:
+            self._watcher.stop()
+
+    def stop(self):
+        '''
+            stop - Stop #run, once it finishes any fetch in progress
+        '''
+        self._stopped.set()
+
+    def resync(self):
+        '''
+            resync - Compare every followed file which is stored against its local copy, and fetch those which differ.
+              With #removeDeleted, also remove the local copies of followed files which are no longer stored.
+
+            @return <bulk.BulkResult> - Files fetched, and any errors
+        '''
+        stored = {}
+        for prefix in self._getPrefixes():
+            for obj in self.model.listFiles(self.hostname, prefix):
+                if obj.filename not in stored and self.isFollowed(obj.filename):
+                    stored[obj.filename] = obj
+
+        toFetch = {}
+        for (filename, obj) in stored.items():
+            if self.checksums.get(filename, None) == obj.checksum:
+                continue
+
+            if filename not in self.checksums:
+                # First time seen, so a copy may already exist (like from a previous run)
+                localFilename = self.getLocalFilename(filename)
+                try:
+                    if os.path.getsize(localFilename) == (obj.size or 0) and hashFile(localFilename, obj.checksumType) == obj.checksum:
+                        self.checksums[filename] = obj.checksum
+                        continue
+                except (OSError, IOError):
+                    pass
+
+            toFetch[filename] = (obj.checksum, obj.size or 0)
+
+        if self.removeDeleted:
+            for filename in [ filename for filename in self.checksums if filename not in stored ]:
+                self._removeLocal(filename)
+
+        return self._fetch(toFetch)
+
+    def _getPrefixes(self):
+        '''
+            _getPrefixes - Internal. Get the filename prefixes which every followed file is listed under (see NetFetchFile.listFiles)
+
+            @return list<str> - Prefixes, none within another
+        '''
+        prefixes = []
+        for pattern in self.patterns:
+            globIndexes = [ pattern.index(globChar) for globChar in GLOB_CHARS if globChar in pattern ]
+            prefixes.append( pattern[ : min(globIndexes) ] if globIndexes else pattern )
+
+        ret = []
+        for prefix in sorted(prefixes):
+            if not ret or not prefix.startswith(ret[-1]):
+                ret.append(prefix)
+        return ret
+
+    def _getEvents(self, timeout):
+        '''
+            _getEvents - Internal. Wait for an event, then take every other event already received, so a burst of changes
+              is fetched together (and a file changed many times, once)
+
+            @param timeout <float> - Seconds to wait for the first event
+
+            @return list<events.ChangeEvent> - Events, oldest first. Empty if #timeout elapsed first.
+        '''
+        ret = []
+        changeEvent = self._watcher.getEvent(timeout=timeout)
+        while changeEvent is not None:
+            ret.append(changeEvent)
+            changeEvent = self._watcher.getEvent(timeout=0)
+        return ret
+
+    def _handleEvents(self, changeEvents):
+        '''
+            _handleEvents - Internal. Fetch (or remove) the followed files named by some events. Only the last event of each file is used.
+
+            @param changeEvents list<events.ChangeEvent> - Events, oldest first
+        '''
+        lastEvents = {}
+        for changeEvent in changeEvents:
+            if changeEvent.event in (EVENT_UPDATE, EVENT_DELETE) and changeEvent.hostname == self.hostname and self.isFollowed(changeEvent.filename):
+                lastEvents[changeEvent.filename] = changeEvent
+
+        toFetch = {}
+        for (filename, changeEvent) in lastEvents.items():
+            if changeEvent.event == EVENT_DELETE:
+                if self.removeDeleted and filename in self.checksums:
+                    self._removeLocal(filename)
+                else:
+                    self.checksums.pop(filename, None)
+            elif self.checksums.get(filename, None) != changeEvent.checksum:
+                toFetch[filename] = (changeEvent.checksum, changeEvent.size)
+
+        self._fetch(toFetch, ignoreMissing=True)
+
+    def _fetch(self, toFetch, ignoreMissing=False):
+        '''
+            _fetch - Internal. Fetch files, and record the checksum of each which is fetched
+
+            @param toFetch dict<str, tuple(str, int)> - Map of filename -> (checksum, size) expected
+            @param ignoreMissing <bool> - If True, a file which is no longer stored is not an error (its deletion is yet to be handled)
+
+            @return <bulk.BulkResult> - Files fetched, and any errors
+        '''
+        if self.localFilename or len(toFetch) <= 1:
+            result = BulkResult()
+            for filename in toFetch:
+                localFilename = self.getLocalFilename(filename)
+                try:
+                    if self.destDir and not os.path.isdir(os.path.dirname(localFilename)):
+                        os.makedirs(os.path.dirname(localFilename))
+                    self.model.downloadToLocal(self.hostname, filename, self.password, localFilename, self.retainPermissions)
+                    result.addFile(toFetch[filename][1])
+                except Exception as e:
+                    result.addError(filename, e)
+            result.finish()
+        else:
+            result = self.model.downloadManyToLocal(self.hostname, sorted(toFetch), self.password, self.destDir, self.retainPermissions,
+                        numWorkers=self.numWorkers, batchSize=self.batchSize)
+
+        failed = set()
+        for (filename, exc) in result.errors:
+            failed.add(filename)
+            self.checksums.pop(filename, None)
+            if self.onError is not None and not (ignoreMissing and isinstance(exc, NoSuchNetFetchFile)):
+                self.onError(filename, exc)
+
+        for filename in sorted(toFetch):
+            if filename not in failed:
+                self.checksums[filename] = toFetch[filename][0]
+                if self.onFetch is not None:
+                    self.onFetch(filename, self.getLocalFilename(filename))
+
+        return result
+
+    def _removeLocal(self, filename):
+        '''
+            _removeLocal - Internal. Remove the local copy of a file which is no longer stored
+
+            @param filename <str> - Stored filename
+        '''
+        self.checksums.pop(filename, None)
+
+        localFilename = self.getLocalFilename(filename)
+        try:
+            os.unlink(localFilename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                if self.onError is not None:
+                    self.onError(filename, e)
+                return
+
+        if self.onRemove is not None:
+            self.onRemove(filename, localFilename)
@@ -0,0 +1,242 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the helpers for the listing index, which allows enumerating stored files
+#    (by hostname and/or filename prefix) without reading their data, and the path index, which resolves
+#    a hostname/filename pair to its stored object in a single lookup
+
+# vim: ts=4 sw=4 expandtab
+
+from IndexedRedis import INDEXED_REDIS_PREFIX
+
+from IndexedRedis.compat_str import tobytes, to_unicode
+
+__all__ = ('DEFAULT_LIST_BATCH_SIZE', 'LAYOUT_INDEXED', 'LAYOUT_COMPACT', 'STORAGE_LAYOUTS',
+            'getListIndexKeys', 'getListIndexMembers', 'getPathIndexKey',
+            'queueListIndexAdd', 'queueListIndexRemove', 'iterListIndex', 'iterListIndexHostnames', 'getPathIndexFilenames',
+            'setStorageLayout', 'getStorageLayout', 'isCompactLayout',
+)
+
+# DEFAULT_LIST_BATCH_SIZE - Default number of files read from the listing index (and their metadata fetched) per round-trip
+DEFAULT_LIST_BATCH_SIZE = 1000
+
+# LIST_BY_HOSTNAME_KEY_NAME - Name of the sorted set with a member per file, sorted by hostname then filename
+LIST_BY_HOSTNAME_KEY_NAME = 'NetFetchFile:list:hostname'
+
+# LIST_BY_FILENAME_KEY_NAME - Name of the sorted set with a member per file, sorted by filename then hostname
+LIST_BY_FILENAME_KEY_NAME = 'NetFetchFile:list:filename'
+
+# PATH_INDEX_KEY_NAME - Name prefix of the hash of each hostname, of filename -> primary key (hostname is appended)
+PATH_INDEX_KEY_NAME = 'NetFetchFile:path:'
+
+# LAYOUT_INDEXED - Storage layout where each file is also in the hostname and filename index sets (of IndexedRedis),
+#   so can be found by versions before 3.1.0
+LAYOUT_INDEXED = 'indexed'
+
+# LAYOUT_COMPACT - Storage layout where files are only in the listing and path indexes
+LAYOUT_COMPACT = 'compact'
+
+# STORAGE_LAYOUTS - All storage layouts
+STORAGE_LAYOUTS = (LAYOUT_INDEXED, LAYOUT_COMPACT)
+
+# MEMBER_SEPARATOR - Separates the parts of a member of the listing index. Cannot occur in a hostname or filename.
+MEMBER_SEPARATOR = b'\x00'
+
+# LEX_MAX_BYTE - Appended to a prefix to form the (inclusive) end of a lexicographical range of all members starting with that prefix
+LEX_MAX_BYTE = b'\xff'
+
+
+#  The listing index is a pair of sorted sets, where every member has a score of 0 so the set is ordered
+#    lexicographically. Each file has a member in both:
+#
+#     hostname set:   hostname \0 filename \0 primaryKey
+#     filename set:   filename \0 hostname \0 primaryKey
+#
+#    so all files of a hostname (or under a filename prefix on a hostname), or under a filename prefix on
+#    any hostname, are a single ZRANGEBYLEX. The primary key is carried in the member, so the metadata can
+#    be fetched directly, without resolving the hostname/filename indexes.
+#
+#  The path index is a hash per hostname, of filename -> primaryKey, so the object of a hostname/filename pair
+#    is a single HGET (see scripts.LOOKUP_FILE_SCRIPT), rather than the intersection of the hostname and filename
+#    index sets kept by IndexedRedis.
+#
+#   Those index sets cost a key for every distinct filename, which with millions of files is much of the memory
+#     used by redis beyond the files themselves. With the compact layout (see #setStorageLayout) they are not kept,
+#     and files are found by the listing and path indexes alone. Convert the files already stored with
+#     NetFetchFile.migrateLayout (netFetchMigrateLayout).
+
+
+global _storageLayout
+_storageLayout = LAYOUT_INDEXED
+
+
+def setStorageLayout(layout):
+    '''
+        setStorageLayout - Set the storage layout of the files stored (or moved) by this process
+
+          Files are found the same way with either layout, but those stored with the compact layout cannot be found by versions before 3.1.0.
+          Use the same layout as the files already stored, @see NetFetchFile.migrateLayout
+
+        @param layout <str> - LAYOUT_INDEXED (the default) or LAYOUT_COMPACT
+
+        @raises ValueError - If layout is unknown
+    '''
+    global _storageLayout
+
+    if layout not in STORAGE_LAYOUTS:
+        raise ValueError('Unknown storage layout "%s". Supported layouts are: %s' %(layout, ', '.join(STORAGE_LAYOUTS)))
+
+    _storageLayout = layout
+
+
+def getStorageLayout():
+    '''
+        getStorageLayout - Get the storage layout. @see setStorageLayout
+
+        @return <str> - LAYOUT_INDEXED or LAYOUT_COMPACT
+    '''
+    return _storageLayout
+
+
+def isCompactLayout():
+    '''
+        isCompactLayout - Check if files are stored with the compact layout (see #setStorageLayout)
+
+        @return <bool>
+    '''
+    return bool(_storageLayout == LAYOUT_COMPACT)
+
+
+def getListIndexKeys():
+    '''
+        getListIndexKeys - Get the redis keys of the listing index
+
+        @return tuple( byHostnameKey<str>, byFilenameKey<str> )
+    '''
+    return ( ''.join([INDEXED_REDIS_PREFIX, LIST_BY_HOSTNAME_KEY_NAME]), ''.join([INDEXED_REDIS_PREFIX, LIST_BY_FILENAME_KEY_NAME]) )
+
+
+def getListIndexMembers(hostname, filename, primaryKey):
+    '''
+        getListIndexMembers - Get the members of the listing index for a file
+
+        @param hostname <str> - Hostname
+        @param filename <str> - Filename
+        @param primaryKey <int> - Primary key of the stored object
+
+        @return tuple( byHostnameMember<bytes>, byFilenameMember<bytes> )
+    '''
+    hostname = tobytes(hostname)
+    filename = tobytes(filename)
+    primaryKey = tobytes(str(int(primaryKey)))
+
+    return ( MEMBER_SEPARATOR.join([hostname, filename, primaryKey]), MEMBER_SEPARATOR.join([filename, hostname, primaryKey]) )
+
+
+def getPathIndexKey(hostname):
+    '''
+        getPathIndexKey - Get the redis key of the path index of a hostname
+
+        @param hostname <str> - Hostname
+
+        @return <str> - Redis key
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, PATH_INDEX_KEY_NAME, to_unicode(hostname)])
+
+
+def queueListIndexAdd(pipeline, hostname, filename, primaryKey):
+    '''
+        queueListIndexAdd - Queue onto a pipeline the addition of a file to the listing index and the path index.
+          Adding a file which is already present does nothing.
+
+        @param pipeline - Pipeline (sync or asyncio)
+        @param hostname <str> - Hostname
+        @param filename <str> - Filename
+        @param primaryKey <int> - Primary key of the stored object
+    '''
+    for (key, member) in zip(getListIndexKeys(), getListIndexMembers(hostname, filename, primaryKey)):
+        pipeline.execute_command('ZADD', key, 0, member)
+    pipeline.hset(getPathIndexKey(hostname), tobytes(filename), str(int(primaryKey)))
+
+
+def queueListIndexRemove(pipeline, hostname, filename, primaryKey):
+    '''
+        queueListIndexRemove - Queue onto a pipeline the removal of a file from the listing index and the path index
+
+        @see queueListIndexAdd for params
+    '''
+    for (key, member) in zip(getListIndexKeys(), getListIndexMembers(hostname, filename, primaryKey)):
+        pipeline.execute_command('ZREM', key, member)
+    pipeline.hdel(getPathIndexKey(hostname), tobytes(filename))
+
+
+def iterListIndex(conn, hostname=None, prefix='', batchSize=DEFAULT_LIST_BATCH_SIZE):
+    '''
+        iterListIndex - Iterate over the files in the listing index matching a hostname and/or filename prefix, a batch at a time.
+
+          Each batch is a single ZRANGEBYLEX, so this scales to any number of stored files.
+
+        @param conn <redis.Redis> - Connection
+        @param hostname <str/None> - If provided, only files stored from this hostname. Otherwise, files from every hostname.
+        @param prefix <str> - Only files whose filename starts with this prefix. Empty string matches all.
+        @param batchSize <int> - Maximum number of files per batch
+
+        @return generator< list< tuple(hostname<str>, filename<str>, primaryKey<int>) > > - Batches of files. Sorted by hostname then filename
+            if #hostname is provided, otherwise by filename then hostname.
+    '''
+    (byHostnameKey, byFilenameKey) = getListIndexKeys()
+    if hostname is not None:
+        key = byHostnameKey
+        rangePrefix = tobytes(hostname) + MEMBER_SEPARATOR + tobytes(prefix or '')
+    else:
+        key = byFilenameKey
+        rangePrefix = tobytes(prefix or '')
+
+    rangeStart = b'[' + rangePrefix
+    rangeEnd = b'[' + rangePrefix + LEX_MAX_BYTE
+
+    while True:
+        members = conn.execute_command('ZRANGEBYLEX', key, rangeStart, rangeEnd, 'LIMIT', 0, batchSize)
+        if not members:
+            break
+
+        batch = []
+        for member in members:
+            (first, second, primaryKey) = member.split(MEMBER_SEPARATOR)
+            if hostname is not None:
+                batch.append( (to_unicode(first), to_unicode(second), int(primaryKey)) )
+            else:
+                batch.append( (to_unicode(second), to_unicode(first), int(primaryKey)) )
+        yield batch
+
+        if len(members) < batchSize:
+            break
+        # Continue after (exclusive) the last member of this batch
+        rangeStart = b'(' + members[-1]
+
+
+def iterListIndexHostnames(conn, filename, batchSize=DEFAULT_LIST_BATCH_SIZE):
+    '''
+        iterListIndexHostnames - Iterate over the hostnames a filename is stored from, in the listing index, a batch at a time.
+
+          The members of a filename in the filename set all start with  filename \\0  so they are a single ZRANGEBYLEX (see #iterListIndex).
+
+        @param conn <redis.Redis> - Connection
+        @param filename <str> - Filename
+        @param batchSize <int> - Maximum number of hostnames per batch
+
+        @return generator< list< tuple(hostname<str>, primaryKey<int>) > > - Batches of hostnames, sorted
+    '''
+    for batch in iterListIndex(conn, None, tobytes(filename) + MEMBER_SEPARATOR, batchSize):
+        yield [ (fileHostname, primaryKey) for (fileHostname, _filename, primaryKey) in batch ]
+
+
+def getPathIndexFilenames(conn, hostname):
+    '''
+        getPathIndexFilenames - Get the filenames stored from a hostname, in the path index
+
+        @param conn <redis.Redis> - Connection
+        @param hostname <str> - Hostname
+
+        @return list<str> - Filenames
+    '''
+    return [ to_unicode(filename) for filename in conn.hkeys(getPathIndexKey(hostname)) ]
@@ -0,0 +1,174 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the reading and writing of local files: files being stored are memory-mapped instead of read
+#    into memory, and fetched files are written to a temporary file which is then renamed into place.
+
+# vim: ts=4 sw=4 expandtab
+
+import binascii
+import errno
+import mmap
+import os
+import stat
+
+__all__ = ('TEMP_SUFFIX', 'mapFile', 'AtomicLocalFile')
+
+# TEMP_SUFFIX - Suffix of the temporary file a fetched file is written to, before it is renamed into place
+TEMP_SUFFIX = '.netfetch-tmp'
+
+
+def mapFile(filename):
+    '''
+        mapFile - Get the contents of a file without reading it into memory, as a memoryview of a read-only memory-map.
+
+          The file is paged in as the data is used (i.e. hashed, compressed, or sent to Redis), and those pages belong to the
+            page cache, so no copy of the file is made. The map stays open as long as the memoryview (or a slice of it) is referenced.
+
+          NOTE: The file must not be truncated while it is mapped, reading past the new end raises SIGBUS.
+
+        @param filename <str> - Filename
+
+        @return <memoryview/bytes> - Contents of file. Empty files, and those which cannot be mapped (like those on /proc),
+            are read into bytes instead.
+    '''
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty, or reports no size (so may still have data)
+            return f.read()
+
+        try:
+            fileMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, OSError, ValueError):
+            return f.read()
+
+    if hasattr(fileMap, 'madvise'):
+        try:
+            fileMap.madvise(mmap.MADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            pass
+
+    try:
+        return memoryview(fileMap)
+    except TypeError:
+        # python2's mmap does not support memoryview
+        return fileMap[:]
+
+
+class AtomicLocalFile(object):
+    '''
+        AtomicLocalFile - Write a local file through a temporary file in the same directory, which is renamed over the
+          destination by #commit. Anything reading the destination sees either its previous contents, or all of the new contents.
+
+          The temporary file gets the mode (and, if possible, owner/group) of the file it replaces, or the mode a
+            regular open would have if it is new. A symlink destination is resolved, so its target is replaced.
+
+          If the destination exists but is not a regular file (like /dev/null, or a fifo), it is written directly instead.
+    '''
+
+    def __init__(self, localFilename, size=None):
+        '''
+            @param localFilename <str> - Destination filename
+            @param size <int/None> - If provided, the expected number of bytes, which are allocated up-front so the file
+                is not fragmented as it grows
+
+            @raises OSError/IOError - If the temporary file cannot be created
+        '''
+        if os.path.islink(localFilename):
+            localFilename = os.path.realpath(localFilename)
+
+        self.localFilename = localFilename
+        self.numBytes = 0
+
+        try:
+            currentInfo = os.stat(localFilename)
+        except OSError:
+            currentInfo = None
+
+        if currentInfo is not None and not stat.S_ISREG(currentInfo.st_mode):
+            # tempFilename - Filename being written, or None if writing directly to the destination
+            self.tempFilename = None
+            self._file = open(localFilename, 'wb')
+            return
+
+        (self.tempFilename, fd) = AtomicLocalFile._createTempFile(localFilename)
+        try:
+            if currentInfo is not None:
+                os.fchmod(fd, stat.S_IMODE(currentInfo.st_mode))
+                try:
+                    os.fchown(fd, currentInfo.st_uid, currentInfo.st_gid)
+                except OSError:
+                    pass
+
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    # Not supported by this filesystem, or no room (which writing will report)
+                    pass
+
+            self._file = os.fdopen(fd, 'wb')
+        except:
+            os.close(fd)
+            os.unlink(self.tempFilename)
+            raise
+
+    @staticmethod
+    def _createTempFile(localFilename):
+        '''
+            _createTempFile - Internal. Create a new temporary file next to a destination. It is created like a regular
+              open would create the destination, so the umask is applied to its mode.
+
+            @param localFilename <str> - Destination filename
+
+            @return tuple( tempFilename<str>, fd<int> )
+        '''
+        (dirname, basename) = os.path.split(os.path.abspath(localFilename))
+        while True:
+            tempFilename = os.path.join(dirname, '.%s.%s%s' %(basename, binascii.hexlify(os.urandom(6)).decode('ascii'), TEMP_SUFFIX))
+            try:
+                return (tempFilename, os.open(tempFilename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def write(self, data):
+        '''
+            write - Write some data
+
+            @param data <bytes/memoryview> - Data
+        '''
+        self._file.write(data)
+        self.numBytes += len(data)
+
+    def commit(self):
+        '''
+            commit - Finish writing, and rename the temporary file over the destination.
+
+              Apply any permissions to #tempFilename (when not None) prior to calling this, so the destination never has the wrong ones.
+        '''
+        if self.tempFilename is not None:
+            # Drop any of the up-front allocation which was not used
+            self._file.truncate(self.numBytes)
+        self._file.close()
+
+        if self.tempFilename is not None:
+            os.rename(self.tempFilename, self.localFilename)
+            self.tempFilename = None
+
+    def abort(self):
+        '''
+            abort - Stop writing, and remove the temporary file. The destination is left as it was.
+
+              If writing directly to the destination (see #tempFilename), it is left partially written.
+        '''
+        try:
+            self._file.close()
+        except:
+            pass
+
+        if self.tempFilename is not None:
+            try:
+                os.unlink(self.tempFilename)
+            except:
+                pass
+            self.tempFilename = None
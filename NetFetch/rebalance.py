@@ -0,0 +1,274 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the migration of stored files to the node each belongs to, after nodes are added,
+#    removed, or reweighted (see sharding.py). Used by netFetchRebalance.
+
+# vim: ts=4 sw=4 expandtab
+
+import redis
+
+from IndexedRedis.compat_str import tobytes, to_unicode
+
+from . import NetFetchFile
+from .bulk import BulkResult
+from .chunks import getChunkKey, parseManifest, isDedupChunkId, iterBatches, getBatchSize, acquireDedupChunks, releaseChunks
+from .dictionaries import copyDictionaries
+from .listing import queueListIndexAdd
+from .revisions import INDEX_FIELD, getRevisionsKey, parseRevisionIndex
+from .scripts import LOOKUP_FILE_SCRIPT, runScript
+from .retention import getEvictionKey, queueFileStored
+from .sharding import isSharded, getNodeNames, getNodeForFile, getNodeModel
+
+__all__ = ('DEFAULT_REBALANCE_BATCH_SIZE', 'RebalanceResult', 'rebalance', 'moveFile')
+
+# DEFAULT_REBALANCE_BATCH_SIZE - Default number of files checked per round-trip
+DEFAULT_REBALANCE_BATCH_SIZE = 500
+
+
+#  Files are moved one at a time, while clients keep using NetFetch:
+#
+#    0. (Once, before any file) The compression dictionaries of every node are copied to every other node which is missing them.
+#    1. The chunks (if any, including those of past revisions) are copied to the target node. Deduplicated chunks
+#         already stored there are referenced, not sent.
+#    2. The object (with its history and accounting, see revisions.py and retention.py) is written to the target node in a transaction which WATCHes
+#         the hostname/filename indexes there, so if a client stores the same file on the target node in the meantime,
+#         the copy is dropped (theirs is newer).
+#    3. The file is deleted from the source node.
+#
+#   Until step 3, clients still find the file on the source node (reads look on every node, see NetFetchFile._fetchObj),
+#     and after step 2 they find it on the target node first. A file already stored on its target node (stored after
+#     the node was added) is newer, so the copy on the source node is just deleted.
+#
+#   All clients must be using the new config before rebalancing, otherwise a client may store to (and the rebalance then
+#     delete from) the old node.
+
+
+class RebalanceResult(BulkResult):
+    '''
+        RebalanceResult - The outcome of a rebalance. "numFiles" and "numBytes" are the files moved (or which would be moved, on a dry run)
+    '''
+
+    def __init__(self):
+        BulkResult.__init__(self)
+
+        # numChecked - Number of files checked
+        self.numChecked = 0
+        # numStale - Number of files whose copy on another node was deleted, because a newer copy is on the node they belong to
+        self.numStale = 0
+
+    def __str__(self):
+        return '%d files checked, %d stale copies removed, moved %s' %(self.numChecked, self.numStale, BulkResult.__str__(self))
+
+
+def rebalance(batchSize=DEFAULT_REBALANCE_BATCH_SIZE, dryRun=False, onMove=None):
+    '''
+        rebalance - Move every stored file which is not on the node it belongs to (see sharding.getNodeForFile) to that node.
+
+          Only the files which belong to a different node are read or written, and clients may keep storing and fetching
+            files while this runs. @see moveFile
+
+        @param batchSize <int> - Number of files checked per round-trip
+        @param dryRun <bool> - If True, only count the files which would be moved
+        @param onMove <function/None> - If provided, called as onMove(hostname, filename, sourceNodeName, targetNodeName) before each file is moved
+
+        @return <RebalanceResult> - Number of files checked, moved, and stale, and any errors
+
+        @raises ValueError - If multiple nodes are not configured (see sharding.setRedisNodes)
+    '''
+    if not isSharded():
+        raise ValueError('Multiple redis nodes are not configured.')
+
+    result = RebalanceResult()
+
+    if not dryRun:
+        # Every node holds every compression dictionary (see dictionaries.py), including any node added since they were trained
+        for sourceNodeName in getNodeNames():
+            for targetNodeName in getNodeNames():
+                if targetNodeName != sourceNodeName:
+                    copyDictionaries(getNodeModel(NetFetchFile, sourceNodeName)._getConnection(), getNodeModel(NetFetchFile, targetNodeName)._getConnection())
+
+    # The files of every node are read before any are moved, so a moved file is not checked again on its new node
+    nodePrimaryKeys = []
+    for sourceNodeName in getNodeNames():
+        sourceModel = getNodeModel(NetFetchFile, sourceNodeName)
+        primaryKeys = sourceModel._getConnection().smembers(sourceModel.objects._get_ids_key())
+        nodePrimaryKeys.append( (sourceNodeName, sorted( [ int(primaryKey) for primaryKey in primaryKeys ] )) )
+
+    for (sourceNodeName, primaryKeys) in nodePrimaryKeys:
+        sourceModel = getNodeModel(NetFetchFile, sourceNodeName)
+        conn = sourceModel._getConnection()
+        helper = sourceModel.objects
+
+        for batch in iterBatches(primaryKeys, batchSize):
+            pipeline = conn.pipeline(transaction=False)
+            for primaryKey in batch:
+                pipeline.hmget(helper._get_key_for_id(primaryKey), ['hostname', 'filename', 'size'])
+            results = pipeline.execute()
+
+            for (hostname, filename, size) in results:
+                if hostname is None or filename is None:
+                    # Deleted since the ids were read
+                    continue
+
+                (hostname, filename) = (to_unicode(hostname), to_unicode(filename))
+                result.numChecked += 1
+
+                targetNodeName = getNodeForFile(hostname, filename)
+                if targetNodeName == sourceNodeName:
+                    continue
+
+                if onMove is not None:
+                    onMove(hostname, filename, sourceNodeName, targetNodeName)
+
+                if dryRun:
+                    result.addFile(int(size or 0))
+                    continue
+
+                try:
+                    isMoved = moveFile(hostname, filename, sourceNodeName, targetNodeName)
+                except Exception as e:
+                    result.addError('%s:%s' %(hostname, filename), e)
+                    continue
+
+                if isMoved:
+                    result.addFile(int(size or 0))
+                else:
+                    result.numStale += 1
+
+    result.finish()
+    return result
+
+
+def moveFile(hostname, filename, sourceNodeName, targetNodeName):
+    '''
+        moveFile - Move a file from one node to another. @see rebalance
+
+        @param hostname <str> - Hostname of file
+        @param filename <str> - Filename of file
+        @param sourceNodeName <str> - Node the file is on
+        @param targetNodeName <str> - Node to move it to
+
+        @return <bool> - True if the file was moved. False if the target node already has (a newer copy of) the file,
+            in which case it is only deleted from the source node, or if the file was deleted meanwhile.
+    '''
+    sourceModel = getNodeModel(NetFetchFile, sourceNodeName)
+    targetModel = getNodeModel(NetFetchFile, targetNodeName)
+
+    sourceConn = sourceModel._getConnection()
+    targetConn = targetModel._getConnection()
+
+    (indexKeys, args) = NetFetchFile._getFetchScriptParams(hostname, filename)
+
+    primaryKey = runScript(sourceConn, LOOKUP_FILE_SCRIPT, indexKeys, args)
+    if primaryKey is None:
+        return False
+    primaryKey = int(primaryKey)
+
+    storedDict = sourceConn.hgetall(sourceModel.objects._get_key_for_id(primaryKey))
+    if not storedDict:
+        return False
+
+    revisionsKey = getRevisionsKey(hostname, filename)
+    revisionsDict = sourceConn.hgetall(revisionsKey)
+
+    # Keeps its place in the eviction order, which may be by when last fetched
+    accessTime = sourceConn.zscore(getEvictionKey(hostname), tobytes(filename)) or storedDict.get(b'mtime', None)
+
+    isMoved = False
+    with targetConn.pipeline() as pipeline:
+        pipeline.watch(*indexKeys)
+        # Same as scripts.LOOKUP_FILE_SCRIPT, which cannot be run while watching
+        if not pipeline.hexists(indexKeys[2], filename) and not pipeline.sinter(indexKeys[:2]):
+            chunkIds = _getFileChunkIds(storedDict, revisionsDict)
+            _copyChunks(sourceConn, targetConn, chunkIds, int(storedDict.get(b'chunkSize', None) or 0))
+
+            saver = targetModel._getSaver()
+            indexedValues = { 'hostname' : hostname, 'filename' : filename }
+            newId = int(targetConn.incr(saver._get_next_id_key()))
+            key = saver._get_key_for_id(newId)
+
+            pipeline.multi()
+            for (fieldName, value) in storedDict.items():
+                pipeline.hset(key, fieldName, value)
+            saver._add_id_to_keys(newId, pipeline)
+            for indexedField in saver.indexedFields:
+                saver._add_id_to_index(indexedField, newId, indexedValues[str(indexedField)], pipeline)
+            queueListIndexAdd(pipeline, hostname, filename, newId)
+            queueFileStored(pipeline, hostname, filename, int(storedDict.get(b'size', None) or 0), float(accessTime or 0.0),
+                float(storedDict.get(b'expires', None) or 0.0))
+
+            pipeline.delete(revisionsKey)
+            for (fieldName, value) in revisionsDict.items():
+                pipeline.hset(revisionsKey, fieldName, value)
+
+            try:
+                pipeline.execute()
+                isMoved = True
+            except redis.WatchError:
+                # A client stored this file on the target node meanwhile
+                releaseChunks(targetConn, chunkIds)
+
+    # The file is unchanged, so watchers are not told it was deleted (see events.py)
+    sourceModel.deleteFile(hostname, filename, notify=False)
+
+    return isMoved
+
+
+def _getFileChunkIds(storedDict, revisionsDict):
+    '''
+        _getFileChunkIds - Internal. Get the chunks of a file and of its past revisions, to copy to another node
+
+        @param storedDict <dict> - Stored fields of the object (from HGETALL)
+        @param revisionsDict <dict> - Its revisions hash (from HGETALL), empty if it has none
+
+        @return list<str> - Chunk ids. A deduplicated chunk is listed once per reference, others only once.
+    '''
+    chunkIds = [ entry.chunkId for entry in parseManifest(to_unicode(storedDict.get(b'chunks', None) or b'')) ]
+    for revision in parseRevisionIndex(revisionsDict.get(tobytes(INDEX_FIELD), None)):
+        chunkIds += revision.getChunkIds()
+
+    ret = []
+    seen = set()
+    for chunkId in chunkIds:
+        if isDedupChunkId(chunkId):
+            ret.append(chunkId)
+        elif chunkId not in seen:
+            seen.add(chunkId)
+            ret.append(chunkId)
+    return ret
+
+
+def _copyChunks(sourceConn, targetConn, chunkIds, chunkSize):
+    '''
+        _copyChunks - Internal. Copy chunks from one node to another, in pipelined batches.
+          A reference is added on the target node to each deduplicated chunk, which is only sent if not already stored there.
+
+        @param sourceConn <redis.Redis> - Connection to the source node
+        @param targetConn <redis.Redis> - Connection to the target node
+        @param chunkIds list<str> - Chunk ids, as listed in the manifest
+        @param chunkSize <int> - Chunk size of the file, to size the batches
+
+        @raises ValueError - If a chunk is missing on the source node. Any references added are released.
+    '''
+    dedupChunkIds = [ chunkId for chunkId in chunkIds if isDedupChunkId(chunkId) ]
+    alreadyStored = set()
+    if dedupChunkIds:
+        alreadyStored = set( [ chunkId for (chunkId, isStored) in zip(dedupChunkIds, acquireDedupChunks(targetConn, dedupChunkIds)) if isStored ] )
+
+    toCopy = [ chunkId for chunkId in chunkIds if chunkId not in alreadyStored ]
+    try:
+        for batch in iterBatches(toCopy, getBatchSize(chunkSize)):
+            pipeline = sourceConn.pipeline(transaction=False)
+            for chunkId in batch:
+                pipeline.get(getChunkKey(chunkId))
+            blocks = pipeline.execute()
+
+            pipeline = targetConn.pipeline(transaction=False)
+            for (chunkId, block) in zip(batch, blocks):
+                if block is None:
+                    raise ValueError('Missing chunk %s on source node. Was the file updated or deleted while moving?' %(chunkId,))
+                pipeline.set(getChunkKey(chunkId), block)
+            pipeline.execute()
+    except:
+        releaseChunks(targetConn, chunkIds)
+        raise
@@ -0,0 +1,363 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the retention of stored files: the expiry of files stored with a TTL, and the storage budget,
+#    which evicts the oldest (or least-recently fetched) files of a hostname once it stores more than allowed.
+
+# vim: ts=4 sw=4 expandtab
+
+import time
+
+from IndexedRedis import INDEXED_REDIS_PREFIX
+
+from IndexedRedis.compat_str import tobytes, to_unicode
+
+__all__ = ('EVICT_OLDEST', 'EVICT_LRU', 'EVICTION_POLICIES', 'DEFAULT_EXPIRE_BATCH_SIZE', 'EXPIRE_SWEEP_INTERVAL',
+            'setStorageBudget', 'getStorageBudget', 'isBudgetEnabled', 'isAccessTracked', 'getExpireTime', 'isExpired',
+            'getUsageKey', 'getExpiryKey', 'getEvictionKey', 'queueFileStored', 'queueFileRemoved', 'queueFilesAccessed',
+            'getExpiredFiles', 'removeExpiryMembers', 'getEvictionCandidates', 'removeEvictionMembers', 'getUsage', 'isExpireSweepDue',
+)
+
+# EVICT_* - Which files are evicted first when a hostname is over its storage budget
+#
+#   EVICT_OLDEST - The files stored longest ago
+#   EVICT_LRU    - The files fetched (or stored) longest ago
+EVICT_OLDEST = 'oldest'
+EVICT_LRU = 'lru'
+
+EVICTION_POLICIES = (EVICT_OLDEST, EVICT_LRU)
+
+# USAGE_KEY_NAME - Name of the hash of hostname -> total size (in bytes) of the files stored from it
+USAGE_KEY_NAME = 'NetFetchFile:usage'
+
+# EXPIRY_KEY_NAME - Name of the sorted set with a member (hostname \0 filename) per file stored with a TTL, scored by when it expires
+EXPIRY_KEY_NAME = 'NetFetchFile:expiry'
+
+# EVICTION_KEY_NAME - Name of the sorted sets (one per hostname, suffixed by the hostname) with a member (filename) per file,
+#   scored by when it was stored, or (with EVICT_LRU) last fetched
+EVICTION_KEY_NAME = 'NetFetchFile:eviction:'
+
+# DEFAULT_EXPIRE_BATCH_SIZE - Default number of expired files deleted per round-trip
+DEFAULT_EXPIRE_BATCH_SIZE = 500
+
+# EXPIRE_SWEEP_INTERVAL - Seconds between the sweeps of expired files which are run as files are stored (see isExpireSweepDue)
+EXPIRE_SWEEP_INTERVAL = 60.0
+
+
+#  Each node keeps the retention keys of the files stored on it, written in the same pipeline as the file itself:
+#
+#    usage hash:        hostname -> sum of the sizes of its files (HINCRBY by the change in size)
+#    expiry set:        hostname \0 filename, scored by the "expires" field of the file (only files with a TTL)
+#    eviction set:      per hostname, filename scored by mtime (or the time last fetched, with EVICT_LRU)
+#
+#   An expired file is never returned (it is as if it does not exist), and is deleted when next fetched, or by a sweep
+#     of the expiry set (NetFetchFile.expireFiles), which is also run every EXPIRE_SWEEP_INTERVAL as files are stored.
+#
+#   The storage budget is checked after each store: while the usage of the hostname (over every node) is over
+#     budget, the first files of its eviction sets are deleted. The file just stored is never evicted.
+#
+#   Sizes are those of the data (the "size" field), not the space used in redis, and past revisions are not counted.
+
+
+global _maxBytesPerHost
+_maxBytesPerHost = None
+
+global _evictionPolicy
+_evictionPolicy = EVICT_OLDEST
+
+global _lastExpireSweep
+_lastExpireSweep = 0.0
+
+
+def setStorageBudget(maxBytes=None, policy=EVICT_OLDEST):
+    '''
+        setStorageBudget - Set the storage budget, the most bytes stored per hostname before files are evicted
+
+        @param maxBytes <int/None> - Maximum total size of the files of each hostname. None (the default) has no budget.
+        @param policy <str> - Which files are evicted first, EVICT_OLDEST (default) or EVICT_LRU
+
+        @raises ValueError - If maxBytes is not positive, or policy is unknown
+    '''
+    global _maxBytesPerHost, _evictionPolicy
+
+    if maxBytes is not None and maxBytes <= 0:
+        raise ValueError('Storage budget must be positive.')
+    if policy not in EVICTION_POLICIES:
+        raise ValueError('Unknown eviction policy "%s". Supported policies are: %s' %(policy, ', '.join(EVICTION_POLICIES)))
+
+    _maxBytesPerHost = maxBytes
+    _evictionPolicy = policy
+
+
+def getStorageBudget():
+    '''
+        getStorageBudget - Get the storage budget. @see setStorageBudget
+
+        @return tuple( maxBytes<int/None>, policy<str> )
+    '''
+    return (_maxBytesPerHost, _evictionPolicy)
+
+
+def isBudgetEnabled():
+    '''
+        isBudgetEnabled - Check if there is a storage budget
+
+        @return <bool>
+    '''
+    return bool(_maxBytesPerHost)
+
+
+def isAccessTracked():
+    '''
+        isAccessTracked - Check if fetching a file marks it as recently used (the budget evicts by EVICT_LRU)
+
+        @return <bool>
+    '''
+    return bool(_maxBytesPerHost and _evictionPolicy == EVICT_LRU)
+
+
+def isExpireSweepDue(now=None):
+    '''
+        isExpireSweepDue - Check if EXPIRE_SWEEP_INTERVAL has passed since the last sweep run as files were stored.
+          If so, that sweep is considered run now.
+
+        @param now <float/None> - Current time. Default is time.time()
+
+        @return <bool>
+    '''
+    global _lastExpireSweep
+
+    if now is None:
+        now = time.time()
+    if now - _lastExpireSweep < EXPIRE_SWEEP_INTERVAL:
+        return False
+
+    _lastExpireSweep = now
+    return True
+
+
+def getExpireTime(ttl, now=None):
+    '''
+        getExpireTime - Get the value of the "expires" field of a file stored with a TTL
+
+        @param ttl <float/None> - Seconds until the file expires, or None for never
+        @param now <float/None> - Time the file is stored. Default is time.time()
+
+        @return <float> - Seconds since epoch, or 0.0 for never
+
+        @raises ValueError - If ttl is not positive
+    '''
+    if ttl is None:
+        return 0.0
+    if ttl <= 0:
+        raise ValueError('TTL must be positive.')
+
+    if now is None:
+        now = time.time()
+    return now + ttl
+
+
+def isExpired(expires, now=None):
+    '''
+        isExpired - Check if a file has expired
+
+        @param expires <float/bytes/None> - The "expires" field of the file, as stored or converted
+        @param now <float/None> - Current time. Default is time.time()
+
+        @return <bool>
+    '''
+    try:
+        expires = float(expires or 0.0)
+    except ValueError:
+        return False
+
+    if not expires:
+        return False
+    if now is None:
+        now = time.time()
+    return expires <= now
+
+
+def getUsageKey():
+    '''
+        getUsageKey - Get the redis key of the usage hash
+
+        @return <str>
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, USAGE_KEY_NAME])
+
+
+def getExpiryKey():
+    '''
+        getExpiryKey - Get the redis key of the expiry set
+
+        @return <str>
+    '''
+    return ''.join([INDEXED_REDIS_PREFIX, EXPIRY_KEY_NAME])
+
+
+def getEvictionKey(hostname):
+    '''
+        getEvictionKey - Get the redis key of the eviction set of a hostname
+
+        @param hostname <str> - Hostname
+
+        @return <bytes>
+    '''
+    return b''.join([tobytes(INDEXED_REDIS_PREFIX), tobytes(EVICTION_KEY_NAME), tobytes(hostname)])
+
+
+def _getExpiryMember(hostname, filename):
+    '''
+        _getExpiryMember - Internal. Get the member of the expiry set for a file
+
+        @return <bytes>
+    '''
+    return b'\x00'.join([tobytes(hostname), tobytes(filename)])
+
+
+def queueFileStored(pipeline, hostname, filename, size, mtime, expires=0.0, previousSize=0, keepAccessTime=False):
+    '''
+        queueFileStored - Queue onto a pipeline the accounting of a file which was stored (created or replaced)
+
+        @param pipeline - Pipeline (sync or asyncio), which should be the one that writes the file
+        @param hostname <str> - Hostname
+        @param filename <str> - Filename
+        @param size <int> - Size of the file
+        @param mtime <float> - Time the file was stored
+        @param expires <float> - The "expires" field of the file (see #getExpireTime), 0.0 for never
+        @param previousSize <int> - Size of the file it replaces, if any
+        @param keepAccessTime <bool> - If True, a file already in the eviction set keeps its score (for rebuilding the accounting)
+    '''
+    sizeDelta = int(size or 0) - int(previousSize or 0)
+    if sizeDelta:
+        pipeline.hincrby(getUsageKey(), hostname, sizeDelta)
+
+    evictionArgs = keepAccessTime and ['NX'] or []
+    pipeline.execute_command('ZADD', getEvictionKey(hostname), *(evictionArgs + [repr(float(mtime or 0.0)), tobytes(filename)]))
+
+    if expires:
+        pipeline.execute_command('ZADD', getExpiryKey(), repr(float(expires)), _getExpiryMember(hostname, filename))
+    else:
+        pipeline.execute_command('ZREM', getExpiryKey(), _getExpiryMember(hostname, filename))
+
+
+def queueFileRemoved(pipeline, hostname, filename, size):
+    '''
+        queueFileRemoved - Queue onto a pipeline the accounting of a file which was deleted
+
+        @param pipeline - Pipeline (sync or asyncio), which should be the one that deletes the file
+        @param hostname <str> - Hostname
+        @param filename <str> - Filename
+        @param size <int> - Size of the file
+    '''
+    if size:
+        pipeline.hincrby(getUsageKey(), hostname, -int(size))
+
+    pipeline.execute_command('ZREM', getEvictionKey(hostname), tobytes(filename))
+    pipeline.execute_command('ZREM', getExpiryKey(), _getExpiryMember(hostname, filename))
+
+
+def queueFilesAccessed(pipeline, hostname, filenames, now=None):
+    '''
+        queueFilesAccessed - Queue onto a pipeline the marking of files as fetched, for EVICT_LRU. Files no longer stored are not added.
+
+        @param pipeline - Pipeline or connection (sync or asyncio)
+        @param hostname <str> - Hostname
+        @param filenames list<str> - Filenames
+        @param now <float/None> - Time fetched. Default is time.time()
+    '''
+    if not filenames:
+        return
+
+    score = repr(float(now or time.time()))
+    args = []
+    for filename in filenames:
+        args += [score, tobytes(filename)]
+
+    return pipeline.execute_command('ZADD', getEvictionKey(hostname), 'XX', *args)
+
+
+def getExpiredFiles(conn, now=None, count=DEFAULT_EXPIRE_BATCH_SIZE):
+    '''
+        getExpiredFiles - Get files of the expiry set which have expired, those which expired first first
+
+        @param conn <redis.Redis> - Connection
+        @param now <float/None> - Current time. Default is time.time()
+        @param count <int> - Most files returned
+
+        @return list< tuple(hostname<str>, filename<str>) >
+    '''
+    if now is None:
+        now = time.time()
+
+    members = conn.execute_command('ZRANGEBYSCORE', getExpiryKey(), '-inf', repr(float(now)), 'LIMIT', 0, count)
+
+    ret = []
+    for member in members:
+        (hostname, filename) = member.split(b'\x00', 1)
+        ret.append( (to_unicode(hostname), to_unicode(filename)) )
+    return ret
+
+
+def removeExpiryMembers(pipeline, files):
+    '''
+        removeExpiryMembers - Queue onto a pipeline the removal of files from the expiry set (without deleting them)
+
+        @param pipeline - Pipeline (sync or asyncio)
+        @param files list< tuple(hostname<str>, filename<str>) > - Files
+    '''
+    if files:
+        pipeline.execute_command('ZREM', getExpiryKey(), *[ _getExpiryMember(hostname, filename) for (hostname, filename) in files ])
+
+
+def getEvictionCandidates(conn, hostname, count):
+    '''
+        getEvictionCandidates - Get the first files of the eviction set of a hostname
+
+        @param conn <redis.Redis> - Connection
+        @param hostname <str> - Hostname
+        @param count <int> - Most files returned
+
+        @return list< tuple(score<float>, filename<str>) > - Files, those to evict first first
+    '''
+    results = conn.execute_command('ZRANGE', getEvictionKey(hostname), 0, count - 1, 'WITHSCORES')
+
+    # redis-py parses WITHSCORES into pairs only through its zrange method, whose signature changed in 3.0
+    if results and not isinstance(results[0], (list, tuple)):
+        results = zip(results[0::2], results[1::2])
+
+    return [ (float(score), to_unicode(filename)) for (filename, score) in results ]
+
+
+def removeEvictionMembers(pipeline, hostname, filenames):
+    '''
+        removeEvictionMembers - Queue onto a pipeline the removal of files from the eviction set of a hostname (without deleting them)
+
+        @param pipeline - Pipeline (sync or asyncio)
+        @param hostname <str> - Hostname
+        @param filenames list<str> - Filenames
+    '''
+    if filenames:
+        pipeline.execute_command('ZREM', getEvictionKey(hostname), *[ tobytes(filename) for filename in filenames ])
+
+
+def getUsage(conn, hostname=None):
+    '''
+        getUsage - Get the total size of the files stored on a node, per hostname
+
+        @param conn <redis.Redis> - Connection
+        @param hostname <str/None> - If provided, only this hostname
+
+        @return dict<str, int> - Hostname -> bytes. Hostnames with nothing stored are omitted.
+    '''
+    if hostname is not None:
+        usage = { hostname : conn.hget(getUsageKey(), hostname) }
+    else:
+        usage = conn.hgetall(getUsageKey())
+
+    ret = {}
+    for (usageHostname, numBytes) in usage.items():
+        numBytes = int(numBytes or 0)
+        if numBytes > 0:
+            ret[to_unicode(usageHostname)] = numBytes
+    return ret
@@ -0,0 +1,584 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the revision history of stored files: the policy of how many past revisions are kept,
+#    and the records of those revisions, which are (mostly) binary deltas against the next newer revision.
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import time
+
+from IndexedRedis import INDEXED_REDIS_PREFIX
+
+from IndexedRedis.compat_str import tobytes, to_unicode
+
+from .chunks import parseManifest, isDedupChunkId
+from .delta import makeDelta, applyDelta
+
+__all__ = ('REVISION_FORMAT_DELTA', 'REVISION_FORMAT_FULL', 'REVISION_FORMAT_CURRENT', 'MAX_DELTA_FILE_SIZE', 'setRevisionPolicy',
+            'getRevisionPolicy', 'isRevisionsEnabled', 'getRevisionsKey', 'getRevisionsKeyPattern', 'parseRevisionsKey', 'Revision', 'PendingRevision', 'buildRevision', 'decodeRevision',
+            'queueRevisionsDelete', 'getDeletedChunkIds', 'applyRevisionPolicy', 'getRevisionChunkIds', 'getReleasableChunkIds',
+            'parseRevisionIndex', 'dumpRevisionIndex', 'parseAge',
+)
+
+# REVISIONS_KEY_NAME - Name of the hash which holds the past revisions of a file. Suffixed by hostname \0 filename.
+REVISIONS_KEY_NAME = 'NetFetchFile:revisions:'
+
+# INDEX_FIELD - Field of the revisions hash which holds the list of revisions (a JSON list of Revision, newest first).
+#   Each revision's payload is in the field named by its revision number.
+INDEX_FIELD = 'index'
+
+# REVISION_FORMAT_* - How the payload of a revision is stored
+#
+#   REVISION_FORMAT_DELTA - The data (encrypted if the revision was), as a delta against the data of the next newer revision (see delta.py)
+#   REVISION_FORMAT_FULL  - The stored fields of the object, as they were. Used when a delta cannot be made: for chunked files
+#                             (whose chunks are kept), files encrypted with another password, files larger than MAX_DELTA_FILE_SIZE,
+#                             or when the delta would not be smaller.
+REVISION_FORMAT_DELTA = 'delta'
+REVISION_FORMAT_FULL = 'full'
+# REVISION_FORMAT_CURRENT - Not stored. The current revision of a file, as listed by NetFetchFile.listRevisions
+REVISION_FORMAT_CURRENT = 'current'
+
+# MAX_DELTA_FILE_SIZE - Largest file (of either revision) which is stored as a delta
+MAX_DELTA_FILE_SIZE = 16 * 1024 * 1024
+
+# AGE_UNITS - Suffixes of an age (see parseAge), and their number of seconds
+AGE_UNITS = {
+    's' : 1,
+    'm' : 60,
+    'h' : 60 * 60,
+    'd' : 24 * 60 * 60,
+    'w' : 7 * 24 * 60 * 60,
+}
+
+
+#  Revisions are numbered (the "revision" field of the stored object), starting at 1 and increasing each time the file
+#    is stored. When a file is replaced and revisions are enabled (see setRevisionPolicy), the replaced revision is added
+#    to the revisions hash of the file, as a delta against the data which replaced it. So each revision is rebuilt from
+#    the current data by applying the deltas of every revision between, newest first.
+#
+#   Only the oldest revisions are ever removed (by count or age, see applyRevisionPolicy), so the revisions kept are
+#    always rebuildable. Every client which stores files should use the same policy: a client with revisions
+#    disabled replaces the current data without adding it to the history, which leaves the older revisions unrebuildable.
+#
+#   A full revision of a chunked file keeps its chunks: their references (dedup chunks) are released, or the chunks
+#     deleted, only when the revision is removed.
+
+
+global _keepRevisions
+_keepRevisions = 0
+
+global _maxRevisionAge
+_maxRevisionAge = None
+
+
+def setRevisionPolicy(keep=0, maxAge=None):
+    '''
+        setRevisionPolicy - Set how many past revisions of each file are kept when it is replaced
+
+        @param keep <int> - Number of past revisions kept per file. 0 (the default) keeps none, so files are replaced in-place.
+        @param maxAge <float/None> - If provided, past revisions older than this many seconds (by the time they were
+            stored) are removed whenever the file is stored again, or by pruneRevisions.
+
+        @raises ValueError - If keep is negative, or maxAge is not positive
+    '''
+    global _keepRevisions, _maxRevisionAge
+
+    keep = int(keep or 0)
+    if keep < 0:
+        raise ValueError('Number of revisions to keep cannot be negative.')
+    if maxAge is not None and maxAge <= 0:
+        raise ValueError('Maximum revision age must be positive.')
+
+    _keepRevisions = keep
+    _maxRevisionAge = maxAge
+
+
+def getRevisionPolicy():
+    '''
+        getRevisionPolicy - Get the revision policy. @see setRevisionPolicy
+
+        @return tuple( keep<int>, maxAge<float/None> )
+    '''
+    return (_keepRevisions, _maxRevisionAge)
+
+
+def isRevisionsEnabled():
+    '''
+        isRevisionsEnabled - Check if past revisions are kept
+
+        @return <bool>
+    '''
+    return _keepRevisions > 0
+
+
+def parseAge(ageStr):
+    '''
+        parseAge - Parse an age, like "3600", "90m", "12h", "30d", or "2w"
+
+        @param ageStr <str> - Age, in seconds or with a unit suffix (s, m, h, d, w)
+
+        @return <float> - Number of seconds
+
+        @raises ValueError - If not a positive age
+    '''
+    ageStr = ageStr.strip().lower()
+    multiplier = 1
+    if ageStr and ageStr[-1] in AGE_UNITS:
+        multiplier = AGE_UNITS[ageStr[-1]]
+        ageStr = ageStr[:-1]
+
+    try:
+        age = float(ageStr) * multiplier
+    except ValueError:
+        raise ValueError('Invalid age "%s". Use a number of seconds, or a number followed by s, m, h, d, or w.' %(ageStr,))
+    if age <= 0:
+        raise ValueError('Age must be positive.')
+
+    return age
+
+
+def getRevisionsKey(hostname, filename):
+    '''
+        getRevisionsKey - Get the redis key of the revisions hash of a file
+
+        @param hostname <str> - Hostname
+        @param filename <str> - Filename
+
+        @return <bytes>
+    '''
+    return b''.join([tobytes(INDEXED_REDIS_PREFIX), tobytes(REVISIONS_KEY_NAME), tobytes(hostname), b'\x00', tobytes(filename)])
+
+
+def getRevisionsKeyPattern(hostname=None):
+    '''
+        getRevisionsKeyPattern - Get the pattern (see SCAN) matching the revisions hash of every file of a hostname
+
+        @param hostname <str/None> - Hostname, or None for every hostname
+
+        @return <bytes>
+    '''
+    prefix = tobytes(INDEXED_REDIS_PREFIX) + tobytes(REVISIONS_KEY_NAME)
+    if hostname is None:
+        return prefix + b'*'
+
+    # Escape any glob characters of the hostname (backslash first)
+    hostname = tobytes(hostname)
+    for char in (b'\\', b'*', b'?', b'[', b']'):
+        hostname = hostname.replace(char, b'\\' + char)
+
+    return prefix + hostname + b'\x00*'
+
+
+def parseRevisionsKey(key):
+    '''
+        parseRevisionsKey - Get the hostname and filename of a revisions hash
+
+        @param key <bytes> - Key, from #getRevisionsKey
+
+        @return tuple( hostname<str>, filename<str> )
+    '''
+    (hostname, filename) = tobytes(key)[len(tobytes(INDEXED_REDIS_PREFIX) + tobytes(REVISIONS_KEY_NAME)) : ].split(b'\x00', 1)
+    return (to_unicode(hostname), to_unicode(filename))
+
+
+class Revision(object):
+    '''
+        Revision - A past revision of a file, as listed in the index of its revisions hash
+    '''
+
+    # _ATTRIBUTES - Attributes which are stored in the index, and their defaults
+    _ATTRIBUTES = (
+        ('revision', 0),
+        ('mtime', 0.0),
+        ('checksum', ''),
+        ('checksumType', ''),
+        ('size', 0),
+        ('format', REVISION_FORMAT_FULL),
+        # REVISION_FORMAT_DELTA only: the revision the delta is against, the checksum of the delta, and its encryption
+        ('baseRevision', 0),
+        ('deltaChecksum', ''),
+        ('encrypted', '0'),
+        ('encryption', ''),
+        ('mode', ''),
+        ('owner', ''),
+        ('group', ''),
+        # REVISION_FORMAT_FULL only: every stored field except "data" (which is the payload)
+        ('fields', None),
+        # Size of the payload
+        ('storedSize', 0),
+    )
+
+    def __init__(self, **kwargs):
+        for (name, default) in Revision._ATTRIBUTES:
+            setattr(self, name, kwargs.pop(name, default))
+        if kwargs:
+            raise TypeError('Unknown revision attributes: %s' %(', '.join(kwargs.keys()),))
+
+    def asDict(self):
+        '''
+            asDict - Get this revision as stored in the index
+
+            @return <dict>
+        '''
+        return dict( [ (name, getattr(self, name)) for (name, default) in Revision._ATTRIBUTES ] )
+
+    @classmethod
+    def fromDict(cls, values):
+        '''
+            fromDict - Get a revision as stored in the index
+
+            @param values <dict> - From #asDict
+
+            @return <Revision>
+        '''
+        names = set( [ name for (name, default) in Revision._ATTRIBUTES ] )
+        return cls(**dict( [ (str(name), value) for (name, value) in values.items() if name in names ] ))
+
+    @classmethod
+    def fromObj(cls, obj, format=REVISION_FORMAT_CURRENT):
+        '''
+            fromObj - Get the revision of an object
+
+            @param obj <NetFetchFile> - The object
+            @param format <str> - Format of the revision
+
+            @return <Revision>
+        '''
+        return cls(
+            revision=int(obj.revision or 0),
+            mtime=float(obj.mtime or 0.0),
+            checksum=to_unicode(obj.checksum or ''),
+            checksumType=to_unicode(obj.checksumType or ''),
+            size=int(obj.size or 0),
+            format=format,
+            mode=to_unicode(obj.mode or ''),
+            owner=to_unicode(obj.owner or ''),
+            group=to_unicode(obj.group or ''),
+        )
+
+    def isEncrypted(self):
+        '''
+            isEncrypted - Check if this revision is encrypted (and so requires a password to rebuild)
+
+            @return <bool>
+        '''
+        if self.format == REVISION_FORMAT_FULL:
+            return bool(self.fields and self.fields.get('encrypted', None) == '1')
+        return self.encrypted == '1'
+
+    def getChunkIds(self):
+        '''
+            getChunkIds - Get the chunks this revision keeps (a full revision of a chunked file)
+
+            @return list<str> - Chunk ids, as listed in the manifest
+        '''
+        if self.format != REVISION_FORMAT_FULL or not self.fields:
+            return []
+        return [ entry.chunkId for entry in parseManifest(self.fields.get('chunks', None) or '') ]
+
+    def __repr__(self):
+        return 'Revision(%d, %s, mtime=%s, size=%d)' %(self.revision, self.format, repr(self.mtime), self.size)
+
+
+def parseRevisionIndex(indexData):
+    '''
+        parseRevisionIndex - Parse the index of a revisions hash
+
+        @param indexData <bytes/None> - Value of the index field, or None if there is no revisions hash
+
+        @return list<Revision> - Revisions, newest first
+    '''
+    if not indexData:
+        return []
+    return [ Revision.fromDict(values) for values in json.loads(to_unicode(indexData)) ]
+
+
+def dumpRevisionIndex(revisions):
+    '''
+        dumpRevisionIndex - Get the index of a revisions hash
+
+        @param revisions list<Revision> - Revisions, newest first
+
+        @return <str> - JSON
+    '''
+    return json.dumps( [ revision.asDict() for revision in revisions ], sort_keys=True )
+
+
+def buildRevision(oldObj, oldStoredDict, newData, password=None):
+    '''
+        buildRevision - Build the revision of an object which is being replaced
+
+        @param oldObj <NetFetchFile> - The object being replaced, as stored (see NetFetchFile._objFromStorage)
+        @param oldStoredDict <dict> - The stored fields (bytes -> bytes) of #oldObj
+        @param newData <bytes/memoryview/None> - The (unencrypted) data replacing it, or None if it is not available
+            (i.e. is being stored in chunks), in which case a full revision is built
+        @param password <str/None> - The password the new data is encrypted with. If #oldObj is encrypted, a delta
+            is only built if this is its password too.
+
+        @return tuple( Revision, payload<bytes> )
+    '''
+    revision = Revision.fromObj(oldObj)
+
+    delta = None
+    if newData is not None and not oldObj.chunks and revision.size <= MAX_DELTA_FILE_SIZE and len(newData) <= MAX_DELTA_FILE_SIZE:
+        delta = _buildDelta(oldObj, newData, password)
+
+    oldData = oldStoredDict.get(b'data', None) or b''
+    if delta is not None and len(delta[0]) < len(oldData):
+        revision.format = REVISION_FORMAT_DELTA
+        revision.encrypted = oldObj.encrypted == '1' and '1' or '0'
+        revision.encryption = to_unicode(oldObj.encryption or '')
+        (payload, revision.deltaChecksum) = delta
+    else:
+        revision.format = REVISION_FORMAT_FULL
+        revision.fields = dict( [ (to_unicode(name), to_unicode(value)) for (name, value) in oldStoredDict.items() if name != b'data' ] )
+        payload = oldData
+
+    revision.storedSize = len(payload)
+    return (revision, payload)
+
+
+def _buildDelta(oldObj, newData, password):
+    '''
+        _buildDelta - Internal. Build the delta of an object's data against the data replacing it, encrypted if the object was
+
+        @return tuple( delta<bytes>, checksum<str> )/None - The delta (encrypted, if the object was) and the checksum
+            of the unencrypted delta. None if the object's data cannot be read with #password.
+    '''
+    from . import NetFetchFile, InvalidPasswordException
+
+    isEncrypted = bool(oldObj.encrypted == '1')
+    if isEncrypted != bool(password):
+        return None
+
+    try:
+        oldData = oldObj.getData(password)
+    except InvalidPasswordException:
+        return None
+
+    delta = makeDelta(newData, oldData)
+    deltaChecksum = NetFetchFile.calculateChecksum(delta, oldObj.checksumType)
+    if not isEncrypted:
+        return (delta, deltaChecksum)
+
+    deltaObj = NetFetchFile()
+    deltaObj.data = delta
+    deltaObj.encryptData(password, oldObj.encryption or None)
+    return (deltaObj.data, deltaChecksum)
+
+
+def decodeRevision(model, primaryKey, revision, payload, newerData, password=None):
+    '''
+        decodeRevision - Get the object of a past revision, with its (unencrypted) data.
+
+        @param model <class> - Model of the current object (bound to the node it is on, if multiple nodes are configured)
+        @param primaryKey <int> - Primary key of the current object
+        @param revision <Revision> - The revision
+        @param payload <bytes> - Its payload
+        @param newerData <bytes/None> - The data of the next newer revision (or current), required for a delta
+
+        @return <NetFetchFile> - Unsaved object with the revision's attributes and data, which is not encrypted
+
+        @raises InvalidPasswordException - If the revision is encrypted, and password is not its password
+        @raises ValueError - If the revision cannot be rebuilt (i.e. its newer revision was replaced without being kept)
+    '''
+    from . import NetFetchFile, InvalidPasswordException
+
+    if revision.format == REVISION_FORMAT_FULL:
+        storedDict = dict( [ (tobytes(name), tobytes(value)) for (name, value) in revision.fields.items() ] )
+        storedDict[b'data'] = payload
+        storedObj = model._objFromStorage(primaryKey, storedDict)
+        data = storedObj.getData(password)
+    else:
+        if revision.encrypted == '1':
+            deltaObj = NetFetchFile(data=payload, encrypted='1', encryption=revision.encryption, checksum=revision.deltaChecksum,
+                            checksumType=revision.checksumType)
+            if not password:
+                raise InvalidPasswordException('Revision %d is encrypted. Must provide password.' %(revision.revision,))
+            payload = deltaObj.getData(password)
+
+        data = applyDelta(newerData, payload)
+        if NetFetchFile.calculateChecksum(data, revision.checksumType) != revision.checksum:
+            raise ValueError('Revision %d failed checksum.' %(revision.revision,))
+
+    obj = NetFetchFile(filename='', hostname='', mode=revision.mode, owner=revision.owner, group=revision.group,
+                mtime=revision.mtime, revision=revision.revision)
+    obj.setData(data, revision.checksumType)
+    obj.encrypted = '0'
+    return obj
+
+
+class PendingRevision(object):
+    '''
+        PendingRevision - The revision of an object which is being replaced, to be added to the history of its file
+          (along with the removal of any revisions the policy no longer keeps) in the same pipeline as the replacement.
+    '''
+
+    def __init__(self, hostname, filename, revision, payload, pastRevisions):
+        '''
+            @param hostname <str> - Hostname of file
+            @param filename <str> - Filename of file
+            @param revision <Revision> - The revision being added, from #buildRevision
+            @param payload <bytes> - Its payload
+            @param pastRevisions list<Revision> - The revisions already kept, newest first
+        '''
+        self.hostname = hostname
+        self.filename = filename
+        self.revision = revision
+        self.payload = payload
+
+        # kept / removed - Revisions (including this one) which the policy keeps, and those it removes
+        (self.kept, self.removed) = applyRevisionPolicy( [revision] + pastRevisions )
+
+    @classmethod
+    def fromStorage(cls, model, primaryKey, storedDict, indexData, newObj):
+        '''
+            fromStorage - Build the pending revision of a stored object, which is being replaced by another
+
+            @param model <class> - Model of the stored object (bound to the node it is on, if multiple nodes are configured)
+            @param primaryKey <int> - Primary key of the stored object
+            @param storedDict <dict> - Its stored fields (bytes -> bytes), from HGETALL
+            @param indexData <bytes/None> - Index of the revisions hash of the file (see INDEX_FIELD), from HGET
+            @param newObj <NetFetchFile> - The object replacing it. If it has "_revisionSource" (see NetFetchFile._setPayload),
+                a delta is built against that data.
+
+            @return <PendingRevision>
+        '''
+        oldObj = model._objFromStorage(primaryKey, storedDict)
+        (newData, password) = getattr(newObj, '_revisionSource', None) or (None, None)
+
+        (revision, payload) = buildRevision(oldObj, storedDict, newData, password)
+        # The object replacing it is always numbered next
+        revision.baseRevision = revision.revision + 1
+
+        return cls(newObj.hostname, newObj.filename, revision, payload, parseRevisionIndex(indexData))
+
+    def keepsChunks(self):
+        '''
+            keepsChunks - Check if the revision keeps the chunks of the object being replaced,
+              in which case they must not be released with it
+
+            @return <bool>
+        '''
+        return bool(self.revision in self.kept and self.revision.getChunkIds())
+
+    def queueWrites(self, pipeline):
+        '''
+            queueWrites - Queue onto a pipeline (sync or asyncio) the addition of the revision, and removal of those not kept
+        '''
+        key = getRevisionsKey(self.hostname, self.filename)
+        if self.revision in self.kept:
+            pipeline.hset(key, str(self.revision.revision), self.payload)
+        for revision in self.removed:
+            if revision is not self.revision:
+                pipeline.hdel(key, str(revision.revision))
+
+        if self.kept:
+            pipeline.hset(key, INDEX_FIELD, dumpRevisionIndex(self.kept))
+        else:
+            pipeline.delete(key)
+
+    def getReleasableChunkIds(self, currentChunkIds):
+        '''
+            getReleasableChunkIds - Get the chunks to release (see chunks.releaseChunks) once the writes are executed
+
+            @param currentChunkIds list<str> - Chunks of the object replacing the stored one
+
+            @return list<str> - Chunk ids. @see getReleasableChunkIds (the function)
+        '''
+        # A revision removed as soon as it is built never took over the chunks of the object it was built from
+        removed = [ revision for revision in self.removed if revision is not self.revision ]
+        return getReleasableChunkIds(removed, self.kept, currentChunkIds)
+
+
+def queueRevisionsDelete(pipeline, hostname, filename):
+    '''
+        queueRevisionsDelete - Queue onto a pipeline (sync or asyncio) the deletion of the history of a file, along with the file.
+          Two commands are queued, the result of the first is the index of the history, see #getDeletedChunkIds
+
+        @param pipeline - Pipeline
+        @param hostname <str> - Hostname of file
+        @param filename <str> - Filename of file
+    '''
+    key = getRevisionsKey(hostname, filename)
+    pipeline.hget(key, INDEX_FIELD)
+    pipeline.delete(key)
+
+
+def getDeletedChunkIds(indexData):
+    '''
+        getDeletedChunkIds - Get the chunks to release (see chunks.releaseChunks) once the history of a file is deleted
+
+        @param indexData <bytes/None> - Index of the deleted history, the first result of #queueRevisionsDelete
+
+        @return list<str> - Chunk ids
+    '''
+    return getReleasableChunkIds(parseRevisionIndex(indexData), [], [])
+
+
+def applyRevisionPolicy(revisions, keep=None, maxAge=None, now=None):
+    '''
+        applyRevisionPolicy - Split revisions into those kept and those removed by the revision policy
+
+        @param revisions list<Revision> - Revisions, newest first
+        @param keep <int/None> - Number kept. Default is that of setRevisionPolicy.
+        @param maxAge <float/None> - Maximum age in seconds. Default is that of setRevisionPolicy.
+        @param now <float/None> - Current time. Default is time.time().
+
+        @return tuple( kept list<Revision>, removed list<Revision> )
+    '''
+    if keep is None:
+        keep = _keepRevisions
+    if maxAge is None:
+        maxAge = _maxRevisionAge
+
+    kept = revisions[ : keep]
+    if maxAge:
+        oldestTime = (now or time.time()) - maxAge
+        # Only the oldest are removed, so every kept revision can still be rebuilt
+        while kept and kept[-1].mtime < oldestTime:
+            kept.pop()
+
+    return (kept, revisions[len(kept) : ])
+
+
+def getRevisionChunkIds(revisions):
+    '''
+        getRevisionChunkIds - Get the chunks kept by some revisions. @see Revision.getChunkIds
+
+        @param revisions list<Revision> - Revisions
+
+        @return list<str> - Chunk ids. A dedup chunk is listed once per reference.
+    '''
+    ret = []
+    for revision in revisions:
+        ret += revision.getChunkIds()
+    return ret
+
+
+def getReleasableChunkIds(removed, kept, currentChunkIds):
+    '''
+        getReleasableChunkIds - Get the chunks to release (see chunks.releaseChunks) when revisions are removed.
+
+          Each dedup chunk reference of a removed revision is released. Other chunks may be shared by revisions
+            (an updated chunked file reuses its unchanged chunks), so are only released if no longer used.
+
+        @param removed list<Revision> - Revisions being removed
+        @param kept list<Revision> - Revisions being kept
+        @param currentChunkIds list<str> - Chunks of the current object
+
+        @return list<str> - Chunk ids
+    '''
+    stillUsed = set(currentChunkIds)
+    stillUsed.update( getRevisionChunkIds(kept) )
+
+    ret = []
+    seen = set()
+    for chunkId in getRevisionChunkIds(removed):
+        if isDedupChunkId(chunkId):
+            ret.append(chunkId)
+        elif chunkId not in stillUsed and chunkId not in seen:
+            seen.add(chunkId)
+            ret.append(chunkId)
+    return ret
@@ -0,0 +1,143 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the server-side (lua) scripts used by NetFetch to save round-trips to Redis
+
+# vim: ts=4 sw=4 expandtab
+
+from redis.client import Script
+
+__all__ = ('LOOKUP_FILE_SCRIPT', 'FETCH_FILE_SCRIPT', 'FETCH_FIELDS_SCRIPT', 'FETCH_DATA_RANGES_SCRIPT', 'RELEASE_CHUNKS_SCRIPT', 'runScript', 'hgetallResultToDict')
+
+# _LOOKUP_SOURCE - Resolve a hostname/filename pair to its primary key (into local "pk", nil if no match). Shared by the scripts below.
+#
+#   The path index (see listing.py) holds the primary key of a file directly, so is a single HGET. Files which are not in it
+#     (stored by versions before 3.1.0, and not since indexed by NetFetchFile.rebuildListIndex) are resolved by the intersection
+#     of the hostname and filename index sets, which are not kept with the compact layout (see listing.setStorageLayout).
+#
+#   KEYS[1] - Index key for hostname
+#   KEYS[2] - Index key for filename
+#   KEYS[3] - Path index key of hostname
+#   ARGV[2] - Filename
+_LOOKUP_SOURCE = '''
+local pk = redis.call('HGET', KEYS[3], ARGV[2])
+if not pk then
+    pk = redis.call('SINTER', KEYS[1], KEYS[2])[1]
+end
+'''
+
+# LOOKUP_FILE_SCRIPT - Resolve a hostname/filename pair to its primary key
+#
+#   KEYS, ARGV[2] - See _LOOKUP_SOURCE
+#   ARGV[1] - Prefix of the key holding an object's data (unused, so all lookup scripts share params)
+#
+#   Returns nil if no match, otherwise primaryKey
+LOOKUP_FILE_SCRIPT = _LOOKUP_SOURCE + '''
+return pk
+'''
+
+# FETCH_FILE_SCRIPT - Resolve a hostname/filename pair and return the stored hash in a single round-trip
+#
+#   KEYS, ARGV[2] - See _LOOKUP_SOURCE
+#   ARGV[1] - Prefix of the key holding an object's data (primary key is appended)
+#
+#   Returns nil if no match, otherwise { primaryKey, { field1, value1, field2, value2, ... } }
+FETCH_FILE_SCRIPT = _LOOKUP_SOURCE + '''
+if not pk then
+    return nil
+end
+return { pk, redis.call('HGETALL', ARGV[1] .. pk) }
+'''
+
+# FETCH_FIELDS_SCRIPT - Like FETCH_FILE_SCRIPT, but only fetch the given fields (i.e. metadata without the data)
+#
+#   KEYS, ARGV[2] - See _LOOKUP_SOURCE
+#   ARGV[1] - Prefix of the key holding an object's data (primary key is appended)
+#   ARGV[3:] - Names of fields to fetch
+#
+#   Returns nil if no match, otherwise { primaryKey, { value1, value2, ... } } in the order of the requested fields
+FETCH_FIELDS_SCRIPT = _LOOKUP_SOURCE + '''
+if not pk then
+    return nil
+end
+return { pk, redis.call('HMGET', ARGV[1] .. pk, unpack(ARGV, 3)) }
+'''
+
+# FETCH_DATA_RANGES_SCRIPT - Fetch byte ranges of a field of an object, so only those bytes are sent (redis has no HGETRANGE).
+#   The whole value is still read on the server, but not transferred.
+#
+#   KEYS[1] - Key of the object
+#   ARGV[1] - Name of field to read the ranges of
+#   ARGV[2] - Expected value of the "checksum" field, so ranges are never read from a newer (or deleted) version of the object
+#   ARGV[3:] - Pairs of offset (from 0) and length of each range
+#
+#   Returns nil if the object does not exist or has another checksum, otherwise { range1, range2, ... }.
+#     A range is shorter than its length if it passes the end of the value.
+FETCH_DATA_RANGES_SCRIPT = '''
+if redis.call('HGET', KEYS[1], 'checksum') ~= ARGV[2] then
+    return nil
+end
+local value = redis.call('HGET', KEYS[1], ARGV[1]) or ''
+local ranges = {}
+for i = 3, #ARGV, 2 do
+    local offset = tonumber(ARGV[i])
+    ranges[#ranges + 1] = string.sub(value, offset + 1, offset + tonumber(ARGV[i + 1]))
+end
+return ranges
+'''
+
+# RELEASE_CHUNKS_SCRIPT - Drop a reference to each given chunk. Reference-counted (deduplicated) chunks are
+#   only removed when the last reference is dropped, chunks without a reference count are always removed.
+#
+#   KEYS[1] - Hash of chunk id -> reference count
+#   ARGV[1] - Prefix of chunk keys (chunk id is appended)
+#   ARGV[2:] - Chunk ids. A chunk id may be given multiple times, to drop multiple references.
+#
+#   Returns number of chunks removed
+RELEASE_CHUNKS_SCRIPT = '''
+local numRemoved = 0
+for i = 2, #ARGV do
+    local chunkId = ARGV[i]
+    if redis.call('HEXISTS', KEYS[1], chunkId) == 1 then
+        if redis.call('HINCRBY', KEYS[1], chunkId, -1) <= 0 then
+            redis.call('HDEL', KEYS[1], chunkId)
+            numRemoved = numRemoved + redis.call('DEL', ARGV[1] .. chunkId)
+        end
+    else
+        numRemoved = numRemoved + redis.call('DEL', ARGV[1] .. chunkId)
+    end
+end
+return numRemoved
+'''
+
+# _scripts - Cache of script source -> Script object, so sha1 is calculated only once per script
+_scripts = {}
+
+def runScript(conn, scriptSource, keys, args):
+    '''
+        runScript - Run a lua script on the server. Uses EVALSHA, and only sends the whole script
+          if it is not already cached on the server.
+
+        @param conn <redis.Redis/redis.client.Pipeline> - Connection (or pipeline) on which to run script
+        @param scriptSource <str> - Source of lua script (like FETCH_FILE_SCRIPT)
+        @param keys list<str> - KEYS for the script
+        @param args list<str> - ARGV for the script
+
+        @return - Result of script
+    '''
+    script = _scripts.get(scriptSource, None)
+    if script is None:
+        script = _scripts[scriptSource] = Script(conn, scriptSource)
+
+    return script(keys=keys, args=args, client=conn)
+
+
+def hgetallResultToDict(flatResult):
+    '''
+        hgetallResultToDict - Convert the result of HGETALL within a lua script (a flat list of field, value, field, value...)
+          into a dict, as returned by a direct HGETALL.
+
+        @param flatResult list<bytes> - Flat list of fields and values
+
+        @return dict<bytes, bytes> - Map of field -> value
+    '''
+    return dict(zip(flatResult[0::2], flatResult[1::2]))
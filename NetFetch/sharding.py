@@ -0,0 +1,192 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the routing of files across multiple Redis servers ("nodes"), by consistent hashing
+
+# vim: ts=4 sw=4 expandtab
+
+import bisect
+import struct
+import threading
+
+from hashlib import md5
+
+from IndexedRedis.compat_str import tobytes
+
+__all__ = ('DEFAULT_NODE_NAME', 'VIRTUAL_NODES_PER_WEIGHT', 'HashRing',
+            'setRedisNodes', 'getNodeNames', 'isSharded', 'getNodeForFile', 'getNodeModel',
+)
+
+# DEFAULT_NODE_NAME - Name of the node configured by the [redis] section of the config
+DEFAULT_NODE_NAME = 'default'
+
+# VIRTUAL_NODES_PER_WEIGHT - Number of points each node has on the ring, per unit of weight.
+#   More points spread the files more evenly, at the cost of a larger ring.
+VIRTUAL_NODES_PER_WEIGHT = 160
+
+
+#  Each file (hostname/filename pair) is stored entirely on one node: its object, its indexes, its entries in the
+#    listing index, and its chunks. The node is chosen by hashing the hostname and filename onto a ring, on which each
+#    node has many points (in proportion to its weight). A file belongs to the node with the first point after its hash.
+#
+#    Adding a node only takes over the files between its new points and the points before them, so only a share of
+#    files in proportion to its weight moves, all of it to the new node. Removing (or draining) a node only moves its own files.
+#
+#    A node with a weight of 0 has no points, so no file belongs to it. It is still read from (and deleted from), so it
+#    can be drained with netFetchRebalance before it is removed from the config.
+
+
+class HashRing(object):
+    '''
+        HashRing - A consistent hash ring of named nodes
+    '''
+
+    def __init__(self, nodeWeights, virtualNodesPerWeight=VIRTUAL_NODES_PER_WEIGHT):
+        '''
+            @param nodeWeights list< tuple(name<str>, weight<int>) > - Each node and its weight. Nodes with a weight of 0 are not placed.
+            @param virtualNodesPerWeight <int> - Number of points per unit of weight
+
+            @raises ValueError - If no node has a weight
+        '''
+        points = []
+        for (nodeName, weight) in nodeWeights:
+            for i in range(int(weight * virtualNodesPerWeight)):
+                points.append( (HashRing.hashKey(tobytes('%s-%d' %(nodeName, i))), nodeName) )
+
+        if not points:
+            raise ValueError('At least one redis node must have a weight greater than 0.')
+
+        points.sort()
+        self._points = [ point for (point, nodeName) in points ]
+        self._nodeNames = [ nodeName for (point, nodeName) in points ]
+
+    @staticmethod
+    def hashKey(key):
+        '''
+            hashKey - Get the position of a key on the ring
+
+            @param key <bytes> - Key
+
+            @return <int> - 64-bit position
+        '''
+        return struct.unpack('>Q', md5(key).digest()[:8])[0]
+
+    def getNode(self, key):
+        '''
+            getNode - Get the node which a key belongs to
+
+            @param key <bytes> - Key
+
+            @return <str> - Node name
+        '''
+        idx = bisect.bisect(self._points, HashRing.hashKey(key))
+        if idx == len(self._points):
+            idx = 0
+
+        return self._nodeNames[idx]
+
+
+# _nodeNames - Names of the configured nodes, in config order. Empty if not sharded.
+_nodeNames = []
+# _nodeParams - Node name -> connection params
+_nodeParams = {}
+_ring = None
+
+# _nodeModels - (model, node name) -> model bound to that node, see #getNodeModel
+_nodeModels = {}
+_nodeModelsLock = threading.Lock()
+
+
+def setRedisNodes(nodes):
+    '''
+        setRedisNodes - Set the Redis servers which files are spread across. @see config.getRedisNodes
+
+          Without nodes (the default), everything is stored on the server given by NetFetch.setRedisConnectionParams.
+
+        @param nodes list< tuple(name<str>, weight<int>, params<dict>) > / None - Each node, with its weight and its
+            connection params (host/port/db, etc). None or empty list to not shard.
+
+        @raises ValueError - If a node name is repeated, or no node has a weight
+    '''
+    global _nodeNames, _nodeParams, _ring
+
+    nodes = list(nodes or [])
+
+    nodeNames = [ nodeName for (nodeName, weight, params) in nodes ]
+    if len(set(nodeNames)) != len(nodeNames):
+        raise ValueError('Redis node names must be unique.')
+
+    ring = None
+    if nodes:
+        ring = HashRing( [ (nodeName, weight) for (nodeName, weight, params) in nodes ] )
+
+    with _nodeModelsLock:
+        _nodeNames = nodeNames
+        _nodeParams = dict( [ (nodeName, dict(params)) for (nodeName, weight, params) in nodes ] )
+        _ring = ring
+        _nodeModels.clear()
+
+
+def getNodeNames():
+    '''
+        getNodeNames - Get the names of all configured nodes, including those with a weight of 0
+
+        @return list<str> - Node names, in config order. Empty if not sharded.
+    '''
+    return list(_nodeNames)
+
+
+def isSharded():
+    '''
+        isSharded - Check if files are spread across multiple nodes (see #setRedisNodes)
+
+        @return <bool>
+    '''
+    return _ring is not None
+
+
+def getNodeForFile(hostname, filename):
+    '''
+        getNodeForFile - Get the node which a file belongs to
+
+        @param hostname <str> - Hostname
+        @param filename <str> - Filename
+
+        @return <str/None> - Node name, or None if not sharded
+    '''
+    ring = _ring
+    if ring is None:
+        return None
+
+    return ring.getNode( tobytes(hostname) + b'\x00' + tobytes(filename) )
+
+
+def getNodeModel(model, nodeName):
+    '''
+        getNodeModel - Get a subclass of a model which is bound to one node. Everything done through it (and its objects)
+          uses that node, i.e. getNodeModel(NetFetchChunkedFile, 'node2').downloadToStr(...)
+
+        @param model <class> - NetFetchFile or a subclass. If already bound to a node, the model it was created from is used.
+        @param nodeName <str> - Node name
+
+        @return <class> - Subclass of #model, with SHARD_NODE set to #nodeName
+
+        @raises KeyError - If there is no such node
+    '''
+    while getattr(model, 'SHARD_NODE', None) is not None:
+        model = model.__bases__[0]
+
+    nodeModel = _nodeModels.get( (model, nodeName), None )
+    if nodeModel is not None:
+        return nodeModel
+
+    with _nodeModelsLock:
+        nodeModel = _nodeModels.get( (model, nodeName), None )
+        if nodeModel is None:
+            # The params dict is shared by every model of a node, so they share a connection pool
+            nodeModel = type(model.__name__, (model,), {
+                'REDIS_CONNECTION_PARAMS' : _nodeParams[nodeName],
+                'SHARD_NODE' : nodeName,
+            })
+            _nodeModels[ (model, nodeName) ] = nodeModel
+
+    return nodeModel
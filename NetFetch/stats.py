@@ -0,0 +1,231 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the instrumentation of NetFetch operations: the time and bytes of each phase
+#    (lookup, transfer, decompression, decryption, checksum, local write, etc) of a put, get, or delete.
+
+# vim: ts=4 sw=4 expandtab
+
+import threading
+import time
+
+__all__ = ('PHASE_LOOKUP', 'PHASE_FETCH', 'PHASE_DECOMPRESS', 'PHASE_DECRYPT', 'PHASE_CHECKSUM', 'PHASE_WRITE', 'PHASE_PERMISSIONS',
+            'PHASE_CACHE', 'PHASE_READ', 'PHASE_COMPRESS', 'PHASE_ENCRYPT', 'PHASE_STORE', 'PHASE_DELETE', 'PHASE_REVISION', 'PHASE_ORDER',
+            'PhaseStats', 'Stats', 'addStatsHook', 'removeStatsHook', 'collectStats', 'timePhase', 'timeIter',
+)
+
+# PHASE_* - Names of the phases which are timed
+#
+#   PHASE_LOOKUP      - Resolving a hostname/filename to its metadata (without data), i.e. to check the cache, or of a chunked file
+#   PHASE_FETCH       - Transfer of stored data from Redis. For files which are not chunked, this is a single round-trip
+#                         which also resolves the hostname/filename indexes and the type (see scripts.FETCH_FILE_SCRIPT)
+#   PHASE_DECOMPRESS  - Converting the stored data, including decompression
+#   PHASE_DECRYPT     - Decryption
+#   PHASE_CHECKSUM    - Calculating (on put) or verifying (on get) checksums
+#   PHASE_WRITE       - Writing data to a local file
+#   PHASE_PERMISSIONS - Applying mode/owner/group (chmod/chown) to a local file
+#   PHASE_CACHE       - Placing a file from (or storing a file into) the local cache
+#   PHASE_READ        - Reading a local file to be stored (and hashing it, which is done as it is read)
+#   PHASE_COMPRESS    - Compression
+#   PHASE_ENCRYPT     - Encryption
+#   PHASE_STORE       - Writing to Redis
+#   PHASE_DELETE      - Deleting from Redis
+#   PHASE_REVISION    - Building (on put) or rebuilding (on get) a past revision of a file, from its delta (see revisions.py)
+PHASE_LOOKUP = 'lookup'
+PHASE_FETCH = 'fetch'
+PHASE_DECOMPRESS = 'decompress'
+PHASE_DECRYPT = 'decrypt'
+PHASE_CHECKSUM = 'checksum'
+PHASE_WRITE = 'write'
+PHASE_PERMISSIONS = 'permissions'
+PHASE_CACHE = 'cache'
+PHASE_READ = 'read'
+PHASE_COMPRESS = 'compress'
+PHASE_ENCRYPT = 'encrypt'
+PHASE_STORE = 'store'
+PHASE_DELETE = 'delete'
+PHASE_REVISION = 'revision'
+
+# PHASE_ORDER - The order in which phases are listed
+PHASE_ORDER = (PHASE_LOOKUP, PHASE_READ, PHASE_FETCH, PHASE_DECOMPRESS, PHASE_COMPRESS, PHASE_DECRYPT, PHASE_ENCRYPT,
+            PHASE_REVISION, PHASE_CHECKSUM, PHASE_STORE, PHASE_CACHE, PHASE_WRITE, PHASE_PERMISSIONS, PHASE_DELETE)
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# _hooks - Functions called with (phase, seconds, numBytes) as each phase completes. Phases are only timed while there are hooks.
+_hooks = []
+_hooksLock = threading.Lock()
+
+
+def addStatsHook(func):
+    '''
+        addStatsHook - Add a function to be called as each phase of every NetFetch operation (in any thread) completes,
+          i.e. to feed a metrics pipeline.
+
+        @param func <function> - Called as func(phase<str>, seconds<float>, numBytes<int>), where phase is a PHASE_* value,
+            and numBytes is the number of bytes handled by that phase (0 if not applicable)
+    '''
+    global _hooks
+    with _hooksLock:
+        _hooks = _hooks + [func]
+
+
+def removeStatsHook(func):
+    '''
+        removeStatsHook - Remove a function added by #addStatsHook
+    '''
+    global _hooks
+    with _hooksLock:
+        _hooks = [ hook for hook in _hooks if hook is not func ]
+
+
+class PhaseStats(object):
+    '''
+        PhaseStats - The totals of one phase
+    '''
+
+    __slots__ = ('count', 'seconds', 'numBytes')
+
+    def __init__(self):
+        # count - Number of times the phase ran (i.e. once per chunk, for chunked files)
+        self.count = 0
+        self.seconds = 0.0
+        self.numBytes = 0
+
+    @property
+    def bytesPerSecond(self):
+        if not self.seconds:
+            return 0.0
+        return self.numBytes / self.seconds
+
+    def asDict(self):
+        return {'count' : self.count, 'seconds' : self.seconds, 'bytes' : self.numBytes}
+
+
+class Stats(object):
+    '''
+        Stats - Totals of the time and bytes of each phase. Collect with #collectStats, or add #record as a hook (see #addStatsHook)
+    '''
+
+    def __init__(self):
+        # phases - PHASE_* value -> PhaseStats
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds, numBytes=0):
+        '''
+            record - Add a run of a phase
+
+            @param phase <str> - PHASE_* value
+            @param seconds <float> - Duration
+            @param numBytes <int> - Number of bytes handled
+        '''
+        with self._lock:
+            phaseStats = self.phases.get(phase, None)
+            if phaseStats is None:
+                phaseStats = self.phases[phase] = PhaseStats()
+            phaseStats.count += 1
+            phaseStats.seconds += seconds
+            phaseStats.numBytes += numBytes
+
+    def getPhaseNames(self):
+        '''
+            getPhaseNames - Get the names of the recorded phases, in PHASE_ORDER
+
+            @return list<str>
+        '''
+        return [ phase for phase in PHASE_ORDER if phase in self.phases ] + sorted( [ phase for phase in self.phases if phase not in PHASE_ORDER ] )
+
+    @property
+    def totalSeconds(self):
+        '''
+            totalSeconds - Sum of the duration of all phases. Phases run by parallel workers may overlap, so this may exceed the elapsed time.
+        '''
+        return sum( [ phaseStats.seconds for phaseStats in self.phases.values() ] )
+
+    def asDict(self):
+        '''
+            asDict - Get the totals as a dict (i.e. to serialize as JSON)
+
+            @return dict - PHASE_* value -> { 'count' : int, 'seconds' : float, 'bytes' : int }
+        '''
+        return dict( [ (phase, phaseStats.asDict()) for (phase, phaseStats) in self.phases.items() ] )
+
+    def __str__(self):
+        lines = [ '%-12s %8s %12s %14s %12s' %('phase', 'count', 'seconds', 'bytes', 'MB/s') ]
+        for phase in self.getPhaseNames():
+            phaseStats = self.phases[phase]
+            lines.append('%-12s %8d %12.6f %14d %12.2f' %(phase, phaseStats.count, phaseStats.seconds, phaseStats.numBytes,
+                        phaseStats.bytesPerSecond / 1048576.0))
+
+        return '\n'.join(lines)
+
+
+class collectStats(object):
+    '''
+        collectStats - Context manager which collects the stats of every NetFetch operation (in any thread) run within it, i.e.:
+
+            with collectStats() as stats:
+                NetFetchFile.downloadToLocal(...)
+            print ( str(stats) )
+    '''
+
+    def __init__(self, stats=None):
+        '''
+            @param stats <Stats/None> - Add to this Stats. Default is a new one.
+        '''
+        self.stats = stats or Stats()
+
+    def __enter__(self):
+        addStatsHook(self.stats.record)
+        return self.stats
+
+    def __exit__(self, *args):
+        removeStatsHook(self.stats.record)
+
+
+class timePhase(object):
+    '''
+        timePhase - Internal. Context manager which times a phase, and reports it to all hooks. Does nothing if there are no hooks.
+
+          The number of bytes may be given up-front, or set on the returned object (as "numBytes") within the block.
+    '''
+
+    __slots__ = ('phase', 'numBytes', '_start')
+
+    def __init__(self, phase, numBytes=0):
+        self.phase = phase
+        self.numBytes = numBytes
+        self._start = None
+
+    def __enter__(self):
+        if _hooks:
+            self._start = _clock()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if self._start is not None and excType is None:
+            seconds = _clock() - self._start
+            for hook in _hooks:
+                hook(self.phase, seconds, self.numBytes)
+
+
+def timeIter(phase, iterable):
+    '''
+        timeIter - Internal. Wrap an iterator of blocks (like a file being read), timing the production of each block as a phase.
+
+        @param phase <str> - PHASE_* value
+        @param iterable <iterable<bytes>> - Blocks
+
+        @return generator<bytes> - The same blocks
+    '''
+    iterator = iter(iterable)
+    while True:
+        start = _clock() if _hooks else None
+        block = next(iterator, None)
+        if block is None:
+            return
+        if start is not None:
+            seconds = _clock() - start
+            for hook in _hooks:
+                hook(phase, seconds, len(block))
+        yield block
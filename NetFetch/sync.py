@@ -0,0 +1,375 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the incremental sync of local files into NetFetch, driven by a local state index. Used by netFetchSync.
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import fnmatch
+import json
+import os
+import socket
+
+from hashlib import md5
+from multiprocessing.pool import ThreadPool
+
+from . import NetFetchFile
+from .bulk import DEFAULT_BULK_BATCH_SIZE, GLOB_CHARS, BulkResult, expandLocalFilenames, getDefaultNumWorkers
+from .checksum import CHECKSUM_MD5, hashFile
+from .localfile import AtomicLocalFile
+
+__all__ = ('SYNC_STATE_VERSION', 'SYNC_ACTION_UPLOAD', 'SYNC_ACTION_DELETE',
+            'SyncState', 'SyncResult', 'getDefaultStateFilename', 'sync',
+)
+
+# SYNC_STATE_VERSION - Version of the state file format
+SYNC_STATE_VERSION = 1
+
+# SYNC_ACTION_* - Actions passed to the onChange callback of #sync
+SYNC_ACTION_UPLOAD = 'upload'
+SYNC_ACTION_DELETE = 'delete'
+
+
+#  The state is a record of each file as of when it was last stored: its stat (mtime, ctime, size, inode, mode, owner, group)
+#    and its checksum. A sync stats every file, and only reads (hashes) those whose stat differs from the state:
+#
+#    * If the checksum is also unchanged (i.e. the file was touched, or rewritten with the same content), only the state is updated.
+#    * Otherwise (or if its mode/owner/group changed, and those are stored), the file is stored again.
+#
+#  So a sync where nothing changed costs a stat per file, and no Redis operations at all. The state is only ever updated
+#    for files which were stored successfully, so anything that failed is retried by the next sync.
+#
+#  The state trusts that what was stored is still stored. If files may be deleted or changed in NetFetch by anything else,
+#    sync with verify=True, which compares the state against the metadata of the stored files (one round-trip per batch).
+
+
+class SyncState(object):
+    '''
+        SyncState - The local state index of a sync: every synced file with its stat and checksum as of when it was last stored,
+          and the options it was stored with. Saved as JSON.
+    '''
+
+    def __init__(self, filename, options=None, files=None):
+        '''
+            @param filename <str> - Filename the state is saved at
+            @param options <dict/None> - Options the files were stored with (see #sync)
+            @param files <dict/None> - filename -> list( mtime, ctime, size, inode, mode, uid, gid, checksum )
+        '''
+        self.filename = filename
+        self.options = options or {}
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, filename):
+        '''
+            load - Load the state saved at a filename. If it does not exist, the state is empty.
+
+            @param filename <str> - Filename
+
+            @return <SyncState>
+
+            @raises ValueError - If the file is not a valid state
+        '''
+        try:
+            with open(filename, 'rt') as f:
+                stateDict = json.load(f)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                return cls(filename)
+            raise
+        except ValueError:
+            raise ValueError('Sync state file "%s" is not valid.' %(filename,))
+
+        if not isinstance(stateDict, dict) or stateDict.get('version', None) != SYNC_STATE_VERSION:
+            raise ValueError('Sync state file "%s" is not valid, or from a different version of NetFetch.' %(filename,))
+
+        return cls(filename, stateDict.get('options', None), stateDict.get('files', None))
+
+    def save(self):
+        '''
+            save - Save the state. The file is replaced atomically (see localfile.AtomicLocalFile), so an interrupted save keeps the previous state.
+        '''
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+
+        stateDict = { 'version' : SYNC_STATE_VERSION, 'options' : self.options, 'files' : self.files }
+
+        localFile = AtomicLocalFile(self.filename)
+        try:
+            localFile.write(json.dumps(stateDict, separators=(',', ':')).encode('utf-8'))
+            localFile.commit()
+        except:
+            localFile.abort()
+            raise
+
+
+class SyncResult(object):
+    '''
+        SyncResult - The outcome of a sync. On a dry run, "uploaded" and "deleted" are what would be uploaded and deleted.
+    '''
+
+    def __init__(self):
+        # numChecked - Number of local files checked
+        self.numChecked = 0
+        # numUnchanged - Number of local files which were unchanged (including those whose stat changed, but not their content)
+        self.numUnchanged = 0
+        # uploaded - <bulk.BulkResult> of the files which were stored
+        self.uploaded = BulkResult()
+        # deleted - <bulk.BulkResult> of the stored files which were deleted
+        self.deleted = BulkResult()
+        # errors - list of tuple( filename, exception ) for each file which could not be checked, stored, or deleted
+        self.errors = []
+
+    def __str__(self):
+        ret = '%d files checked, %d unchanged, uploaded %s, deleted %d files' %(self.numChecked, self.numUnchanged, str(self.uploaded), self.deleted.numFiles)
+        if self.errors:
+            ret += ', %d failed' %(len(self.errors),)
+
+        return ret
+
+
+def getDefaultStateFilename(paths, hostname=None, destination=''):
+    '''
+        getDefaultStateFilename - Get the default filename of the state of a sync, which is unique to the set of paths synced,
+          the hostname, and where they are synced to. It is within $HOME/.netfetch-sync
+
+        @param paths list<str> - Paths being synced
+        @param hostname <str/None> - Hostname files are stored as. Default is current hostname.
+        @param destination <str> - Identifies where files are stored (like the redis host, port, and db)
+
+        @return <str> - Filename
+    '''
+    key = '\x00'.join( [ hostname or socket.gethostname(), destination ] + sorted( [ os.path.abspath(path) for path in paths ] ) )
+
+    return os.path.join(os.path.expanduser('~'), '.netfetch-sync', md5(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def _getStatEntry(statData):
+    '''
+        _getStatEntry - Internal. Get the part of a state entry which comes from a file's stat
+
+        @param statData <os.stat_result> - Stat of file
+
+        @return list( mtime, ctime, size, inode, mode, uid, gid )
+    '''
+    return [ statData.st_mtime, statData.st_ctime, statData.st_size, statData.st_ino, statData.st_mode, statData.st_uid, statData.st_gid ]
+
+
+def _isWithinPaths(filename, paths):
+    '''
+        _isWithinPaths - Internal. Check if a filename is one of the paths being synced (a file, within a directory, or matching a glob pattern)
+
+        @param filename <str> - Absolute filename
+        @param paths list<str> - Paths being synced
+
+        @return <bool>
+    '''
+    for path in paths:
+        if any( [ globChar in path for globChar in GLOB_CHARS ] ):
+            if fnmatch.fnmatch(filename, os.path.abspath(path)):
+                return True
+            continue
+
+        path = os.path.realpath(path)
+        if filename == path or filename.startswith(path.rstrip('/') + '/'):
+            return True
+
+    return False
+
+
+def _getPathPrefix(path):
+    '''
+        _getPathPrefix - Internal. Get the filename prefix under which all stored files of a path being synced are listed
+
+        @param path <str> - Path being synced (file, directory, or glob pattern)
+
+        @return <str> - Filename prefix
+    '''
+    if any( [ globChar in path for globChar in GLOB_CHARS ] ):
+        path = os.path.abspath(path)
+        return path[ : min( [ path.index(globChar) for globChar in GLOB_CHARS if globChar in path ] ) ]
+
+    return os.path.realpath(path)
+
+
+def sync(paths, state, storeFiles, hostname=None, checksumType=CHECKSUM_MD5, savePermissions=True, options=None,
+            delete=False, verify=False, full=False, dryRun=False, numWorkers=None, batchSize=DEFAULT_BULK_BATCH_SIZE, onChange=None):
+    '''
+        sync - Store every local file (within some paths) which changed since it was last synced, and (optionally) delete
+          the stored files which no longer exist locally. @see the comment above SyncState
+
+          Files are stored in bulk by #storeFiles (i.e. in pipelined batches, see NetFetchFile.createOrUpdateMany), and deleted
+            in bulk (see NetFetchFile.deleteMany). The state is updated and saved, unless #dryRun.
+
+        @param paths list<str> - Files, directories (synced recursively), or glob patterns
+        @param state <SyncState> - State of the previous sync of these paths. @see getDefaultStateFilename
+        @param storeFiles <function> - Called with a list of filenames to store, returns a <bulk.BulkResult>.
+            i.e. lambda filenames : NetFetchFile.createOrUpdateMany(filenames, password=password)
+        @param hostname <str/None> - Hostname files are stored as (used for deletes and #verify). Default is current hostname.
+        @param checksumType <str> - Checksum algorithm files are stored with, used for the state. A checksum.CHECKSUM_* value.
+        @param savePermissions <bool> - If True, a file whose mode/owner/group changed (but not its content) is stored again
+        @param options <dict/None> - The options files are stored with (like compression and encryption), which must be JSON-serializable.
+            If they differ from those of the state, every file is stored again.
+        @param delete <bool> - If True, delete stored files which no longer exist locally (and, with #verify, stored files within #paths which are not local)
+        @param verify <bool> - If True, also store files which are unchanged locally but missing (or different) in NetFetch
+        @param full <bool> - If True, ignore the state and store every file
+        @param dryRun <bool> - If True, only count (and report to #onChange) what would be stored and deleted
+        @param numWorkers <int/None> - Number of threads hashing files whose stat changed. Default is number of cpus.
+        @param batchSize <int> - Number of files deleted (or listed, with #verify) per round-trip
+        @param onChange <function/None> - If provided, called as onChange(action, filename) for each file which is (or would be)
+            stored (action is SYNC_ACTION_UPLOAD) or deleted (SYNC_ACTION_DELETE)
+
+        @return <SyncResult>
+
+        @raises ValueError - If a path does not exist
+    '''
+    hostname = hostname or socket.gethostname()
+    options = options or {}
+    result = SyncResult()
+
+    if state.files and state.options != options:
+        # Files were stored differently, so store them all again
+        full = True
+
+    filenames = list(expandLocalFilenames(paths, recursive=True))
+
+    # Stat every file, and find those which may have changed
+    seen = set()
+    maybeChanged = []
+    for filename in filenames:
+        result.numChecked += 1
+        seen.add(filename)
+        try:
+            statEntry = _getStatEntry(os.stat(filename))
+        except OSError as e:
+            result.errors.append( (filename, e) )
+            continue
+
+        entry = state.files.get(filename, None)
+        if not full and entry and entry[:-1] == statEntry:
+            result.numUnchanged += 1
+            continue
+
+        maybeChanged.append( (filename, statEntry, entry) )
+
+    # Hash those, and store the ones which did change
+    def _hashFile(item):
+        try:
+            return hashFile(item[0], checksumType)
+        except Exception as e:
+            return e
+
+    checksums = []
+    if maybeChanged:
+        pool = ThreadPool(numWorkers or getDefaultNumWorkers())
+        try:
+            checksums = pool.map(_hashFile, maybeChanged)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    newEntries = {}
+    toUpload = []
+    for ((filename, statEntry, entry), checksum) in zip(maybeChanged, checksums):
+        if isinstance(checksum, Exception):
+            result.errors.append( (filename, checksum) )
+            continue
+
+        newEntries[filename] = statEntry + [checksum]
+        if not full and entry and entry[-1] == checksum and (not savePermissions or entry[4:7] == statEntry[4:7]):
+            result.numUnchanged += 1
+        else:
+            toUpload.append(filename)
+
+    toDelete = []
+    if delete:
+        toDelete = [ filename for filename in sorted(state.files.keys()) if filename not in seen and _isWithinPaths(filename, paths) ]
+
+    if verify and not full:
+        (missing, extra) = _verifyStored(paths, state, hostname, checksumType, seen, set(toUpload), batchSize)
+        for filename in missing:
+            toUpload.append(filename)
+            result.numUnchanged -= 1
+        if delete:
+            toDelete += [ filename for filename in extra if filename not in state.files ]
+
+    if onChange is not None:
+        for filename in toUpload:
+            onChange(SYNC_ACTION_UPLOAD, filename)
+        for filename in toDelete:
+            onChange(SYNC_ACTION_DELETE, filename)
+
+    if dryRun:
+        for filename in toUpload:
+            result.uploaded.addFile( (newEntries.get(filename, None) or state.files[filename])[2] )
+        for filename in toDelete:
+            result.deleted.addFile( (state.files.get(filename, None) or [0, 0, 0])[2] )
+        result.uploaded.finish()
+        result.deleted.finish()
+        return result
+
+    # Touched files (whose content is the same) only need their state updated
+    uploadFilenames = set(toUpload)
+    for (filename, newEntry) in newEntries.items():
+        if filename not in uploadFilenames:
+            state.files[filename] = newEntry
+
+    if toUpload:
+        result.uploaded = storeFiles(toUpload)
+        result.errors += result.uploaded.errors
+
+        failed = set( [ filename for (filename, exc) in result.uploaded.errors ] )
+        for filename in toUpload:
+            if filename not in failed:
+                # Files re-stored by verify are unchanged, so keep their entry
+                state.files[filename] = newEntries.get(filename, None) or state.files[filename]
+    result.uploaded.finish()
+
+    if toDelete:
+        try:
+            result.deleted = NetFetchFile.deleteMany(hostname, toDelete, batchSize)
+        except Exception as e:
+            result.errors.append( (', '.join(toDelete), e) )
+        else:
+            for filename in toDelete:
+                state.files.pop(filename, None)
+    result.deleted.finish()
+
+    state.options = options
+    state.save()
+
+    return result
+
+
+def _verifyStored(paths, state, hostname, checksumType, seen, toUpload, batchSize):
+    '''
+        _verifyStored - Internal. Compare the state against the metadata of the stored files (see NetFetchFile.listFiles)
+
+        @param paths list<str> - Paths being synced
+        @param state <SyncState> - State
+        @param hostname <str> - Hostname files are stored as
+        @param checksumType <str> - Checksum algorithm files are stored with
+        @param seen set<str> - Local files within #paths
+        @param toUpload set<str> - Files already being stored
+        @param batchSize <int> - Number of files listed per round-trip
+
+        @return tuple( missing list<str>, extra list<str> ) - Local files which are unchanged, but are not stored as in the state,
+            and stored files within #paths which are not local.
+    '''
+    stored = {}
+    for prefix in sorted(set( [ _getPathPrefix(path) for path in paths ] )):
+        for obj in NetFetchFile.listFiles(hostname, prefix, batchSize):
+            if _isWithinPaths(obj.filename, paths):
+                stored[obj.filename] = (obj.checksumType or CHECKSUM_MD5, obj.checksum)
+
+    missing = []
+    for filename in sorted(seen):
+        if filename in toUpload or filename not in state.files:
+            continue
+        if stored.get(filename, None) != (checksumType, state.files[filename][-1]):
+            missing.append(filename)
+
+    extra = [ filename for filename in sorted(stored.keys()) if filename not in seen ]
+
+    return (missing, extra)
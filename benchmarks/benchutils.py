@@ -0,0 +1,216 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains helpers shared by the NetFetch benchmarks
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import redis
+
+# Allow running the benchmarks from a source checkout without installing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NetFetch
+from NetFetch.config import getRedisConnectionParams
+
+
+class RoundTripCounter(object):
+    '''
+        RoundTripCounter - Counts round-trips to Redis (each single command, and each pipeline execute),
+          and optionally adds a simulated latency to each one (to model a WAN link to Redis).
+
+          Use as a context manager, i.e.:
+
+            with RoundTripCounter() as counter:
+                NetFetchFile.downloadToStr(...)
+            print ( counter.count )
+    '''
+
+    def __init__(self, latency=0.0):
+        '''
+            @param latency <float> - Seconds to sleep on every round-trip
+        '''
+        self.latency = latency
+        self.count = 0
+        self._origExecuteCommand = None
+        self._origPipelineExecute = None
+
+    def reset(self):
+        self.count = 0
+
+    def _roundTrip(self):
+        self.count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def __enter__(self):
+        counter = self
+
+        self._origExecuteCommand = origExecuteCommand = redis.Redis.execute_command
+        self._origPipelineExecute = origPipelineExecute = redis.client.Pipeline.execute
+
+        def execute_command(self, *args, **kwargs):
+            counter._roundTrip()
+            return origExecuteCommand(self, *args, **kwargs)
+
+        def execute(self, *args, **kwargs):
+            counter._roundTrip()
+            return origPipelineExecute(self, *args, **kwargs)
+
+        redis.Redis.execute_command = execute_command
+        redis.client.Pipeline.execute = execute
+        return self
+
+    def __exit__(self, *args):
+        redis.Redis.execute_command = self._origExecuteCommand
+        redis.client.Pipeline.execute = self._origPipelineExecute
+
+
+def connectForBenchmark(configFilename=None, useFake=False):
+    '''
+        connectForBenchmark - Set the NetFetch connection for a benchmark run
+
+        @param configFilename <str/None> - NetFetch config to use (connects to a real redis-server)
+        @param useFake <bool> - If True, use an in-process fake redis (requires "fakeredis" with "lupa")
+
+          NOTE: The database selected will have NetFetch keys written to it, use a scratch db.
+    '''
+    if useFake:
+        import fakeredis
+        NetFetch.setRedisConnectionParams({'connection_pool' : fakeredis.FakeRedis().connection_pool})
+    else:
+        NetFetch.setRedisConnectionParams(getRedisConnectionParams(configFilename))
+
+
+class LocalRedisServer(object):
+    '''
+        LocalRedisServer - A throwaway redis-server (no persistence, listening only on localhost) spawned on a free port,
+          so benchmarks run against a real server without touching any existing data.
+
+          Use as a context manager, i.e.:
+
+            with LocalRedisServer() as server:
+                NetFetch.setRedisConnectionParams(server.connectionParams)
+    '''
+
+    def __init__(self, redisServer='redis-server', startTimeout=10.0):
+        '''
+            @param redisServer <str> - Path to (or name on PATH of) the redis-server executable
+            @param startTimeout <float> - Seconds to wait for the server to accept connections
+        '''
+        self.redisServer = redisServer
+        self.startTimeout = startTimeout
+        self.port = None
+        self._process = None
+
+    @property
+    def connectionParams(self):
+        return {'host' : '127.0.0.1', 'port' : self.port, 'db' : 0}
+
+    def start(self):
+        '''
+            start - Spawn the server, and wait until it accepts connections
+
+            @raises OSError - If redis-server could not be run
+            @raises RuntimeError - If the server did not start within #startTimeout
+        '''
+        # Find a free port
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+
+        with open(os.devnull, 'w') as devnull:
+            self._process = subprocess.Popen([self.redisServer, '--port', str(self.port), '--bind', '127.0.0.1',
+                        '--save', '', '--appendonly', 'no'], stdout=devnull, stderr=devnull)
+
+        conn = redis.Redis(**self.connectionParams)
+        deadline = time.time() + self.startTimeout
+        while True:
+            try:
+                conn.ping()
+                return
+            except redis.exceptions.ConnectionError:
+                if self._process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError('Failed to start %s on port %d' %(self.redisServer, self.port))
+                time.sleep(0.05)
+
+    def stop(self):
+        '''
+            stop - Stop the server (discarding all of its data)
+        '''
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class PeakRSS(object):
+    '''
+        PeakRSS - Measures the peak resident memory of this process over a section of a benchmark.
+
+          On Linux 4.0+ the peak is reset at the start of each section (via /proc/self/clear_refs), otherwise
+            it is the peak of the whole process so far (#resettable is False).
+    '''
+
+    def __init__(self):
+        self.resettable = self._canReset()
+
+    @staticmethod
+    def _canReset():
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except (IOError, OSError):
+            return False
+        return PeakRSS._readStatus('VmHWM') is not None
+
+    @staticmethod
+    def _readStatus(fieldName):
+        '''
+            _readStatus - Read a field (in kB) from /proc/self/status, as bytes. None if not available.
+        '''
+        try:
+            with open('/proc/self/status', 'r') as f:
+                for line in f:
+                    if line.startswith(fieldName + ':'):
+                        return int(line.split()[1]) * 1024
+        except (IOError, OSError):
+            pass
+        return None
+
+    def reset(self):
+        '''
+            reset - Start a new section, resetting the peak to the current resident size (if #resettable)
+        '''
+        if self.resettable:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+
+    def peak(self):
+        '''
+            peak - Get the peak resident size, in bytes, since #reset (or since the process started, if not #resettable)
+        '''
+        if self.resettable:
+            return self._readStatus('VmHWM')
+
+        import resource
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on OSX
+        if sys.platform == 'darwin':
+            return maxRss
+        return maxRss * 1024
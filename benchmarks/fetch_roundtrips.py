@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains a benchmark of the Redis round-trips (and resulting latency) of a single fetch,
+#   comparing the single round-trip path used by downloadToStr/downloadToLocal to the previous
+#   index lookup -> type lookup -> fetch path.
+
+# vim: ts=4 sw=4 expandtab
+
+import sys
+import time
+
+from benchutils import RoundTripCounter, connectForBenchmark
+
+from NetFetch import NetFetchFile, NetFetchCompressedGzipFile
+
+
+def printUsage():
+    sys.stderr.write('''Usage: fetch_roundtrips.py (options)
+  Compares Redis round-trips per fetch of a small file before/after the single round-trip fetch path.
+
+    Options:
+
+      --config=/path/config.cfg   Connect to the redis-server in this NetFetch config (use a scratch db!)
+      --fake                      Use an in-process fake redis instead (requires fakeredis and lupa)
+      --latency=MS                Simulated latency added to every round-trip, in milliseconds. Default 0.
+      --iterations=N              Number of fetches to time per path. Default 100.
+''')
+
+
+def legacyFetch(hostname, filename):
+    '''
+        legacyFetch - The fetch path prior to 3.1.0: index lookup, then type lookup, then fetch
+    '''
+    primaryKeys = list(NetFetchFile.objects.filter(hostname=hostname, filename=filename).getPrimaryKeys())
+    fetchClass = NetFetchFile.getNetFetchClassForKey(primaryKeys[0])
+    return fetchClass.objects.get(primaryKeys[0]).getData()
+
+
+def runPath(name, fetchFunc, counter, iterations):
+    # Warm-up (loads script, opens connection)
+    fetchFunc('bench-host', '/etc/bench.cfg')
+
+    counter.reset()
+    start = time.time()
+    for i in range(iterations):
+        fetchFunc('bench-host', '/etc/bench.cfg')
+    elapsed = time.time() - start
+
+    sys.stdout.write('%-20s  round-trips/fetch: %-4d  avg latency: %.3f ms\n' %(name, counter.count // iterations, (elapsed / iterations) * 1000.0))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--help' in args:
+        printUsage()
+        sys.exit(1)
+
+    configFilename = None
+    useFake = False
+    latency = 0.0
+    iterations = 100
+
+    for arg in args:
+        if arg.startswith('--config='):
+            configFilename = arg[len('--config='):]
+        elif arg == '--fake':
+            useFake = True
+        elif arg.startswith('--latency='):
+            latency = float(arg[len('--latency='):]) / 1000.0
+        elif arg.startswith('--iterations='):
+            iterations = int(arg[len('--iterations='):])
+        else:
+            sys.stderr.write('Unknown argument: %s\n\n' %(arg,))
+            printUsage()
+            sys.exit(1)
+
+    if not configFilename and not useFake:
+        sys.stderr.write('Must provide --config=/path/config.cfg or --fake\n\n')
+        printUsage()
+        sys.exit(1)
+
+    connectForBenchmark(configFilename, useFake)
+
+    NetFetchCompressedGzipFile.createOrUpdate('/etc/bench.cfg', b'nameserver 127.0.0.1\n' * 10, hostnameOverride='bench-host')
+
+    try:
+        with RoundTripCounter(latency) as counter:
+            runPath('before (legacy)', legacyFetch, counter, iterations)
+            runPath('after (single)', NetFetchFile.downloadToStr, counter, iterations)
+    finally:
+        NetFetchFile.deleteFile('bench-host', '/etc/bench.cfg')
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains a benchmark of put/get throughput (createOrUpdate, downloadToStr, downloadToLocal)
+#   across file sizes, models (compression), and encryption, with results written as JSON so they
+#   can be compared between releases (see --compare).
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from benchutils import RoundTripCounter, LocalRedisServer, PeakRSS, connectForBenchmark
+
+import NetFetch
+
+from NetFetch import ( NetFetchFile, NetFetchCompressedLzmaFile, NetFetchCompressedGzipFile, NetFetchCompressedBzip2File,
+            NetFetchCompressedZstdFile, NetFetchCompressedLz4File, NetFetchChunkedFile )
+from NetFetch.chunks import parseSize
+from NetFetch.compression import isCompressModeAvailable
+
+
+# RESULTS_FORMAT_VERSION - Version of the JSON output, incremented on any incompatible change to it
+RESULTS_FORMAT_VERSION = 1
+
+# MODELS - name -> tuple( model, extra createOrUpdate kwargs, compress mode which must be available or None )
+MODELS = {
+    'plain'         : (NetFetchFile, {}, None),
+    'lzma'          : (NetFetchCompressedLzmaFile, {}, 'lzma'),
+    'gzip'          : (NetFetchCompressedGzipFile, {}, 'gzip'),
+    'bzip2'         : (NetFetchCompressedBzip2File, {}, 'bzip2'),
+    'zstd'          : (NetFetchCompressedZstdFile, {}, 'zstd'),
+    'lz4'           : (NetFetchCompressedLz4File, {}, 'lz4'),
+    'chunked'       : (NetFetchChunkedFile, {}, None),
+    'chunked-zstd'  : (NetFetchChunkedFile, {'compressMode' : 'zstd'}, 'zstd'),
+    'chunked-lz4'   : (NetFetchChunkedFile, {'compressMode' : 'lz4'}, 'lz4'),
+}
+MODEL_ORDER = ('plain', 'lzma', 'gzip', 'bzip2', 'zstd', 'lz4', 'chunked', 'chunked-zstd', 'chunked-lz4')
+
+# ENCRYPTIONS - name -> value of "encryption" (None is not encrypted)
+ENCRYPTIONS = {
+    'none'   : None,
+    'fernet' : 'fernet',
+    'aesgcm' : 'aesgcm',
+}
+ENCRYPTION_ORDER = ('none', 'fernet', 'aesgcm')
+
+OPERATIONS = ('put', 'getStr', 'getLocal')
+
+DEFAULT_SIZES = '1K,16K,256K,4M,64M,1G'
+
+# DEFAULT_MAX_SINGLE_SIZE - Largest file benchmarked with a non-chunked model, which stores it as a single value.
+#   Redis refuses values over 512M, and an encrypted/compressed value may be larger than the file.
+DEFAULT_MAX_SINGLE_SIZE = '256M'
+
+# DEFAULT_BYTES_PER_CASE - With automatic iterations, each case runs until about this many bytes have been moved
+DEFAULT_BYTES_PER_CASE = 64 * 1024 * 1024
+MIN_ITERATIONS = 3
+MAX_ITERATIONS = 100
+
+BENCH_HOSTNAME = 'bench-host'
+BENCH_FILENAME = '/bench/throughput.dat'
+BENCH_PASSWORD = 'benchpassword'
+
+# REGRESSION_THRESHOLD - With --compare, a case whose mean latency grew by more than this fraction is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def printUsage():
+    sys.stderr.write('''Usage: throughput.py (options)
+  Benchmarks put (createOrUpdate), get (downloadToStr), and get-to-file (downloadToLocal) across file sizes,
+    models, and encryption. Results (latency percentiles, MB/s, peak RSS, Redis round-trips) are written as JSON.
+
+    Redis (one is required):
+
+      --config=/path/config.cfg   Connect to the redis-server in this NetFetch config (use a scratch db!)
+      --spawn(=/path/redis-server) Spawn a throwaway redis-server on a free local port for the run
+      --fake                      Use an in-process fake redis (requires fakeredis and lupa)
+
+    Options:
+
+      --sizes=LIST                Comma-separated file sizes. Default is %s
+      --models=LIST               Comma-separated models, of: %s
+                                    Default is all whose compression module is installed.
+      --encryption=LIST           Comma-separated, of: %s. Default is all.
+      --data=text|random          Content of the files, compressible text (default) or random bytes
+      --iterations=N              Timed iterations per case. Default is enough to move about 64M (%d-%d)
+      --max-single-size=SIZE      Skip non-chunked models above this file size. Default is %s.
+      --output=FILE               Write JSON results to FILE. Default is stdout.
+      --compare=FILE              Compare against the JSON results of an earlier run, and list cases
+                                    whose mean latency grew by over %d%%. Exits 2 if any did.
+
+  Progress is printed to stderr.
+''' %(DEFAULT_SIZES, ','.join(MODEL_ORDER), ','.join(ENCRYPTION_ORDER), MIN_ITERATIONS, MAX_ITERATIONS, DEFAULT_MAX_SINGLE_SIZE,
+        int(REGRESSION_THRESHOLD * 100)))
+
+
+def makeData(size, dataType):
+    '''
+        makeData - Generate the content of a benchmark file
+
+        @param size <int> - Number of bytes
+        @param dataType <str> - "text" (compressible, like config files or logs) or "random" (incompressible)
+
+        @return <bytes>
+    '''
+    if dataType == 'random':
+        return os.urandom(size)
+
+    # Lines of log-like text with varying numbers, so it compresses well but not trivially
+    lines = []
+    total = 0
+    lineNum = 0
+    while total < size:
+        line = ('%08d %s host=bench-host pid=%d level=%s message="request handled in %d ms"\n' %(lineNum,
+                    time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1500000000 + lineNum)), 1000 + (lineNum % 97),
+                    ('INFO', 'WARN', 'DEBUG')[lineNum % 3], (lineNum * 7919) % 1000)).encode('utf-8')
+        lines.append(line)
+        total += len(line)
+        lineNum += 1
+
+    return b''.join(lines)[:size]
+
+
+def percentile(sortedValues, pct):
+    '''
+        percentile - Nearest-rank percentile of a sorted list
+    '''
+    idx = max(0, min(len(sortedValues) - 1, int(round(pct / 100.0 * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[idx]
+
+
+def summarizeLatencies(latencies):
+    '''
+        summarizeLatencies - Get the statistics (in milliseconds) of a list of latencies (in seconds)
+    '''
+    latencies = sorted(latencies)
+    return {
+        'min'  : latencies[0] * 1000.0,
+        'p50'  : percentile(latencies, 50) * 1000.0,
+        'p90'  : percentile(latencies, 90) * 1000.0,
+        'p99'  : percentile(latencies, 99) * 1000.0,
+        'max'  : latencies[-1] * 1000.0,
+        'mean' : (sum(latencies) / len(latencies)) * 1000.0,
+    }
+
+
+def getIterations(size, iterations):
+    '''
+        getIterations - Get the number of timed iterations of a case
+    '''
+    if iterations:
+        return iterations
+    return max(MIN_ITERATIONS, min(MAX_ITERATIONS, DEFAULT_BYTES_PER_CASE // max(1, size)))
+
+
+def runCase(modelName, encryptionName, size, data, iterations, tempDir, counter, peakRSS):
+    '''
+        runCase - Time each operation on one file, a number of iterations
+
+        @return list<dict> - One result per operation
+    '''
+    (model, modelKwargs, compressMode) = MODELS[modelName]
+    encryption = ENCRYPTIONS[encryptionName]
+    password = encryption and BENCH_PASSWORD or None
+
+    localFilename = os.path.join(tempDir, 'throughput.dat')
+
+    def _put():
+        model.createOrUpdate(BENCH_FILENAME, data, password=password, hostnameOverride=BENCH_HOSTNAME, encryption=encryption, **modelKwargs)
+
+    def _getStr():
+        NetFetchFile.downloadToStr(BENCH_HOSTNAME, BENCH_FILENAME, password)
+
+    def _getLocal():
+        NetFetchFile.downloadToLocal(BENCH_HOSTNAME, BENCH_FILENAME, password, localFilename=localFilename, retainPermissions=False)
+
+    # Puts are each of a new file (deleted, untimed, before each), so chunked updates do not skip unchanged chunks
+    def _beforePut():
+        NetFetchFile.deleteFile(BENCH_HOSTNAME, BENCH_FILENAME)
+
+    operations = ( ('put', _put, _beforePut), ('getStr', _getStr, None), ('getLocal', _getLocal, None) )
+
+    results = []
+    for (opName, opFunc, beforeFunc) in operations:
+        # Warm-up (loads scripts, opens connections, leaves a stored file for the gets)
+        if beforeFunc:
+            beforeFunc()
+        opFunc()
+
+        latencies = []
+        roundTrips = 0
+        peakRSS.reset()
+        for i in range(iterations):
+            if beforeFunc:
+                beforeFunc()
+
+            countBefore = counter.count
+            start = time.time()
+            opFunc()
+            latencies.append(time.time() - start)
+            roundTrips += counter.count - countBefore
+
+        totalElapsed = sum(latencies)
+        results.append( {
+            'model'         : modelName,
+            'encryption'    : encryptionName,
+            'size'          : size,
+            'operation'     : opName,
+            'iterations'    : iterations,
+            'latencyMs'     : summarizeLatencies(latencies),
+            'mbPerSecond'   : totalElapsed and ((size * iterations) / totalElapsed / 1048576.0) or 0.0,
+            'roundTrips'    : float(roundTrips) / iterations,
+            'peakRssBytes'  : peakRSS.peak(),
+        } )
+
+    NetFetchFile.deleteFile(BENCH_HOSTNAME, BENCH_FILENAME)
+    if os.path.exists(localFilename):
+        os.unlink(localFilename)
+
+    return results
+
+
+def getCaseKey(result):
+    return (result['model'], result['encryption'], result['size'], result['operation'])
+
+
+def compareResults(baseline, current, threshold=REGRESSION_THRESHOLD):
+    '''
+        compareResults - Compare the results of two runs
+
+        @param baseline <dict> - JSON results of an earlier run
+        @param current <dict> - JSON results of this run
+        @param threshold <float> - Fraction of growth in mean latency reported as a regression
+
+        @return list< tuple(caseKey<tuple>, baselineMeanMs<float>, currentMeanMs<float>) > - Regressed cases
+    '''
+    baselineByKey = dict( [ (getCaseKey(result), result) for result in baseline['results'] ] )
+
+    regressions = []
+    for result in current['results']:
+        baselineResult = baselineByKey.get(getCaseKey(result), None)
+        if baselineResult is None:
+            continue
+        (baselineMean, currentMean) = (baselineResult['latencyMs']['mean'], result['latencyMs']['mean'])
+        if baselineMean and (currentMean - baselineMean) / baselineMean > threshold:
+            regressions.append( (getCaseKey(result), baselineMean, currentMean) )
+
+    return regressions
+
+
+def getRedisVersion():
+    conn = NetFetchFile._getConnection()
+    try:
+        return conn.info('server').get('redis_version', None)
+    except Exception:
+        # Some stand-ins do not support INFO, and drop the connection after the error
+        conn.connection_pool.disconnect()
+        return None
+
+
+def parseList(value, allowed):
+    items = [ item.strip() for item in value.split(',') if item.strip() ]
+    for item in items:
+        if item not in allowed:
+            raise ValueError('Unknown value "%s". Supported are: %s' %(item, ', '.join(allowed)))
+    return items
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--help' in args:
+        printUsage()
+        sys.exit(1)
+
+    configFilename = None
+    useFake = False
+    spawnServer = None
+    sizes = DEFAULT_SIZES
+    modelNames = None
+    encryptionNames = ENCRYPTION_ORDER
+    dataType = 'text'
+    iterations = None
+    maxSingleSize = DEFAULT_MAX_SINGLE_SIZE
+    outputFilename = None
+    compareFilename = None
+
+    try:
+        for arg in args:
+            if arg.startswith('--config='):
+                configFilename = arg[len('--config='):]
+            elif arg == '--fake':
+                useFake = True
+            elif arg == '--spawn':
+                spawnServer = 'redis-server'
+            elif arg.startswith('--spawn='):
+                spawnServer = arg[len('--spawn='):]
+            elif arg.startswith('--sizes='):
+                sizes = arg[len('--sizes='):]
+            elif arg.startswith('--models='):
+                modelNames = parseList(arg[len('--models='):], MODEL_ORDER)
+            elif arg.startswith('--encryption='):
+                encryptionNames = parseList(arg[len('--encryption='):], ENCRYPTION_ORDER)
+            elif arg.startswith('--data='):
+                dataType = parseList(arg[len('--data='):], ('text', 'random'))[0]
+            elif arg.startswith('--iterations='):
+                iterations = int(arg[len('--iterations='):])
+            elif arg.startswith('--max-single-size='):
+                maxSingleSize = arg[len('--max-single-size='):]
+            elif arg.startswith('--output='):
+                outputFilename = arg[len('--output='):]
+            elif arg.startswith('--compare='):
+                compareFilename = arg[len('--compare='):]
+            else:
+                raise ValueError('Unknown argument: %s' %(arg,))
+
+        sizes = [ parseSize(size) for size in sizes.split(',') if size.strip() ]
+        maxSingleSize = parseSize(maxSingleSize)
+    except ValueError as e:
+        sys.stderr.write('%s\n\n' %(str(e),))
+        printUsage()
+        sys.exit(1)
+
+    if [bool(configFilename), useFake, bool(spawnServer)].count(True) != 1:
+        sys.stderr.write('Must provide exactly one of --config=/path/config.cfg, --spawn, or --fake\n\n')
+        printUsage()
+        sys.exit(1)
+
+    if modelNames is None:
+        modelNames = [ modelName for modelName in MODEL_ORDER if MODELS[modelName][2] is None or isCompressModeAvailable(MODELS[modelName][2]) ]
+
+    baseline = None
+    if compareFilename:
+        with open(compareFilename, 'rt') as f:
+            baseline = json.load(f)
+
+    localServer = None
+    if spawnServer:
+        localServer = LocalRedisServer(spawnServer)
+        localServer.start()
+        NetFetch.setRedisConnectionParams(localServer.connectionParams)
+        redisMode = 'spawned'
+    else:
+        connectForBenchmark(configFilename, useFake)
+        redisMode = useFake and 'fake' or 'config'
+
+    tempDir = tempfile.mkdtemp(prefix='netfetch-bench-')
+    peakRSS = PeakRSS()
+
+    output = {
+        'formatVersion' : RESULTS_FORMAT_VERSION,
+        'netfetchVersion' : NetFetch.__version__,
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'redis' : { 'mode' : redisMode, 'version' : getRedisVersion() },
+        'startTime' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'params' : {
+            'sizes' : sizes,
+            'models' : modelNames,
+            'encryption' : list(encryptionNames),
+            'data' : dataType,
+            'iterations' : iterations,
+            'maxSingleSize' : maxSingleSize,
+            'peakRssResettable' : peakRSS.resettable,
+        },
+        'results' : [],
+        'skipped' : [],
+    }
+
+    try:
+        with RoundTripCounter() as counter:
+            for size in sizes:
+                data = makeData(size, dataType)
+                caseIterations = getIterations(size, iterations)
+
+                for modelName in modelNames:
+                    if size > maxSingleSize and not issubclass(MODELS[modelName][0], NetFetchChunkedFile):
+                        output['skipped'].append( {'model' : modelName, 'size' : size, 'reason' : 'larger than --max-single-size'} )
+                        continue
+
+                    for encryptionName in encryptionNames:
+                        sys.stderr.write('%-12s  %-6s  %10d bytes  x%d ... ' %(modelName, encryptionName, size, caseIterations))
+                        sys.stderr.flush()
+
+                        results = runCase(modelName, encryptionName, size, data, caseIterations, tempDir, counter, peakRSS)
+                        output['results'] += results
+
+                        sys.stderr.write('  '.join( [ '%s %.1f MB/s' %(result['operation'], result['mbPerSecond']) for result in results ] ) + '\n')
+
+                data = None
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+        if localServer is not None:
+            localServer.stop()
+
+    output['endTime'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    outputStr = json.dumps(output, indent=2, sort_keys=True)
+    if outputFilename:
+        with open(outputFilename, 'wt') as f:
+            f.write(outputStr + '\n')
+    else:
+        sys.stdout.write(outputStr + '\n')
+
+    if baseline is not None:
+        regressions = compareResults(baseline, output)
+        for ((modelName, encryptionName, size, opName), baselineMean, currentMean) in regressions:
+            sys.stderr.write('REGRESSION: %s %s %d bytes %s  mean %.3f ms -> %.3f ms (+%.0f%%)\n' %(modelName, encryptionName, size, opName,
+                        baselineMean, currentMean, ((currentMean - baselineMean) / baselineMean) * 100.0))
+        if regressions:
+            sys.exit(2)
+        sys.stderr.write('No regressions against %s\n' %(compareFilename,))
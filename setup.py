@@ -38,7 +38,7 @@ if __name__ == '__main__':
     setup(name='NetFetch',
             version='3.0.3',
             packages=['NetFetch'],
-            scripts=['netFetchPut', 'netFetchGet', 'netFetchDelete'],
+            scripts=['netFetchPut', 'netFetchGet', 'netFetchDelete', 'netFetchList', 'netFetchDaemon', 'netFetchClient', 'netFetchRebalance', 'netFetchSync', 'netFetchRevisions', 'netFetchDictionary', 'netFetchMigrateLayout'],
             author='Tim Savannah',
             author_email='kata198@gmail.com',
             maintainer='Tim Savannah',
@@ -49,6 +49,7 @@ if __name__ == '__main__':
             license='GPLv3',
             requires=['IndexedRedis', 'cryptography'] + extra_install_requires,
             install_requires=['IndexedRedis>=5.0.0,<7.0.0', 'cryptography'] + extra_install_requires,
+            extras_require={'zstd': ['zstandard'], 'lz4': ['lz4'], 'xxh3': ['xxhash']},
             keywords=['NetFetch', 'redis', 'file', 'storage', 'retrieval', 'put', 'get',' network', 'password', 'encrypt', 'netFetchPut', 'netFetchGet', 'server'],
             classifiers=['Development Status :: 5 - Production/Stable',
                          'Programming Language :: Python',
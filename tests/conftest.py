@@ -0,0 +1,70 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  This file contains the fixtures shared by the NetFetch tests.
+#
+#   The tests run against an in-process redis (fakeredis, which runs the lua scripts with lupa),
+#     so no server is needed: pip install pytest fakeredis lupa ; python -m pytest tests
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import sys
+
+import pytest
+
+# Allow running the tests from a source checkout without installing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+import redis
+
+import NetFetch
+from NetFetch import setRedisConnectionParams, setRedisNodes
+
+
+@pytest.fixture
+def conn():
+    '''
+        conn - Point NetFetch at a new, empty in-process redis for the test
+
+        @return <redis.Redis> - Connection to it
+    '''
+    # Newer fakeredis renames FakeConnection
+    connectionClass = getattr(fakeredis, 'FakeRedisConnection', None) or fakeredis.FakeConnection
+    pool = redis.ConnectionPool(connection_class=connectionClass, server=fakeredis.FakeServer())
+    setRedisNodes(None)
+    setRedisConnectionParams({'connection_pool': pool})
+
+    return redis.Redis(connection_pool=pool)
+
+
+@pytest.fixture
+def storeOldFile(conn):
+    '''
+        storeOldFile - Store files the way NetFetch 3.0.3 did: a hash of only the fields it had, and its two index sets.
+          None of the fields added since (size, chunks, mtime, expires, revision, ...) are present.
+
+        @return <function> - storeOldFile(hostname, filename, data, mode='') -> primaryKey<int>
+    '''
+    def _storeOldFile(hostname, filename, data, mode=''):
+        primaryKey = conn.incr('_ir_|NetFetchFile:next')
+        conn.hset('_ir_|NetFetchFile:data:%d' %(primaryKey,), mapping={
+            'filename' : filename,
+            'hostname' : hostname,
+            'checksum' : NetFetch.NetFetchFile.calculateChecksum(data),
+            'encrypted' : '0',
+            'mode' : mode,
+            'owner' : '',
+            'group' : '',
+            'netfetchType' : str(NetFetch.NETFETCH_TYPE_PLAIN),
+            'data' : data,
+        })
+        conn.sadd('_ir_|NetFetchFile:idx:filename:' + filename, primaryKey)
+        conn.sadd('_ir_|NetFetchFile:idx:hostname:' + hostname, primaryKey)
+        conn.sadd('_ir_|NetFetchFile:keys', primaryKey)
+
+        return primaryKey
+
+    return _storeOldFile
@@ -0,0 +1,69 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  Tests of placing files from the local cache, in particular the mode of hardlinked files
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+
+import pytest
+
+from NetFetch import NetFetchFile
+from NetFetch.cache import LocalCache, LINK_MODE_HARDLINK, LINK_MODE_COPY
+
+
+@pytest.fixture
+def umask():
+    '''
+        umask - Run the test with a umask of 022
+    '''
+    oldUmask = os.umask(0o022)
+    yield 0o022
+    os.umask(oldUmask)
+
+
+def _getMode(filename):
+    return os.stat(filename).st_mode & 0o7777
+
+
+@pytest.mark.parametrize('linkMode', [LINK_MODE_HARDLINK, LINK_MODE_COPY])
+def test_placedMode(conn, tmpdir, umask, linkMode):
+    cache = LocalCache(str(tmpdir.join('cache')), linkMode=linkMode)
+    NetFetchFile.createOrUpdate('/a', b'data', hostnameOverride='host1')
+    NetFetchFile.createOrUpdate('/b', b'data', mode='0600', hostnameOverride='host1')
+
+    for (filename, retainPermissions) in ( ('/a', True), ('/a', False), ('/b', False) ):
+        localFilename = str(tmpdir.join(filename + str(retainPermissions)))
+        NetFetchFile.downloadToLocal('host1', filename, localFilename=localFilename, retainPermissions=retainPermissions, cache=cache)
+        assert _getMode(localFilename) == 0o644
+
+
+def test_hardlinkRetainedModes(conn, tmpdir, umask):
+    cache = LocalCache(str(tmpdir.join('cache')), linkMode=LINK_MODE_HARDLINK)
+    for (filename, mode) in ( ('/a', '0755'), ('/b', '0600'), ('/c', '0644') ):
+        NetFetchFile.createOrUpdate(filename, b'data', mode=mode, hostnameOverride='host1')
+
+    localFilenames = []
+    for filename in ('/a', '/b', '/c'):
+        localFilename = str(tmpdir.join(filename))
+        NetFetchFile.downloadToLocal('host1', filename, localFilename=localFilename, cache=cache)
+        localFilenames.append(localFilename)
+
+    # Only the file with the mode of the cache entry shares it
+    assert [ _getMode(localFilename) for localFilename in localFilenames ] == [0o755, 0o600, 0o644]
+    assert [ os.stat(localFilename).st_nlink for localFilename in localFilenames ] == [1, 1, 2]
+
+
+def test_hardlinkEntryModeDiffers(conn, tmpdir, umask):
+    cache = LocalCache(str(tmpdir.join('cache')), linkMode=LINK_MODE_HARDLINK)
+    NetFetchFile.createOrUpdate('/a', b'data', hostnameOverride='host1')
+    NetFetchFile.downloadToLocal('host1', '/a', localFilename=str(tmpdir.join('a1')), cache=cache)
+
+    # i.e. stored with another umask
+    for entryName in os.listdir(cache.cacheDir):
+        os.chmod(os.path.join(cache.cacheDir, entryName), 0o600)
+
+    localFilename = str(tmpdir.join('a2'))
+    NetFetchFile.downloadToLocal('host1', '/a', localFilename=localFilename, retainPermissions=False, cache=cache)
+    assert _getMode(localFilename) == 0o644
+    assert os.stat(localFilename).st_nlink == 1
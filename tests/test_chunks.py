@@ -0,0 +1,88 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  Tests of chunked files: the manifest, updating only the changed chunks, and deduplicated chunks with their references
+
+# vim: ts=4 sw=4 expandtab
+
+import hashlib
+
+from NetFetch import NetFetchFile, NetFetchChunkedFile
+from NetFetch.chunks import ManifestEntry, buildManifest, parseManifest, getChunkKey, getChunkRefsKey, isDedupChunkId
+
+# DATA - 5 distinct blocks of 100 bytes, then 50 more
+DATA = b''.join( [ bytes(bytearray([i])) * 100 for i in range(5) ] ) + b'z' * 50
+
+
+def _getStoredChunkIds(conn):
+    prefix = getChunkKey('')
+    return sorted( [ key.decode('utf-8')[len(prefix):] for key in conn.keys(prefix + '*') ] )
+
+
+def test_manifestRoundTrip():
+    entries = [ ManifestEntry('abc.0', 100, 'd1'), ManifestEntry('cas-none-ff', 7, 'd2') ]
+
+    parsed = parseManifest(buildManifest(entries))
+    assert [ (entry.chunkId, entry.size, entry.digest) for entry in parsed ] == [ ('abc.0', 100, 'd1'), ('cas-none-ff', 7, 'd2') ]
+    assert parseManifest('') == []
+
+
+def test_chunkedFile(conn):
+    obj = NetFetchChunkedFile.createOrUpdate('/a', DATA, hostnameOverride='host1', chunkSize=100)
+
+    entries = parseManifest(obj.chunks)
+    assert [ entry.size for entry in entries ] == [100, 100, 100, 100, 100, 50]
+    assert [ entry.digest for entry in entries ] == [ hashlib.md5(DATA[i : i + 100]).hexdigest() for i in range(0, len(DATA), 100) ]
+    assert obj.size == len(DATA)
+    assert _getStoredChunkIds(conn) == sorted( [ entry.chunkId for entry in entries ] )
+
+    assert NetFetchFile.downloadToStr('host1', '/a') == DATA
+    assert NetFetchFile.downloadRange('host1', '/a', 150, 420) == DATA[150:420]
+
+    NetFetchFile.deleteFile('host1', '/a')
+    assert _getStoredChunkIds(conn) == []
+
+
+def test_updateOnlyChangedChunks(conn):
+    before = parseManifest(NetFetchChunkedFile.createOrUpdate('/a', DATA, hostnameOverride='host1', chunkSize=100).chunks)
+
+    newData = DATA[:100] + b'y' * 100 + DATA[200:]
+    after = parseManifest(NetFetchChunkedFile.createOrUpdate('/a', newData, hostnameOverride='host1', chunkSize=100).chunks)
+
+    assert after[1].chunkId != before[1].chunkId
+    assert [ entry.chunkId for entry in after[:1] + after[2:] ] == [ entry.chunkId for entry in before[:1] + before[2:] ]
+    # The replaced chunk is released
+    assert _getStoredChunkIds(conn) == sorted( [ entry.chunkId for entry in after ] )
+    assert NetFetchFile.downloadToStr('host1', '/a') == newData
+
+
+def test_dedupReferences(conn):
+    entries1 = parseManifest(NetFetchChunkedFile.createOrUpdate('/a', DATA, hostnameOverride='host1', chunkSize=100, dedup=True).chunks)
+    # Its first block twice, then the rest of the same data
+    entries2 = parseManifest(NetFetchChunkedFile.createOrUpdate('/b', DATA[:100] + DATA, hostnameOverride='host1', chunkSize=100, dedup=True).chunks)
+
+    assert all( [ isDedupChunkId(entry.chunkId) for entry in entries1 + entries2 ] )
+    assert entries2[0].chunkId == entries2[1].chunkId == entries1[0].chunkId
+    assert _getStoredChunkIds(conn) == sorted( [ entry.chunkId for entry in entries1 ] )
+
+    refs = conn.hgetall(getChunkRefsKey())
+    assert int(refs[entries1[0].chunkId.encode('utf-8')]) == 3
+    assert [ int(refs[entry.chunkId.encode('utf-8')]) for entry in entries1[1:] ] == [2, 2, 2, 2, 2]
+
+    # Chunks are kept while any file references them
+    NetFetchFile.deleteFile('host1', '/a')
+    assert _getStoredChunkIds(conn) == sorted( [ entry.chunkId for entry in entries1 ] )
+    assert NetFetchFile.downloadToStr('host1', '/b') == DATA[:100] + DATA
+
+    NetFetchFile.deleteFile('host1', '/b')
+    assert _getStoredChunkIds(conn) == []
+    assert not conn.exists(getChunkRefsKey())
+
+
+def test_dedupUpdateReleases(conn):
+    NetFetchChunkedFile.createOrUpdate('/a', DATA, hostnameOverride='host1', chunkSize=100, dedup=True)
+    entries = parseManifest(NetFetchChunkedFile.createOrUpdate('/a', DATA[:200], hostnameOverride='host1', chunkSize=100, dedup=True).chunks)
+
+    assert _getStoredChunkIds(conn) == sorted( [ entry.chunkId for entry in entries ] )
+    refs = conn.hgetall(getChunkRefsKey())
+    assert sorted(refs.keys()) == sorted( [ entry.chunkId.encode('utf-8') for entry in entries ] )
+    assert [ int(refs[entry.chunkId.encode('utf-8')]) for entry in entries ] == [1, 1]
@@ -0,0 +1,96 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  Tests that files stored by NetFetch 3.0.3 (without any of the fields added since) can still be fetched, updated, and deleted
+
+# vim: ts=4 sw=4 expandtab
+
+import time
+
+from NetFetch import NetFetchFile
+from NetFetch.retention import setStorageBudget
+
+
+def test_fetchOldFile(conn, storeOldFile):
+    storeOldFile('host1', '/etc/motd', b'hello', mode='0644')
+
+    assert NetFetchFile.exists('host1', '/etc/motd')
+    assert NetFetchFile.downloadToStr('host1', '/etc/motd') == b'hello'
+
+
+def test_deleteOldFile(conn, storeOldFile):
+    storeOldFile('host1', '/etc/motd', b'hello')
+    storeOldFile('host1', '/etc/empty', b'')
+
+    assert NetFetchFile.deleteFile('host1', '/etc/motd') is True
+    assert NetFetchFile.deleteFile('host1', '/etc/empty') is True
+
+    assert not NetFetchFile.exists('host1', '/etc/motd')
+    assert not NetFetchFile.exists('host1', '/etc/empty')
+    assert not conn.keys('_ir_|NetFetchFile:data:*')
+    assert not conn.keys('_ir_|NetFetchFile:idx:*')
+
+
+def test_updateOldFile(conn, storeOldFile, tmpdir):
+    localFilename = str(tmpdir.join('issue'))
+    storeOldFile('host1', '/etc/motd', b'hello', mode='0600')
+    storeOldFile('host1', localFilename, b'hello')
+
+    obj = NetFetchFile.createOrUpdate('/etc/motd', b'updated', hostnameOverride='host1')
+    assert obj.revision == 1
+    assert obj.mode == '0600'
+    assert obj.size == len(b'updated')
+
+    with open(localFilename, 'wb') as f:
+        f.write(b'from file')
+    NetFetchFile.createOrUpdateFromFile(localFilename, hostnameOverride='host1')
+
+    assert NetFetchFile.downloadToStr('host1', '/etc/motd') == b'updated'
+    assert NetFetchFile.downloadToStr('host1', localFilename) == b'from file'
+    # Each was updated in place
+    assert len(conn.keys('_ir_|NetFetchFile:data:*')) == 2
+
+
+def test_deleteManyOldFiles(conn, storeOldFile):
+    for filename in ('/etc/a', '/etc/b', '/etc/c', '/var/d'):
+        storeOldFile('host1', filename, b'data')
+
+    result = NetFetchFile.deleteMany('host1', ['/etc/a', '/var/d'])
+    assert result.numFiles == 2
+
+    # Files stored before 3.1.0 are only listed (so deleted by prefix) once the listing index is rebuilt
+    NetFetchFile.rebuildListIndex()
+    result = NetFetchFile.deleteByPrefix('host1', '/etc/')
+    assert result.numFiles == 2
+
+    assert not conn.keys('_ir_|NetFetchFile:data:*')
+
+
+def test_expireOldFile(conn, storeOldFile, monkeypatch):
+    storeOldFile('host1', '/tmp/a', b'data')
+    NetFetchFile.createOrUpdate('/tmp/a', b'data', hostnameOverride='host1', ttl=1)
+
+    result = NetFetchFile.expireFiles()
+    assert result.numFiles == 0
+
+    realTime = time.time
+    monkeypatch.setattr(time, 'time', lambda : realTime() + 10)
+    result = NetFetchFile.expireFiles()
+    assert result.numFiles == 1
+    assert not NetFetchFile.exists('host1', '/tmp/a')
+
+
+def test_evictOldFiles(conn, storeOldFile):
+    storeOldFile('host1', '/tmp/a', b'')
+    storeOldFile('host1', '/tmp/b', b'data')
+    NetFetchFile.rebuildListIndex()
+
+    setStorageBudget(5)
+    try:
+        NetFetchFile.createOrUpdate('/tmp/c', b'0123456789', hostnameOverride='host1')
+    finally:
+        setStorageBudget(None)
+
+    # The old files are evicted first, as they have no mtime, even though they have no size
+    assert NetFetchFile.downloadToStr('host1', '/tmp/c') == b'0123456789'
+    assert not NetFetchFile.exists('host1', '/tmp/a')
+    assert not NetFetchFile.exists('host1', '/tmp/b')
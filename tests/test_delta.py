@@ -0,0 +1,65 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  Tests of the binary delta codec used to store past revisions, and of fetching those revisions
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import random
+
+import pytest
+
+from NetFetch import NetFetchFile
+from NetFetch.delta import makeDelta, applyDelta
+from NetFetch.revisions import setRevisionPolicy
+
+_random = random.Random(1)
+BASE = bytes(bytearray( [ _random.randint(0, 255) for i in range(20000) ] ))
+
+
+@pytest.mark.parametrize('base, data', [
+    (BASE, BASE),
+    (b'', BASE),
+    (BASE, b''),
+    (b'', b''),
+    (BASE, BASE[:5000] + b'inserted' + BASE[5000:]),
+    (BASE, BASE[:5000] + BASE[6000:]),
+    (BASE, b'new prefix' + BASE + b'new suffix'),
+    (BASE, BASE[10000:] + BASE[:10000]),
+    (BASE, BASE[:100] * 50),
+    (b'short', b'shorter'),
+    (BASE, os.urandom(5000)),
+])
+def test_roundTrip(base, data):
+    delta = makeDelta(base, data)
+    assert applyDelta(base, delta) == data
+
+
+def test_smallChange():
+    data = BASE[:5000] + b'inserted' + BASE[5000:]
+
+    assert len(makeDelta(BASE, data)) < 200
+
+
+def test_wrongBase():
+    delta = makeDelta(BASE, BASE + b'more')
+
+    with pytest.raises(ValueError):
+        applyDelta(BASE[:-1], delta)
+    with pytest.raises(ValueError):
+        applyDelta(BASE, b'not a delta')
+
+
+def test_revisions(conn):
+    setRevisionPolicy(keep=5)
+    try:
+        versions = [ BASE, BASE[:5000] + b'inserted' + BASE[5000:], BASE[:5000] + BASE[6000:] + b'end' ]
+        for data in versions:
+            NetFetchFile.createOrUpdate('/a', data, hostnameOverride='host1')
+
+        assert NetFetchFile.downloadToStr('host1', '/a') == versions[2]
+        assert NetFetchFile.downloadToStr('host1', '/a', revision=-1) == versions[1]
+        assert NetFetchFile.downloadToStr('host1', '/a', revision=-2) == versions[0]
+        assert NetFetchFile.downloadToStr('host1', '/a', revision=1) == versions[0]
+    finally:
+        setRevisionPolicy(keep=0)
@@ -0,0 +1,90 @@
+# Copyright (c) 2017 Tim Savannah GPLv3 + attribution clause. See LICENSE for more information.
+#
+#  Tests of the AES-GCM payload format (NFG1), which is split into independently-encrypted, authenticated chunks
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+
+import pytest
+
+from NetFetch import NetFetchFile, InvalidPasswordException
+from NetFetch.encryption import ( ENCRYPTION_AESGCM, PAYLOAD_HEADER_SIZE, AesGcmCipher, DecryptionError, getCipher,
+            encryptPayload, decryptPayload )
+
+CHUNK_SIZE = 64
+
+
+def _getCipher(password='password1'):
+    return getCipher(ENCRYPTION_AESGCM, NetFetchFile._getFernetKey(password))
+
+
+def _splitChunks(payload):
+    storedChunkSize = CHUNK_SIZE + AesGcmCipher.OVERHEAD
+    body = payload[PAYLOAD_HEADER_SIZE:]
+
+    return [ body[i : i + storedChunkSize] for i in range(0, len(body), storedChunkSize) ]
+
+
+@pytest.mark.parametrize('dataLen', [0, 1, CHUNK_SIZE, CHUNK_SIZE * 3 + 5])
+def test_roundTrip(dataLen):
+    data = os.urandom(dataLen)
+    cipher = _getCipher()
+
+    payload = encryptPayload(cipher, data, CHUNK_SIZE)
+    assert payload[:4] == b'NFG1'
+    assert decryptPayload(cipher, payload) == data
+
+
+def test_truncated():
+    cipher = _getCipher()
+    payload = encryptPayload(cipher, os.urandom(CHUNK_SIZE * 3), CHUNK_SIZE)
+    chunks = _splitChunks(payload)
+
+    # Dropping whole chunks from the end is caught, as the last chunk is marked as such
+    with pytest.raises(DecryptionError):
+        decryptPayload(cipher, payload[:PAYLOAD_HEADER_SIZE] + b''.join(chunks[:-1]))
+
+    with pytest.raises(DecryptionError):
+        decryptPayload(cipher, payload[:-1])
+
+    with pytest.raises(DecryptionError):
+        decryptPayload(cipher, payload[:PAYLOAD_HEADER_SIZE - 1])
+
+
+def test_reordered():
+    cipher = _getCipher()
+    payload = encryptPayload(cipher, os.urandom(CHUNK_SIZE * 3), CHUNK_SIZE)
+    chunks = _splitChunks(payload)
+
+    with pytest.raises(DecryptionError):
+        decryptPayload(cipher, payload[:PAYLOAD_HEADER_SIZE] + chunks[1] + chunks[0] + chunks[2])
+
+
+def test_modified():
+    cipher = _getCipher()
+    payload = bytearray(encryptPayload(cipher, os.urandom(CHUNK_SIZE * 2), CHUNK_SIZE))
+    payload[-20] ^= 1
+
+    with pytest.raises(DecryptionError):
+        decryptPayload(cipher, bytes(payload))
+
+
+def test_wrongKey():
+    payload = encryptPayload(_getCipher('password1'), os.urandom(CHUNK_SIZE * 2), CHUNK_SIZE)
+
+    with pytest.raises(DecryptionError):
+        decryptPayload(_getCipher('password2'), payload)
+
+
+def test_storedFile(conn):
+    data = os.urandom(1000)
+    NetFetchFile.createOrUpdate('/secret', data, password='password1', hostnameOverride='host1', encryption='aesgcm')
+
+    assert NetFetchFile.downloadToStr('host1', '/secret', password='password1') == data
+    assert NetFetchFile.downloadRange('host1', '/secret', 10, 20, password='password1') == data[10:20]
+
+    with pytest.raises(InvalidPasswordException):
+        NetFetchFile.downloadToStr('host1', '/secret', password='password2')
+    with pytest.raises(InvalidPasswordException):
+        NetFetchFile.downloadToStr('host1', '/secret')